@@ -0,0 +1,136 @@
+import math
+import threading
+import time
+from collections import deque
+
+
+class AdaptiveConcurrencyLimiter:
+    """観測したレイテンシとエラーから同時リクエスト数を調整するリミッター（AIMD方式）
+
+    - 一定件数（ウィンドウ）ごとに、エラーがなくp95レイテンシが基準値の許容倍率以内なら上限を+1する
+    - 5xx・429・タイムアウト等のエラー、またはp95レイテンシの上昇を検知したら上限を減少率倍に下げる
+    - 上限は min_limit 〜 max_limit の範囲に収める
+
+    基準レイテンシは観測したp95の最小値で、負荷の低い時間帯の値を保持する。
+    サイトが恒常的に遅くなった場合に最小値に張り付かないよう、ウィンドウごとに少しずつ引き上げる。
+    """
+
+    def __init__(self, min_limit=1, max_limit=8, initial_limit=None, latency_tolerance=2.0,
+                 window=10, decrease_ratio=0.5, baseline_drift=1.02, clock=time.perf_counter):
+        if min_limit < 1 or max_limit < min_limit:
+            raise ValueError("同時接続数の範囲が不正です")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial_limit if initial_limit is not None else min_limit)
+        self.limit = min(max(self.limit, min_limit), max_limit)
+        self.latency_tolerance = latency_tolerance
+        self.window = window
+        self.decrease_ratio = decrease_ratio
+        self.baseline_drift = baseline_drift
+        # 履歴の経過秒に使う時計（テストでは差し替える）
+        self._clock = clock
+
+        self.in_flight = 0
+        self.baseline_latency = None
+        self.increases = 0
+        self.decreases = 0
+        self.peak_limit = int(self.limit)
+        # (経過秒, 上限, 理由) の履歴
+        self.history = [(0.0, int(self.limit), 'initial')]
+
+        self._samples = deque(maxlen=max(window, max_limit * 2))
+        self._completed = 0
+        self._cooldown = 0
+        self._started = clock()
+        self._cond = threading.Condition()
+
+    @property
+    def current_limit(self):
+        return int(self.limit)
+
+    def try_acquire(self):
+        """空きがあれば実行枠を確保してTrueを返す（待機しない）"""
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self, timeout=None):
+        """実行枠が空くまで待機して確保する"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.in_flight < int(self.limit), timeout=timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency, error=False):
+        """リクエスト完了時に実行枠を返却し、結果に応じて上限を調整する
+
+        latency: リクエストの所要時間（秒）
+        error:   サーバー過負荷を示すエラー（5xx・429・タイムアウト・接続エラー）ならTrue
+        """
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            if self._cooldown > 0:
+                self._cooldown -= 1
+
+            if error:
+                self._decrease('error')
+            else:
+                self._samples.append(latency)
+                self._completed += 1
+                # 上限に応じてウィンドウを広げ、十分なサンプルがそろってから判定する
+                if self._completed >= max(self.window, int(self.limit)):
+                    self._evaluate_window()
+            self._cond.notify_all()
+
+    def _evaluate_window(self):
+        samples = sorted(self._samples)
+        p95 = samples[min(len(samples) - 1, int(math.ceil(0.95 * len(samples))) - 1)]
+        if self.baseline_latency is None:
+            self.baseline_latency = p95
+        else:
+            self.baseline_latency = min(p95, self.baseline_latency * self.baseline_drift)
+        self._completed = 0
+
+        if p95 > self.baseline_latency * self.latency_tolerance:
+            self._decrease('latency')
+        elif self.in_flight + 1 >= int(self.limit):
+            # 上限まで使い切っている場合のみ増やす（使われていない枠を増やしても意味がない）
+            self._increase()
+
+    def _increase(self):
+        if self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1)
+            self.increases += 1
+            self.peak_limit = max(self.peak_limit, int(self.limit))
+            self._record('increase')
+
+    def _decrease(self, reason):
+        # 同じ過負荷で何度も下げないよう、直前の減少後は処理中の件数分が完了するまで待つ
+        if self._cooldown > 0:
+            return
+        new_limit = max(self.min_limit, math.floor(self.limit * self.decrease_ratio))
+        self._samples.clear()
+        self._completed = 0
+        self._cooldown = max(self.in_flight, 1)
+        if new_limit < self.limit:
+            self.limit = float(new_limit)
+            self.decreases += 1
+            self._record(reason)
+
+    def _record(self, reason):
+        self.history.append((round(self._clock() - self._started, 3), int(self.limit), reason))
+
+    def stats(self):
+        """調整結果のサマリーを辞書で返す"""
+        return {
+            'min_limit': self.min_limit,
+            'max_limit': self.max_limit,
+            'final_limit': int(self.limit),
+            'peak_limit': self.peak_limit,
+            'increases': self.increases,
+            'decreases': self.decreases,
+            'baseline_latency_s': self.baseline_latency,
+        }
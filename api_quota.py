@@ -0,0 +1,251 @@
+import math
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# APIごとの利用制限（1日の上限回数・1分あたりの上限回数）
+API_QUOTAS = {
+    # Yahoo!ショッピング 商品検索(v3): 1アプリケーションIDあたり1日50,000回・1分30回
+    'yahoo': {'daily': 50000, 'per_minute': 30},
+    # 楽天市場API: 1分30リクエスト（2秒間隔。1日の上限なし）。
+    # 公開されている上限は1秒1回だが、それより短い間隔では制限エラーになるため、以前から2秒間隔で取得している
+    'rakuten': {'daily': None, 'per_minute': 30},
+}
+# 1日の上限回数がリセットされる時刻の基準（日本時間0時）
+QUOTA_TZ = timezone(timedelta(hours=9))
+# チャンクの大きさを決める時に、他の取得・再取得の分として残しておく割合
+DAILY_SAFETY_MARGIN = 0.05
+
+
+def quota_day(now=None):
+    """上限回数を数える日付（日本時間）を返す関数"""
+    return datetime.fromtimestamp(now if now is not None else time.time(), QUOTA_TZ).strftime('%Y-%m-%d')
+
+
+def next_reset(now=None):
+    """次に1日の上限回数がリセットされる時刻（UNIX時間）を返す関数"""
+    current = datetime.fromtimestamp(now if now is not None else time.time(), QUOTA_TZ)
+    midnight = current.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    return midnight.timestamp()
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS api_usage (
+            source TEXT NOT NULL,
+            day TEXT NOT NULL,
+            calls INTEGER NOT NULL,
+            -- 商品コードごとの検索の件数とその呼び出し回数（1件あたりの呼び出し回数の見積もりに使う）
+            codes INTEGER NOT NULL,
+            code_calls INTEGER NOT NULL,
+            PRIMARY KEY (source, day)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_runs (
+            source TEXT NOT NULL,
+            plan_key TEXT NOT NULL,
+            chunk INTEGER NOT NULL,
+            -- 分割した時の1チャンクの商品コード数（見積もりが変わっても同じ区切りで続きを実行するため）
+            chunk_size INTEGER NOT NULL,
+            finished_at REAL NOT NULL,
+            PRIMARY KEY (source, plan_key, chunk)
+        )
+    """)
+    return conn
+
+
+def record_usage(path, source, calls, codes=0, code_calls=0, now=None):
+    """API呼び出し回数をその日の使用量に加算する関数
+
+    codes・code_calls: 商品コードごとの検索の件数とその呼び出し回数（カタログ取得等の呼び出しは含めない）
+    """
+    if calls <= 0 and codes <= 0:
+        return
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO api_usage (source, day, calls, codes, code_calls) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(source, day) DO UPDATE SET calls = calls + excluded.calls, "
+                "codes = codes + excluded.codes, code_calls = code_calls + excluded.code_calls",
+                (source, quota_day(now), calls, codes, code_calls)
+            )
+    finally:
+        conn.close()
+
+
+def usage_today(path, source, now=None):
+    """今日（日本時間）のAPI呼び出し回数を返す関数（他のセッション・過去の実行の分を含む）"""
+    conn = _connect(path)
+    try:
+        row = conn.execute(
+            "SELECT calls FROM api_usage WHERE source = ? AND day = ?", (source, quota_day(now))
+        ).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row is not None else 0
+
+
+def calls_per_code(path, source):
+    """過去の実行での商品コード1件あたりのAPI呼び出し回数（リトライを含む）を返す関数（記録がなければ1.0）"""
+    conn = _connect(path)
+    try:
+        calls, codes = conn.execute(
+            "SELECT COALESCE(SUM(code_calls), 0), COALESCE(SUM(codes), 0) FROM api_usage WHERE source = ?",
+            (source,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return max(1.0, calls / codes) if codes else 1.0
+
+
+def mark_chunk_done(path, source, plan_key, chunk, chunk_size):
+    """分割した取得のうち、最後まで実行したチャンクを記録する関数"""
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO chunk_runs VALUES (?, ?, ?, ?, ?)",
+                (source, plan_key, chunk, chunk_size, time.time())
+            )
+    finally:
+        conn.close()
+
+
+def done_chunks(path, source, plan_key):
+    """実行済みのチャンク番号 → 完了時刻の辞書と、そのチャンクの商品コード数（実行済みがなければNone）を返す関数"""
+    conn = _connect(path)
+    try:
+        rows = conn.execute(
+            "SELECT chunk, finished_at, chunk_size FROM chunk_runs WHERE source = ? AND plan_key = ? "
+            "ORDER BY finished_at", (source, plan_key)
+        ).fetchall()
+    finally:
+        conn.close()
+    # 区切りを変えて実行し直した場合は、最後に実行した区切りのチャンクだけを実行済みとする
+    chunk_size = rows[-1][2] if rows else None
+    return {chunk: finished_at for chunk, finished_at, size in rows if size == chunk_size}, chunk_size
+
+
+def plan_job(source, codes, per_code, used_today, interval, now=None, codes_per_chunk=None):
+    """取得前にAPI呼び出し回数・所要時間・1日の上限回数の使用量を見積もり、取得の分割を決める関数
+
+    codes: 取得する商品コード数（拡張後）、per_code: 商品コード1件あたりの呼び出し回数の見込み
+    interval: リクエスト間隔（秒）。1分あたりの上限を超える間隔の場合は上限に合わせた間隔で見積もる。
+    1日の上限がある場合は、1チャンクの呼び出しが上限（安全分を除く）に収まるように商品コードを分割し、
+    今日の残り回数で実行できないチャンクは次のリセット以降に1日1チャンクずつ割り当てる。
+    codes_per_chunk: 途中まで実行済みの分割の続きを見積もる場合の1チャンクの商品コード数
+    """
+    now = now if now is not None else time.time()
+    quota = API_QUOTAS[source]
+    min_interval = 60 / quota['per_minute']
+    call_interval = max(interval, min_interval)
+    calls = math.ceil(codes * per_code)
+    plan = {
+        'codes': codes,
+        'calls': calls,
+        'per_code': per_code,
+        'interval_s': call_interval,
+        # 設定されたリクエスト間隔が1分あたりの上限より短いかどうか
+        'interval_too_short': interval < min_interval,
+        'duration_s': calls * call_interval,
+        'daily': quota['daily'],
+        'used_today': used_today,
+        'remaining_today': quota['daily'] - used_today if quota['daily'] is not None else None,
+        'chunks': [],
+    }
+    if quota['daily'] is None:
+        plan['chunks'].append({'start': 0, 'end': codes, 'calls': calls, 'not_before': now})
+        return plan
+
+    chunk_calls = math.floor(quota['daily'] * (1 - DAILY_SAFETY_MARGIN))
+    codes_per_chunk = codes_per_chunk or max(1, math.floor(chunk_calls / per_code))
+    plan['codes_per_chunk'] = codes_per_chunk
+    reset = next_reset(now)
+    day = 0
+    for start in range(0, max(codes, 1), codes_per_chunk):
+        end = min(start + codes_per_chunk, codes)
+        estimated = math.ceil((end - start) * per_code)
+        # 1チャンク目は今日の残り回数で足りれば今日、足りなければ次のリセット以降
+        if start == 0 and estimated > plan['remaining_today']:
+            day = 1
+        not_before = now if day == 0 else reset + (day - 1) * 86400
+        plan['chunks'].append({'start': start, 'end': end, 'calls': estimated, 'not_before': not_before})
+        day += 1
+    return plan
+
+
+class QuotaMeter:
+    """取得中のAPI呼び出し回数を数え、1日の上限回数に達したかを判定するクラス
+
+    呼び出し回数は flush_every 回ごとにSQLiteへ記録し、その時点の今日の使用量を読み直す
+    （同時に実行している他のセッションの呼び出しも残り回数に反映する）。
+    同時実行のスレッドから呼び出してよい。
+    """
+
+    def __init__(self, path, source, flush_every=50):
+        self.path = path
+        self.source = source
+        self.daily = API_QUOTAS[source]['daily']
+        self.flush_every = flush_every
+        self.started_used = usage_today(path, source)
+        self.used = self.started_used
+        self.calls = 0
+        self.codes = 0
+        self.exhausted_codes = 0
+        self._pending_calls = 0
+        self._pending_codes = 0
+        self._pending_code_calls = 0
+        self._lock = threading.RLock()
+
+    @property
+    def remaining(self):
+        if self.daily is None:
+            return None
+        return self.daily - self.used - self._pending_calls
+
+    @property
+    def exhausted(self):
+        remaining = self.remaining
+        return remaining is not None and remaining <= 0
+
+    def add(self, calls, codes=1):
+        """API呼び出し回数を数える（codes=0 はカタログ取得等の商品コードごとでない呼び出し）"""
+        with self._lock:
+            self.calls += calls
+            self.codes += codes
+            self._pending_calls += calls
+            self._pending_codes += codes
+            if codes:
+                self._pending_code_calls += calls
+            if self._pending_calls >= self.flush_every:
+                self.flush()
+
+    def skip(self):
+        """上限に達したため取得しなかった商品コードを数える"""
+        with self._lock:
+            self.exhausted_codes += 1
+
+    def flush(self):
+        with self._lock:
+            record_usage(self.path, self.source, self._pending_calls, self._pending_codes, self._pending_code_calls)
+            self._pending_calls = 0
+            self._pending_codes = 0
+            self._pending_code_calls = 0
+            self.used = usage_today(self.path, self.source)
+
+    def close(self):
+        self.flush()
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'codes': self.codes,
+            'daily': self.daily,
+            'used_today': self.used,
+            'remaining_today': self.remaining,
+            'exhausted_codes': self.exhausted_codes,
+        }
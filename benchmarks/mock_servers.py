@@ -0,0 +1,313 @@
+"""ベンチマーク用のローカルモックサーバー
+
+自社サイトの商品ページ（/shop/g/g<商品コード>）、楽天市場API（/rakuten）、
+Yahoo!ショッピングAPI（/yahoo）の応答を、遅延・エラー率・429率を指定して返す。
+楽天市場・Yahoo!ショッピングは、商品コードを指定しない店舗全商品の検索（価格帯・ページ指定）にも応答する。
+
+単体での起動例:
+    python benchmarks/mock_servers.py --port 8765 --latency-ms 30 --error-rate 0.01
+"""
+import argparse
+import bisect
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import socket
+import time
+import zlib
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+OWN_SITE_TEMPLATE = os.path.join(FIXTURE_DIR, 'own_site_product.html')
+
+RAKUTEN_ITEM_URL = "https://item.rakuten.co.jp/tonya/{code}/?rafcid=wsc_i_is_1027604414937000350"
+
+
+@dataclass
+class MockConfig:
+    """モックサーバーの応答設定"""
+    latency_ms: float = 20.0      # 平均応答遅延（ミリ秒）
+    jitter_ms: float = 5.0        # 遅延のばらつき（ミリ秒）
+    error_rate: float = 0.0       # 500エラーを返す割合
+    rate_limit_rate: float = 0.0  # 429エラーを返す割合
+    not_found_rate: float = 0.0   # 商品なし（404 / ヒットなし）を返す割合
+    filler_kb: int = 60           # 商品ページ末尾に付与するダミー本文のサイズ（KB）
+    catalog_size: int = 0         # 店舗全商品検索で返す商品数（商品コード 100000 から連番）
+    compress: bool = True         # Accept-Encoding に gzip があれば圧縮して返す
+    etag: bool = False            # 自社サイトの商品ページにETagを付け、If-None-Match が一致すれば304を返す
+    change_rate: float = 0.0      # 自社サイトの商品ページで、change_period_s ごとに価格・在庫が変わる商品の割合
+    change_period_s: float = 60.0
+    seed: int = 0
+
+
+def item_price(code):
+    """商品コードから決定的な価格を生成する関数"""
+    return 500 + (zlib.crc32(str(code).encode()) % 200) * 10
+
+
+def _is_not_found(code, rate):
+    """商品コードから決定的に「商品なし」を判定する関数"""
+    return rate > 0 and (zlib.crc32(f"nf:{code}".encode()) % 10000) < rate * 10000
+
+
+def own_site_variant(code, config, now=None):
+    """自社サイトの商品ページの現在の内容の版を返す関数（変化していない期間は0）
+
+    change_period_s ごとに、change_rate の割合の商品が決定的に選ばれて価格・在庫が変わる（ウォッチリスト監視の確認用）。
+    """
+    if config.change_rate <= 0:
+        return 0
+    period = int((now if now is not None else time.time()) // config.change_period_s)
+    if zlib.crc32(f"chg:{code}:{period}".encode()) % 10000 < config.change_rate * 10000:
+        return period
+    return 0
+
+
+def render_own_site_page(template, code, filler, variant=0):
+    """自社サイトの商品ページHTMLを生成する関数（variant が0以外なら価格・在庫を変えた内容）"""
+    price = item_price(code) + (variant % 5 + 1) * 10 if variant else item_price(code)
+    return template.format(
+        code=code,
+        name=f"テスト商品 {code}",
+        price=f"{price:,}",
+        point=price // 100,
+        stock="在庫切れ" if variant % 2 else "在庫あり",
+        token=f"{random.getrandbits(64):016x}",
+        timestamp=time.strftime('%Y-%m-%d %H:%M:%S'),
+        filler=filler,
+    )
+
+
+def _rakuten_item(code):
+    return {
+        "itemName": f"テスト商品 {code}",
+        "itemPrice": item_price(code),
+        "itemUrl": RAKUTEN_ITEM_URL.format(code=code),
+        "pointRate": 1,
+        "postageFlag": 0,
+    }
+
+
+def _yahoo_hit(code):
+    return {
+        "code": f"tonya_{code}",
+        "name": f"テスト商品 {code}",
+        "price": item_price(code),
+        "point": {"times": 1},
+        "shipping": {"code": 1, "name": "送料無料"},
+    }
+
+
+def build_catalog(config):
+    """店舗全商品検索用に、(価格, 商品コード)を価格順に並べたリストを作成する関数"""
+    codes = [str(100000 + i) for i in range(config.catalog_size)]
+    return sorted((item_price(c), c) for c in codes if not _is_not_found(c, config.not_found_rate))
+
+
+def _catalog_range(catalog, low, high):
+    """価格帯（両端を含む）に含まれる商品を返す関数"""
+    return catalog[bisect.bisect_left(catalog, (low, '')):bisect.bisect_right(catalog, (high, '\uffff'))]
+
+
+def rakuten_catalog_response(catalog, query):
+    """楽天市場APIの店舗全商品検索（ページ上限100）の結果JSONを生成する関数"""
+    hits = int(query.get('hits', ['30'])[0])
+    page = int(query.get('page', ['1'])[0])
+    if page > 100:
+        return None
+    matched = _catalog_range(
+        catalog, int(query.get('minPrice', ['0'])[0]), int(query.get('maxPrice', ['999999999'])[0])
+    )
+    items = [{"Item": _rakuten_item(code)} for _, code in matched[(page - 1) * hits:page * hits]]
+    page_count = min(100, -(-len(matched) // hits))
+    return {"count": len(matched), "page": page, "pageCount": page_count, "hits": len(items), "Items": items}
+
+
+def yahoo_catalog_response(catalog, query):
+    """Yahoo!ショッピングAPIの出店者全商品検索（取得位置の上限1000件）の結果JSONを生成する関数"""
+    results = int(query.get('results', ['20'])[0])
+    start = int(query.get('start', ['1'])[0])
+    if start + results - 1 > 1000:
+        return None
+    matched = _catalog_range(
+        catalog, int(query.get('price_from', ['0'])[0]), int(query.get('price_to', ['999999999'])[0])
+    )
+    hits = [_yahoo_hit(code) for _, code in matched[start - 1:start - 1 + results]]
+    return {"totalResultsAvailable": len(matched), "totalResultsReturned": len(hits), "hits": hits}
+
+
+def rakuten_response(code, not_found):
+    """楽天市場APIの検索結果JSONを生成する関数"""
+    if not_found:
+        return {"count": 0, "page": 1, "pageCount": 0, "hits": 0, "Items": []}
+    return {"count": 1, "page": 1, "pageCount": 1, "hits": 1, "Items": [{"Item": _rakuten_item(code)}]}
+
+
+def yahoo_response(code, not_found):
+    """Yahoo!ショッピングAPIの検索結果JSONを生成する関数"""
+    if not_found:
+        return {"totalResultsAvailable": 0, "totalResultsReturned": 0, "hits": []}
+    return {"totalResultsAvailable": 1, "totalResultsReturned": 1, "hits": [_yahoo_hit(code)]}
+
+
+def make_handler(config):
+    """設定を束縛したリクエストハンドラクラスを作成する関数"""
+    with open(OWN_SITE_TEMPLATE, encoding='utf-8') as f:
+        template = f.read()
+    filler = "<p>" + ("珈琲の香りと味わいをお楽しみください。" * 16 + "</p>\n<p>") * config.filler_kb + "</p>"
+    rng = random.Random(config.seed)
+    catalog = build_catalog(config)
+
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # keep-alive時にヘッダーと本文の送信が遅延ACKで待たされないようにする
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type, headers=None):
+            data = body.encode('utf-8')
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            if config.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                data = gzip.compress(data, compresslevel=6)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            delay = max(0.0, rng.gauss(config.latency_ms, config.jitter_ms)) / 1000
+            time.sleep(delay)
+
+            roll = rng.random()
+            if roll < config.rate_limit_rate:
+                self._send(429, '{"error": "too_many_requests"}', 'application/json')
+                return
+            if roll < config.rate_limit_rate + config.error_rate:
+                self._send(500, 'Internal Server Error', 'text/plain')
+                return
+
+            parsed = urlparse(self.path)
+            query = parse_qs(parsed.query)
+            if parsed.path.startswith('/shop/g/g'):
+                code = parsed.path[len('/shop/g/g'):].strip('/')
+                if _is_not_found(code, config.not_found_rate):
+                    self._send(404, 'Not Found', 'text/html; charset=UTF-8')
+                    return
+                variant = own_site_variant(code, config)
+                headers = {}
+                if config.etag:
+                    headers['ETag'] = f'"{code}-{variant}"'
+                    if self.headers.get('If-None-Match') == headers['ETag']:
+                        # 304は本文なし
+                        self.send_response(304)
+                        self.send_header('ETag', headers['ETag'])
+                        self.end_headers()
+                        return
+                html = render_own_site_page(template, code, filler, variant)
+                self._send(200, html, 'text/html; charset=UTF-8', headers)
+            elif parsed.path == '/rakuten' and 'keyword' not in query:
+                body = rakuten_catalog_response(catalog, query)
+                if body is None:
+                    self._send(400, '{"error": "wrong_parameter"}', 'application/json')
+                    return
+                self._send(200, json.dumps(body, ensure_ascii=False), 'application/json; charset=UTF-8')
+            elif parsed.path == '/rakuten':
+                code = query.get('keyword', [''])[0]
+                body = rakuten_response(code, _is_not_found(code, config.not_found_rate))
+                self._send(200, json.dumps(body, ensure_ascii=False), 'application/json; charset=UTF-8')
+            elif parsed.path == '/yahoo' and 'query' not in query:
+                body = yahoo_catalog_response(catalog, query)
+                if body is None:
+                    self._send(400, '{"error": "wrong_parameter"}', 'application/json')
+                    return
+                self._send(200, json.dumps(body, ensure_ascii=False), 'application/json; charset=UTF-8')
+            elif parsed.path == '/yahoo':
+                code = query.get('query', [''])[0]
+                body = yahoo_response(code, _is_not_found(code, config.not_found_rate))
+                self._send(200, json.dumps(body, ensure_ascii=False), 'application/json; charset=UTF-8')
+            else:
+                self._send(404, 'Not Found', 'text/plain')
+
+    return MockHandler
+
+
+def serve(host, port, config):
+    """モックサーバーを起動してリクエストを待ち受ける関数"""
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def _free_port():
+    """空いているTCPポートを取得する関数"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_in_process(config, host='127.0.0.1', port=None):
+    """別プロセスでモックサーバーを起動し、(プロセス, ベースURL)を返す関数
+
+    計測対象と同じプロセスで動かすとCPU時間が混ざるため、別プロセスで起動する。
+    """
+    port = port or _free_port()
+    ctx = multiprocessing.get_context('spawn')
+    process = ctx.Process(target=serve, args=(host, port, config), daemon=True)
+    process.start()
+
+    # 起動待ち
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.2):
+                break
+        except OSError:
+            time.sleep(0.05)
+    else:
+        process.terminate()
+        raise RuntimeError("モックサーバーの起動に失敗しました")
+
+    return process, f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ベンチマーク用モックサーバー")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=MockConfig.latency_ms)
+    parser.add_argument('--jitter-ms', type=float, default=MockConfig.jitter_ms)
+    parser.add_argument('--error-rate', type=float, default=MockConfig.error_rate)
+    parser.add_argument('--rate-limit-rate', type=float, default=MockConfig.rate_limit_rate)
+    parser.add_argument('--not-found-rate', type=float, default=MockConfig.not_found_rate)
+    parser.add_argument('--filler-kb', type=int, default=MockConfig.filler_kb)
+    parser.add_argument('--catalog-size', type=int, default=MockConfig.catalog_size)
+    parser.add_argument('--no-compress', action='store_true', help="圧縮転送を無効にする")
+    parser.add_argument('--etag', action='store_true', help="自社サイトの商品ページにETagを付けて304に対応する")
+    parser.add_argument('--change-rate', type=float, default=MockConfig.change_rate)
+    parser.add_argument('--change-period-s', type=float, default=MockConfig.change_period_s)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        not_found_rate=args.not_found_rate,
+        filler_kb=args.filler_kb,
+        catalog_size=args.catalog_size,
+        compress=not args.no_compress,
+        etag=args.etag,
+        change_rate=args.change_rate,
+        change_period_s=args.change_period_s,
+    )
+    print(f"モックサーバー起動: http://{args.host}:{args.port} {asdict(config)}")
+    serve(args.host, args.port, config)
@@ -0,0 +1,163 @@
+"""画面表示（Streamlitスクリプト実行）のベンチマーク
+
+streamlit.testing の AppTest でアプリのスクリプトを実行し、次の時間を計測する。
+- 起動: 新しいプロセスで最初にスクリプトを実行するまでの時間（streamlit自体のインポートは除く）
+- 再実行: 取得結果がセッション状態にある状態で、画面操作のたびに起きるスクリプト再実行の時間
+
+取得処理は行わず、取得結果（販売リスト・3ソースの結果・計測データ）は合成してセッション状態に入れる。
+
+実行例:
+    python benchmarks/run_app_benchmarks.py --size 20000 --repeat 5
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+APP_PATH = os.path.join(REPO_DIR, 'streamlit_scraping_app.py')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+VIEWS = ["自社サイトスクレイピング", "楽天市場API取得", "Yahoo!ショッピングAPI取得"]
+
+
+def make_session_state(size, not_found_rate=0.02):
+    """取得済みの状態を再現するセッション状態を合成する関数"""
+    import pandas as pd
+    from fetch_failures import FetchFailure, NOT_LISTED
+    from fetch_metrics import FetchMetrics
+    from run_benchmarks import make_sale_list
+
+    sale_list = make_sale_list(size)
+    step = max(1, int(1 / not_found_rate)) if not_found_rate > 0 else None
+    missing = set(sale_list['商品コード'][::step]) if step else set()
+    found = sale_list[~sale_list['商品コード'].isin(missing)]
+
+    df_onlinestore = pd.DataFrame({
+        'No': found['商品コード'],
+        'Name': found['商品名'],
+        'Price': found['通販単価'],
+        'Point': 10,
+        'Stock': '在庫あり',
+        'Icon': [['SALE'] for _ in range(len(found))],
+        '通販単価': found['通販単価'],
+        '差額': '0',
+        '送料区分名': found['送料区分名'],
+    })
+    df_mall = pd.DataFrame({
+        'itemCode': found['商品コード'],
+        'itemName': found['商品名'],
+        'itemPrice': found['通販単価'],
+        'pointRate': 1,
+        'postageFlag': '送料込',
+        '通販単価': found['通販単価'],
+        '差額': '0',
+        '送料区分名': found['送料区分名'],
+    })
+
+    state = {'sale_list': sale_list, 'df_onlinestore': df_onlinestore,
+             'df_rakuten': df_mall, 'df_yahoo': df_mall.copy()}
+    for key, source in [('onlinestore', 'own_site'), ('rakuten', 'rakuten'), ('yahoo', 'yahoo')]:
+        metrics = FetchMetrics(source)
+        reasons = {}
+        for code in sale_list['商品コード']:
+            span = metrics.start(code)
+            failure = FetchFailure(NOT_LISTED) if code in missing else None
+            metrics.finish(span, failure)
+            if failure is not None:
+                reasons[code] = failure
+        metrics.close()
+        state[f'not_found_reasons_{key}'] = reasons
+        state[f'fetch_metrics_{key}'] = metrics
+    return state
+
+
+def measure_startup(queue):
+    """新しいプロセスでスクリプトを初回実行する時間を計測する関数"""
+    os.environ.setdefault('STREAMLIT_LOGGER_LEVEL', 'error')
+    # streamlit自体はサーバー起動時に読み込み済みのため計測に含めない
+    from streamlit import delta_generator
+    from streamlit.testing.v1 import AppTest
+
+    # AppTestでは「streamlit runで実行していない」警告の判定（inspect.stack）で
+    # 全モジュールの属性が参照され遅延読み込みが外れるため、警告は表示済みにしておく
+    delta_generator._use_warning_has_been_displayed = True
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    start = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - start
+    # 遅延読み込み（lazy_import）で登録されただけのモジュールは読み込み済みに含めない
+    modules = sorted(
+        name for name in ('pandas', 'numpy', 'requests', 'bs4', 'tqdm', 'sqlite3')
+        if type(sys.modules.get(name)) is types.ModuleType
+    )
+    queue.put({'startup_s': elapsed, 'loaded_modules': modules, 'exception': bool(at.exception)})
+
+
+def measure_reruns(size, repeat):
+    """取得結果がある状態でのスクリプト再実行時間を表示ごとに計測する関数"""
+    os.environ.setdefault('STREAMLIT_LOGGER_LEVEL', 'error')
+    from streamlit.testing.v1 import AppTest
+
+    state = make_session_state(size)
+    results = {}
+    for view in VIEWS:
+        at = AppTest.from_file(APP_PATH, default_timeout=300)
+        for key, value in state.items():
+            at.session_state[key] = value
+        at.session_state['selected_data_source'] = view
+
+        start = time.perf_counter()
+        at.run()
+        first = time.perf_counter() - start
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            at.run()
+            times.append(time.perf_counter() - start)
+        results[view] = {'first_s': first, 'rerun_median_s': statistics.median(times), 'rerun_max_s': max(times)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="画面表示（スクリプト実行）のベンチマーク")
+    parser.add_argument('--size', type=int, default=20000, help="合成する販売リストの件数")
+    parser.add_argument('--repeat', type=int, default=5, help="計測の繰り返し回数")
+    parser.add_argument('--output', help="結果をJSONで保存するファイルパス")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    startups = []
+    for _ in range(args.repeat):
+        queue = ctx.Queue()
+        process = ctx.Process(target=measure_startup, args=(queue,))
+        process.start()
+        startups.append(queue.get(timeout=300))
+        process.join()
+    startup = statistics.median(result['startup_s'] for result in startups)
+    print(f"起動（初回実行）: {startup * 1000:.0f}ms  読み込み済みモジュール: {startups[0]['loaded_modules']}")
+
+    reruns = measure_reruns(args.size, args.repeat)
+    print(f"{'表示':<24}{'初回(ms)':>10}{'再実行中央値(ms)':>18}{'再実行最大(ms)':>16}")
+    for view, result in reruns.items():
+        print(f"{view:<24}{result['first_s'] * 1000:>10.0f}{result['rerun_median_s'] * 1000:>18.0f}"
+              f"{result['rerun_max_s'] * 1000:>16.0f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'size': args.size, 'startup_s': startup, 'startups': startups, 'reruns': reruns},
+                      f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
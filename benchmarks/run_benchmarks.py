@@ -0,0 +1,258 @@
+"""取得処理のベンチマーク
+
+ローカルのモックサーバーに対して scrape_own_site / get_rakuten_data / get_yahoo_data と
+店舗カタログの一括取得（get_catalog_data）を実行し、
+取得件数/秒、レイテンシ（p50/p99）、CPU時間の内訳（通信・解析・その他）、ピークメモリを計測する。
+本番のエンドポイントにはアクセスしない。
+
+実行例:
+    python benchmarks/run_benchmarks.py --fetchers own_site rakuten yahoo --sizes 1000 10000 50000
+    python benchmarks/run_benchmarks.py --fetchers yahoo --sizes 1000 --latency-ms 50 --rate-limit-rate 0.02
+    python benchmarks/run_benchmarks.py --fetchers rakuten rakuten_catalog --sizes 1000 --catalog-size 20000
+    python benchmarks/run_benchmarks.py --fetchers own_site --sizes 10000 50000 --concurrency 4 16 --spill
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from queue import Empty
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from mock_servers import MockConfig, start_in_process  # noqa: E402
+
+FETCHERS = {
+    'own_site': 'scrape_own_site',
+    'rakuten': 'get_rakuten_data',
+    'yahoo': 'get_yahoo_data',
+    'rakuten_catalog': 'get_catalog_data',
+    'yahoo_catalog': 'get_catalog_data',
+}
+
+
+def make_sale_list(size, category=3):
+    """ベンチマーク用の販売リストを作成する関数"""
+    import pandas as pd
+    from mock_servers import item_price
+
+    codes = [str(100000 + i) for i in range(size)]
+    return pd.DataFrame({
+        '商品コード': codes,
+        '商品名': [f"テスト商品 {c}" for c in codes],
+        '通販単価': [f"{item_price(c):,}" for c in codes],
+        '送料区分名': '送料無料',
+        '大分類コード': category,
+    })
+
+
+def percentile(values, q):
+    """値のリストからパーセンタイルを求める関数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def peak_rss():
+    """プロセスのピークメモリ（MB）を返す関数（取得できない環境ではNone）"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(fetcher, size, base_url, category, trace_memory, concurrency, streamed, spill, profile_dir, queue):
+    """1ケース分のベンチマークを子プロセスで実行する関数"""
+    # アプリのインポート前にエンドポイントと待機時間を差し替える
+    os.environ['OWN_SITE_BASE_URL'] = base_url
+    os.environ['RAKUTEN_API_URL'] = f"{base_url}/rakuten"
+    os.environ['YAHOO_API_URL'] = f"{base_url}/yahoo"
+    os.environ['API_REQUEST_INTERVAL'] = '0'
+    os.environ['API_RETRY_WAIT'] = '0.01'
+    os.environ['RETRY_PASS_DELAY'] = '0'
+    # 店舗カタログは毎回同期する
+    os.environ['CATALOG_DB'] = os.path.join(tempfile.mkdtemp(), 'catalog.sqlite3')
+    os.environ['SPILL_DIR'] = tempfile.mkdtemp()
+    # 実際のAPI呼び出し回数の記録に含めない（Yahoo!の大きなケースで1日の上限回数に達しないようにする）
+    os.environ['QUOTA_DB'] = os.path.join(tempfile.mkdtemp(), 'api_quota.sqlite3')
+    # 前回の取得結果の記録（取得する順番の優先度）もベンチマークの実行ごとに分ける
+    os.environ['PRIORITY_DB'] = os.path.join(tempfile.mkdtemp(), 'fetch_history.sqlite3')
+    os.environ.setdefault('STREAMLIT_LOGGER_LEVEL', 'error')
+
+    import tracemalloc
+    import streamlit_scraping_app as app
+    from fetch_metrics import FetchMetrics
+    from run_profiler import RunProfiler
+
+    sale_list = make_sale_list(size, category)
+    metrics = FetchMetrics(fetcher)
+    rss_before_mb = peak_rss()
+
+    if trace_memory:
+        tracemalloc.start()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    args = (sale_list,)
+    kwargs = {'spill': spill}
+    if fetcher == 'own_site':
+        kwargs.update({'min_concurrency': concurrency[0], 'max_concurrency': concurrency[1], 'streamed': streamed})
+    elif fetcher.endswith('_catalog'):
+        args = (fetcher[:-len('_catalog')], sale_list)
+    profiler = RunProfiler(f"{fetcher}_{size}", trace_memory=True) if profile_dir else None
+    if profiler is not None:
+        profiler.start()
+    df = getattr(app, FETCHERS[fetcher])(*args, metrics=metrics, **kwargs)
+    if profiler is not None:
+        profiler.stop()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    profile_paths = profiler.save(profile_dir, f"{fetcher}_{size}") if profiler is not None else None
+    traced_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+
+    peak_rss_mb = peak_rss()
+
+    # 商品コードごとの通信時間（接続+TTFB+受信、リトライ分を含む）
+    latencies = [
+        span.phases['connect'] + span.phases['ttfb'] + span.phases['download']
+        for span in metrics.spans
+    ]
+    summary = metrics.summary()
+
+    queue.put({
+        'fetcher': fetcher,
+        'codes': size,
+        'requests': summary['requests'],
+        'items': len(df),
+        'wall_s': wall,
+        'items_per_s': len(df) / wall if wall > 0 else None,
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+        'cpu_total_s': cpu,
+        'cpu_network_s': summary['network_cpu_s'],
+        'cpu_parse_s': summary['parse_cpu_s'],
+        'cpu_other_s': cpu - summary['network_cpu_s'] - summary['parse_cpu_s'],
+        'merge_s': summary['run_phases'].get('merge'),
+        'bytes': summary['bytes'],
+        'wire_bytes': summary['wire_bytes'],
+        'early_stops': summary['early_stops'],
+        'status_counts': summary['status_counts'],
+        'concurrency': summary['info'].get('concurrency'),
+        'catalog': summary['info'].get('catalog'),
+        'failure_counts': summary['failure_counts'],
+        'spill': spill,
+        'peak_rss_mb': peak_rss_mb,
+        # 取得開始前（モジュール・販売リスト読み込み後）からのピークメモリの増加分
+        'rss_growth_mb': peak_rss_mb - rss_before_mb if peak_rss_mb is not None else None,
+        'traced_peak_mb': traced_peak / 1024 / 1024 if traced_peak is not None else None,
+        'profile': profile_paths,
+    })
+
+
+def wait_result(process, queue):
+    """子プロセスの結果を待つ関数（子プロセスが異常終了した場合は例外）"""
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"ベンチマークの子プロセスが異常終了しました (exit code: {process.exitcode})")
+
+
+def format_row(result):
+    """結果1件を表形式の1行に整形する関数"""
+    def fmt(value, spec):
+        return format(value, spec) if value is not None else '-'
+    return (
+        f"{result['fetcher']:<16}{result['codes']:>8}{result['items']:>8}{result['requests']:>9}"
+        f"{fmt(result['items_per_s'], '10.1f')}{fmt(result['p50_ms'], '9.1f')}{fmt(result['p99_ms'], '9.1f')}"
+        f"{fmt(result['cpu_network_s'], '10.2f')}{fmt(result['cpu_parse_s'], '10.2f')}{fmt(result['cpu_other_s'], '10.2f')}"
+        f"{fmt(result['peak_rss_mb'], '10.1f')}{fmt(result['rss_growth_mb'], '10.1f')}"
+        f"{result['wire_bytes'] / 1024 / 1024:>10.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="取得処理のベンチマーク（ローカルモックサーバー使用）")
+    parser.add_argument('--fetchers', nargs='+', choices=list(FETCHERS), default=list(FETCHERS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 50000])
+    parser.add_argument('--category', type=int, default=3,
+                        help="販売リストの大分類コード（1: 6種類に展開, 2: -50に展開, その他: 展開なし）")
+    parser.add_argument('--latency-ms', type=float, default=MockConfig.latency_ms)
+    parser.add_argument('--jitter-ms', type=float, default=MockConfig.jitter_ms)
+    parser.add_argument('--error-rate', type=float, default=MockConfig.error_rate)
+    parser.add_argument('--rate-limit-rate', type=float, default=MockConfig.rate_limit_rate)
+    parser.add_argument('--not-found-rate', type=float, default=MockConfig.not_found_rate)
+    parser.add_argument('--filler-kb', type=int, default=MockConfig.filler_kb)
+    parser.add_argument('--catalog-size', type=int, default=MockConfig.catalog_size,
+                        help="店舗全商品検索で返す商品数（*_catalog の計測用）")
+    parser.add_argument('--concurrency', nargs=2, type=int, default=[1, 1], metavar=('MIN', 'MAX'),
+                        help="自社サイト取得の同時接続数の範囲（自動調整）")
+    parser.add_argument('--full-body', action='store_true',
+                        help="自社サイトの商品ページを途中で打ち切らず本文全体を受信する（比較用）")
+    parser.add_argument('--spill', action='store_true',
+                        help="メモリ節約モード（取得結果をファイルに書き出す）で実行する")
+    parser.add_argument('--no-compress', action='store_true', help="モックサーバーの圧縮転送を無効にする")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="tracemalloc でPythonオブジェクトのピークメモリも計測する（処理は遅くなる）")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="ケースごとにCPU（speedscope・folded形式）とメモリ割り当てのプロファイルをDIRに保存する"
+                             "（tracemalloc を使うため処理は遅くなる）")
+    parser.add_argument('--output', help="結果をJSONで保存するファイルパス")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        not_found_rate=args.not_found_rate,
+        filler_kb=args.filler_kb,
+        catalog_size=args.catalog_size,
+        compress=not args.no_compress,
+    )
+    server, base_url = start_in_process(config)
+    print(f"モックサーバー: {base_url} {asdict(config)}")
+
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    print(f"{'fetcher':<16}{'codes':>8}{'items':>8}{'requests':>9}{'items/s':>10}{'p50ms':>9}{'p99ms':>9}"
+          f"{'cpu_net':>10}{'cpu_parse':>10}{'cpu_other':>10}{'rss_MB':>10}{'rss_up':>10}{'wire_MB':>10}")
+    try:
+        for fetcher in args.fetchers:
+            for size in args.sizes:
+                # ピークメモリを正しく測るためケースごとに別プロセスで実行する
+                queue = ctx.Queue()
+                process = ctx.Process(
+                    target=run_case,
+                    args=(fetcher, size, base_url, args.category, args.trace_memory, args.concurrency,
+                          not args.full_body, args.spill, args.profile, queue)
+                )
+                process.start()
+                result = wait_result(process, queue)
+                process.join()
+                results.append(result)
+                print(format_row(result), flush=True)
+                if result['profile']:
+                    print(f"  プロファイル: {', '.join(result['profile'])}")
+    finally:
+        server.terminate()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': asdict(config), 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
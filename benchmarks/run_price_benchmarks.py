@@ -0,0 +1,135 @@
+"""取得後の価格の整形・差額計算のベンチマーク
+
+自社サイト（merge_own_site_items）と楽天市場・Yahoo!ショッピング（merge_marketplace_items）の
+価格の整形・差額計算について、行ごとの処理（以前の apply による実装）と price_normalize の列単位の処理の
+実行時間を比べる。結果が同じことは tests/test_price_normalize.py で確認する。
+
+実行例:
+    python benchmarks/run_price_benchmarks.py --sizes 1000 10000 50000 --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import price_normalize  # noqa: E402
+
+
+def own_site_reference(df):
+    """以前の自社サイトの価格の整形・差額計算（行ごと）"""
+    df = df.copy()
+    df['通販単価'] = df['通販単価'].apply(
+        lambda x: f"{int(str(x).replace(',', '')):,}" if pd.notnull(x) and str(x).replace(',', '').isdigit() else x
+    )
+
+    def calc_diff(row):
+        try:
+            price = int(str(row['Price']).replace(',', ''))
+            sale = int(str(row['通販単価']).replace(',', ''))
+            return f"{price - sale:,}"
+        except:  # noqa: E722
+            return None
+
+    df['差額'] = df.apply(calc_diff, axis=1)
+    return df
+
+
+def own_site_vectorized(df):
+    """price_normalize による自社サイトの価格の整形・差額計算（列単位）"""
+    df = df.copy()
+    df['通販単価'], df['差額'] = price_normalize.own_site_prices(df['Price'], df['通販単価'])
+    return df
+
+
+def marketplace_reference(df):
+    """以前の楽天市場・Yahoo!ショッピングの価格の整形・差額計算（行ごと）"""
+    df = df.copy()
+    df['itemPrice'] = df['itemPrice'].replace(',', '', regex=True).astype(float)
+    df['通販単価'] = df['通販単価'].astype(float)
+    df['差額'] = df['itemPrice'] - df['通販単価']
+    df['通販単価'] = df['通販単価'].apply(lambda x: '{:,.0f}'.format(x) if not np.isnan(x) else '')
+    df['itemPrice'] = df['itemPrice'].apply(lambda x: '{:,.0f}'.format(x) if not np.isnan(x) else '')
+    df['差額'] = df['差額'].apply(lambda x: '{:,.0f}'.format(x) if not np.isnan(x) else '')
+    return df
+
+
+def marketplace_vectorized(df):
+    """price_normalize による楽天市場・Yahoo!ショッピングの価格の整形・差額計算（列単位）"""
+    df = df.copy()
+    item_price = price_normalize.to_price_number(df['itemPrice']).astype(float)
+    unit_price = price_normalize.to_price_number(df['通販単価']).astype(float)
+    df['通販単価'] = price_normalize.format_prices(unit_price)
+    df['itemPrice'] = price_normalize.format_prices(item_price)
+    df['差額'] = price_normalize.format_prices(item_price - unit_price)
+    return df
+
+
+def make_own_site_frame(size, seed=0):
+    """合成データ（自社サイト。価格なし・通販単価なし・空の行を含む）を作成する関数"""
+    rng = np.random.default_rng(seed)
+    prices = rng.integers(100, 200000, size)
+    units = prices + rng.integers(-500, 500, size)
+    price_text = np.array([f"{p:,}" for p in prices.tolist()], dtype=object)
+    unit_text = np.array([f"{u:,}" for u in units.tolist()], dtype=object)
+    price_text[rng.random(size) < 0.02] = None
+    unit_text[rng.random(size) < 0.02] = np.nan
+    unit_text[rng.random(size) < 0.01] = ''
+    return pd.DataFrame({'Price': price_text, '通販単価': unit_text})
+
+
+def make_marketplace_frame(size, seed=0):
+    """合成データ（楽天市場・Yahoo!ショッピング。取得できなかった行・販売リストにない行を含む）を作成する関数"""
+    rng = np.random.default_rng(seed)
+    prices = rng.integers(100, 200000, size).astype(object)
+    units = prices.astype(float) + rng.integers(-500, 500, size)
+    prices[rng.random(size) < 0.02] = None
+    units[rng.random(size) < 0.02] = np.nan
+    return pd.DataFrame({'itemPrice': prices, '通販単価': units})
+
+
+def measure(func, df, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(df)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="取得後の価格の整形・差額計算のベンチマーク")
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 50000])
+    parser.add_argument('--repeat', type=int, default=5, help="計測の繰り返し回数")
+    parser.add_argument('--output', help="結果をJSONで保存するファイルパス")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'処理':<16}{'件数':>8}{'行ごと(ms)':>12}{'列単位(ms)':>12}{'速度比':>8}")
+    for size in args.sizes:
+        cases = [
+            ('自社サイト', own_site_reference, own_site_vectorized, make_own_site_frame(size)),
+            ('楽天・Yahoo', marketplace_reference, marketplace_vectorized, make_marketplace_frame(size)),
+        ]
+        for name, reference, vectorized, df in cases:
+            before = measure(reference, df, args.repeat)
+            after = measure(vectorized, df, args.repeat)
+            results.append({'case': name, 'size': size, 'reference_s': before, 'vectorized_s': after})
+            print(f"{name:<16}{size:>8}{before * 1000:>12.1f}{after * 1000:>12.1f}{before / after:>7.1f}x")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
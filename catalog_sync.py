@@ -0,0 +1,185 @@
+import sqlite3
+import time
+
+import pandas as pd
+
+# カタログの列（楽天市場・Yahoo!ショッピングの取得結果と同じ列名）
+CATALOG_COLUMNS = ['itemCode', 'itemName', 'itemPrice', 'pointRate', 'postageFlag']
+# 価格帯分割の上限価格
+PRICE_CEILING = 999_999_999
+
+
+def _item_price(item):
+    try:
+        return float(item['itemPrice'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _lower_first_page(split, band_high, page_size):
+    """分割前の価格帯の1ページ目から、下側の価格帯の1ページ目と件数を求める関数（求められなければNone）
+
+    検索結果は価格の安い順のため、下側の価格帯の1ページ目は分割前の1ページ目のうち上限価格以下の商品で、
+    件数は分割前の件数から上側の価格帯の件数を引いたものになる。
+    """
+    if split['upper_total'] is None:
+        return None
+    prices = [_item_price(item) for item in split['items']]
+    if any(price is None for price in prices):
+        return None
+    items = [item for item, price in zip(split['items'], prices) if price <= band_high]
+    total = split['total'] - split['upper_total']
+    # 取得の間に商品が増減して合わない場合は取り直す
+    if len(items) != min(total, page_size):
+        return None
+    return items, total
+
+
+def enumerate_catalog(fetch_page, page_size, max_results, low=0, high=PRICE_CEILING, on_page=None):
+    """価格帯で分割しながら店舗の全商品を列挙する関数
+
+    fetch_page(low, high, page) は (商品リスト, ヒット件数, FetchFailure) を返す（価格の安い順・両端の価格を含む）。
+    検索APIは1つの条件で取得できる件数に上限（max_results）があるため、
+    価格帯のヒット件数が上限を超える場合は価格帯を重ならないように二分して取り直す（価格は円単位の整数）。
+    1つの価格だけの価格帯まで分割しても上限を超える場合は、取得できる分だけ取得する。
+    二分した下側の価格帯の1ページ目は、分割前の価格帯の1ページ目を使う（上側を先に取得して件数を求める）。
+
+    戻り値: (商品コード→商品情報の辞書, 取得に失敗した価格帯のリスト, 集計)
+    """
+    items = {}
+    failed_bands = []
+    stats = {'requests': 0, 'bands': 0, 'splits': 0, 'truncated_bands': 0, 'reused_pages': 0}
+    # (下限, 上限, 分割前の価格帯の1ページ目・件数, 上側かどうか)
+    bands = [(low, high, None, False)]
+    while bands:
+        band_low, band_high, split, upper = bands.pop()
+        first_page = None
+        if split is not None and not upper:
+            first_page = _lower_first_page(split, band_high, page_size)
+        if first_page is not None:
+            page_items, total = first_page
+            stats['reused_pages'] += 1
+        else:
+            page_items, total, failure = fetch_page(band_low, band_high, 1)
+            stats['requests'] += 1
+            if failure is not None:
+                failed_bands.append((band_low, band_high, failure))
+                continue
+        if upper:
+            split['upper_total'] = total
+
+        if total > max_results:
+            if band_high > band_low:
+                # 件数が上限を超える価格帯は二分して取り直す（上側を先に取得する）
+                mid = (band_low + band_high) // 2
+                split = {'items': page_items, 'total': total, 'upper_total': None}
+                bands.append((band_low, mid, split, False))
+                bands.append((mid + 1, band_high, split, True))
+                stats['splits'] += 1
+                continue
+            # 同一価格の商品が上限を超える場合は分割できないため、取得できる分だけ取得する
+            stats['truncated_bands'] += 1
+
+        stats['bands'] += 1
+        for item in page_items:
+            items[item['itemCode']] = item
+        if on_page:
+            on_page(band_low, band_high, 1, total, len(items))
+
+        pages = -(-min(total, max_results) // page_size)
+        for page in range(2, pages + 1):
+            page_items, _, failure = fetch_page(band_low, band_high, page)
+            stats['requests'] += 1
+            if failure is not None:
+                failed_bands.append((band_low, band_high, failure))
+                break
+            for item in page_items:
+                items[item['itemCode']] = item
+            if on_page:
+                on_page(band_low, band_high, page, total, len(items))
+
+    return items, failed_bands, stats
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_items (
+            source TEXT NOT NULL,
+            itemCode TEXT NOT NULL,
+            itemName TEXT,
+            itemPrice REAL,
+            pointRate TEXT,
+            postageFlag TEXT,
+            PRIMARY KEY (source, itemCode)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_syncs (
+            source TEXT PRIMARY KEY,
+            synced_at REAL NOT NULL,
+            complete INTEGER NOT NULL,
+            items INTEGER NOT NULL,
+            requests INTEGER NOT NULL
+        )
+    """)
+    return conn
+
+
+def save_catalog(path, source, items, complete, requests):
+    """同期したカタログをローカルのSQLiteに保存する関数（同じソースの前回分は置き換える）"""
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM catalog_items WHERE source = ?", (source,))
+            conn.executemany(
+                "INSERT INTO catalog_items VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (source, str(item['itemCode']), item['itemName'], item['itemPrice'],
+                     str(item['pointRate']), item['postageFlag'])
+                    for item in items.values()
+                ]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO catalog_syncs VALUES (?, ?, ?, ?, ?)",
+                (source, time.time(), int(complete), len(items), requests)
+            )
+    finally:
+        conn.close()
+
+
+def load_catalog_info(path, source):
+    """保存済みカタログの同期情報を返す関数（未同期ならNone）"""
+    conn = _connect(path)
+    try:
+        row = conn.execute(
+            "SELECT synced_at, complete, items, requests FROM catalog_syncs WHERE source = ?", (source,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {'synced_at': row[0], 'complete': bool(row[1]), 'items': row[2], 'requests': row[3]}
+
+
+def load_catalog(path, source):
+    """保存済みカタログをデータフレームで返す関数"""
+    conn = _connect(path)
+    try:
+        return pd.read_sql_query(
+            "SELECT itemCode, itemName, itemPrice, pointRate, postageFlag FROM catalog_items WHERE source = ?",
+            conn, params=(source,)
+        )
+    finally:
+        conn.close()
+
+
+def match_catalog(sale_list_mod, catalog):
+    """展開済み販売リストの商品コードをカタログと1回の結合で照合する関数
+
+    戻り値: (カタログにあった商品のデータフレーム, カタログになかった商品コードのリスト)
+    """
+    codes = pd.DataFrame({'itemCode': sale_list_mod['商品コード'].astype(str).unique()})
+    matched = codes.merge(catalog[CATALOG_COLUMNS], on='itemCode', how='left', indicator=True)
+    found = matched['_merge'] == 'both'
+    return matched.loc[found, CATALOG_COLUMNS].reset_index(drop=True), matched.loc[~found, 'itemCode'].tolist()
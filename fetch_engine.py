@@ -0,0 +1,155 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+
+from fetch_failures import FetchFailure, QUOTA_EXHAUSTED, TRANSIENT_NETWORK, exception_failure
+
+
+class RequestPacer:
+    """リクエストの開始間隔を interval 秒以上に保つクラス（APIの1分あたりの制限。同時実行のスレッドで共有する）"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next = None
+        self._lock = threading.Lock()
+
+    def wait(self, metrics, span):
+        """次のリクエストを開始できるまで待機する（待機時間は span に記録する）"""
+        if self.interval <= 0:
+            return
+        with self._lock:
+            now = time.perf_counter()
+            start = now if self._next is None else max(now, self._next)
+            self._next = start + self.interval
+        metrics.wait(span, start - now)
+
+
+def _fetch_worker(session, code, fetch_item, metrics, limiter, queue_wait, pacer, quota):
+    """商品コード1件分の取得（リミッターへ結果を返す）
+
+    fetch_item(session, 商品コード, metrics, span) は (商品情報, FetchFailure) を返す。
+    """
+    span = metrics.start(code)
+    metrics.add_wait(span, queue_wait)
+    overloaded = False
+    try:
+        if quota is not None and quota.exhausted:
+            # 1日の上限回数に達した後はAPIを呼び出さずに記録する
+            quota.skip()
+            failure = FetchFailure(QUOTA_EXHAUSTED)
+            metrics.finish(span, failure)
+            return None, failure
+        if pacer is not None:
+            pacer.wait(metrics, span)
+        item, failure = fetch_item(session, code, metrics, span)
+        # 5xx・429はサーバー過負荷のサインとして扱う
+        overloaded = span.status is not None and (span.status >= 500 or span.status == 429)
+        return item, failure
+    except Exception as e:
+        # リクエストエラー（タイムアウト・接続エラーも過負荷のサインとして扱う）・その他のエラー
+        failure = exception_failure(e)
+        overloaded = failure.kind == TRANSIENT_NETWORK
+        if isinstance(e, requests.exceptions.RequestException):
+            metrics.request_error(span, e)
+        metrics.finish(span, failure)
+        return None, failure
+    finally:
+        if quota is not None and span.attempts:
+            quota.add(span.attempts)
+        latency = span.phases['connect'] + span.phases['ttfb'] + span.phases['download']
+        limiter.release(latency, error=overloaded)
+
+
+def fetch_pass(session, codes, fetch_item, metrics, limiter, on_progress, pacer=None, quota=None, on_item=None,
+               order=None):
+    """商品コードのリストを取得し、[(商品情報, FetchFailure), ...]を並び順で返す関数
+
+    同時リクエスト数は limiter（AdaptiveConcurrencyLimiter）で調整する。上限が1の場合は呼び出し元のスレッドで順に取得する。
+    pacer（RequestPacer）を指定した場合はリクエストの開始間隔を空け、quota（api_quota.QuotaMeter）を指定した場合は
+    呼び出し回数を数えて1日の上限回数に達した後は呼び出さない。
+    on_progress(完了件数, 件数, 商品コード) で進捗を通知する。
+    on_item(位置, 商品情報) を指定した場合は、取得できた商品情報を保持せずに on_item に渡す（メモリ節約モード）。
+    order（codes の位置のリスト）を指定した場合はその順番で取得する（戻り値は codes の並び順のまま）。
+    """
+    total = len(codes)
+    results = [None] * total
+    order = list(range(total)) if order is None else order
+
+    def collect(idx, item, failure):
+        if on_item is not None and item is not None:
+            on_item(idx, item)
+            item = None
+        results[idx] = (item, failure)
+
+    if limiter.max_limit == 1:
+        for completed, idx in enumerate(order, 1):
+            limiter.acquire()
+            collect(idx, *_fetch_worker(session, codes[idx], fetch_item, metrics, limiter, 0.0, pacer, quota))
+            on_progress(completed, total, codes[idx])
+        return results
+
+    next_idx = 0
+    completed = 0
+    pending = {}
+    wait_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
+        while next_idx < total or pending:
+            # 空いている実行枠の分だけリクエストを投入
+            while next_idx < total and limiter.try_acquire():
+                queue_wait = time.perf_counter() - wait_started
+                idx = order[next_idx]
+                future = executor.submit(
+                    _fetch_worker, session, codes[idx], fetch_item, metrics, limiter, queue_wait, pacer, quota
+                )
+                pending[future] = idx
+                next_idx += 1
+                wait_started = time.perf_counter()
+
+            done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = pending.pop(future)
+                collect(idx, *future.result())
+                completed += 1
+            if done:
+                on_progress(completed, total, codes[idx])
+    return results
+
+
+def fetch_codes(session, codes, fetch_item, metrics, limiter, on_progress, retry_delay, pacer=None, quota=None,
+                on_item=None, order=None):
+    """商品コードのリストを取得し、一時的なエラーで失敗した商品だけをもう一度取得する関数
+
+    on_progress(完了件数, 件数, 再取得中かどうか, 商品コード) で進捗を通知する。その他の引数は fetch_pass と同じ。
+    再取得も order の順番で行う。
+    戻り値: ([(商品情報, FetchFailure), ...]（並び順）, 商品コード→FetchFailure の辞書)
+    """
+    results = fetch_pass(
+        session, codes, fetch_item, metrics, limiter,
+        lambda completed, total, code: on_progress(completed, total, False, code), pacer, quota, on_item, order
+    )
+    not_found_reasons = {code: failure for code, (_, failure) in zip(codes, results) if failure is not None}
+
+    # 一時的なエラー（通信エラー・429・5xx）で失敗した商品だけを再取得
+    retry_indexes = [
+        i for i in (order if order is not None else range(len(codes)))
+        if results[i][1] is not None and results[i][1].retryable
+    ]
+    if retry_indexes:
+        time.sleep(retry_delay)
+        retry_results = fetch_pass(
+            session, [codes[i] for i in retry_indexes], fetch_item, metrics, limiter,
+            lambda completed, total, code: on_progress(completed, total, True, code), pacer, quota,
+            (lambda j, item: on_item(retry_indexes[j], item)) if on_item is not None else None
+        )
+        for i, (item, failure) in zip(retry_indexes, retry_results):
+            if failure is None:
+                not_found_reasons.pop(codes[i], None)
+            else:
+                not_found_reasons[codes[i]] = failure.after_retry(not_found_reasons[codes[i]])
+            results[i] = (item, failure)
+    retry_pass = metrics.info.setdefault('retry_pass', {'retried': 0, 'recovered': 0})
+    retry_pass['retried'] += len(retry_indexes)
+    retry_pass['recovered'] += sum(1 for i in retry_indexes if results[i][1] is None)
+    return results, not_found_reasons
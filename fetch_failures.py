@@ -0,0 +1,145 @@
+from dataclasses import dataclass, field
+
+# 取得失敗の分類コード
+TRANSIENT_NETWORK = 'transient_network'      # 一時的な通信エラー（タイムアウト・接続エラー等）
+HTTP_STATUS = 'http_status'                  # HTTPエラー（ステータスコードは status に保持）
+RATE_LIMITED = 'rate_limited'                # API制限（429）
+PARSE_MISSING_BLOCK = 'parse_missing_block'  # ページ解析失敗（商品詳細ブロックなし）
+NOT_LISTED = 'not_listed'                    # 商品が掲載されていない（404・APIでヒットなし）
+QUOTA_EXHAUSTED = 'quota_exhausted'          # APIの1日の上限回数に達したため取得しなかった（分割した取得の対象外を含む）
+LAYOUT_DRIFT = 'layout_drift'                # 商品詳細ブロックのないページが多く、レイアウト変更の疑いで取得を中断した
+NOT_SAMPLED = 'not_sampled'                  # 抽出して確認する取得・層を選んだ全件取得の対象外のため取得しなかった
+UNEXPECTED = 'unexpected'                    # その他の想定外エラー
+
+FAILURE_LABELS = {
+    TRANSIENT_NETWORK: '通信エラー（一時的）',
+    HTTP_STATUS: 'HTTPエラー',
+    RATE_LIMITED: 'API制限（429）',
+    PARSE_MISSING_BLOCK: '解析エラー（商品詳細なし）',
+    NOT_LISTED: '未掲載',
+    QUOTA_EXHAUSTED: 'API上限（1日の回数）',
+    LAYOUT_DRIFT: 'レイアウト変更の疑い（中断）',
+    NOT_SAMPLED: '抽出の対象外',
+    UNEXPECTED: 'その他のエラー',
+}
+
+
+@dataclass
+class FetchFailure:
+    """商品コード1件分の取得失敗の記録"""
+    kind: str
+    detail: str = ''
+    status: int = None
+    attempts: int = 1
+    # 以前の試行で記録された失敗（上書きせずに残す）
+    history: list = field(default_factory=list)
+
+    @property
+    def retryable(self):
+        """再取得で回復する可能性がある（一時的な）失敗かどうか"""
+        if self.kind in (TRANSIENT_NETWORK, RATE_LIMITED):
+            return True
+        return self.kind == HTTP_STATUS and self.status is not None and self.status >= 500
+
+    @property
+    def label(self):
+        return FAILURE_LABELS.get(self.kind, self.kind)
+
+    @property
+    def metric_key(self):
+        """計測データの失敗理由キー"""
+        if self.kind == HTTP_STATUS:
+            return f"http_{self.status}"
+        return self.kind
+
+    @property
+    def message(self):
+        """画面表示用の取得失敗理由"""
+        if self.kind == HTTP_STATUS:
+            text = f"HTTPエラー: {self.status}"
+        elif self.kind == RATE_LIMITED:
+            text = "API制限（429）: 最大リトライ回数に達しました"
+        elif self.kind == TRANSIENT_NETWORK:
+            text = f"リクエストエラー: {self.detail}"
+        elif self.kind == PARSE_MISSING_BLOCK:
+            text = "商品詳細ブロックが見つかりませんでした"
+        elif self.kind == NOT_LISTED:
+            text = self.detail or "APIで商品が見つかりませんでした"
+        elif self.kind == QUOTA_EXHAUSTED:
+            text = self.detail or "APIの1日の上限回数に達したため取得していません"
+        elif self.kind == LAYOUT_DRIFT:
+            text = self.detail or "商品詳細ブロックのないページが多いため取得を中断しました"
+        elif self.kind == NOT_SAMPLED:
+            text = self.detail or "抽出の対象外のため取得していません"
+        else:
+            text = f"エラー: {self.detail}"
+        if self.attempts > 1:
+            text += f"（{self.attempts}回試行）"
+        return text
+
+    def __str__(self):
+        return self.message
+
+    def after_retry(self, previous):
+        """再取得でも失敗した場合に、前回の失敗を履歴として引き継ぐ"""
+        self.attempts = previous.attempts + self.attempts
+        self.history = previous.history + [previous.metric_key]
+        return self
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'label': self.label,
+            'status': self.status,
+            'detail': self.detail,
+            'attempts': self.attempts,
+            'history': list(self.history),
+            'retryable': self.retryable,
+        }
+
+
+def failure_from_dict(data):
+    """to_dict() の出力から失敗の記録を復元する関数（分散ワーカーの取得結果の集計用）"""
+    return FetchFailure(
+        data['kind'], detail=data['detail'], status=data['status'],
+        attempts=data['attempts'], history=list(data['history'])
+    )
+
+
+def http_failure(status, missing_means_not_listed=False):
+    """HTTPステータスコードから失敗を分類する関数
+
+    missing_means_not_listed: 404/410を「商品が掲載されていない」として扱う（自社サイトの商品ページ）
+    """
+    if status == 429:
+        return FetchFailure(RATE_LIMITED, status=status)
+    if missing_means_not_listed and status in (404, 410):
+        return FetchFailure(NOT_LISTED, detail=f"商品ページがありません（HTTP {status}）", status=status)
+    return FetchFailure(HTTP_STATUS, status=status)
+
+
+def exception_failure(error):
+    """例外から失敗を分類する関数"""
+    # requestsは通信処理で読み込み済みのため、ここでインポートする（画面表示だけの場合は読み込まない）
+    import requests
+
+    # 通信が原因の一時的な失敗とみなす例外
+    transient_exceptions = (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+        requests.exceptions.ContentDecodingError,
+    )
+    if isinstance(error, transient_exceptions):
+        return FetchFailure(TRANSIENT_NETWORK, detail=str(error))
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return http_failure(error.response.status_code)
+    return FetchFailure(UNEXPECTED, detail=str(error))
+
+
+def failure_counts(failures):
+    """失敗の記録を分類ラベル別に集計する関数"""
+    counts = {}
+    for failure in failures.values():
+        counts[failure.label] = counts.get(failure.label, 0) + 1
+    return counts
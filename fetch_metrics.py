@@ -0,0 +1,418 @@
+import codecs
+import json
+import threading
+import time
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# リクエスト単位で計測する区間
+# queue_wait: 待機（API制限のための待機・同時実行枠の空き待ち）
+# backoff:    429エラー等によるリトライ待機
+# connect:    DNS解決・TCP接続・TLSハンドシェイク（接続を再利用した場合は0）
+# ttfb:       リクエスト送信からレスポンスヘッダー受信まで
+# download:   レスポンス本文の受信
+# parse:      HTML/JSONの解析と項目抽出
+REQUEST_PHASES = ['queue_wait', 'backoff', 'connect', 'ttfb', 'download', 'parse']
+
+# スレッドごとの接続時間の計測値
+_connect_timer = threading.local()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_timer.seconds = getattr(_connect_timer, 'seconds', 0.0) + time.perf_counter() - start
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_timer.seconds = getattr(_connect_timer, 'seconds', 0.0) + time.perf_counter() - start
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """接続確立にかかった時間を計測できるHTTPAdapter"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+def create_session(pool_maxsize=10):
+    """接続プール付きの計測用セッションを作成する関数"""
+    session = requests.Session()
+    adapter = TimedHTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class RequestSpan:
+    """1商品コード分のリクエスト計測値"""
+
+    def __init__(self, source, code):
+        self.source = source
+        self.code = code
+        self.started = time.time()
+        self.phases = dict.fromkeys(REQUEST_PHASES, 0.0)
+        self.network_cpu = 0.0
+        self.parse_cpu = 0.0
+        self.attempts = 0
+        self.status = None
+        self.bytes = 0
+        # 通信路上で受信したバイト数（圧縮転送の場合は圧縮後のサイズ）
+        self.wire_bytes = 0
+        # 必要な部分を受信した時点で本文の受信を打ち切ったかどうか
+        self.early_stop = False
+        self.failure = None
+        self.total = None
+
+    def to_dict(self):
+        return {
+            'type': 'request',
+            'source': self.source,
+            'code': self.code,
+            'started': self.started,
+            'attempts': self.attempts,
+            'status': self.status,
+            'bytes': self.bytes,
+            'wire_bytes': self.wire_bytes,
+            'early_stop': self.early_stop,
+            'failure': self.failure,
+            'total': self.total,
+            **{f'{phase}_s': round(value, 6) for phase, value in self.phases.items()},
+            'network_cpu_s': round(self.network_cpu, 6),
+            'parse_cpu_s': round(self.parse_cpu, 6),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """to_dict() の出力から計測値を復元する（分散ワーカーで計測したリクエストの集計用）"""
+        span = cls(data['source'], data['code'])
+        span.started = data['started']
+        span.phases = {phase: data[f'{phase}_s'] for phase in REQUEST_PHASES}
+        span.network_cpu = data['network_cpu_s']
+        span.parse_cpu = data['parse_cpu_s']
+        for name in ('attempts', 'status', 'bytes', 'wire_bytes', 'early_stop', 'failure', 'total'):
+            setattr(span, name, data[name])
+        return span
+
+
+class _ParseTimer:
+    def __init__(self, span):
+        self.span = span
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.span.phases['parse'] += time.perf_counter() - self.wall
+        self.span.parse_cpu += time.thread_time() - self.cpu
+        return False
+
+
+def _percentile(values, q):
+    """値のリストからパーセンタイルを求める関数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class FetchMetrics:
+    """取得処理1回分のリクエスト計測・集計を行うクラス
+
+    リクエストごとの区間時間（RequestSpan）、ステータスコード別・失敗理由別の件数、
+    実行全体の区間時間（merge等）を保持し、JSON Lines / Prometheusテキスト形式で出力する。
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.started = time.time()
+        self.finished = None
+        self.spans = []
+        self.status_counts = Counter()
+        self.failure_counts = Counter()
+        self.run_phases = {}
+        # 実行条件・調整結果などの付加情報（同時接続数の推移など）
+        self.info = {}
+        self._lock = threading.Lock()
+        self._wall_start = time.perf_counter()
+        self.wall = None
+
+    # --- リクエスト単位の計測 ---
+    def start(self, code):
+        """商品コード1件分の計測を開始する"""
+        return RequestSpan(self.source, code)
+
+    def get(self, session, span, url, **kwargs):
+        """計測しながらGETリクエストを送信し、本文まで受信したレスポンスを返す"""
+        span.attempts += 1
+        _connect_timer.seconds = 0.0
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            res = session.get(url, stream=True, **kwargs)
+            headers_received = time.perf_counter()
+            content = res.content
+            finished = time.perf_counter()
+        finally:
+            span.network_cpu += time.thread_time() - cpu
+            connect = getattr(_connect_timer, 'seconds', 0.0)
+            span.phases['connect'] += connect
+
+        span.phases['ttfb'] += max(0.0, headers_received - wall - connect)
+        span.phases['download'] += finished - headers_received
+        span.bytes += len(content)
+        span.wire_bytes += res.raw.tell()
+        span.status = res.status_code
+        with self._lock:
+            self.status_counts[str(res.status_code)] += 1
+        return res
+
+    def get_until(self, session, span, url, scanner, chunk_size=8192, drain_limit=16384, **kwargs):
+        """本文を少しずつ受信・デコードし、scanner.feed(新しく受信したテキスト)がTrueになった時点で受信を打ち切る
+
+        圧縮転送（gzip/deflate）はチャンク単位で展開する。scanner には受信した部分だけを渡す
+        （受信済みテキスト全体を毎回作り直すと、ページが大きいほど判定が遅くなるため）。
+        打ち切った場合でも、残りが drain_limit バイト以下なら読み捨てて接続を再利用する
+        （再接続・TLSハンドシェイクの方が高くつくため）。
+        戻り値: (レスポンス, 受信済みテキスト, 打ち切ったかどうか)
+        """
+        span.attempts += 1
+        _connect_timer.seconds = 0.0
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        stopped = False
+        try:
+            res = session.get(url, stream=True, **kwargs)
+            headers_received = time.perf_counter()
+            decoder = codecs.getincrementaldecoder(res.encoding or 'utf-8')(errors='replace')
+            parts = []
+            size = 0
+            for chunk in res.iter_content(chunk_size):
+                size += len(chunk)
+                text = decoder.decode(chunk)
+                parts.append(text)
+                if res.status_code == 200 and scanner.feed(text):
+                    stopped = True
+                    break
+            parts.append(decoder.decode(b'', final=True))
+            wire_bytes = res.raw.tell()
+            if stopped:
+                content_length = res.headers.get('Content-Length')
+                remaining = int(content_length) - wire_bytes if content_length and content_length.isdigit() else None
+                if remaining is not None and remaining <= drain_limit:
+                    res.raw.drain_conn()
+                res.close()
+            finished = time.perf_counter()
+        finally:
+            span.network_cpu += time.thread_time() - cpu
+            connect = getattr(_connect_timer, 'seconds', 0.0)
+            span.phases['connect'] += connect
+
+        span.phases['ttfb'] += max(0.0, headers_received - wall - connect)
+        span.phases['download'] += finished - headers_received
+        span.bytes += size
+        span.wire_bytes += wire_bytes
+        span.early_stop = stopped
+        span.status = res.status_code
+        with self._lock:
+            self.status_counts[str(res.status_code)] += 1
+        return res, ''.join(parts), stopped
+
+    def parse(self, span):
+        """解析処理の計測用コンテキストマネージャーを返す"""
+        return _ParseTimer(span)
+
+    def wait(self, span, seconds, phase='queue_wait'):
+        """待機しながら待機時間を記録する"""
+        if seconds > 0:
+            time.sleep(seconds)
+        span.phases[phase] += seconds
+
+    def add_wait(self, span, seconds, phase='queue_wait'):
+        """待機済みの時間を記録する"""
+        span.phases[phase] += seconds
+
+    def request_error(self, span, error):
+        """通信エラー（ステータスコードなし）を記録する"""
+        with self._lock:
+            self.status_counts[type(error).__name__] += 1
+
+    def finish(self, span, failure=None):
+        """商品コード1件分の計測を終了する（failure: FetchFailure または失敗理由の分類キー）"""
+        failure = getattr(failure, 'metric_key', failure)
+        span.failure = failure
+        span.total = time.time() - span.started
+        with self._lock:
+            self.spans.append(span)
+            if failure:
+                self.failure_counts[failure] += 1
+
+    def add_remote(self, spans, status_counts):
+        """他のプロセス（分散ワーカー）で計測したリクエストを追加する
+
+        spans: RequestSpan.to_dict() のリスト、status_counts: ステータスコード別の件数
+        """
+        restored = [RequestSpan.from_dict(data) for data in spans]
+        with self._lock:
+            self.spans.extend(restored)
+            self.status_counts.update(status_counts)
+            self.failure_counts.update(span.failure for span in restored if span.failure)
+
+    # --- 実行全体の計測 ---
+    def run_phase(self, name):
+        """実行全体の区間（merge等）の計測用コンテキストマネージャーを返す"""
+        metrics = self
+
+        class _RunPhase:
+            def __enter__(self):
+                self.start = time.perf_counter()
+                return self
+
+            def __exit__(self, *exc):
+                metrics.run_phases[name] = metrics.run_phases.get(name, 0.0) + time.perf_counter() - self.start
+                return False
+
+        return _RunPhase()
+
+    def close(self):
+        """実行全体の計測を終了する"""
+        self.finished = time.time()
+        self.wall = time.perf_counter() - self._wall_start
+
+    # --- 集計・出力 ---
+    def summary(self):
+        """実行サマリーを辞書で返す"""
+        wall = self.wall if self.wall is not None else time.perf_counter() - self._wall_start
+        # 再取得した商品コードは最後の結果で成否を判定する
+        last_spans = {}
+        for span in self.spans:
+            last_spans[span.code] = span
+        failed = sum(1 for span in last_spans.values() if span.failure)
+        phases = {}
+        for phase in REQUEST_PHASES:
+            values = [span.phases[phase] for span in self.spans]
+            phases[phase] = {
+                'sum_s': sum(values),
+                'p50_s': _percentile(values, 0.5),
+                'p95_s': _percentile(values, 0.95),
+                'p99_s': _percentile(values, 0.99),
+            }
+        return {
+            'type': 'summary',
+            'source': self.source,
+            'started': self.started,
+            'finished': self.finished,
+            'wall_s': wall,
+            'codes': len(last_spans),
+            'succeeded': len(last_spans) - failed,
+            'failed': failed,
+            'requests': sum(span.attempts for span in self.spans),
+            'bytes': sum(span.bytes for span in self.spans),
+            'wire_bytes': sum(span.wire_bytes for span in self.spans),
+            'early_stops': sum(1 for span in self.spans if span.early_stop),
+            'codes_per_s': len(last_spans) / wall if wall > 0 else None,
+            'network_cpu_s': sum(span.network_cpu for span in self.spans),
+            'parse_cpu_s': sum(span.parse_cpu for span in self.spans),
+            'status_counts': dict(self.status_counts),
+            'failure_counts': dict(self.failure_counts),
+            'phases': phases,
+            'run_phases': dict(self.run_phases),
+            'info': dict(self.info),
+        }
+
+    def to_jsonl(self):
+        """リクエストごとの計測値と実行サマリーをJSON Lines形式で返す"""
+        lines = [json.dumps(span.to_dict(), ensure_ascii=False) for span in self.spans]
+        lines.append(json.dumps(self.summary(), ensure_ascii=False))
+        return '\n'.join(lines) + '\n'
+
+    def to_prometheus(self, prefix='sitecheck'):
+        """計測結果をPrometheusテキスト形式で返す"""
+        summary = self.summary()
+        source = _escape_label(self.source)
+        lines = [
+            f'# HELP {prefix}_requests_total HTTP requests by status code (or exception name).',
+            f'# TYPE {prefix}_requests_total counter',
+        ]
+        for status, count in sorted(self.status_counts.items()):
+            lines.append(f'{prefix}_requests_total{{source="{source}",status="{_escape_label(status)}"}} {count}')
+
+        lines += [
+            f'# HELP {prefix}_failures_total Codes that could not be fetched, by failure reason.',
+            f'# TYPE {prefix}_failures_total counter',
+        ]
+        for reason, count in sorted(self.failure_counts.items()):
+            lines.append(f'{prefix}_failures_total{{source="{source}",reason="{_escape_label(reason)}"}} {count}')
+
+        lines += [
+            f'# HELP {prefix}_codes_total Processed codes by result.',
+            f'# TYPE {prefix}_codes_total counter',
+            f'{prefix}_codes_total{{source="{source}",result="succeeded"}} {summary["succeeded"]}',
+            f'{prefix}_codes_total{{source="{source}",result="failed"}} {summary["failed"]}',
+            f'# HELP {prefix}_request_phase_seconds Per-code time spent in each request phase.',
+            f'# TYPE {prefix}_request_phase_seconds summary',
+        ]
+        for phase, stats in summary['phases'].items():
+            for quantile, key in [('0.5', 'p50_s'), ('0.95', 'p95_s'), ('0.99', 'p99_s')]:
+                if stats[key] is not None:
+                    lines.append(
+                        f'{prefix}_request_phase_seconds{{source="{source}",phase="{phase}",quantile="{quantile}"}} '
+                        f'{stats[key]:.6f}'
+                    )
+            lines.append(f'{prefix}_request_phase_seconds_sum{{source="{source}",phase="{phase}"}} {stats["sum_s"]:.6f}')
+            lines.append(f'{prefix}_request_phase_seconds_count{{source="{source}",phase="{phase}"}} {len(self.spans)}')
+
+        lines += [
+            f'# HELP {prefix}_run_phase_seconds Time spent in run-level phases such as merge.',
+            f'# TYPE {prefix}_run_phase_seconds gauge',
+        ]
+        for name, seconds in summary['run_phases'].items():
+            lines.append(f'{prefix}_run_phase_seconds{{source="{source}",phase="{_escape_label(name)}"}} {seconds:.6f}')
+
+        lines += [
+            f'# HELP {prefix}_run_duration_seconds Wall-clock duration of the fetch run.',
+            f'# TYPE {prefix}_run_duration_seconds gauge',
+            f'{prefix}_run_duration_seconds{{source="{source}"}} {summary["wall_s"]:.6f}',
+            f'# HELP {prefix}_response_bytes_total Response body bytes received.',
+            f'# TYPE {prefix}_response_bytes_total counter',
+            f'{prefix}_response_bytes_total{{source="{source}"}} {summary["bytes"]}',
+            f'# HELP {prefix}_wire_bytes_total Bytes received on the wire (compressed size when compressed).',
+            f'# TYPE {prefix}_wire_bytes_total counter',
+            f'{prefix}_wire_bytes_total{{source="{source}"}} {summary["wire_bytes"]}',
+            f'# HELP {prefix}_early_stops_total Responses whose body was cut off once the needed blocks arrived.',
+            f'# TYPE {prefix}_early_stops_total counter',
+            f'{prefix}_early_stops_total{{source="{source}"}} {summary["early_stops"]}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value):
+    """Prometheusのラベル値をエスケープする関数"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
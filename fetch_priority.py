@@ -0,0 +1,138 @@
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+# 優先度の点数（合計が高い商品コードから先に取得する）
+PRIORITY_WEIGHTS = {
+    # 通販単価（取得する商品コードの中での順位を0〜1に換算）
+    'price': 1.0,
+    # 前回の取得から販売リストの行が変わった、または初めて取得する商品コード
+    'edited': 2.0,
+    # 前回の取得で通販単価との差額があった
+    'mismatch': 3.0,
+    # 前回の取得に失敗した（未掲載を含む）
+    'failed': 1.5,
+    # 自社サイトで下記のアイコンが付いていた（楽天市場・Yahoo!ショッピングは基本コードで参照）
+    'icon': 2.0,
+}
+PRIORITY_ICONS = ('SALE', '期間限定')
+# 取得結果の分類
+OK = 'ok'
+MISMATCH = 'mismatch'
+FAILED = 'failed'
+# 差額がこの金額（円）未満なら一致とみなす
+PRICE_TOLERANCE = 1
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS code_history (
+            source TEXT NOT NULL,
+            code TEXT NOT NULL,
+            -- 取得した時の販売リストの行のハッシュ値（販売リストの変更の検出に使う）
+            row_digest TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            -- 自社サイトのアイコン（PRIORITY_ICONS のうち付いていたもの。カンマ区切り）
+            icons TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (source, code)
+        )
+    """)
+    return conn
+
+
+def parse_price(values):
+    """カンマ区切りの価格を数値に変換する関数（変換できない値はNaN）"""
+    return pd.to_numeric(pd.Series(values).astype(str).str.replace(',', '', regex=False), errors='coerce')
+
+
+def code_rows(df, base_column=None):
+    """取得する商品コードごとの基本コード・通販単価・販売リストの行のハッシュ値を作成する関数
+
+    同じ商品コードが複数行ある場合は先頭行を使う（並び順は商品コードの初出順）。
+    base_column: 拡張前の商品コードの列（楽天市場・Yahoo!ショッピング。自社サイトは商品コードと同じ）
+    """
+    df = df.assign(商品コード=df['商品コード'].astype(str).str.strip()).drop_duplicates('商品コード')
+    codes = df['商品コード'].to_numpy()
+    return pd.DataFrame({
+        'code': codes,
+        'base_code': df[base_column].astype(str).to_numpy() if base_column else codes,
+        'price': parse_price(df['通販単価']).to_numpy(),
+        'row_digest': pd.util.hash_pandas_object(df.astype(str), index=False).astype(str).to_numpy(),
+    })
+
+
+def load_history(path, source):
+    """取得先の前回までの取得結果（商品コード → (行のハッシュ値, 取得結果, アイコン)）を返す関数"""
+    conn = _connect(path)
+    try:
+        rows = conn.execute(
+            "SELECT code, row_digest, outcome, icons FROM code_history WHERE source = ?", (source,)
+        ).fetchall()
+    finally:
+        conn.close()
+    return {code: (row_digest, outcome, icons) for code, row_digest, outcome, icons in rows}
+
+
+def prioritize(path, source, rows):
+    """商品コードの優先度を計算し、取得する順番（rows の位置のリスト）と内訳を返す関数
+
+    点数が同じ商品コードは販売リストの並び順で取得する。
+    """
+    history = load_history(path, source)
+    # アイコンは自社サイトの取得結果を基本コードで参照する
+    icon_history = history if source == 'own_site' else load_history(path, 'own_site')
+    previous = [history.get(code) for code in rows['code']]
+
+    signals = pd.DataFrame({
+        'price': rows['price'].rank(pct=True).fillna(0).to_numpy(),
+        'edited': [entry is None or entry[0] != digest for entry, digest in zip(previous, rows['row_digest'])],
+        'mismatch': [entry is not None and entry[1] == MISMATCH for entry in previous],
+        'failed': [entry is not None and entry[1] == FAILED for entry in previous],
+        'icon': [bool(icon_history.get(code, (None, None, ''))[2]) for code in rows['base_code']],
+    })
+    scores = sum(signals[name].astype(float) * weight for name, weight in PRIORITY_WEIGHTS.items())
+    order = np.argsort(-scores.to_numpy(), kind='stable')
+    stats = {
+        'codes': len(rows),
+        'history': sum(entry is not None for entry in previous),
+        **{name: int(signals[name].sum()) for name in ('edited', 'mismatch', 'failed', 'icon')},
+    }
+    return order.tolist(), stats
+
+
+def outcome(item_price, target_price, failure):
+    """1件分の取得結果を分類する関数（失敗・差額あり・一致）"""
+    if failure is not None:
+        return FAILED
+    price = parse_price([item_price])[0]
+    if not np.isnan(price) and not np.isnan(target_price) and abs(price - target_price) >= PRICE_TOLERANCE:
+        return MISMATCH
+    return OK
+
+
+def record_outcomes(path, source, rows, outcomes, icons=None):
+    """取得した商品コードの取得結果と販売リストの行のハッシュ値を保存する関数（次回の優先度の計算に使う）
+
+    outcomes: 商品コード → 取得結果（取得しなかった商品コードは含めず、前回の記録を残す）
+    icons: 商品コード → アイコンのリスト（自社サイト）
+    """
+    icons = icons or {}
+    now = time.time()
+    records = [
+        (source, code, row_digest, outcomes[code],
+         ','.join(icon for icon in icons.get(code, []) if icon in PRIORITY_ICONS), now)
+        for code, row_digest in zip(rows['code'], rows['row_digest'])
+        if code in outcomes
+    ]
+    if not records:
+        return
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO code_history VALUES (?, ?, ?, ?, ?, ?)", records)
+    finally:
+        conn.close()
@@ -0,0 +1,188 @@
+import threading
+import time
+
+# 実行中のスレッドで動いている共有ジョブ（進捗を記録するため）
+_local = threading.local()
+
+
+def current_job():
+    """このスレッドで実行中の共有ジョブを返す関数（共有ジョブの外ではNone）"""
+    return getattr(_local, 'job', None)
+
+
+class Job:
+    """取得処理1件分の状態
+
+    同じ内容の取得（ソース・販売リスト・オプションが同じ）を複数のセッションで共有するため、
+    進捗と結果をセッション状態ではなくここに保持する。
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.started_at = time.time()
+        self.finished_at = None
+        self.progress = 0.0
+        self.status = ''
+        # 結果（セッション状態のキー → 値）
+        self.result = None
+        self.error = None
+        # 実行中に合流したセッション数
+        self.attached = 0
+        # 結果を使っているセッション → 最後にそのセッションの画面を実行した時刻
+        self.holders = {}
+        self._done = threading.Event()
+
+    @property
+    def running(self):
+        return not self._done.is_set()
+
+    def update(self, progress=None, status=None):
+        if progress is not None:
+            self.progress = progress
+        if status is not None:
+            self.status = status
+
+    def wait(self, timeout):
+        """ジョブの完了を最大timeout秒待ち、完了していればTrueを返す"""
+        return self._done.wait(timeout)
+
+    def holds(self, value):
+        return self.result is not None and any(v is value for v in self.result.values())
+
+
+class JobRegistry:
+    """プロセス内の全セッションで共有する取得処理の一覧
+
+    同じキーの取得が実行中なら合流し、完了済みなら ttl_seconds の間は結果を再利用する。
+    結果を使っているセッションが holder_ttl_seconds の間 touch() しなければ、結果を手放したとみなす
+    （release() を呼ばずに閉じたブラウザのセッション）。有効期限を過ぎ、使っているセッションもなくなったジョブは
+    claim() のたびに一覧から外し、on_evict(ジョブ) を呼ぶ（結果の書き出しファイルの削除等）。
+    """
+
+    def __init__(self, ttl_seconds, holder_ttl_seconds, on_evict=None):
+        self.ttl_seconds = ttl_seconds
+        self.holder_ttl_seconds = holder_ttl_seconds
+        self.on_evict = on_evict
+        self._jobs = {}
+        # 期限切れ・取り直しで置き換えたが、まだ結果を使っているセッションがあるジョブ
+        self._retired = []
+        self._lock = threading.Lock()
+
+    def claim(self, key, refresh=False):
+        """キーに対応するジョブを返す関数
+
+        戻り値: (ジョブ, 実行するかどうか)。実行中・有効期限内のジョブがあればそのジョブと False を返す。
+        refresh=True の場合は、完了済みのジョブを使わずに新しく実行する（実行中のジョブには合流する）。
+        """
+        with self._lock:
+            self._evict(time.time())
+            job = self._jobs.get(key)
+            if job is not None:
+                if job.running:
+                    job.attached += 1
+                    return job, False
+                if not refresh:
+                    return job, False
+                self._retire(job)
+            job = Job(key)
+            self._jobs[key] = job
+            return job, True
+
+    def run(self, job, func):
+        """ジョブを実行して結果を記録する関数（func() はセッション状態のキー → 値の辞書を返す）"""
+        _local.job = job
+        try:
+            job.result = func()
+        except BaseException as e:
+            # 失敗したジョブは共有しない（待機中のセッションには失敗を伝え、次の要求で実行し直す）
+            job.error = e
+            raise
+        finally:
+            _local.job = None
+            job.finished_at = time.time()
+            job._done.set()
+        return job.result
+
+    def hold(self, job, holder):
+        """セッションがジョブの結果を使い始めたことを記録する関数"""
+        with self._lock:
+            job.holders[holder] = time.time()
+
+    def touch(self, holder):
+        """セッションがまだ使われていることを記録する関数（画面の実行のたびに呼ぶ）"""
+        now = time.time()
+        with self._lock:
+            for job in list(self._jobs.values()) + self._retired:
+                if holder in job.holders:
+                    job.holders[holder] = now
+
+    def held_paths(self):
+        """一覧にあるジョブの結果の書き出しファイルのパスを返す関数（古いファイルの削除から除く）"""
+        with self._lock:
+            return {
+                value.path
+                for job in list(self._jobs.values()) + self._retired if job.result is not None
+                for value in job.result.values() if isinstance(getattr(value, 'path', None), str)
+            }
+
+    def release(self, value, holder):
+        """セッションが結果を手放したことを記録する関数
+
+        ほかに同じ結果を使っているセッションがない場合（またはジョブの結果でない場合）は True を返す。
+        """
+        with self._lock:
+            for job in list(self._jobs.values()) + self._retired:
+                if job.holds(value):
+                    job.holders.pop(holder, None)
+                    if job.holders:
+                        return False
+                    if job in self._retired:
+                        self._retired.remove(job)
+                    elif not job.running:
+                        # 結果のファイルを削除するため、以降の要求には共有しない
+                        del self._jobs[job.key]
+                    return True
+            return True
+
+    def _retire(self, job):
+        del self._jobs[job.key]
+        if job.holders:
+            self._retired.append(job)
+        else:
+            self._discard(job)
+
+    def _evict(self, now):
+        """有効期限を過ぎたジョブ・失敗したジョブを一覧から外し、使っているセッションのないジョブを破棄する"""
+        for job in list(self._jobs.values()) + self._retired:
+            for holder, seen in list(job.holders.items()):
+                if now - seen > self.holder_ttl_seconds:
+                    del job.holders[holder]
+        for job in list(self._jobs.values()):
+            if not job.running and (job.error is not None or now - job.finished_at > self.ttl_seconds):
+                self._retire(job)
+        for job in [job for job in self._retired if not job.holders]:
+            self._retired.remove(job)
+            self._discard(job)
+
+    def _discard(self, job):
+        if self.on_evict is not None and job.result is not None:
+            self.on_evict(job)
+
+
+class ProgressMirror:
+    """Streamlitの進捗表示を更新しながら、共有ジョブにも同じ内容を記録するラッパー
+
+    合流したセッションは、ジョブに記録された進捗を自分の画面に表示する。
+    """
+
+    def __init__(self, element, job):
+        self.element = element
+        self.job = job
+
+    def progress(self, value):
+        self.element.progress(value)
+        self.job.update(progress=value)
+
+    def text(self, value):
+        self.element.text(value)
+        self.job.update(status=value)
@@ -0,0 +1,45 @@
+import importlib
+import sys
+import threading
+import types
+
+# 読み込みを1回にするためのロック（Streamlitはセッションごとのスレッドでスクリプトを実行し、
+# 取得処理のスレッドプールからも同時に最初の参照が起きるため）
+_import_lock = threading.RLock()
+
+
+class _LazyModule(types.ModuleType):
+    """最初に属性を参照した時点でモジュールを読み込み、以降は読み込んだモジュールの属性を返すモジュールの代わり"""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._module = None
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with _import_lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self.__name__)
+                module = self._module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name):
+    """モジュールを最初に属性を参照した時点で読み込む関数
+
+    Streamlitはスクリプトを実行するたびに先頭から実行し直すため、
+    CSV読み込み前の画面では使わない重いモジュール（pandas等）の読み込みを後回しにする。
+    読み込み済みのモジュールはそのまま返す。
+    importlib.util.LazyLoader は同時に最初の参照が起きると読み込みが2回実行されたり、
+    読み込み途中のモジュールが見えたりするため、ロックをかけて通常の import で読み込む。
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return _LazyModule(name)
@@ -0,0 +1,145 @@
+import os
+import threading
+
+import fetch_engine
+import own_site_parser
+from fetch_failures import FetchFailure, LAYOUT_DRIFT, PARSE_MISSING_BLOCK, http_failure
+
+# 取得先と待機時間（ベンチマーク等で環境変数から差し替え可能）
+OWN_SITE_BASE_URL = os.environ.get('OWN_SITE_BASE_URL', 'https://www.tonya.co.jp')
+# 自社サイトのリクエストタイムアウト（秒）
+OWN_SITE_TIMEOUT = float(os.environ.get('OWN_SITE_TIMEOUT', '30'))
+# 自社サイトの商品ページの受信を途中で打ち切る場合に、読み捨てて接続を再利用する残りバイト数の上限
+OWN_SITE_DRAIN_LIMIT = int(os.environ.get('OWN_SITE_DRAIN_LIMIT', '16384'))
+# 最初の DRIFT_SAMPLE_PAGES ページのうち、商品詳細ブロックのないページの割合が DRIFT_MAX_MISSING_RATE を超えたら
+# サイトのレイアウト変更を疑って残りの取得を中断する
+DRIFT_SAMPLE_PAGES = int(os.environ.get('OWN_SITE_DRIFT_SAMPLE_PAGES', '50'))
+DRIFT_MAX_MISSING_RATE = float(os.environ.get('OWN_SITE_DRIFT_MAX_MISSING_RATE', '0.2'))
+
+
+class LayoutDriftMonitor:
+    """最初に受信した商品ページの抽出率を監視し、レイアウト変更の疑いがあれば取得を中断させるクラス
+
+    商品ページ（HTTP 200）を受信するたびに、商品詳細ブロックがあったかを record() で記録する。
+    最初の sample_pages ページで商品詳細ブロックのないページの割合が max_missing_rate を超えた時点
+    （残りのページの結果に関わらず超えることが確定した時点を含む）で tripped になる。同時実行のスレッドから呼び出してよい。
+    """
+
+    def __init__(self, sample_pages=DRIFT_SAMPLE_PAGES, max_missing_rate=DRIFT_MAX_MISSING_RATE):
+        self.sample_pages = sample_pages
+        self.max_missing_rate = max_missing_rate
+        self.pages = 0
+        self.missing = 0
+        self.tripped = False
+        self._lock = threading.Lock()
+
+    def record(self, found):
+        with self._lock:
+            if self.pages >= self.sample_pages:
+                return
+            self.pages += 1
+            self.missing += 0 if found else 1
+            if self.missing > self.sample_pages * self.max_missing_rate:
+                self.tripped = True
+
+    def trip(self):
+        """残りの取得を中断させる（分散ワーカーで、他のワーカーがレイアウト変更の疑いを検出した場合）"""
+        with self._lock:
+            self.tripped = True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pages': self.pages,
+                'missing': self.missing,
+                'sample_pages': self.sample_pages,
+                'max_missing_rate': self.max_missing_rate,
+                'tripped': self.tripped,
+            }
+
+
+# 自社サイトの商品ページ1件分の取得
+def fetch_own_site_item(session, code, metrics, span, streamed=True, page_cache=None, drift=None):
+    """自社サイトの商品ページを1件取得・解析し、(商品情報, FetchFailure)を返す関数
+
+    streamed=True の場合は圧縮転送で少しずつ受信し、使用するブロックがそろった時点で受信を打ち切る。
+    打ち切った本文で商品詳細ブロックが見つからない場合は、本文全体を取得し直す。
+    page_cache（page_cache.PageRecordCache）を指定した場合は、使用するブロックのハッシュ値が
+    前回と同じ商品ページを解析せずに前回の商品情報を返す。
+    drift（LayoutDriftMonitor）を指定した場合は抽出率を記録し、レイアウト変更の疑いで中断した後はリクエストしない。
+    """
+    if drift is not None and drift.tripped:
+        failure = FetchFailure(LAYOUT_DRIFT)
+        metrics.finish(span, failure)
+        return None, failure
+    url = f'{OWN_SITE_BASE_URL}/shop/g/g{code}'
+    if streamed:
+        res, html, stopped = metrics.get_until(
+            session, span, url, own_site_parser.BlockScanner(), drain_limit=OWN_SITE_DRAIN_LIMIT,
+            headers={'Accept-Encoding': 'gzip, deflate'}, timeout=OWN_SITE_TIMEOUT
+        )
+    else:
+        res = metrics.get(session, span, url, timeout=OWN_SITE_TIMEOUT)
+        html, stopped = None, False
+
+    # HTTPエラーチェック（404は商品ページなし＝未掲載として扱う）
+    if res.status_code != 200:
+        failure = http_failure(res.status_code, missing_means_not_listed=True)
+        metrics.finish(span, failure)
+        return None, failure
+
+    html = html if html is not None else res.text
+    digest = None
+    if page_cache is not None:
+        digest = own_site_parser.own_site_blocks_digest(html)
+        item_dict = page_cache.lookup(code, digest)
+        if item_dict is not None:
+            if drift is not None:
+                drift.record(True)
+            metrics.finish(span)
+            return item_dict, None
+
+    with metrics.parse(span):
+        item_dict = own_site_parser.parse_own_site_page(html)
+
+    if item_dict is None and stopped:
+        # 打ち切った本文では解析できなかった場合は本文全体で取得し直す
+        return fetch_own_site_item(session, code, metrics, span, streamed=False, page_cache=page_cache, drift=drift)
+    if drift is not None:
+        drift.record(item_dict is not None)
+    if item_dict is None:
+        failure = FetchFailure(PARSE_MISSING_BLOCK)
+        metrics.finish(span, failure)
+        return None, failure
+
+    if page_cache is not None:
+        page_cache.store(code, digest, item_dict)
+    metrics.finish(span)
+    return item_dict, None
+
+
+def scrape_pass(session, codes, metrics, limiter, on_progress, streamed, on_item=None, fetch_item=fetch_own_site_item):
+    """商品コードのリストを同時実行で取得し、[(商品情報, FetchFailure), ...]を並び順で返す関数
+
+    on_item(位置, 商品情報) を指定した場合は、取得できた商品情報を保持せずに on_item に渡す（メモリ節約モード）。
+    fetch_item(session, 商品コード, metrics, span, streamed) で1件分の取得処理を差し替えられる（ウォッチリスト監視）。
+    """
+    return fetch_engine.fetch_pass(
+        session, codes, lambda session, code, metrics, span: fetch_item(session, code, metrics, span, streamed),
+        metrics, limiter, lambda completed, total, code: on_progress(completed, total), on_item=on_item
+    )
+
+
+def scrape_codes(session, codes, metrics, limiter, on_progress, streamed, retry_delay, on_item=None, drift=None):
+    """商品コードのリストを取得し、一時的なエラーで失敗した商品だけをもう一度取得する関数（分散ワーカー）
+
+    on_progress(完了件数, 件数, 再取得中かどうか) で進捗を通知する。
+    drift（LayoutDriftMonitor）を指定した場合は抽出率を記録し、レイアウト変更の疑いで中断した後はリクエストしない。
+    戻り値: ([(商品情報, FetchFailure), ...]（並び順）, 商品コード→FetchFailure の辞書)
+    """
+    return fetch_engine.fetch_codes(
+        session, codes,
+        lambda session, code, metrics, span: fetch_own_site_item(session, code, metrics, span, streamed, drift=drift),
+        metrics, limiter, lambda completed, total, retry, code: on_progress(completed, total, retry), retry_delay,
+        on_item=on_item
+    )
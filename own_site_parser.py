@@ -0,0 +1,224 @@
+import hashlib
+import json
+import re
+
+import soupsieve
+from bs4 import BeautifulSoup
+
+# 自社サイトの商品ページの抽出仕様
+# - blocks: 使用するブロック（名前 → CSSセレクター・受信済み部分で探す開始タグのパターン・タグ名）。
+#   required のブロックがないページは解析失敗（レイアウト変更の検出に使う）
+# - fields: 項目（項目名, ブロック, CSSセレクター（先に見つかったものを使う）, 値の変換（_VALUE_PARSERS））
+# - icons: アイコンの画像（ブロック内の icons['css'] の中の img）の src → 表示名
+# サイトのレイアウトが変わった場合はここを直す（変えるとハッシュ値が変わり、保存済みの商品情報は使わずに解析し直す）
+OWN_SITE_SPEC = {
+    'blocks': {
+        'detail': {
+            'css': 'div.goodsproductdetail_', 'start': r'<div[^>]*class="[^"]*\bgoodsproductdetail_\b', 'tag': 'div',
+        },
+        'point': {'css': 'ul#point_stock', 'start': r'<ul[^>]*id="point_stock"', 'tag': 'ul'},
+        'stock': {'css': 'tr.id_stock_msg_', 'start': r'<tr[^>]*class="[^"]*\bid_stock_msg_\b', 'tag': 'tr'},
+    },
+    'required': 'detail',
+    'fields': [
+        ('No', 'detail', ['span.goodscode_id_number_'], 'code'),
+        ('Name', 'detail', ['h2.goods_rifhtname_'], 'text'),
+        # セール価格があればセール価格、なければ通常価格
+        ('Price', 'detail', ['span.goods_detail_saleprice_', 'h2.goods_price_'], 'price'),
+        ('Point', 'point', ['li'], 'point'),
+        ('Stock', 'stock', ['td.id_txt'], 'text'),
+    ],
+    'icons': {
+        'block': 'detail',
+        'css': 'div.icon_',
+        'labels': {
+            '/img/sys/new.gif': 'NEW',
+            '/img/sys/onsales.gif': 'SALE',
+            '/img/icon/10000001.png': '送料無料',
+            '/img/icon/10000002.png': 'よりどり対象',
+            '/img/icon/10000003.png': '期間限定',
+            '/img/icon/10000004.png': 'クーポン進呈',
+            '/img/icon/10000005.png': '会員限定',
+            '/img/icon/10000006.png': 'オンライン限定',
+            '/img/icon/10000007.png': 'NEW',
+        },
+    },
+}
+
+
+def _parse_code(text):
+    return int(re.sub('商品コード：', '', text))
+
+
+def _parse_price(text):
+    # 金額はカンマ区切りの文字列として格納
+    price_text = text.replace('円（税込）', '')
+    return f"{int(price_text.replace(',', '')):,}" if price_text else None
+
+
+def _parse_point(text):
+    try:
+        return int(text.replace('ポイント：', '').replace('pt', ''))
+    except ValueError:
+        return None
+
+
+# 値の変換（要素のテキスト → 項目の値）
+_VALUE_PARSERS = {
+    'text': lambda text: text,
+    'code': _parse_code,
+    'price': _parse_price,
+    'point': _parse_point,
+}
+
+
+def compile_spec(spec):
+    """抽出仕様のCSSセレクター・開始タグのパターンを事前にコンパイルする関数（取得中はコンパイル済みのものを使う）"""
+    blocks = {
+        name: {
+            'select': soupsieve.compile(block['css']),
+            'start': re.compile(block['start']),
+            'tag': block['tag'],
+        }
+        for name, block in spec['blocks'].items()
+    }
+    return {
+        'blocks': blocks,
+        'required': spec['required'],
+        'fields': [
+            (name, block, [soupsieve.compile(css) for css in selectors], _VALUE_PARSERS[parser])
+            for name, block, selectors, parser in spec['fields']
+        ],
+        'icons': {**spec['icons'], 'select': soupsieve.compile(spec['icons']['css']), 'img': soupsieve.compile('img')},
+        # 抽出仕様のハッシュ値（商品ページのハッシュ値に含める）
+        'fingerprint': hashlib.sha256(json.dumps(spec, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest(),
+    }
+
+
+_COMPILED_SPEC = compile_spec(OWN_SITE_SPEC)
+# 受信済み部分で探すブロック（開始タグのパターン, タグ名）
+OWN_SITE_BLOCKS = [(block['start'], block['tag']) for block in _COMPILED_SPEC['blocks'].values()]
+_TAG_PATTERNS = {tag: re.compile(rf'<(/?){tag}\b', re.IGNORECASE) for _, tag in OWN_SITE_BLOCKS}
+# ブロック内の毎回変わる部分（ハッシュ値の計算前に取り除く）: (パターン, 置換後)
+_VOLATILE_PATTERNS = [
+    # コメント・hiddenのinput（CSRFトークン等）
+    (re.compile(r'<!--.*?-->', re.DOTALL), ''),
+    (re.compile(r'<input[^>]*type="hidden"[^>]*>', re.IGNORECASE), ''),
+    # 画像・CSS等のURLのキャッシュ回避用パラメーター（?v=20260101 等）
+    (re.compile(r'[?&](?:v|t|ts|_)=[^"\'&>\s]*'), ''),
+    # 空白の違い
+    (re.compile(r'\s+'), ' '),
+]
+# parse_own_site_page の処理を変えた時に上げる（保存済みの商品情報を使わずに解析し直すため。抽出仕様の変更は自動で反映）
+EXTRACTION_VERSION = 1
+
+
+def _find_block(html, start_pattern, tag):
+    """ブロックの開始タグから対応する閉じタグまでの範囲 (開始位置, 終了位置) を返す関数（閉じていなければNone）"""
+    match = start_pattern.search(html)
+    if match is None:
+        return None
+    # 入れ子を数えて対応する閉じタグを探す
+    depth = 0
+    for tag_match in _TAG_PATTERNS[tag].finditer(html, match.start()):
+        depth += -1 if tag_match.group(1) else 1
+        if depth == 0:
+            return match.start(), tag_match.end()
+    return None
+
+
+class BlockScanner:
+    """受信途中の商品ページを受信した分ずつ受け取り、使用するブロックがすべて閉じタグまでそろったか判定するクラス
+
+    受信済み部分全体を毎回探し直さないよう、新しく受信した部分だけを探す（受信の区切りでタグが途中まで
+    しか届いていない場合は、そのタグを次に受信した部分とあわせて探す）。1ページごとに作成する。
+    """
+
+    def __init__(self):
+        # ブロックごとの状態: [開始タグのパターン, タグ名, 開始タグが見つかったか, 入れ子の深さ, 閉じたか]
+        self._blocks = [[start_pattern, tag, False, 0, False] for start_pattern, tag in OWN_SITE_BLOCKS]
+        # 前回の末尾の途中までのタグ
+        self._carry = ''
+
+    def feed(self, text):
+        """新しく受信したテキストを渡し、使用するブロックがすべてそろったらTrueを返す"""
+        window = self._carry + text
+        # 閉じていないタグ（「<」の後に「>」がない）は次に受信した部分とあわせて探す
+        cut = window.rfind('<')
+        if cut == -1 or window.find('>', cut) != -1:
+            cut = len(window)
+        self._carry = window[cut:]
+        for block in self._blocks:
+            start_pattern, tag, started, depth, closed = block
+            if closed:
+                continue
+            pos = 0
+            if not started:
+                match = start_pattern.search(window, 0, cut)
+                if match is None:
+                    continue
+                started, pos = True, match.start()
+            # 入れ子を数えて対応する閉じタグを探す
+            for tag_match in _TAG_PATTERNS[tag].finditer(window, pos, cut):
+                depth += -1 if tag_match.group(1) else 1
+                if depth == 0:
+                    closed = True
+                    break
+            block[2:] = [started, depth, closed]
+        return all(block[4] for block in self._blocks)
+
+
+def own_site_blocks_digest(html):
+    """商品ページの使用するブロックだけのハッシュ値を返す関数（ブロックがそろっていなければNone）
+
+    ページ全体にはセッショントークン・更新時刻等の毎回変わる部分があるため、
+    商品情報の変化の判定（解析を省略できるか）にはブロックの部分だけを、毎回変わる部分を取り除いて使う。
+    抽出内容のバージョン（EXTRACTION_VERSION）と抽出仕様のハッシュ値も含める。
+    """
+    digest = hashlib.sha256(f"v{EXTRACTION_VERSION}:{_COMPILED_SPEC['fingerprint']}".encode('utf-8'))
+    for start_pattern, tag in OWN_SITE_BLOCKS:
+        span = _find_block(html, start_pattern, tag)
+        if span is None:
+            return None
+        block = html[span[0]:span[1]]
+        for pattern, replacement in _VOLATILE_PATTERNS:
+            block = pattern.sub(replacement, block)
+        digest.update(block.encode('utf-8'))
+    return digest.hexdigest()
+
+
+# 自社サイトの商品ページの解析
+def parse_own_site_page(html, spec=None):
+    """商品ページのHTMLから抽出仕様（compile_spec の結果。省略時は OWN_SITE_SPEC）に従って商品情報を抽出する関数
+
+    必須のブロック（商品詳細）がなければNoneを返す。
+    """
+    spec = spec or _COMPILED_SPEC
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # 使用するブロック取得
+    blocks = {name: block['select'].select_one(soup) for name, block in spec['blocks'].items()}
+    if blocks[spec['required']] is None:
+        return None
+
+    item_dict = {name: None for name, _, _, _ in spec['fields']}
+    item_dict['Icon'] = []
+    for name, block, selectors, parser in spec['fields']:
+        if blocks[block] is None:
+            continue
+        for selector in selectors:
+            element = selector.select_one(blocks[block])
+            if element is not None:
+                item_dict[name] = parser(element.text)
+                break
+
+    # アイコン（表示名のない画像は無視）
+    icons = spec['icons']
+    icon_div = icons['select'].select_one(blocks[icons['block']]) if blocks[icons['block']] is not None else None
+    if icon_div is not None:
+        for img in icons['img'].select(icon_div):
+            label = icons['labels'].get(img.get('src', ''))
+            if label is not None:
+                item_dict['Icon'].append(label)
+
+    return item_dict
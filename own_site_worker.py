@@ -0,0 +1,163 @@
+"""自社サイトスクレイピングの分散ワーカー
+
+コーディネーター（Streamlitアプリの「分散ワーカーで取得する」）がキュー（SQLite）に登録した作業単位を確保し、
+商品ページを取得・解析して結果をキューに書き込む。
+複数のマシンで実行する場合は、キューのファイルを全マシンから読み書きできる共有ディレクトリに置く。
+処理中のワーカーが停止した作業単位は、リースの期限切れ後に他のワーカーが取り直す。
+
+実行例:
+    python own_site_worker.py --queue /mnt/shared/work_queue.sqlite3 --max-concurrency 8
+"""
+import argparse
+import os
+import threading
+import time
+
+import fetch_metrics
+import own_site_fetch
+import work_queue
+from adaptive_limiter import AdaptiveConcurrencyLimiter
+
+# 作業単位のリース期間（秒）。処理中はこの1/3ごとに延長する
+LEASE_SECONDS = float(os.environ.get('WORK_QUEUE_LEASE_SECONDS', '60'))
+# 一時的なエラーの再取得を始めるまでの待機時間（秒）
+RETRY_PASS_DELAY = float(os.environ.get('RETRY_PASS_DELAY', '5'))
+
+
+class JobDrift:
+    """ワーカーでのジョブごとのレイアウト変更の検出（LayoutDriftMonitor）と、ジョブ全体の集計への報告
+
+    ワーカーが記録した抽出率は作業単位の開始・完了時とリースの延長時にキューのジョブ全体の集計へ報告し、
+    他のワーカーがレイアウト変更の疑いを検出していれば、このワーカーの残りの取得も中断する。
+    """
+
+    def __init__(self, queue_path, job_id, options):
+        self.queue_path = queue_path
+        self.job_id = job_id
+        # 判定の基準はコーディネーターが指定したもの（ワーカーの環境変数ではなく）を使う
+        self.monitor = own_site_fetch.LayoutDriftMonitor(**options.get('drift', {}))
+        self._reported = (0, 0)
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """前回の報告以降の記録をジョブ全体の集計に加え、ジョブ全体の状態を返す"""
+        with self._lock:
+            stats = self.monitor.stats()
+            pages, missing = self._reported
+            state = work_queue.record_drift(
+                self.queue_path, self.job_id, stats['pages'] - pages, stats['missing'] - missing,
+                stats['sample_pages'], stats['max_missing_rate'], tripped=stats['tripped']
+            )
+            self._reported = (stats['pages'], stats['missing'])
+        if state['tripped']:
+            self.monitor.trip()
+        return state
+
+
+def process_unit(queue_path, unit, worker_id, session, limiter, lease_seconds=LEASE_SECONDS,
+                 retry_delay=RETRY_PASS_DELAY, drift=None):
+    """確保した作業単位の商品コードを取得し、結果をキューに書き込む関数
+
+    処理中は別スレッドでリースを延長し、完了件数をキューに記録する（画面の進捗表示に使う）。
+    drift（JobDrift）: 同じジョブの作業単位をまたいで使うレイアウト変更の検出（省略時はこの作業単位だけで作成する）
+    戻り値: 結果を書き込んだかどうか（先に他のワーカーが完了していた場合は False）
+    """
+    metrics = fetch_metrics.FetchMetrics('own_site')
+    drift = drift or JobDrift(queue_path, unit['job_id'], unit['options'])
+    progress = {'completed': 0}
+    finished = threading.Event()
+
+    def keep_lease():
+        while not finished.wait(lease_seconds / 3):
+            work_queue.heartbeat(queue_path, unit, worker_id, lease_seconds, progress['completed'])
+            drift.sync()
+
+    def on_progress(completed, total, retry):
+        if not retry:
+            progress['completed'] = completed
+
+    # 他のワーカーがレイアウト変更の疑いを検出済みなら、この作業単位はリクエストせずに中断として記録する
+    drift.sync()
+    heartbeat_thread = threading.Thread(target=keep_lease, daemon=True)
+    heartbeat_thread.start()
+    try:
+        results, _ = own_site_fetch.scrape_codes(
+            session, unit['codes'], metrics, limiter, on_progress,
+            unit['options'].get('streamed', True), retry_delay, drift=drift.monitor
+        )
+    finally:
+        finished.set()
+        heartbeat_thread.join()
+    drift.sync()
+    metrics.close()
+
+    # 商品情報・失敗理由は商品コードの並び順、計測値はリクエストごとに書き込む
+    return work_queue.complete_unit(queue_path, unit, worker_id, {
+        'items': [[item_dict, failure.to_dict() if failure is not None else None] for item_dict, failure in results],
+        'spans': [span.to_dict() for span in metrics.spans],
+        'status_counts': dict(metrics.status_counts),
+        'retry_pass': metrics.info['retry_pass'],
+    })
+
+
+def run_worker(queue_path, worker_id=None, min_concurrency=1, max_concurrency=4, lease_seconds=LEASE_SECONDS,
+               retry_delay=RETRY_PASS_DELAY, poll_interval=1.0, job_id=None, exit_when_idle=False, stop=None):
+    """キューの作業単位を順に確保して処理する関数
+
+    同時リクエスト数は作業単位をまたいで自動調整する（AdaptiveConcurrencyLimiter）。
+    レイアウト変更の検出（JobDrift）は同じジョブの作業単位をまたいで記録する。
+    job_id を指定した場合はそのジョブだけを処理する。
+    exit_when_idle=True の場合は、確保できる作業単位がなくなった時点で終了する。
+    stop（threading.Event）をセットすると、処理中の作業単位を書き込んだ後に終了する。
+    戻り値: 結果を書き込んだ作業単位の数
+    """
+    worker_id = worker_id or work_queue.default_worker_id()
+    session = fetch_metrics.create_session(pool_maxsize=max_concurrency)
+    limiter = AdaptiveConcurrencyLimiter(min_limit=min_concurrency, max_limit=max_concurrency)
+    drift = None
+    written = 0
+    while stop is None or not stop.is_set():
+        unit = work_queue.claim_unit(queue_path, worker_id, lease_seconds, job_id=job_id)
+        if unit is None:
+            if exit_when_idle:
+                break
+            if stop is not None:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+        if drift is None or drift.job_id != unit['job_id']:
+            drift = JobDrift(queue_path, unit['job_id'], unit['options'])
+        written += process_unit(queue_path, unit, worker_id, session, limiter, lease_seconds, retry_delay, drift)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="自社サイトスクレイピングの分散ワーカー")
+    parser.add_argument('--queue', default=os.environ.get('WORK_QUEUE_DB', 'work_queue.sqlite3'),
+                        help="キューのSQLiteファイル（コーディネーターと同じファイル）")
+    parser.add_argument('--worker-id', help="ワーカーの識別子（省略時はホスト名とランダムな文字列）")
+    parser.add_argument('--min-concurrency', type=int, default=1, help="最小同時接続数")
+    parser.add_argument('--max-concurrency', type=int, default=4, help="最大同時接続数")
+    parser.add_argument('--lease', type=float, default=LEASE_SECONDS, help="作業単位のリース期間（秒）")
+    parser.add_argument('--poll', type=float, default=1.0, help="作業単位がない時の確認間隔（秒）")
+    parser.add_argument('--exit-when-idle', action='store_true', help="作業単位がなくなったら終了する")
+    args = parser.parse_args()
+
+    worker_id = args.worker_id or work_queue.default_worker_id()
+    print(f"ワーカー {worker_id} を開始します（キュー: {args.queue}）")
+    try:
+        written = run_worker(
+            args.queue, worker_id, min_concurrency=args.min_concurrency,
+            max_concurrency=max(args.min_concurrency, args.max_concurrency), lease_seconds=args.lease,
+            poll_interval=args.poll, exit_when_idle=args.exit_when_idle
+        )
+    except KeyboardInterrupt:
+        # 処理中の作業単位はリースの期限切れ後に他のワーカーが取り直す
+        print("中断しました")
+        return
+    print(f"ワーカー {worker_id} を終了します（完了した作業単位: {written}件）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS page_records (
+            code TEXT PRIMARY KEY,
+            -- 商品ページの使用するブロックのハッシュ値（own_site_parser.own_site_blocks_digest）
+            digest TEXT NOT NULL,
+            -- 前回抽出した商品情報（JSON）
+            record TEXT NOT NULL,
+            parsed_at REAL NOT NULL
+        )
+    """)
+    return conn
+
+
+class PageRecordCache:
+    """商品コードごとに、前回の商品ページのハッシュ値と抽出した商品情報を保持するクラス
+
+    ハッシュ値が前回と同じ商品ページは解析せずに前回の商品情報を使う。
+    取得中は同時実行のスレッドから参照・追加し、save() でまとめて保存する。
+    """
+
+    def __init__(self, path, codes):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        wanted = set(codes)
+        conn = _connect(path)
+        try:
+            self._records = {
+                code: (digest, record)
+                for code, digest, record in conn.execute("SELECT code, digest, record FROM page_records")
+                if code in wanted
+            }
+        finally:
+            conn.close()
+
+    def lookup(self, code, digest):
+        """ハッシュ値が前回と同じなら前回の商品情報を、違う（または前回がない）ならNoneを返す"""
+        cached = self._records.get(code) if digest is not None else None
+        with self._lock:
+            if cached is None or cached[0] != digest:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # 呼び出し側で変更しても保存済みの内容が変わらないよう、毎回JSONから作り直す
+        return json.loads(cached[1])
+
+    def store(self, code, digest, record):
+        """解析した商品情報を追加する"""
+        if digest is None:
+            return
+        with self._lock:
+            self._pending[code] = (digest, json.dumps(record, ensure_ascii=False))
+
+    def save(self):
+        """追加した商品情報を保存する"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        now = time.time()
+        conn = _connect(self.path)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO page_records VALUES (?, ?, ?, ?)",
+                    [(code, digest, record, now) for code, (digest, record) in pending.items()]
+                )
+        finally:
+            conn.close()
+        self._records.update(pending)
+
+    def stats(self):
+        return {'cached': len(self._records), 'hits': self.hits, 'misses': self.misses}
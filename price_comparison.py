@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+from price_normalize import to_price_number
+
+# 価格比較で扱うデータソース（列名の接頭辞, 価格列, キー列）
+SOURCE_COLUMNS = {
+    '自社': ('Price', 'No'),
+    '楽天': ('itemPrice', 'itemCode'),
+    'Yahoo': ('itemPrice', 'itemCode'),
+}
+
+KEY_COLUMNS = ['基本コード', 'バリエーション']
+
+
+def build_comparison_keys(sale_list, sale_list_mod):
+    """販売リストを（基本コード, バリエーション）単位の比較キーに正規化する関数
+
+    基本コード行（バリエーションなし）は自社サイトとの比較に、
+    拡張コード行は楽天・Yahooとの比較に使用する。
+    """
+    base = pd.DataFrame({
+        '基本コード': sale_list['商品コード'].astype(str).str.strip(),
+        'バリエーション': '',
+        '商品コード': sale_list['商品コード'].astype(str).str.strip(),
+        '通販単価': to_price_number(sale_list['通販単価']),
+        '送料区分名': sale_list['送料区分名'],
+        '商品名': sale_list['商品名'] if '商品名' in sale_list.columns else '',
+    })
+    frames = [base]
+    if sale_list_mod is not None and not sale_list_mod.empty:
+        variants = sale_list_mod[sale_list_mod['バリエーション'] != '']
+        frames.append(pd.DataFrame({
+            '基本コード': variants['基本コード'].astype(str),
+            'バリエーション': variants['バリエーション'].astype(str),
+            '商品コード': variants['商品コード'].astype(str),
+            '通販単価': to_price_number(variants['通販単価']),
+            '送料区分名': variants['送料区分名'],
+            '商品名': variants['商品名'] if '商品名' in variants.columns else '',
+        }))
+    keys = pd.concat(frames, ignore_index=True)
+    return keys.drop_duplicates(subset=KEY_COLUMNS).set_index(KEY_COLUMNS)
+
+
+def _source_prices(df, label, keys):
+    """取得結果を比較キー単位の価格Seriesに変換する関数"""
+    price_col, key_col = SOURCE_COLUMNS[label]
+    name = f'{label}価格'
+    if df is None or df.empty:
+        return pd.Series(dtype='float64', name=name, index=keys.index[:0])
+
+    codes = df[key_col].astype(str).str.strip()
+    prices = to_price_number(df[price_col])
+    if label == '自社':
+        # 自社サイトは基本コード単位の価格
+        index = pd.MultiIndex.from_arrays([codes, np.full(len(codes), '')], names=KEY_COLUMNS)
+    else:
+        # 拡張コード → (基本コード, バリエーション) は販売リストの展開結果から引く
+        code_map = keys.reset_index().drop_duplicates('商品コード').set_index('商品コード')
+        base = codes.map(code_map['基本コード'])
+        variant = codes.map(code_map['バリエーション'])
+        # 販売リストにないコードは先頭の「-」で分割して補完
+        split = codes.str.split('-', n=1, expand=True).reindex(columns=[0, 1])
+        base = base.fillna(split[0])
+        variant = variant.fillna(('-' + split[1].astype(object)).fillna(''))
+        index = pd.MultiIndex.from_arrays([base, variant], names=KEY_COLUMNS)
+
+    series = pd.Series(prices.to_numpy(), index=index, name=name)
+    return series[~series.index.duplicated(keep='first')]
+
+
+def build_price_comparison(sale_list, sale_list_mod, df_onlinestore=None, df_rakuten=None,
+                           df_yahoo=None, outlier_threshold=0.1):
+    """自社サイト・楽天・Yahooの取得結果と販売リストを一括で結合し、差額と価格差を算出する関数
+
+    outlier_threshold: 通販単価に対する乖離率（例: 0.1 = 10%）がこの値以上の行を外れ値とする
+    """
+    keys = build_comparison_keys(sale_list, sale_list_mod)
+    sources = {'自社': df_onlinestore, '楽天': df_rakuten, 'Yahoo': df_yahoo}
+    price_series = [_source_prices(df, label, keys) for label, df in sources.items()]
+
+    # キーと3ソースの価格を外部結合（1回のconcatで結合）
+    df = pd.concat([keys] + price_series, axis=1, join='outer')
+    df['商品コード'] = df['商品コード'].fillna(
+        pd.Series(df.index.get_level_values(0) + df.index.get_level_values(1), index=df.index)
+    )
+
+    price_cols = [f'{label}価格' for label in sources]
+    diff_cols = [f'{label}差額' for label in sources]
+    prices = df[price_cols].to_numpy(dtype='float64')
+    sale_price = df['通販単価'].to_numpy(dtype='float64')
+
+    diffs = prices - sale_price[:, None]
+    for i, col in enumerate(diff_cols):
+        df[col] = diffs[:, i]
+
+    # モール間価格差（取得できたソースが2つ以上ある行の最大値−最小値）
+    counts = np.sum(~np.isnan(prices), axis=1)
+    with np.errstate(invalid='ignore'):
+        spread = np.nanmax(np.where(np.isnan(prices), -np.inf, prices), axis=1) - \
+            np.nanmin(np.where(np.isnan(prices), np.inf, prices), axis=1)
+    df['価格差'] = np.where(counts >= 2, spread, np.nan)
+
+    # 乖離率（通販単価に対する差額・価格差の最大割合）
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratios = np.abs(np.column_stack([diffs, df['価格差'].to_numpy()])) / sale_price[:, None]
+    ratios[~np.isfinite(ratios)] = np.nan
+    max_ratio = np.full(len(df), np.nan)
+    has_ratio = ~np.all(np.isnan(ratios), axis=1)
+    max_ratio[has_ratio] = np.nanmax(ratios[has_ratio], axis=1)
+    df['乖離率'] = max_ratio
+    df['外れ値'] = np.nan_to_num(max_ratio, nan=0.0) >= outlier_threshold
+
+    df = df.reset_index()
+    columns = KEY_COLUMNS + ['商品コード', '商品名', '送料区分名', '通販単価'] + price_cols + diff_cols + \
+        ['価格差', '乖離率', '外れ値']
+    return df[columns]
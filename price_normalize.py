@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+# int() で変換できる半角の整数の文字列（カンマを除いた後。前後の空白・符号を含む。int64に収まる18桁まで）
+_INTEGER_PATTERN = r'\s*[+-]?[0-9]{1,18}\s*'
+# 数字だけの半角の文字列（通販単価をカンマ区切りに整形する対象。str.isdigit() と同じ判定）
+_DIGITS_PATTERN = r'[0-9]+'
+# 列単位の変換では扱わず、1件ずつ int() で変換する値（全角数字等の半角以外の文字・「1_000」形式）
+_PYTHON_INT_PATTERN = r'[^\x00-\x7f]|[0-9]_[0-9]'
+
+
+def _strip_commas(values):
+    return pd.Series(values).astype(str).str.replace(',', '', regex=False)
+
+
+def _python_int(text):
+    try:
+        return int(text)
+    except ValueError:
+        return None
+
+
+def to_price_number(series):
+    """カンマ区切りの価格文字列を数値に変換する関数（変換できない値はNaN。数値の列はそのまま）"""
+    series = pd.Series(series)
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return series
+    # 数値（APIの価格）だけのobject列は文字列に変換せずに変換する
+    if pd.api.types.infer_dtype(series, skipna=True) in ('integer', 'floating', 'mixed-integer-float', 'empty'):
+        return pd.to_numeric(series, errors='coerce')
+    return pd.to_numeric(_strip_commas(series).str.strip(), errors='coerce')
+
+
+def parse_integers(values):
+    """カンマ区切りの整数の文字列を Int64 の列に変換する関数
+
+    int() で変換できる値（前後の空白・符号・全角数字を含む）だけを変換し、
+    小数・空文字・None・NaN 等の変換できない値は <NA> にする。
+    """
+    text = _strip_commas(values)
+    valid = text.str.fullmatch(_INTEGER_PATTERN).fillna(False).astype(bool)
+    numbers = pd.to_numeric(text.where(valid).str.strip(), errors='coerce', dtype_backend='numpy_nullable')
+    numbers = numbers.astype('Int64')
+    others = ~valid & text.str.contains(_PYTHON_INT_PATTERN).fillna(False).astype(bool)
+    if others.any():
+        numbers[others] = pd.array([_python_int(value) for value in text[others]], dtype='Int64')
+    return numbers
+
+
+def format_integers(numbers, missing=None):
+    """Int64 の列をカンマ区切りの文字列（<NA> は missing）の配列に変換する関数"""
+    numbers = pd.array(numbers, dtype='Int64')
+    out = np.full(len(numbers), missing, dtype=object)
+    present = ~numbers.isna()
+    out[present] = [f"{value:,}" for value in numbers[present].to_numpy(dtype='int64').tolist()]
+    return out
+
+
+def format_prices(values, missing=''):
+    """価格（float）の列を小数点以下を丸めたカンマ区切りの文字列（NaN は missing）の配列に変換する関数"""
+    values = np.asarray(values, dtype=float)
+    out = np.full(len(values), missing, dtype=object)
+    present = ~np.isnan(values)
+    out[present] = [f"{value:,.0f}" for value in values[present].tolist()]
+    return out
+
+
+def own_site_prices(prices, unit_prices):
+    """自社サイトの価格と通販単価から、整形した通販単価と差額（価格 - 通販単価）を返す関数
+
+    通販単価は数字だけの値をカンマ区切りに整形し、それ以外（空・NaN・小数・符号付き等）はそのまま返す。
+    差額はどちらかが整数に変換できない場合はNone。戻り値: (通販単価の配列, 差額の配列)
+    """
+    unit_prices = pd.Series(unit_prices)
+    sale = parse_integers(unit_prices)
+    text = _strip_commas(unit_prices)
+    digits = text.str.fullmatch(_DIGITS_PATTERN).fillna(False).to_numpy(dtype=bool, copy=True)
+    others = text.str.contains(_PYTHON_INT_PATTERN).fillna(False).astype(bool).to_numpy()
+    if others.any():
+        digits[others] = [value.isdigit() for value in text[others]]
+    digits &= sale.notna().to_numpy()
+    formatted = unit_prices.to_numpy(dtype=object, copy=True)
+    formatted[digits] = format_integers(sale.array[digits])
+    return formatted, format_integers(parse_integers(prices).array - sale.array)
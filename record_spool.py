@@ -0,0 +1,186 @@
+import os
+import time
+import uuid
+
+import pyarrow as pa
+import pandas as pd
+
+# 取得途中のレコードの列（_order は商品コードの並び順。結果ファイルには含めない）
+OWN_SITE_RECORD_SCHEMA = pa.schema([
+    ('No', pa.string()), ('Name', pa.string()), ('Price', pa.string()), ('Point', pa.int64()),
+    ('Stock', pa.string()), ('Icon', pa.list_(pa.string())), ('_order', pa.int64()),
+])
+MARKETPLACE_RECORD_SCHEMA = pa.schema([
+    ('itemCode', pa.string()), ('itemName', pa.string()), ('itemPrice', pa.string()),
+    ('pointRate', pa.string()), ('postageFlag', pa.string()), ('_order', pa.int64()),
+])
+# 販売リストと結合した結果の列
+OWN_SITE_RESULT_SCHEMA = pa.schema([
+    ('No', pa.string()), ('Name', pa.string()), ('Price', pa.string()), ('Point', pa.int64()),
+    ('Stock', pa.string()), ('Icon', pa.list_(pa.string())),
+    ('通販単価', pa.string()), ('差額', pa.string()), ('送料区分名', pa.string()),
+])
+MARKETPLACE_RESULT_SCHEMA = pa.schema([
+    ('itemCode', pa.string()), ('itemName', pa.string()), ('itemPrice', pa.string()),
+    ('pointRate', pa.string()), ('postageFlag', pa.string()),
+    ('通販単価', pa.string()), ('差額', pa.string()), ('送料区分名', pa.string()),
+])
+# 価格比較表の列（外れ値の判定はしきい値に応じて表示時に行うため含めない）
+PRICE_COMPARISON_SCHEMA = pa.schema(
+    [(name, pa.string()) for name in ['基本コード', 'バリエーション', '商品コード', '商品名', '送料区分名']] +
+    [(name, pa.float64()) for name in [
+        '通販単価', '自社価格', '楽天価格', 'Yahoo価格', '自社差額', '楽天差額', 'Yahoo差額', '価格差', '乖離率'
+    ]]
+)
+
+
+def spill_path(directory, label):
+    """書き出し先のファイルパスを作成する関数（同時に実行される取得処理と重ならない名前にする）"""
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{label}_{uuid.uuid4().hex}.arrow")
+
+
+def remove_stale(directory, max_age_hours, keep=()):
+    """書き出し先のディレクトリから、古くなったファイル（終了したセッションの取得結果）を削除する関数
+
+    keep: 古くても削除しないファイルのパス（まだ共有ジョブの結果として使われているファイル）
+    """
+    if not os.path.isdir(directory):
+        return
+    limit = time.time() - max_age_hours * 3600
+    keep = {os.path.abspath(path) for path in keep}
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            if name.endswith('.arrow') and os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _open_table(path):
+    """Arrowファイルをメモリマップで開く（読み込んだ列・行の分だけがメモリに載る）"""
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+class RecordSpool:
+    """取得したレコードをbatch_size件ごとにArrowファイルへ書き出すクラス
+
+    取得中にメモリに保持するのは書き出し前の1バッチ分だけにする。
+    """
+
+    def __init__(self, path, schema, batch_size=1000):
+        self.path = path
+        self.schema = schema
+        self.batch_size = batch_size
+        self.rows = 0
+        self._batch = []
+        self._string_fields = [f.name for f in schema if pa.types.is_string(f.type)]
+        self._sink = pa.OSFile(path, 'wb')
+        self._writer = pa.ipc.new_file(self._sink, schema)
+
+    def __len__(self):
+        return self.rows + len(self._batch)
+
+    def append(self, record):
+        record = {name: record.get(name) for name in self.schema.names}
+        # APIによって数値で返る項目も文字列の列にそろえる
+        for name in self._string_fields:
+            value = record[name]
+            if value is not None and not isinstance(value, str):
+                record[name] = str(value)
+        self._batch.append(record)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            self._writer.write_batch(pa.RecordBatch.from_pylist(self._batch, schema=self.schema))
+            self.rows += len(self._batch)
+            self._batch = []
+
+    def close(self):
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+            self._sink.close()
+            self._writer = None
+
+    def frames(self, order_column=None, batch_size=None):
+        """書き出したレコードをbatch_size件ずつのデータフレームで返す
+
+        order_column を指定した場合は、その列の値の順に並べ替えて返す（並べ替えに使う列だけを読み込む）。
+        """
+        self.close()
+        table = _open_table(self.path)
+        batch_size = batch_size or self.batch_size
+        if order_column is not None:
+            order = table.column(order_column).to_numpy().argsort(kind='stable')
+            table = table.drop_columns([order_column])
+            for start in range(0, len(order), batch_size):
+                yield table.take(order[start:start + batch_size]).to_pandas()
+        else:
+            for start in range(0, table.num_rows, batch_size):
+                yield table.slice(start, batch_size).to_pandas()
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _to_table(df, schema):
+    """データフレームを結果ファイルの列の型にそろえてArrowのテーブルに変換する関数"""
+    df = df.copy()
+    for field in schema:
+        if pa.types.is_string(field.type):
+            df[field.name] = df[field.name].astype('string')
+        elif pa.types.is_integer(field.type):
+            df[field.name] = pd.to_numeric(df[field.name], errors='coerce').astype('Int64')
+        elif pa.types.is_floating(field.type):
+            df[field.name] = pd.to_numeric(df[field.name], errors='coerce').astype('float64')
+    return pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+
+
+def write_result(path, frames, schema):
+    """販売リストと結合済みのデータフレームを順にファイルへ書き出し、SpilledResultを返す関数"""
+    rows = 0
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        for df in frames:
+            writer.write_table(_to_table(df, schema))
+            rows += len(df)
+    return SpilledResult(path, rows, schema.names)
+
+
+class SpilledResult:
+    """ファイルに書き出した取得結果
+
+    セッション状態には件数・列名・ファイルパスだけを保持し、表示に必要な列・行はその都度ファイルから読む。
+    データフレームと同じように len()・df[列名]・take(行の位置) で参照できる。
+    """
+
+    def __init__(self, path, rows, columns):
+        self.path = path
+        self.rows = rows
+        self.columns = list(columns)
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, column):
+        return _open_table(self.path).column(column).to_pandas()
+
+    def read(self, columns=None):
+        table = _open_table(self.path)
+        if columns is not None:
+            table = table.select(columns)
+        return table.to_pandas()
+
+    def take(self, positions):
+        return _open_table(self.path).take(pa.array(positions, type=pa.int64())).to_pandas()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+# 数値として絞り込み・並べ替えする列（画面上はカンマ区切りの文字列）
+NUMERIC_COLUMNS = ['Price', 'Point', 'itemPrice', 'pointRate', '通販単価', '差額']
+# 値の一覧から選んで絞り込む列
+CATEGORY_COLUMNS = ['送料区分名', 'Stock', 'postageFlag']
+# 複数の値（リスト）を持つ列
+LIST_COLUMNS = ['Icon']
+# 商品コード・商品名の検索対象の列
+TEXT_COLUMNS = ['No', 'Name', 'itemCode', 'itemName', '商品コード', '商品名']
+# 値がない場合の表示
+EMPTY_LABEL = '（なし）'
+
+# 差額の絞り込み
+DIFF_ALL = 'すべて'
+DIFF_NONZERO = '差額あり（≠0）'
+DIFF_ZERO = '差額なし（=0）'
+DIFF_MISSING = '差額なし（計算できない）'
+DIFF_OPTIONS = [DIFF_ALL, DIFF_NONZERO, DIFF_ZERO, DIFF_MISSING]
+
+
+def to_number(series):
+    """カンマ区切りの文字列を含む列を数値の配列に変換する関数（変換できない値はNaN）"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=float, na_value=np.nan)
+    text = series.astype(str).str.replace(',', '', regex=False)
+    return pd.to_numeric(text, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+
+def category_values(series):
+    """値の一覧から選ぶ列を、値がない行を「（なし）」にした文字列の配列に変換する関数"""
+    values = series.astype(object).where(series.notna(), EMPTY_LABEL).astype(str).replace('', EMPTY_LABEL)
+    return values.to_numpy()
+
+
+def list_value_sets(series):
+    """複数の値（リスト）を持つ列を、行ごとの値の集合に変換する関数"""
+    return [set(v) if isinstance(v, (list, tuple, set, np.ndarray)) else set() for v in series]
+
+
+def text_values(df, text_cols):
+    """検索対象の列を連結し、小文字にした文字列の配列を作成する関数"""
+    text = df[text_cols[0]].astype(str)
+    for col in text_cols[1:]:
+        text = text + '\t' + df[col].astype(str)
+    return text.str.lower().to_numpy()
+
+
+def build_grid_index(df, keep_arrays=True):
+    """絞り込み・並べ替え用の型付きの列を作成する関数（取得結果ごとに1回だけ作成する）
+
+    keep_arrays=False の場合は件数と選択肢だけを保持し、型付きの列は絞り込み・並べ替えのたびに
+    必要な列だけを読み込んで作成する（ファイルに書き出した結果を1列ずつ読むため）。
+    """
+    index = {'rows': len(df), 'numeric': {}, 'category': {}, 'options': {}, 'list': {}, 'text': None,
+             'text_columns': [col for col in TEXT_COLUMNS if col in df.columns]}
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            index['numeric'][col] = to_number(df[col]) if keep_arrays else None
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            values = category_values(df[col])
+            index['category'][col] = values if keep_arrays else None
+            index['options'][col] = sorted(pd.unique(values))
+    for col in LIST_COLUMNS:
+        if col in df.columns:
+            # 値ごとに、その値を含む行の真偽値配列を作成しておく
+            value_sets = list_value_sets(df[col])
+            index['list'][col] = {
+                value: np.array([value in s for s in value_sets], dtype=bool) if keep_arrays else None
+                for value in sorted(set().union(*value_sets))
+            }
+    if index['text_columns'] and keep_arrays:
+        index['text'] = text_values(df, index['text_columns'])
+    return index
+
+
+def filter_rows(index, diff=DIFF_ALL, categories=None, list_values=None, keyword='', df=None):
+    """絞り込み条件に一致する行の真偽値配列を返す関数
+
+    categories: 列名→選択した値のリスト（空なら絞り込まない）
+    list_values: 列名→選択した値のリスト（いずれかの値を含む行に一致）
+    keyword: 商品コード・商品名の部分一致（大文字小文字を区別しない）
+    df: 型付きの列を保持していない索引（keep_arrays=False）の場合に、条件に使う列を読み込む取得結果
+    """
+    mask = np.ones(index['rows'], dtype=bool)
+    if '差額' in index['numeric'] and diff != DIFF_ALL:
+        diff_values = _numeric(index, df, '差額')
+        if diff == DIFF_NONZERO:
+            mask &= ~np.isnan(diff_values) & (diff_values != 0)
+        elif diff == DIFF_ZERO:
+            mask &= diff_values == 0
+        elif diff == DIFF_MISSING:
+            mask &= np.isnan(diff_values)
+    for col, selected in (categories or {}).items():
+        if selected and col in index['category']:
+            values = index['category'][col]
+            if values is None:
+                values = category_values(df[col])
+            mask &= np.isin(values, list(selected))
+    for col, selected in (list_values or {}).items():
+        if selected and col in index['list']:
+            matched = np.zeros(index['rows'], dtype=bool)
+            if any(index['list'][col].get(value) is None for value in selected):
+                value_sets = list_value_sets(df[col])
+                matched |= np.array([not s.isdisjoint(selected) for s in value_sets], dtype=bool)
+            else:
+                for value in selected:
+                    matched |= index['list'][col][value]
+            mask &= matched
+    if keyword and index['text_columns']:
+        text = index['text'] if index['text'] is not None else text_values(df, index['text_columns'])
+        mask &= pd.Series(text).str.contains(keyword.lower(), regex=False).to_numpy()
+    return mask
+
+
+def _numeric(index, df, col):
+    """数値の列を返す関数（索引に保持していない場合はその列だけを読み込む）"""
+    values = index['numeric'][col]
+    return values if values is not None else to_number(df[col])
+
+
+def sorted_positions(df, index, mask, sort_column=None, ascending=True):
+    """絞り込んだ行の位置を並べ替えて返す関数（数値の列は数値で並べ、値がない行は最後にする）
+
+    並べ替えに使う列だけを読み込む。
+    """
+    positions = np.flatnonzero(mask)
+    if not sort_column or sort_column not in df.columns:
+        return positions
+    if sort_column in index['numeric']:
+        key = pd.Series(_numeric(index, df, sort_column)[positions])
+    else:
+        key = df[sort_column].iloc[positions].astype(str).reset_index(drop=True)
+    order = key.sort_values(ascending=ascending, na_position='last', kind='stable').index.to_numpy()
+    return positions[order]
+
+
+def page_slice(positions, page, page_size):
+    """並べ替え済みの行の位置から、指定ページの分だけを返す関数（ページは1始まり）"""
+    pages = max(1, -(-len(positions) // page_size))
+    page = min(max(1, page), pages)
+    start = (page - 1) * page_size
+    return positions[start:start + page_size], page, pages
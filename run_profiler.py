@@ -0,0 +1,248 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# 割り当て量の集計から除くファイル（プロファイラー自身・インポート処理）
+_ALLOCATION_IGNORED = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+# tracemalloc はプロセスで1つのため、使っているプロファイラーの数を数え、最後のプロファイラーの終了時に止める
+# （同時にプロファイルしている他のセッションの計測を止めないため）
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+# プロファイラーが tracemalloc を開始したかどうか（ベンチマークの --trace-memory 等で開始済みなら止めない）
+_tracing_started = False
+
+
+class RunProfiler:
+    """取得処理・画面表示の1回分のCPU・メモリのプロファイルを取得するクラス
+
+    - CPU: interval 秒ごとに呼び出し履歴を記録するサンプリング方式。開始したスレッドと、
+      開始後に作られたスレッド（取得処理のスレッドプール等）を、処理を止めずに記録する
+    - メモリ: tracemalloc の開始時・終了時のスナップショットの差分（trace_memory=True の場合。処理は遅くなる）
+
+    結果は speedscope 形式（https://www.speedscope.app で表示）、フレームグラフ用の folded 形式、
+    割り当て量の上位のテキストで出力する。with 文で使う。
+    """
+
+    def __init__(self, label, interval=0.005, trace_memory=True):
+        self.label = label
+        self.interval = interval
+        self.trace_memory = trace_memory
+        self.started = None
+        self.duration = None
+        # (スレッド名, 呼び出し履歴（フレームキーのタプル、外側から順）) → [サンプル数, 合計秒]
+        self.stacks = {}
+        self.samples = 0
+        self.traced_peak = None
+        self._frames = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._snapshot = None
+        self._allocations = None
+        # 開始時にすでに動いていた他のスレッド（Streamlitのサーバー・他のセッション）は記録しない
+        self._ignored_threads = set()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def start(self):
+        global _tracing_users, _tracing_started
+        if self.trace_memory:
+            with _tracing_lock:
+                if _tracing_users == 0:
+                    # すでに計測中（ベンチマークの --trace-memory 等）の場合はそのまま使う
+                    _tracing_started = not tracemalloc.is_tracing()
+                    if _tracing_started:
+                        tracemalloc.start()
+                    # ピークは同時にプロファイルしているプロファイラーで共有するため、最初のプロファイラーだけが戻す
+                    tracemalloc.reset_peak()
+                _tracing_users += 1
+                self._snapshot = tracemalloc.take_snapshot()
+        current = threading.get_ident()
+        self._ignored_threads = {thread.ident for thread in threading.enumerate() if thread.ident != current}
+        self.started = time.time()
+        self._wall_start = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample_loop, name='run-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        global _tracing_users
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.duration = time.perf_counter() - self._wall_start
+        if self.trace_memory:
+            with _tracing_lock:
+                snapshot = tracemalloc.take_snapshot()
+                self.traced_peak = tracemalloc.get_traced_memory()[1]
+                _tracing_users -= 1
+                if _tracing_users == 0 and _tracing_started:
+                    tracemalloc.stop()
+            self._allocations = snapshot.filter_traces(_ALLOCATION_IGNORED).compare_to(
+                self._snapshot.filter_traces(_ALLOCATION_IGNORED), 'lineno'
+            )
+            self._snapshot = None
+
+    def _frame_key(self, code):
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        if key not in self._frames:
+            self._frames[key] = len(self._frames)
+        return key
+
+    def _sample_loop(self):
+        own_ident = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            elapsed = now - last
+            last = now
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident or ident in self._ignored_threads:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_key(frame.f_code))
+                    frame = frame.f_back
+                key = (names.get(ident, str(ident)), tuple(reversed(stack)))
+                entry = self.stacks.setdefault(key, [0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+            self.samples += 1
+
+    # --- 集計・出力 ---
+    def top_functions(self, limit=30):
+        """関数ごとのサンプル数（自身: 実行中だった回数、合計: 呼び出し履歴に含まれていた回数）を多い順に返す"""
+        own = Counter()
+        total = Counter()
+        for (_, stack), (count, _) in self.stacks.items():
+            own[stack[-1]] += count
+            for key in set(stack):
+                total[key] += count
+        rows = []
+        for key, count in total.most_common(limit):
+            name, filename, line = key
+            rows.append({
+                'function': name,
+                'file': f"{_short_path(filename)}:{line}",
+                'own_samples': own[key],
+                'total_samples': count,
+            })
+        return rows
+
+    def top_allocations(self, limit=30):
+        """開始時から増えたメモリ割り当ての多い行を返す（trace_memory=False の場合は空）"""
+        rows = []
+        for stat in (self._allocations or [])[:limit]:
+            frame = stat.traceback[0]
+            rows.append({
+                'file': f"{_short_path(frame.filename)}:{frame.lineno}",
+                'size_diff_kib': stat.size_diff / 1024,
+                'size_kib': stat.size / 1024,
+                'count_diff': stat.count_diff,
+            })
+        return rows
+
+    def allocation_report(self, limit=30):
+        """割り当て量の上位をテキストで返す"""
+        if self._allocations is None:
+            return "メモリの計測は無効です\n"
+        lines = [
+            f"# {self.label} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started))}",
+            f"# 計測中のピーク: {self.traced_peak / 1024 / 1024:,.1f}MB（tracemalloc）",
+            f"{'増加(KiB)':>12}{'終了時(KiB)':>14}{'増加(個)':>10}  場所",
+        ]
+        for row in self.top_allocations(limit):
+            lines.append(
+                f"{row['size_diff_kib']:>12,.1f}{row['size_kib']:>14,.1f}{row['count_diff']:>10,}  {row['file']}"
+            )
+        return '\n'.join(lines) + '\n'
+
+    def to_folded(self):
+        """フレームグラフ用の folded 形式（1行に「スレッド;関数;...;関数 サンプル数」）で返す"""
+        lines = []
+        for (thread_name, stack), (count, _) in sorted(self.stacks.items()):
+            names = [thread_name] + [f"{name} ({_short_path(filename)}:{line})" for name, filename, line in stack]
+            lines.append(f"{';'.join(name.replace(';', ':') for name in names)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def to_speedscope(self):
+        """speedscope のファイル形式（スレッドごとのサンプリングプロファイル）のJSONを返す"""
+        frames = sorted(self._frames.items(), key=lambda item: item[1])
+        profiles = {}
+        for (thread_name, stack), (count, seconds) in self.stacks.items():
+            profile = profiles.setdefault(thread_name, {'samples': [], 'weights': []})
+            profile['samples'].append([self._frames[key] for key in stack])
+            profile['weights'].append(seconds)
+        return json.dumps({
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': self.label,
+            'exporter': 'sitecheck run_profiler',
+            'shared': {
+                'frames': [{'name': name, 'file': filename, 'line': line} for (name, filename, line), _ in frames],
+            },
+            'profiles': [
+                {
+                    'type': 'sampled',
+                    'name': thread_name,
+                    'unit': 'seconds',
+                    'startValue': 0,
+                    'endValue': sum(profile['weights']),
+                    'samples': profile['samples'],
+                    'weights': profile['weights'],
+                }
+                for thread_name, profile in sorted(profiles.items())
+            ],
+        }, ensure_ascii=False)
+
+    def summary(self):
+        return {
+            'label': self.label,
+            'started': self.started,
+            'duration_s': self.duration,
+            'samples': self.samples,
+            'interval_s': self.interval,
+            'threads': len({thread_name for thread_name, _ in self.stacks}),
+            'traced_peak_mb': self.traced_peak / 1024 / 1024 if self.traced_peak is not None else None,
+        }
+
+    def save(self, directory, name=None):
+        """プロファイルをディレクトリに保存し、保存したファイルパスのリストを返す"""
+        os.makedirs(directory, exist_ok=True)
+        name = name or f"{self.label}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(self.started))}"
+        outputs = [
+            (f"{name}.speedscope.json", self.to_speedscope()),
+            (f"{name}.folded", self.to_folded()),
+            (f"{name}_allocations.txt", self.allocation_report()),
+        ]
+        paths = []
+        for filename, text in outputs:
+            path = os.path.join(directory, filename)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            paths.append(path)
+        return paths
+
+
+def _short_path(filename):
+    """表示用に、標準ライブラリ・パッケージのパスを短くする関数"""
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and filename.startswith(prefix + os.sep):
+            return filename[len(prefix) + 1:]
+    return filename
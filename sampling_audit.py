@@ -0,0 +1,169 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# 層の分け方（大分類コード・送料区分名・通販単価の価格帯）
+STRATUM_COLUMNS = ['大分類コード', '送料区分名', '価格帯']
+# 価格帯の区切り（円。下限を含み上限を含まない）
+PRICE_BANDS = [0, 1000, 3000, 5000, 10000, math.inf]
+# 1つの層から最低限抽出する件数（層の商品数がこれより少ない場合は全件）
+MIN_PER_STRATUM = 2
+# 信頼区間の信頼水準（95%）に対応する標準正規分布の値
+CONFIDENCE_Z = 1.96
+# 差額がこの金額（円）未満なら一致とみなす（merge_marketplace_items の差額）
+PRICE_TOLERANCE = 1
+
+
+def price_band(prices):
+    """通販単価を価格帯のラベルに変換する関数（価格なしは「価格なし」）"""
+    labels = [
+        f"{low:,}円〜" if high == math.inf else f"{low:,}〜{high - 1:,}円"
+        for low, high in zip(PRICE_BANDS, PRICE_BANDS[1:])
+    ]
+    bands = pd.cut(prices, PRICE_BANDS, right=False, labels=labels).astype(object)
+    return bands.where(prices.notna(), "価格なし")
+
+
+def build_strata(sale_list_mod):
+    """拡張後の商品コードごとの層（大分類コード・送料区分名・価格帯）の一覧を作成する関数
+
+    同じ商品コードが複数行ある場合は先頭行を使う（販売リストとの結合・通販単価の照合と同じ）。
+    """
+    df = sale_list_mod.drop_duplicates('商品コード')
+    strata = pd.DataFrame({
+        '商品コード': df['商品コード'].astype(str).to_numpy(),
+        '大分類コード': df['大分類コード'].to_numpy() if '大分類コード' in df.columns else 0,
+        '送料区分名': df['送料区分名'].fillna('').astype(str).to_numpy(),
+        '価格帯': price_band(pd.to_numeric(df['通販単価'], errors='coerce')).to_numpy(),
+    })
+    # 層の表示名（全件取得する層の選択に使う）
+    strata['層'] = (
+        "大分類" + strata['大分類コード'].astype(str) + " / "
+        + strata['送料区分名'].replace('', "送料区分なし") + " / " + strata['価格帯']
+    )
+    return strata
+
+
+def allocate(sizes, sample_size):
+    """層ごとの抽出件数を決める関数
+
+    各層から最低 MIN_PER_STRATUM 件（層の商品数が少ない場合は全件）を抽出し、
+    残りは層の残りの商品数に比例して配分する（端数は大きい順）。
+    """
+    sizes = np.asarray(sizes, dtype=int)
+    counts = np.minimum(sizes, MIN_PER_STRATUM)
+    remaining = sample_size - counts.sum()
+    room = sizes - counts
+    if remaining <= 0:
+        return counts
+    if room.sum() <= remaining:
+        return sizes
+    share = remaining * room / room.sum()
+    extra = np.floor(share).astype(int)
+    leftover = remaining - extra.sum()
+    extra[np.argsort(-(share - extra), kind='stable')[:leftover]] += 1
+    return counts + extra
+
+
+def draw_sample(strata, sample_size, seed):
+    """層別に商品コードを無作為抽出する関数
+
+    同じ seed なら同じ商品コードを抽出する。戻り値: 抽出した商品コードのリスト（元の並び順）
+    """
+    rng = np.random.default_rng(seed)
+    groups = strata.groupby(STRATUM_COLUMNS, sort=True).indices
+    keys = list(groups)
+    counts = allocate([len(groups[key]) for key in keys], sample_size)
+    picked = [rng.choice(groups[key], count, replace=False) for key, count in zip(keys, counts) if count]
+    if not picked:
+        return []
+    return strata['商品コード'].to_numpy()[np.sort(np.concatenate(picked))].tolist()
+
+
+def wilson_interval(rate, n, z=CONFIDENCE_Z):
+    """割合の信頼区間（Wilsonの方法。件数が少ない・不一致が0件の場合も幅のある区間になる）"""
+    if n <= 0:
+        return 0.0, 1.0
+    denom = 1 + z * z / n
+    center = (rate + z * z / (2 * n)) / denom
+    half = z * math.sqrt(rate * (1 - rate) / n + z * z / (4 * n * n)) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def estimate(strata, sampled_codes, price_diffs, not_listed_codes):
+    """抽出した商品の取得結果から、層ごと・全体の価格の不一致率と信頼区間を推定する関数
+
+    price_diffs: 取得できた商品コード → 差額（円。通販単価がない場合はNaN）
+    not_listed_codes: 未掲載だった商品コード（不一致率の分母には含めない）
+    全体の不一致率は層の商品数で重み付けした推定値（層別抽出）で、信頼区間は
+    分散から求めた有効標本数でWilsonの区間を計算する。確認できた商品がない層は推定から除く。
+    """
+    sampled = set(sampled_codes)
+    not_listed = set(not_listed_codes)
+    rows = []
+    for key, group in strata.groupby(STRATUM_COLUMNS, sort=True):
+        codes = [code for code in group['商品コード'] if code in sampled]
+        diffs = [price_diffs[code] for code in codes if code in price_diffs and not np.isnan(price_diffs[code])]
+        mismatches = sum(1 for diff in diffs if abs(diff) >= PRICE_TOLERANCE)
+        rate = mismatches / len(diffs) if diffs else np.nan
+        low, high = wilson_interval(rate, len(diffs)) if diffs else (np.nan, np.nan)
+        rows.append({
+            '層': group['層'].iloc[0],
+            '大分類コード': key[0],
+            '送料区分名': key[1],
+            '価格帯': key[2],
+            '商品数': len(group),
+            '抽出数': len(codes),
+            '確認数': len(diffs),
+            '未掲載': sum(1 for code in codes if code in not_listed),
+            '不一致': mismatches,
+            '不一致率': rate,
+            '下限': low,
+            '上限': high,
+        })
+    df = pd.DataFrame(rows)
+
+    checked = df[df['確認数'] > 0] if not df.empty else df
+    result = {
+        'strata': df,
+        'population': int(df['商品数'].sum()) if not df.empty else 0,
+        'sampled': len(sampled),
+        'checked': int(df['確認数'].sum()) if not df.empty else 0,
+        'mismatches': int(df['不一致'].sum()) if not df.empty else 0,
+        # 推定の対象（確認できた商品がある層）の商品数の割合
+        'coverage': checked['商品数'].sum() / df['商品数'].sum() if not checked.empty else 0.0,
+        'rate': np.nan,
+        'low': np.nan,
+        'high': np.nan,
+    }
+    if checked.empty:
+        return result
+
+    weights = checked['商品数'] / checked['商品数'].sum()
+    rates = checked['不一致率']
+    n = checked['確認数']
+    # 有限母集団修正つきの層別抽出の分散（不一致が0件・全件の層でも分散が0にならないよう、
+    # 分散の計算だけ不一致率を (不一致 + 0.5) / (確認数 + 1) で補正する）
+    adjusted = (checked['不一致'] + 0.5) / (n + 1)
+    variance = (weights ** 2 * adjusted * (1 - adjusted) / n * (1 - n / checked['商品数'])).sum()
+    rate = float((weights * rates).sum())
+    # 分散と同じ補正をした不一致率から有効標本数（層別抽出の効果を反映した件数）を求める
+    adjusted_rate = float((weights * adjusted).sum())
+    effective_n = adjusted_rate * (1 - adjusted_rate) / variance if variance > 0 else float(n.sum())
+    result['rate'] = rate
+    result['low'], result['high'] = wilson_interval(rate, effective_n)
+    return result
+
+
+def flagged_strata(strata_estimates, threshold):
+    """不一致率が許容値（割合）を超えた層の表示名を返す関数（全件取得の候補）"""
+    df = strata_estimates
+    if df.empty:
+        return []
+    return df.loc[df['不一致率'] > threshold, '層'].tolist()
+
+
+def strata_codes(strata, labels):
+    """指定した層（表示名）に含まれる商品コードを返す関数"""
+    return strata.loc[strata['層'].isin(set(labels)), '商品コード'].tolist()
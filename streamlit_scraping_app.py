@@ -1,13 +1,96 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import requests
-from bs4 import BeautifulSoup
-from tqdm import tqdm
 import time
-import re
 import os
+import hashlib
+import math
+import tempfile
+import uuid
 import datetime as dt
+import threading
+
+from lazy_imports import lazy_import
+
+# 重いモジュールは最初に使う時点で読み込む（CSV読み込み前の画面表示を速くするため）
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+requests = lazy_import('requests')
+api_quota = lazy_import('api_quota')
+catalog_sync = lazy_import('catalog_sync')
+fetch_engine = lazy_import('fetch_engine')
+fetch_metrics = lazy_import('fetch_metrics')
+fetch_priority = lazy_import('fetch_priority')
+own_site_fetch = lazy_import('own_site_fetch')
+own_site_worker = lazy_import('own_site_worker')
+page_cache = lazy_import('page_cache')
+work_queue = lazy_import('work_queue')
+price_comparison = lazy_import('price_comparison')
+price_normalize = lazy_import('price_normalize')
+result_grid = lazy_import('result_grid')
+record_spool = lazy_import('record_spool')
+run_profiler = lazy_import('run_profiler')
+sampling_audit = lazy_import('sampling_audit')
+watchlist_monitor = lazy_import('watchlist_monitor')
+
+import job_registry
+from adaptive_limiter import AdaptiveConcurrencyLimiter
+from fetch_failures import (
+    FetchFailure, NOT_LISTED, NOT_SAMPLED, QUOTA_EXHAUSTED, UNEXPECTED, exception_failure, failure_from_dict,
+    http_failure
+)
+
+# 取得先エンドポイントと待機時間（ベンチマーク等で環境変数から差し替え可能。自社サイトは own_site_fetch で設定）
+RAKUTEN_API_URL = os.environ.get('RAKUTEN_API_URL', 'https://app.rakuten.co.jp/services/api/IchibaItem/Search/20170706')
+YAHOO_API_URL = os.environ.get('YAHOO_API_URL', 'https://shopping.yahooapis.jp/ShoppingWebService/V3/itemSearch')
+# API制限を考慮したリクエスト間隔（秒）
+API_REQUEST_INTERVAL = float(os.environ.get('API_REQUEST_INTERVAL', '2.1'))
+# 楽天市場APIのアプリケーションID
+RAKUTEN_APP_ID = 1027604414937000350
+# Yahoo!ショッピングAPIのアプリケーションID
+# 制限内容: 1アプリケーションIDあたり1日50,000回
+# 商品検索(v3)APIは1分30リクエスト（2秒間隔でリクエスト）
+YAHOO_APP_ID = "dj00aiZpPTBCMkFRMnZSNU1sSyZzPWNvbnN1bWVyc2VjcmV0Jng9ZDQ-"
+# 429エラー時の待機時間の基準（秒）
+API_RETRY_WAIT = float(os.environ.get('API_RETRY_WAIT', '5'))
+# 一時的なエラーの再取得を始めるまでの待機時間（秒）
+RETRY_PASS_DELAY = float(os.environ.get('RETRY_PASS_DELAY', '5'))
+# 店舗カタログ（楽天市場・Yahoo!ショッピングの全商品）の保存先
+CATALOG_DB = os.environ.get('CATALOG_DB', 'catalog.sqlite3')
+# 同期済みカタログを再利用できる期間（時間）
+CATALOG_REUSE_HOURS = 24
+# API呼び出し回数（1日の上限回数の使用量）と分割した取得の実行状況の保存先
+QUOTA_DB = os.environ.get('QUOTA_DB', 'api_quota.sqlite3')
+# メモリ節約モードで取得結果を書き出すディレクトリと、1回に書き出す件数
+SPILL_DIR = os.environ.get('SPILL_DIR', os.path.join(tempfile.gettempdir(), 'sitecheck_spill'))
+SPILL_BATCH_SIZE = int(os.environ.get('SPILL_BATCH_SIZE', '1000'))
+# 書き出したファイルを残しておく時間（これより古いファイルは次の取得時に削除する）
+SPILL_MAX_AGE_HOURS = 24
+# 商品コードごとの前回の取得結果（取得する順番の優先度の計算に使う）の保存先
+PRIORITY_DB = os.environ.get('PRIORITY_DB', 'fetch_history.sqlite3')
+# 抽出して確認する取得（楽天市場・Yahoo!ショッピング）の抽出件数の初期値
+SAMPLE_AUDIT_SIZE = 300
+# 自社サイトの商品ページのハッシュ値と前回抽出した商品情報の保存先（変化のないページの解析の省略に使う）
+PAGE_CACHE_DB = os.environ.get('PAGE_CACHE_DB', 'page_cache.sqlite3')
+# 同じ内容の取得結果を他のセッションと共有する時間（分）
+JOB_RESULT_TTL_MINUTES = float(os.environ.get('JOB_RESULT_TTL_MINUTES', '60'))
+# 共有した結果を使っているセッションが操作しなくなってから、結果を手放したとみなすまでの時間（時間）
+JOB_HOLDER_TTL_HOURS = float(os.environ.get('JOB_HOLDER_TTL_HOURS', '24'))
+# 他のセッションの取得処理に合流した時の進捗の確認間隔（秒）
+JOB_POLL_INTERVAL = 0.5
+# 分散ワーカーのキュー（SQLite。他のマシンのワーカーと共有する場合は共有ディレクトリに置く）と1作業単位の商品数
+WORK_QUEUE_DB = os.environ.get('WORK_QUEUE_DB', 'work_queue.sqlite3')
+WORK_QUEUE_UNIT_SIZE = int(os.environ.get('WORK_QUEUE_UNIT_SIZE', '200'))
+# 集計されないまま残ったジョブを削除するまでの時間
+WORK_QUEUE_MAX_AGE_HOURS = 24
+# この秒数以内にキューへアクセスしたワーカーを接続中として表示する
+WORKER_ACTIVE_SECONDS = 30
+# プロファイル（CPU・メモリ）の保存先
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'sitecheck_profiles'))
+PROFILE_LABELS = {
+    'own_site': "自社サイトスクレイピング",
+    'rakuten': "楽天市場API取得",
+    'yahoo': "Yahoo!ショッピングAPI取得",
+    'render': "画面表示（前回のスクリプト再実行）",
+}
 
 # ページ設定
 st.set_page_config(
@@ -18,22 +101,34 @@ st.set_page_config(
 )
 
 # セッション状態の初期化
-if 'df_onlinestore' not in st.session_state:
-    st.session_state.df_onlinestore = None
-if 'df_rakuten' not in st.session_state:
-    st.session_state.df_rakuten = None
-if 'df_yahoo' not in st.session_state:
-    st.session_state.df_yahoo = None
-if 'sale_list' not in st.session_state:
-    st.session_state.sale_list = None
-if 'selected_data_source' not in st.session_state:
-    st.session_state.selected_data_source = "自社サイトスクレイピング"
-if 'not_found_reasons_onlinestore' not in st.session_state:
-    st.session_state.not_found_reasons_onlinestore = {}
-if 'not_found_reasons_rakuten' not in st.session_state:
-    st.session_state.not_found_reasons_rakuten = {}
-if 'not_found_reasons_yahoo' not in st.session_state:
-    st.session_state.not_found_reasons_yahoo = {}
+SESSION_DEFAULTS = {
+    'df_onlinestore': None,
+    'df_rakuten': None,
+    'df_yahoo': None,
+    'sale_list': None,
+    # 読み込み済みのCSVファイル（同じファイルを再実行のたびに読み込み直さないため）
+    'sale_list_file_id': None,
+    'selected_data_source': "自社サイトスクレイピング",
+    'not_found_reasons_onlinestore': {},
+    'not_found_reasons_rakuten': {},
+    'not_found_reasons_yahoo': {},
+    'fetch_metrics_onlinestore': None,
+    'fetch_metrics_rakuten': None,
+    'fetch_metrics_yahoo': None,
+    # 抽出して確認した価格の不一致率の推定（sampling_audit.estimate の結果）
+    'sample_audit_rakuten': None,
+    'sample_audit_yahoo': None,
+    # 取得結果から作成した表示用データ（取得結果が変わるまで再利用する）
+    'result_views': {},
+    # 取得処理・画面表示のプロファイル（種類 → {'profiler', 'paths'}）
+    'profiles': {},
+}
+for key, value in SESSION_DEFAULTS.items():
+    if key not in st.session_state:
+        st.session_state[key] = value.copy() if isinstance(value, dict) else value
+# 共有ジョブの結果を使っているセッションの識別子
+if 'session_key' not in st.session_state:
+    st.session_state.session_key = uuid.uuid4().hex
 
 # タイトル
 st.title("📊 商品データ取得ツール")
@@ -74,596 +169,1295 @@ def load_csv_data_from_upload(uploaded_file):
         return None
 
 
-# 自社サイトスクレイピング関数
-def scrape_own_site(sale_list):
-    """自社サイトの商品情報をスクレイピングする関数"""
-    st.info("自社サイトのスクレイピングを開始します...")
-    
-    # 商品情報を格納するリスト
-    onlinestore_data = []
-    # 取得できなかった商品とその理由を記録
-    not_found_reasons = {}
-    
-    # プログレスバー
+# 商品コード拡張関数（楽天・Yahoo共通）
+def expand_sale_list(sale_list):
+    """大分類コードに応じて商品コードを拡張コード（-50, -100等）に展開する関数
+
+    展開後の各行には元の商品コード（基本コード）と拡張サフィックス（バリエーション）を保持する。
+    行ごとのコピーを作らず、展開するサフィックスごとに列単位で作成して並べ直す（件数が多い時のメモリ使用量を抑えるため）。
+    """
+    cat1 = sale_list[sale_list['大分類コード'] == 1]
+    cat2 = sale_list[sale_list['大分類コード'] == 2]
+    other = sale_list[~sale_list['大分類コード'].isin([1, 2])]
+
+    # 販売単価1-5の値を安全に取得（空・変換できない値は0）
+    def safe_get_price(df, column):
+        if column not in df.columns:
+            return pd.Series(0.0, index=df.index)
+        values = df[column].astype(str).str.replace(',', '', regex=False)
+        return pd.to_numeric(values, errors='coerce').fillna(0)
+
+    # 通販単価を数値に変換（0・空は価格なしとしてNaN）
+    def unit_price(df):
+        values = df['通販単価'].astype(str).str.replace(',', '', regex=False)
+        return pd.to_numeric(values, errors='coerce').where(df['通販単価'].map(bool))
+
+    def variants(df, suffix, price):
+        code = df['商品コード'].astype(str)
+        return df.assign(商品コード=code + suffix, 通販単価=price, 基本コード=code, バリエーション=suffix)
+
+    # 大分類コード1は元の行の順に、行ごとのサフィックスの順（_rank）で並べ直すため、元の位置（_row）を持たせる
+    cat1 = cat1.assign(_row=np.arange(len(cat1)))
+    sale_prices = [safe_get_price(cat1, f'販売単価{n}') for n in range(1, 6)]
+    has_sale_price = pd.concat([price > 0 for price in sale_prices], axis=1).any(axis=1)
+    with_sale = cat1[has_sale_price]
+    without_sale = cat1[~has_sale_price]
+    sale_prices = [price[has_sale_price] for price in sale_prices]
+    base_price = unit_price(without_sale)
+
+    cat1_frames = [
+        # 販売単価1-5が0でない場合の計算（-50と-100は販売単価1、-200〜-500は販売単価2〜5×数量）
+        variants(with_sale, '-50', sale_prices[0].where(sale_prices[0] > 0)).assign(_rank=0),
+        variants(with_sale, '-100', sale_prices[0].where(sale_prices[0] > 0)).assign(_rank=1),
+        *[
+            variants(with_sale, f'-{n}00', (sale_prices[n - 1] * n).where(sale_prices[n - 1] > 0)).assign(_rank=n)
+            for n in range(2, 6)
+        ],
+        # 従来の計算方法（販売単価1-5がすべて0の場合）
+        *[variants(without_sale, f'-{n}00', base_price * n).assign(_rank=n) for n in range(1, 6)],
+    ]
+    cat1_expanded = pd.concat(cat1_frames).sort_values(['_row', '_rank'], kind='stable')
+
+    return pd.concat([
+        cat1_expanded.drop(columns=['_row', '_rank']),
+        variants(cat2, '-50', unit_price(cat2)),
+        variants(other, '', unit_price(other)),
+    ])
+
+
+# HTTPセッション（接続プール）
+@st.cache_resource(show_spinner=False)
+def get_http_session(source, pool_maxsize=10):
+    """取得先ごとのHTTPセッションを返す関数
+
+    再実行・再取得をまたいで同じセッションを使い、確立済みの接続（TLSハンドシェイク済み）を再利用する。
+    """
+    return fetch_metrics.create_session(pool_maxsize=pool_maxsize)
+
+
+# 取得処理の共有（同じ内容の取得をセッション間で1回にまとめる）
+@st.cache_resource(show_spinner=False)
+def get_job_registry():
+    """プロセス内の全セッションで共有するジョブ一覧を返す関数"""
+    return job_registry.JobRegistry(
+        ttl_seconds=JOB_RESULT_TTL_MINUTES * 60, holder_ttl_seconds=JOB_HOLDER_TTL_HOURS * 3600,
+        on_evict=remove_job_files
+    )
+
+
+def remove_job_files(job):
+    """どのセッションも使わなくなったジョブの結果の書き出しファイルを削除する関数"""
+    for value in job.result.values():
+        if isinstance(value, record_spool.SpilledResult):
+            value.remove()
+
+
+@st.cache_resource(show_spinner=False)
+def get_watch_monitor():
+    """サーバー全体で1つのウォッチリスト監視を返す関数（画面を閉じても監視を続ける）"""
+    return watchlist_monitor.WatchMonitor()
+
+
+def progress_elements():
+    """進捗バーと状態表示を作成する関数（共有ジョブの実行中は、合流したセッションにも進捗を伝える）"""
     progress_bar = st.progress(0)
     status_text = st.empty()
-    
-    total_items = len(sale_list['商品コード'])
-    
-    for idx, code in enumerate(sale_list['商品コード']):
-        try:
-            # 商品コードの正規化（前後の空白を削除）
-            code = str(code).strip()
-            # 進捗更新
-            progress = (idx + 1) / total_items
-            progress_bar.progress(progress)
-            status_text.text(f"処理中: {idx + 1}/{total_items} - 商品コード: {code}")
-            
-            url = f'https://www.tonya.co.jp/shop/g/g{code}'
-            res = requests.get(url)
-            
-            # HTTPエラーチェック
-            if res.status_code != 200:
-                not_found_reasons[str(code)] = f"HTTPエラー: {res.status_code}"
-                continue
-            
-            soup = BeautifulSoup(res.text, 'html.parser')
-
-            # 各項目の初期化
-            item_dict = {
-                'No': None,
-                'Name': None,
-                'Price': None,
-                'Point': None,
-                'Stock': None,
-                'Icon': []
-            }
+    job = job_registry.current_job()
+    if job is None:
+        return progress_bar, status_text
+    return job_registry.ProgressMirror(progress_bar, job), job_registry.ProgressMirror(status_text, job)
 
-            # 商品詳細ブロック取得
-            detail_div = soup.find('div', class_='goodsproductdetail_')
-            if detail_div is None:
-                not_found_reasons[str(code)] = "商品詳細ブロックが見つかりませんでした"
-                continue
 
-            # 商品コード
-            code_span = detail_div.find('span', class_='goodscode_id_number_')
-            if code_span:
-                item_dict['No'] = int(re.sub('商品コード：', '', code_span.text))
+def sale_list_digest(sale_list):
+    """販売リストの内容のハッシュ値を返す関数（同じCSVをアップロードしたセッション同士で一致する）"""
+    def digest():
+        values = pd.util.hash_pandas_object(sale_list, index=False).to_numpy().tobytes()
+        return hashlib.sha256(repr(list(sale_list.columns)).encode('utf-8') + values).hexdigest()
 
-            # 商品名
-            name_h2 = detail_div.find('h2', class_='goods_rifhtname_')
-            if name_h2:
-                item_dict['Name'] = name_h2.text
+    return result_view('sale_list_digest', (sale_list,), digest)
 
-            # 価格
-            price_span = detail_div.find('span', class_='goods_detail_saleprice_')
-            if price_span:
-                price_text = price_span.text.replace('円（税込）', '')
-            else:
-                price_h2 = detail_div.find('h2', class_='goods_price_')
-                price_text = price_h2.text.replace('円（税込）', '') if price_h2 else None
-            if price_text:
-                # 金額はカンマ区切りの文字列として格納
-                price_int = int(price_text.replace(',', ''))
-                item_dict['Price'] = f"{price_int:,}"
-
-            # アイコン
-            icon_div = detail_div.find('div', class_='icon_')
-            if icon_div:
-                for img in icon_div.find_all('img'):
-                    src = img.get('src', '')
-                    if src == '/img/sys/new.gif':
-                        item_dict['Icon'].append('NEW')
-                    elif src == '/img/sys/onsales.gif':
-                        item_dict['Icon'].append('SALE')
-                    elif src == '/img/icon/10000001.png':
-                        item_dict['Icon'].append('送料無料')
-                    elif src == '/img/icon/10000002.png':
-                        item_dict['Icon'].append('よりどり対象')
-                    elif src == '/img/icon/10000003.png':
-                        item_dict['Icon'].append('期間限定')
-                    elif src == '/img/icon/10000004.png':
-                        item_dict['Icon'].append('クーポン進呈')
-                    elif src == '/img/icon/10000005.png':
-                        item_dict['Icon'].append('会員限定')
-                    elif src == '/img/icon/10000006.png':
-                        item_dict['Icon'].append('オンライン限定')
-                    elif src == '/img/icon/10000007.png':
-                        item_dict['Icon'].append('NEW')
-
-            # ポイント
-            point_ul = soup.find('ul', id='point_stock')
-            if point_ul:
-                li_list = point_ul.find_all('li')
-                if li_list:
-                    point_text = li_list[0].text.replace('ポイント：', '').replace('pt', '')
-                    try:
-                        item_dict['Point'] = int(point_text)
-                    except:
-                        item_dict['Point'] = None
-
-            # 在庫
-            stock_tr = soup.find('tr', class_='id_stock_msg_')
-            if stock_tr:
-                stock_td = stock_tr.find('td', class_='id_txt')
-                if stock_td:
-                    item_dict['Stock'] = stock_td.text
-
-            # 辞書をリストに追加
-            onlinestore_data.append(item_dict)
-
-        except requests.exceptions.RequestException as e:
-            # リクエストエラー
-            not_found_reasons[str(code)] = f"リクエストエラー: {str(e)}"
-            continue
-        except Exception as e:
-            # その他のエラー
-            not_found_reasons[str(code)] = f"エラー: {str(e)}"
-            continue
 
-    # データフレーム化
-    df_onlinestore = pd.DataFrame(onlinestore_data)
-    
-    # salelistの「商品コード」「通販単価」「送料区分名」をdf_onlinestoreにNoで紐づけて追加し、差額列も追加
+# メモリ節約モード（取得結果をファイルに書き出す）
+def new_spool(label, schema):
+    """取得途中のレコードを書き出すRecordSpoolを作成する関数（古い書き出しファイルもここで削除する）"""
+    record_spool.remove_stale(SPILL_DIR, SPILL_MAX_AGE_HOURS, keep=get_job_registry().held_paths())
+    return record_spool.RecordSpool(record_spool.spill_path(SPILL_DIR, label), schema, batch_size=SPILL_BATCH_SIZE)
+
+
+def write_spilled_result(label, frames, schema):
+    """結合済みのデータフレームを順にファイルへ書き出し、SpilledResultを返す関数"""
+    return record_spool.write_result(record_spool.spill_path(SPILL_DIR, label), frames, schema)
+
+
+def result_frame(result, columns=None):
+    """取得結果をデータフレームで返す関数（ファイルに書き出した結果はファイルから読み込む）
+
+    columns: ファイルに書き出した結果から読み込む列（省略時は全列）
+    """
+    if result is None or isinstance(result, pd.DataFrame):
+        return result
+    return result.read(columns)
+
+
+def store_result(key, result):
+    """取得結果をセッション状態に保存する関数
+
+    置き換える前の結果の書き出しファイルは、他のセッションが共有していなければ削除する。
+    """
+    previous = st.session_state[key]
+    if previous is not None and previous is not result:
+        released = get_job_registry().release(previous, st.session_state.session_key)
+        if released and not isinstance(previous, pd.DataFrame):
+            previous.remove()
+    st.session_state[key] = result
+
+
+# プロファイル（CPU・メモリ）
+def profile_enabled():
+    return st.session_state.get('profile_runs', False)
+
+
+def store_profile(name, profiler):
+    """プロファイルを保存先のディレクトリに書き出し、セッション状態に保存する関数
+
+    画面表示のプロファイルは再実行のたびに同じファイルへ上書きする。
+    """
+    file_name = f"render_{st.session_state.session_key[:8]}" if name == 'render' else None
+    paths = profiler.save(PROFILE_DIR, file_name)
+    st.session_state.profiles[name] = {'profiler': profiler, 'paths': paths}
+
+
+def profiled(name, func):
+    """プロファイルが有効な場合は、func() の実行中のCPU・メモリのプロファイルを取得して保存する関数"""
+    if not profile_enabled():
+        return func()
+    with run_profiler.RunProfiler(name, trace_memory=st.session_state.get('profile_memory', True)) as profiler:
+        result = func()
+    store_profile(name, profiler)
+    return result
+
+
+# 自社サイトの取得結果と販売リストのマージ
+def own_site_sales(sale_list):
+    """販売リストから自社サイトの取得結果に結合する列（No・通販単価・送料区分名）を取り出す関数"""
+    # salelistの「商品コード」「通販単価」「送料区分名」をdf_onlinestoreにNoで紐づけて追加する
     salelist_renamed = sale_list.rename(columns={'商品コード': 'No', '通販単価': '通販単価', '送料区分名': '送料区分名'})
-    df_onlinestore['No'] = df_onlinestore['No'].astype(str)
     salelist_renamed['No'] = salelist_renamed['No'].astype(str)
+    return salelist_renamed[['No', '通販単価', '送料区分名']]
+
+
+def merge_own_site_items(df_onlinestore, df_sales):
+    """取得した商品情報に通販単価・送料区分名を結合し、差額列を追加する関数"""
+    if df_onlinestore.empty:
+        # 1件も取得できなかった場合（レイアウト変更の疑いで中断した場合等）
+        df_onlinestore = pd.DataFrame(columns=['No', 'Name', 'Price', 'Point', 'Stock', 'Icon'])
+    df_onlinestore['No'] = df_onlinestore['No'].astype(str)
 
     # 通販単価と送料区分名を追加
-    df_onlinestore = pd.merge(df_onlinestore, salelist_renamed[['No', '通販単価', '送料区分名']], on='No', how='left')
+    df_onlinestore = pd.merge(df_onlinestore, df_sales, on='No', how='left')
 
-    # 通販単価もカンマ区切りの文字列に変換
-    df_onlinestore['通販単価'] = df_onlinestore['通販単価'].apply(
-        lambda x: f"{int(str(x).replace(',', '')):,}" if pd.notnull(x) and str(x).replace(',', '').isdigit() else x
+    # 通販単価をカンマ区切りの文字列に変換し、差額列を追加（Price - 通販単価）
+    df_onlinestore['通販単価'], df_onlinestore['差額'] = price_normalize.own_site_prices(
+        df_onlinestore['Price'], df_onlinestore['通販単価']
     )
 
-    # 差額列を追加（Price - 通販単価）
-    def calc_diff(row):
-        try:
-            price = int(str(row['Price']).replace(',', ''))
-            sale = int(str(row['通販単価']).replace(',', ''))
-            return f"{price - sale:,}"
-        except:
-            return None
-
-    df_onlinestore['差額'] = df_onlinestore.apply(calc_diff, axis=1)
-    
     # 列の順序を指定（通販単価、差額、送料区分名の順に）
     column_order = ['No', 'Name', 'Price', 'Point', 'Stock', 'Icon', '通販単価', '差額', '送料区分名']
-    df_onlinestore = df_onlinestore[column_order]
-    
-    # プログレスバーを完了
+    return df_onlinestore[column_order]
+
+
+# 自社サイトスクレイピング関数
+def scrape_own_site(sale_list, metrics=None, min_concurrency=1, max_concurrency=1, streamed=True, spill=False,
+                    skip_unchanged=False, prioritize=False):
+    """自社サイトの商品情報をスクレイピングする関数
+
+    同時リクエスト数は min_concurrency〜max_concurrency の範囲で、
+    レイテンシとエラーの状況に応じて自動調整する（AdaptiveConcurrencyLimiter）。
+    全件の取得後、一時的なエラーで失敗した商品だけをもう一度取得する。
+    streamed=True の場合は、商品ページの必要な部分を受信した時点で受信を打ち切る。
+    spill=True の場合は、取得した商品情報をファイルに書き出し、結果を SpilledResult で返す（メモリ節約モード）。
+    skip_unchanged=True の場合は、前回から内容が変わっていない商品ページを解析せずに前回の商品情報を使う。
+    prioritize=True の場合は、優先度の高い商品コードから取得する（fetch_priority）。
+    """
+    return run_source_fetch(
+        'own_site', sale_list, metrics, spill, min_concurrency=min_concurrency, max_concurrency=max_concurrency,
+        prioritize=prioritize, streamed=streamed, skip_unchanged=skip_unchanged
+    )
+
+
+def _merge_own_site_results(sale_list, results, metrics, spool=None):
+    """並び順の取得結果を販売リストと結合する関数（メモリ節約モードでは書き出した商品情報から結合する）"""
+    with metrics.run_phase('merge'):
+        df_sales = own_site_sales(sale_list)
+        if spool is not None:
+            # 書き出した商品情報をバッチごとに結合し、結果もファイルに書き出す
+            df_onlinestore = write_spilled_result(
+                'own_site', (merge_own_site_items(df, df_sales) for df in spool.frames(order_column='_order')),
+                record_spool.OWN_SITE_RESULT_SCHEMA
+            )
+            metrics.info['spill'] = {'records': spool.rows, 'batch_size': spool.batch_size}
+            spool.remove()
+        else:
+            onlinestore_data = [item_dict for item_dict, _ in results if item_dict is not None]
+            df_onlinestore = merge_own_site_items(pd.DataFrame(onlinestore_data), df_sales)
+    return df_onlinestore
+
+
+# 自社サイトスクレイピング（分散ワーカー）
+def scrape_own_site_distributed(sale_list, queue_path, unit_size, local_workers=1, max_concurrency=4,
+                                streamed=True, spill=False, metrics=None):
+    """自社サイトの商品情報を分散ワーカーで取得する関数（このセッションはコーディネーターとして動く）
+
+    商品コードを unit_size 件ずつの作業単位に分けてキュー（SQLite）に登録し、
+    own_site_worker.py で起動したワーカー（他のマシンを含む）が書き込んだ結果を並び順に集計する。
+    local_workers > 0 の場合は、このサーバーでもこのジョブ専用のワーカーを動かす。
+    戻り値・セッション状態への保存は scrape_own_site と同じ。
+    """
+    st.info("自社サイトのスクレイピングを分散ワーカーで開始します...")
+
+    metrics = metrics or fetch_metrics.FetchMetrics('own_site')
+    progress_bar, status_text = progress_elements()
+    codes = [str(code).strip() for code in sale_list['商品コード']]
+
+    work_queue.remove_stale(queue_path, WORK_QUEUE_MAX_AGE_HOURS)
+    # レイアウト変更の検出の基準はワーカーの環境変数ではなく、このサーバーの設定を使う
+    drift_options = {
+        'sample_pages': own_site_fetch.DRIFT_SAMPLE_PAGES, 'max_missing_rate': own_site_fetch.DRIFT_MAX_MISSING_RATE,
+    }
+    job_id = work_queue.create_job(queue_path, codes, unit_size, options={'streamed': streamed, 'drift': drift_options})
+    # このサーバーのワーカー（リース期限切れの作業単位も取り直すため、ジョブが終わるまで動かし続ける）
+    stop = threading.Event()
+    threads = [
+        threading.Thread(
+            target=own_site_worker.run_worker, args=(queue_path,), daemon=True,
+            kwargs={'max_concurrency': max_concurrency, 'retry_delay': RETRY_PASS_DELAY, 'job_id': job_id,
+                    'poll_interval': JOB_POLL_INTERVAL, 'stop': stop}
+        )
+        for _ in range(local_workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    finished = False
+    try:
+        while True:
+            progress = work_queue.job_progress(queue_path, job_id)
+            progress_bar.progress(progress['completed_codes'] / progress['codes'] if progress['codes'] else 1.0)
+            status_text.text(
+                f"処理中: {progress['completed_codes']}/{progress['codes']} - "
+                f"作業単位: 完了 {progress['done']}/{progress['units']}・処理中 {progress['leased']} - "
+                f"ワーカー: {len(progress['workers'])}台"
+                + (" - レイアウト変更の疑いで中断" if progress['drift']['tripped'] else "")
+            )
+            if progress['finished']:
+                finished = True
+                break
+            time.sleep(JOB_POLL_INTERVAL)
+    finally:
+        stop.set()
+        # 画面の停止などで集計前に中断した場合は、残りの作業単位をワーカーに処理させない
+        if not finished:
+            work_queue.cancel_job(queue_path, job_id)
+
+    # 作業単位の結果を並び順に集計する
+    spool = new_spool('own_site_records', record_spool.OWN_SITE_RECORD_SCHEMA) if spill else None
+    results = []
+    not_found_reasons = {}
+    retry_pass = {'retried': 0, 'recovered': 0}
+    unit_workers = {}
+    failed_units = 0
+    with metrics.run_phase('collect'):
+        for unit_codes, state, worker, result in work_queue.job_results(queue_path, job_id):
+            if result is None:
+                # 処理中のワーカーが停止し続けた作業単位は、商品コードごとの失敗として記録する
+                failed_units += 1
+                for code in unit_codes:
+                    failure = not_found_reasons[code] = FetchFailure(
+                        UNEXPECTED, detail="ワーカーが作業単位の処理を完了できませんでした"
+                    )
+                    results.append((None, failure))
+                continue
+            unit_workers[worker] = unit_workers.get(worker, 0) + 1
+            metrics.add_remote(result['spans'], result['status_counts'])
+            for key in retry_pass:
+                retry_pass[key] += result['retry_pass'][key]
+            for code, (item_dict, failure) in zip(unit_codes, result['items']):
+                if failure is not None:
+                    failure = not_found_reasons[code] = failure_from_dict(failure)
+                if spool is not None and item_dict is not None:
+                    spool.append({**item_dict, '_order': len(results)})
+                    item_dict = None
+                results.append((item_dict, failure))
+    work_queue.delete_job(queue_path, job_id)
+    report_layout_drift(metrics, {**progress['drift'], **drift_options})
+    metrics.info['retry_pass'] = retry_pass
+    metrics.info['distributed'] = {
+        'unit_size': unit_size,
+        'units': sum(unit_workers.values()),
+        'failed_units': failed_units,
+        'local_workers': local_workers,
+        'workers': unit_workers,
+    }
+
+    df_onlinestore = _merge_own_site_results(sale_list, results, metrics, spool)
+
     progress_bar.progress(1.0)
     status_text.text("スクレイピング完了！")
-    
-    # 取得できなかった商品の理由をセッション状態に保存
+
+    metrics.close()
     st.session_state.not_found_reasons_onlinestore = not_found_reasons
-    
+    st.session_state.fetch_metrics_onlinestore = metrics
+
     return df_onlinestore
 
+
+def _rakuten_item(d):
+    """楽天市場APIの商品情報を取得結果の形式に変換する関数"""
+    url = d.get('itemUrl', '')
+    url = url.replace("https://item.rakuten.co.jp/tonya/", "").replace("/?rafcid=wsc_i_is_1027604414937000350", "")
+    return {
+        'itemCode': url,
+        'itemName': d.get('itemName', ''),
+        'itemPrice': d.get('itemPrice', ''),
+        'pointRate': d.get('pointRate', ''),
+        'postageFlag': "送料込" if d.get('postageFlag') == 0 else "送料別" if d.get('postageFlag') == 1 else ""
+    }
+
+
+# 楽天市場APIの商品1件分の取得
+def fetch_rakuten_item(session, code, metrics, span):
+    """楽天市場APIで商品コードを1件検索し、(商品情報, FetchFailure)を返す関数"""
+    params = {
+        "format": "json",
+        "shopCode": "tonya",
+        "keyword": code,
+        "orFlag": 0,
+        "hasReviewFlag": 0,
+        "applicationId": RAKUTEN_APP_ID,
+        "availability": 1,
+        "hits": 30,
+        "page": 1,
+        'sort': '+itemPrice',
+    }
+    try:
+        res = metrics.get(session, span, RAKUTEN_API_URL, params=params)
+        if res.status_code != 200:
+            failure = http_failure(res.status_code)
+            metrics.finish(span, failure)
+            return None, failure
+        with metrics.parse(span):
+            result = res.json()
+    except Exception as e:
+        failure = exception_failure(e)
+        if isinstance(e, requests.exceptions.RequestException):
+            metrics.request_error(span, e)
+        metrics.finish(span, failure)
+        return None, failure
+
+    with metrics.parse(span):
+        for item in result.get('Items', []):
+            d = item['Item']
+            tmp = _rakuten_item(d)
+            if tmp['itemCode'] == code:
+                metrics.finish(span)
+                return tmp, None
+
+    failure = FetchFailure(NOT_LISTED, detail="APIで商品が見つかりませんでした")
+    metrics.finish(span, failure)
+    return None, failure
+
+
+# APIの利用制限（1日の上限回数）
+def deferred_chunk_codes(codes, chunk, not_found_reasons):
+    """分割した取得で、今回のチャンクの対象外の商品コードを記録し、対象の商品コードを返す関数"""
+    if chunk is None:
+        return codes
+    detail = f"APIの1日の上限回数に収めるため、チャンク{chunk['index'] + 1}/{chunk['count']}の対象外です"
+    for code in list(codes[:chunk['start']]) + list(codes[chunk['end']:]):
+        not_found_reasons[code] = FetchFailure(QUOTA_EXHAUSTED, detail=detail)
+    return codes[chunk['start']:chunk['end']]
+
+
+def selected_codes(codes, only_codes, detail, not_found_reasons):
+    """指定した商品コードだけを並び順のまま返し、それ以外を対象外として記録する関数（抽出して確認する取得等）"""
+    wanted = set(only_codes)
+    for code in codes:
+        if code not in wanted:
+            not_found_reasons[code] = FetchFailure(NOT_SAMPLED, detail=detail)
+    return [code for code in codes if code in wanted]
+
+
+def close_quota_meter(meter, metrics, chunk=None):
+    """API呼び出し回数を記録し、分割した取得のチャンクを最後まで実行できた場合は実行済みにする関数"""
+    meter.close()
+    metrics.info['quota'] = {**meter.stats(), 'chunk': chunk}
+    if meter.exhausted_codes:
+        st.warning(
+            f"APIの1日の上限回数に達したため、{meter.exhausted_codes}件は取得していません。"
+            "日本時間0時のリセット後に取得し直してください。"
+        )
+    elif chunk is not None:
+        api_quota.mark_chunk_done(QUOTA_DB, meter.source, chunk['plan_key'], chunk['index'], chunk['size'])
+
+
+# 楽天市場・Yahoo!ショッピングの取得結果と販売リストのマージ
+def merge_marketplace_items(df_items, sale_list_mod):
+    """取得した商品情報に通販単価・送料区分名を結合し、差額を計算する関数"""
+    if df_items.empty:
+        df_items = pd.DataFrame(columns=['itemCode', 'itemName', 'itemPrice', 'pointRate', 'postageFlag'])
+
+    df_sales = sale_list_mod[['商品コード', '通販単価', '送料区分名']].rename(columns={'商品コード': 'itemCode'})
+    df_merged = pd.merge(df_items, df_sales, on='itemCode', how='left')
+
+    # 価格の整形・差額計算
+    item_price = price_normalize.to_price_number(df_merged['itemPrice']).astype(float)
+    unit_price = price_normalize.to_price_number(df_merged['通販単価']).astype(float)
+
+    df_merged['通販単価'] = price_normalize.format_prices(unit_price)
+    df_merged['itemPrice'] = price_normalize.format_prices(item_price)
+    df_merged['差額'] = price_normalize.format_prices(item_price - unit_price)
+
+    cols = ['itemCode', 'itemName', 'itemPrice', 'pointRate', 'postageFlag', '通販単価', '差額', '送料区分名']
+    return df_merged[cols]
+
+
 # 楽天市場API取得関数
-def get_rakuten_data(sale_list):
-    """楽天市場APIから商品情報を取得する関数"""
-    st.info("楽天市場APIからのデータ取得を開始します...")
-    
-    REQUEST_URL = "https://app.rakuten.co.jp/services/api/IchibaItem/Search/20170706"
-    APP_ID = 1027604414937000350
+def get_rakuten_data(sale_list, metrics=None, spill=False, chunk=None, prioritize=False):
+    """楽天市場APIから商品情報を取得する関数
 
-    # 商品コード拡張
-    cat1 = sale_list[sale_list['大分類コード'] == 1]
-    cat2 = sale_list[sale_list['大分類コード'] == 2]
-    other = sale_list[~sale_list['大分類コード'].isin([1, 2])]
+    全件の取得後、一時的なエラーで失敗した商品だけをもう一度取得する。
+    spill=True の場合は、取得した商品情報をファイルに書き出し、結果を SpilledResult で返す（メモリ節約モード）。
+    chunk を指定した場合は、拡張後の商品コードのうちそのチャンクの範囲だけを取得する（api_quota.plan_job の分割）。
+    prioritize=True の場合は、優先度の高い商品コードから取得する（分割した取得ではチャンクの中で並べ替える）。
+    """
+    return run_source_fetch('rakuten', sale_list, metrics, spill, chunk, prioritize=prioritize)
 
-    rows = []
-    for _, row in cat1.iterrows():
-        code = str(row['商品コード'])
-        
-        # 販売単価1-5の値を安全に取得
-        def safe_get_price(price_value):
-            try:
-                if pd.isna(price_value) or price_value == '' or price_value is None:
-                    return 0
-                return float(str(price_value).replace(',', ''))
-            except (ValueError, TypeError):
-                return 0
-        
-        sale_price1 = safe_get_price(row.get('販売単価1', 0))
-        sale_price2 = safe_get_price(row.get('販売単価2', 0))
-        sale_price3 = safe_get_price(row.get('販売単価3', 0))
-        sale_price4 = safe_get_price(row.get('販売単価4', 0))
-        sale_price5 = safe_get_price(row.get('販売単価5', 0))
-        
-        # 販売単価1-5が0でない場合の計算
-        if sale_price1 > 0 or sale_price2 > 0 or sale_price3 > 0 or sale_price4 > 0 or sale_price5 > 0:
-            # -50と-100は販売単価1
-            for suf in ['-50', '-100']:
-                r = row.copy()
-                r['商品コード'] = code + suf
-                r['通販単価'] = float(str(sale_price1).replace(',', '')) if sale_price1 > 0 else np.nan
-                rows.append(r)
+
+# Yahoo!ショッピングAPIの商品1件分の取得
+def fetch_yahoo_item(session, code, target_price, metrics, span, max_retries=3):
+    """Yahoo!ショッピングAPIで商品コードを1件検索し、(商品情報, FetchFailure)を返す関数
+
+    target_price: 販売リストの通販単価（複数ヒット時に価格が一致する商品を選ぶために使用）
+    """
+    params = {
+        "appid": YAHOO_APP_ID,
+        "query": code,
+        "hits": 30,  # 複数ヒットに対応するため30件まで取得
+        "seller_id": "tonya",  # 出店者IDを指定
+    }
+    # リトライ処理（各試行の失敗は履歴として残す）
+    failure = None
+    history = []
+    for retry_count in range(max_retries):
+        if failure is not None:
+            history.append(failure.metric_key)
+        try:
+            res = metrics.get(session, span, YAHOO_API_URL, params=params)
             
-            # -200は販売単価2×2
-            r = row.copy()
-            r['商品コード'] = code + '-200'
-            r['通販単価'] = float(str(sale_price2).replace(',', '')) * 2 if sale_price2 > 0 else np.nan
-            rows.append(r)
+            # 429エラー（Too Many Requests）の場合は待機時間を延長
+            if res.status_code == 429:
+                wait_time = (retry_count + 1) * API_RETRY_WAIT  # 5秒、10秒、15秒と段階的に延長
+                st.warning(f"API制限に達しました。{wait_time}秒待機します...")
+                metrics.wait(span, wait_time, 'backoff')
+                failure = http_failure(res.status_code)
+                continue
             
-            # -300は販売単価3×3
-            r = row.copy()
-            r['商品コード'] = code + '-300'
-            r['通販単価'] = float(str(sale_price3).replace(',', '')) * 3 if sale_price3 > 0 else np.nan
-            rows.append(r)
+            if res.status_code != 200:
+                failure = http_failure(res.status_code)
+                continue
             
-            # -400は販売単価4×4
-            r = row.copy()
-            r['商品コード'] = code + '-400'
-            r['通販単価'] = float(str(sale_price4).replace(',', '')) * 4 if sale_price4 > 0 else np.nan
-            rows.append(r)
+            with metrics.parse(span):
+                data = res.json()
+                hits = data.get("hits", [])
+                if not hits:
+                    failure = FetchFailure(NOT_LISTED, detail="APIで商品が見つかりませんでした（ヒットなし）")
+                    break
+                
+                # 通販単価と一致する商品を探す
+                selected_item = None
+                if target_price is not None:
+                    for item in hits:
+                        item_price = item.get("price", "")
+                        if item_price:
+                            try:
+                                # 価格を数値に変換して比較
+                                item_price_num = float(str(item_price).replace(',', ''))
+                                target_price_num = float(str(target_price).replace(',', ''))
+                                if abs(item_price_num - target_price_num) < 1:  # 1円以内の差なら一致とみなす
+                                    selected_item = item
+                                    break
+                            except (ValueError, TypeError):
+                                continue
+                
+                # 通販単価と一致する商品がない場合は最初の商品を使用
+                if selected_item is None:
+                    selected_item = hits[0]
+                    if target_price is not None:
+                        st.info(f"商品コード: {code} - 通販単価と一致する商品が見つかりません。最初の商品を選択します。")
+                
+                shipping_name = ""
+                if "shipping" in selected_item and "name" in selected_item["shipping"]:
+                    shipping_name = selected_item["shipping"]["name"]
+                
+                item = {
+                    "itemCode": code,
+                    "itemName": selected_item.get("name", ""),
+                    "itemPrice": selected_item.get("price", ""),
+                    "pointRate": selected_item.get("point", {}).get("times", ""),
+                    "postageFlag": shipping_name,
+                }
+            metrics.finish(span)
+            return item, None
             
-            # -500は販売単価5×5
-            r = row.copy()
-            r['商品コード'] = code + '-500'
-            r['通販単価'] = float(str(sale_price5).replace(',', '')) * 5 if sale_price5 > 0 else np.nan
-            rows.append(r)
-        else:
-            # 従来の計算方法（販売単価1-5がすべて0の場合）
-            for i, suf in enumerate(['-100', '-200', '-300', '-400', '-500'], 1):
-                r = row.copy()
-                r['商品コード'] = code + suf
-                r['通販単価'] = float(str(row['通販単価']).replace(',', '')) * i if row['通販単価'] else np.nan
-                rows.append(r)
-    
-    for _, row in cat2.iterrows():
-        code = str(row['商品コード'])
-        r = row.copy()
-        r['商品コード'] = code + '-50'
-        r['通販単価'] = float(str(row['通販単価']).replace(',', '')) if row['通販単価'] else np.nan
-        rows.append(r)
-    for _, row in other.iterrows():
-        r = row.copy()
-        r['商品コード'] = str(row['商品コード'])
-        r['通販単価'] = float(str(row['通販単価']).replace(',', '')) if row['通販単価'] else np.nan
-        rows.append(r)
-    sale_list_mod = pd.DataFrame(rows)
-
-    codes = sale_list_mod['商品コード'].astype(str).unique()
-    item_list = []
-    # 取得できなかった商品とその理由を記録
+        except Exception as e:
+            if isinstance(e, requests.exceptions.RequestException):
+                metrics.request_error(span, e)
+            failure = exception_failure(e)
+            continue
+
+    failure.attempts = span.attempts
+    failure.history = history
+    metrics.finish(span, failure)
+    return None, failure
+
+
+# Yahoo!ショッピングAPI取得関数
+def get_yahoo_data(sale_list, metrics=None, spill=False, chunk=None, prioritize=False):
+    """Yahoo!ショッピングAPIから商品情報を取得する関数
+
+    全件の取得後、一時的なエラーで失敗した商品だけをもう一度取得する。
+    spill=True の場合は、取得した商品情報をファイルに書き出し、結果を SpilledResult で返す（メモリ節約モード）。
+    chunk を指定した場合は、拡張後の商品コードのうちそのチャンクの範囲だけを取得する（api_quota.plan_job の分割）。
+    1日の上限回数（他のセッション・過去の実行の分を含む）に達した後の商品コードはAPIを呼び出さずに記録する。
+    prioritize=True の場合は、優先度の高い商品コードから取得する（上限に達した場合は優先度の低い商品コードが残る）。
+    """
+    return run_source_fetch('yahoo', sale_list, metrics, spill, chunk, prioritize=prioritize)
+
+
+# 取得先ごとの取得対象の準備・1件分の取得・販売リストとの結合
+def prepare_own_site(sale_list, options):
+    """自社サイトの取得対象（商品コード）と、結合する販売リストの列を準備する関数"""
+    # 商品コードの正規化（前後の空白を削除）
+    codes = [str(code).strip() for code in sale_list['商品コード']]
+    return {
+        'codes': codes,
+        'df_sales': own_site_sales(sale_list),
+        'rows': fetch_priority.code_rows(sale_list),
+        'streamed': options.get('streamed', True),
+        'page_cache': page_cache.PageRecordCache(PAGE_CACHE_DB, codes) if options.get('skip_unchanged') else None,
+        # サイトのレイアウト変更の検出（最初のページの抽出率）
+        'drift': own_site_fetch.LayoutDriftMonitor(),
+    }
+
+
+def fetch_own_site_source_item(session, code, metrics, span, context):
+    return own_site_fetch.fetch_own_site_item(
+        session, code, metrics, span, context['streamed'], context['page_cache'], context['drift']
+    )
+
+
+def finish_own_site_fetch(context, metrics):
+    """変化のないページの解析の省略に使う商品情報を保存し、レイアウト変更の疑いで中断した場合は表示する関数"""
+    if context['page_cache'] is not None:
+        context['page_cache'].save()
+        metrics.info['page_cache'] = context['page_cache'].stats()
+    report_layout_drift(metrics, context['drift'].stats())
+
+
+def report_layout_drift(metrics, drift):
+    """レイアウト変更の検出結果を計測値に記録し、疑いで中断した場合は表示する関数"""
+    metrics.info['layout_drift'] = drift
+    if drift['tripped']:
+        st.error(
+            f"最初の{drift['pages']}ページのうち{drift['missing']}ページで商品詳細ブロックが見つからないため、"
+            "サイトのレイアウトが変わった可能性があります。残りの取得を中断しました。"
+            "own_site_parser.OWN_SITE_SPEC の抽出仕様を確認してください。"
+        )
+
+
+def prepare_marketplace(sale_list, options):
+    """楽天市場・Yahoo!ショッピングの取得対象（拡張後の商品コード）と、結合する販売リストを準備する関数"""
+    sale_list_mod = expand_sale_list(sale_list)
+    return {
+        'codes': sale_list_mod['商品コード'].astype(str).unique(),
+        'sale_list_mod': sale_list_mod,
+        'rows': fetch_priority.code_rows(sale_list_mod, '基本コード'),
+        # 商品コードごとの通販単価（同じコードが複数行ある場合は先頭行。Yahoo!ショッピングで複数ヒットした時の選択に使う）
+        'target_prices': sale_list_mod.drop_duplicates('商品コード').set_index('商品コード')['通販単価'].to_dict(),
+    }
+
+
+def fetch_rakuten_source_item(session, code, metrics, span, context):
+    return fetch_rakuten_item(session, code, metrics, span)
+
+
+def fetch_yahoo_source_item(session, code, metrics, span, context):
+    return fetch_yahoo_item(session, code, context['target_prices'].get(code), metrics, span)
+
+
+def merge_own_site_source(df_items, context):
+    return merge_own_site_items(df_items, context['df_sales'])
+
+
+def merge_marketplace_source(df_items, context):
+    return merge_marketplace_items(df_items, context['sale_list_mod'])
+
+
+# 取得先ごとの設定（共通の取得処理 run_source_fetch で使う）
+# - prepare(販売リスト, オプション): 取得対象の商品コード（'codes'）と商品コードごとの販売リストの行（'rows'。
+#   fetch_priority.code_rows）等の取得・結合に使う値の辞書を返す
+# - fetch_item(session, 商品コード, metrics, span, 準備した値): 1件分の取得（リクエスト・解析・バリエーションの照合）
+# - merge(取得した商品情報のデータフレーム, 準備した値): 販売リストとの結合
+# - price_field: 取得した商品情報の価格のキー（前回の取得結果の記録に使う）
+# - paced: API制限のリクエスト間隔を空ける、quota: API呼び出し回数を記録して1日の上限回数で打ち切る
+FETCH_SOURCES = {
+    'own_site': {
+        'start_message': "自社サイトのスクレイピングを開始します...",
+        'done_message': "スクレイピング完了！",
+        'prepare': prepare_own_site,
+        'fetch_item': fetch_own_site_source_item,
+        'after_fetch': finish_own_site_fetch,
+        'merge': merge_own_site_source,
+        'price_field': 'Price',
+        'record_schema': 'OWN_SITE_RECORD_SCHEMA',
+        'result_schema': 'OWN_SITE_RESULT_SCHEMA',
+        'state_key': 'onlinestore',
+        'paced': False,
+        'quota': False,
+        'adaptive': True,
+    },
+    'rakuten': {
+        'start_message': "楽天市場APIからのデータ取得を開始します...",
+        'done_message': "楽天市場API取得完了！",
+        'prepare': prepare_marketplace,
+        'fetch_item': fetch_rakuten_source_item,
+        'merge': merge_marketplace_source,
+        'price_field': 'itemPrice',
+        'record_schema': 'MARKETPLACE_RECORD_SCHEMA',
+        'result_schema': 'MARKETPLACE_RESULT_SCHEMA',
+        'state_key': 'rakuten',
+        'paced': True,
+        'quota': True,
+        'adaptive': False,
+    },
+    'yahoo': {
+        'start_message': "Yahoo!ショッピングAPIからのデータ取得を開始します...",
+        'done_message': "Yahoo!ショッピングAPI取得完了！",
+        'empty_warning': "Yahoo!ショッピングAPIから商品情報が取得できませんでした。",
+        'prepare': prepare_marketplace,
+        'fetch_item': fetch_yahoo_source_item,
+        'merge': merge_marketplace_source,
+        'price_field': 'itemPrice',
+        'record_schema': 'MARKETPLACE_RECORD_SCHEMA',
+        'result_schema': 'MARKETPLACE_RESULT_SCHEMA',
+        'state_key': 'yahoo',
+        'paced': True,
+        'quota': True,
+        'adaptive': False,
+    },
+}
+
+
+# 商品コードごとの取得（全取得先で共通）
+def run_source_fetch(source, sale_list, metrics=None, spill=False, chunk=None, min_concurrency=1, max_concurrency=1,
+                     only_codes=None, only_detail='', prioritize=False, **options):
+    """取得先の設定（FETCH_SOURCES）に従って商品コードごとに取得し、販売リストと結合する関数
+
+    同時リクエスト数の自動調整、API制限のリクエスト間隔、1日の上限回数と分割した取得（chunk）、
+    一時的なエラーの再取得、進捗表示、リクエスト計測、メモリ節約モード（spill）は全取得先で共通に行う。
+    only_codes を指定した場合は、その商品コードだけを取得し、それ以外は only_detail の理由で対象外として記録する。
+    prioritize=True の場合は、優先度（fetch_priority）の高い商品コードから取得する（結果は販売リストの並び順）。
+    商品コードごとの取得結果は、次回の優先度の計算のため prioritize に関わらず記録する。
+    options は取得先の prepare に渡す（自社サイトの streamed・skip_unchanged）。
+    取得できなかった商品とその理由、計測結果はセッション状態に保存する。
+    """
+    config = FETCH_SOURCES[source]
+    st.info(config['start_message'])
+
+    context = config['prepare'](sale_list, options)
+    # 取得できなかった商品とその理由（FetchFailure）を記録
     not_found_reasons = {}
-    
+    codes = context['codes']
+    if only_codes is not None:
+        codes = selected_codes(codes, only_codes, only_detail, not_found_reasons)
+    codes = deferred_chunk_codes(codes, chunk, not_found_reasons)
+    # リクエスト計測
+    metrics = metrics or fetch_metrics.FetchMetrics(source)
+    # 取得する商品コードごとの販売リストの行（優先度の計算・取得結果の記録に使う）
+    rows = context['rows'].set_index('code', drop=False).loc[list(codes)].reset_index(drop=True)
+    order = None
+    if prioritize:
+        order, metrics.info['priority'] = fetch_priority.prioritize(PRIORITY_DB, source, rows)
+    session = get_http_session(source, pool_maxsize=max(max_concurrency, 10))
+    # 同時リクエスト数の調整・API制限のリクエスト間隔（楽天市場・Yahoo!ショッピング: 1分30リクエスト = 2秒間隔）
+    limiter = AdaptiveConcurrencyLimiter(min_limit=min_concurrency, max_limit=max_concurrency)
+    pacer = fetch_engine.RequestPacer(API_REQUEST_INTERVAL) if config['paced'] else None
+    # API呼び出し回数の記録（1日の上限回数の確認）
+    meter = api_quota.QuotaMeter(QUOTA_DB, source) if config['quota'] else None
+
     # プログレスバー
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    total_codes = len(codes)
-    
-    for idx, code in enumerate(codes):
-        # 進捗更新
-        progress = (idx + 1) / total_codes
-        progress_bar.progress(progress)
-        status_text.text(f"処理中: {idx + 1}/{total_codes} - 商品コード: {code}")
-        
-        params = {
-            "format": "json",
-            "shopCode": "tonya",
-            "keyword": code,
-            "orFlag": 0,
-            "hasReviewFlag": 0,
-            "applicationId": APP_ID,
-            "availability": 1,
-            "hits": 30,
-            "page": 1,
-            'sort': '+itemPrice',
-        }
-        found = False
+    progress_bar, status_text = progress_elements()
+
+    def on_progress(completed, total, retry, code):
+        progress_bar.progress(completed / total)
+        label = "一時的なエラーの再取得中" if retry else "処理中"
+        text = f"{label}: {completed}/{total} - 商品コード: {code}"
+        if config['adaptive']:
+            text += f" - 同時接続数: {limiter.current_limit}"
+        status_text.text(text)
+
+    # メモリ節約モードでは、商品情報を商品コードの並び順（_order）付きでファイルに書き出す
+    spool = new_spool(f'{source}_records', getattr(record_spool, config['record_schema'])) if spill else None
+
+    def on_item(i, item):
+        spool.append({**item, '_order': i})
+
+    # 取得できた商品の差額の有無と自社サイトのアイコン（次回の優先度の計算に使う）
+    target_prices = dict(zip(rows['code'], rows['price']))
+    outcomes = {}
+    icons = {}
+
+    def fetch_item(session, code, metrics, span):
+        item, failure = config['fetch_item'](session, code, metrics, span, context)
+        if item is not None:
+            outcomes[code] = fetch_priority.outcome(item[config['price_field']], target_prices[code], None)
+            icons[code] = item.get('Icon', [])
+        return item, failure
+
+    results, reasons = fetch_engine.fetch_codes(
+        session, codes, fetch_item, metrics, limiter, on_progress, RETRY_PASS_DELAY, pacer=pacer, quota=meter,
+        on_item=on_item if spill else None, order=order
+    )
+    not_found_reasons.update(reasons)
+    for code, failure in reasons.items():
+        if failure.kind != QUOTA_EXHAUSTED:
+            outcomes[code] = fetch_priority.FAILED
+    fetch_priority.record_outcomes(PRIORITY_DB, source, rows, outcomes, icons)
+    if config['adaptive']:
+        metrics.info['concurrency'] = limiter.stats()
+        metrics.info['concurrency_history'] = limiter.history
+    if 'after_fetch' in config:
+        config['after_fetch'](context, metrics)
+    if meter is not None:
+        close_quota_meter(meter, metrics, chunk)
+
+    with metrics.run_phase('merge'):
+        if 'empty_warning' in config and all(failure is not None for _, failure in results):
+            st.warning(config['empty_warning'])
+        if spool is not None:
+            # 書き出した商品情報をバッチごとに結合し、結果もファイルに書き出す
+            df_merged = write_spilled_result(
+                source, (config['merge'](df, context) for df in spool.frames(order_column='_order')),
+                getattr(record_spool, config['result_schema'])
+            )
+            metrics.info['spill'] = {'records': spool.rows, 'batch_size': spool.batch_size}
+            spool.remove()
+        else:
+            df_merged = config['merge'](pd.DataFrame([item for item, _ in results if item is not None]), context)
+
+    # プログレスバーを完了
+    progress_bar.progress(1.0)
+    status_text.text(config['done_message'])
+
+    # 取得できなかった商品の理由と計測結果をセッション状態に保存
+    metrics.close()
+    st.session_state[f"not_found_reasons_{config['state_key']}"] = not_found_reasons
+    st.session_state[f"fetch_metrics_{config['state_key']}"] = metrics
+
+    return df_merged
+
+
+# 抽出して確認する取得（楽天市場・Yahoo!ショッピング）
+def marketplace_price_diffs(df_merged):
+    """販売リストと結合した取得結果から、商品コード → 差額（円）の辞書を作成する関数"""
+    df = df_merged.drop_duplicates('itemCode')
+    diffs = pd.to_numeric(df['差額'].astype(str).str.replace(',', '', regex=False), errors='coerce')
+    return dict(zip(df['itemCode'].astype(str), diffs))
+
+
+def get_sample_audit(source, sale_list, sample_size, seed):
+    """拡張後の商品コードを層別に無作為抽出して取得し、価格の不一致率を推定する関数
+
+    層は大分類コード・送料区分名・価格帯で分ける（sampling_audit）。
+    推定結果はセッション状態（sample_audit_*）に保存し、抽出した商品の取得結果を返す。
+    """
+    strata = sampling_audit.build_strata(expand_sale_list(sale_list))
+    codes = sampling_audit.draw_sample(strata, sample_size, seed)
+    df_merged = run_source_fetch(
+        source, sale_list, only_codes=codes, only_detail=f"抽出して確認する取得（{len(codes):,}件）の対象外です"
+    )
+
+    state_key = FETCH_SOURCES[source]['state_key']
+    not_found_reasons = st.session_state[f'not_found_reasons_{state_key}']
+    audit = sampling_audit.estimate(
+        strata, codes, marketplace_price_diffs(df_merged),
+        [code for code, failure in not_found_reasons.items() if failure.kind == NOT_LISTED]
+    )
+    st.session_state[f'sample_audit_{state_key}'] = {**audit, 'seed': seed}
+    return df_merged
+
+
+def get_strata_data(source, sale_list, labels, spill=False, prioritize=False):
+    """抽出して確認した結果から選んだ層（sampling_audit の層の表示名）の商品コードを全件取得する関数"""
+    strata = sampling_audit.build_strata(expand_sale_list(sale_list))
+    codes = sampling_audit.strata_codes(strata, labels)
+    df_merged = run_source_fetch(
+        source, sale_list, spill=spill, only_codes=codes, only_detail="全件取得した層の対象外です", prioritize=prioritize
+    )
+    st.session_state[f"sample_audit_{FETCH_SOURCES[source]['state_key']}"] = None
+    return df_merged
+
+
+# 店舗カタログの1ページ分の取得
+def _fetch_catalog_page(session, metrics, url, params, label, parse_page, interval, quota=None, max_retries=3):
+    """検索APIを1ページ分取得し、(商品リスト, ヒット件数, FetchFailure)を返す関数
+
+    parse_page(JSON) は (商品リスト, ヒット件数) を返す。
+    一時的なエラー（通信エラー・429・5xx）は待機時間を延ばしながらリトライする。
+    quota（api_quota.QuotaMeter）を指定した場合は呼び出し回数を数え、1日の上限回数に達した後は呼び出さない。
+    """
+    span = metrics.start(label)
+    if quota is not None and quota.exhausted:
+        failure = FetchFailure(QUOTA_EXHAUSTED)
+        metrics.finish(span, failure)
+        return [], 0, failure
+    try:
+        return _request_catalog_page(session, metrics, span, url, params, parse_page, interval, max_retries)
+    finally:
+        if quota is not None:
+            quota.add(span.attempts, codes=0)
+
+
+def _request_catalog_page(session, metrics, span, url, params, parse_page, interval, max_retries):
+    """_fetch_catalog_page のリクエスト部分（リトライを含む）"""
+    # API制限を考慮して待機
+    metrics.wait(span, interval)
+    failure = None
+    history = []
+    for retry_count in range(max_retries):
+        if failure is not None:
+            history.append(failure.metric_key)
+            metrics.wait(span, retry_count * API_RETRY_WAIT, 'backoff')
         try:
-            res = requests.get(REQUEST_URL, params=params)
+            res = metrics.get(session, span, url, params=params)
             if res.status_code != 200:
-                not_found_reasons[code] = f"HTTPエラー: {res.status_code}"
-                time.sleep(2.1)
-                continue
-            result = res.json()
-        except requests.exceptions.RequestException as e:
-            not_found_reasons[code] = f"リクエストエラー: {str(e)}"
-            time.sleep(2.1)
-            continue
-        except Exception as e:
-            not_found_reasons[code] = f"エラー: {str(e)}"
-            time.sleep(2.1)
-            continue
-        
-        for item in result.get('Items', []):
-            d = item['Item']
-            url = d.get('itemUrl', '')
-            url = url.replace("https://item.rakuten.co.jp/tonya/", "").replace("/?rafcid=wsc_i_is_1027604414937000350", "")
-            if url == code:
-                tmp = {
-                    'itemCode': url,
-                    'itemName': d.get('itemName', ''),
-                    'itemPrice': d.get('itemPrice', ''),
-                    'pointRate': d.get('pointRate', ''),
-                    'postageFlag': "送料込" if d.get('postageFlag') == 0 else "送料別" if d.get('postageFlag') == 1 else ""
-                }
-                item_list.append(tmp)
-                found = True
+                failure = http_failure(res.status_code)
+                if failure.retryable:
+                    continue
                 break
-        
-        if not found:
-            not_found_reasons[code] = "APIで商品が見つかりませんでした"
-        
-        # API制限を考慮して待機（楽天市場API: 1分30リクエスト = 2秒間隔）
-        time.sleep(2.1)
+            with metrics.parse(span):
+                items, total = parse_page(res.json())
+            metrics.finish(span)
+            return items, total, None
+        except Exception as e:
+            if isinstance(e, requests.exceptions.RequestException):
+                metrics.request_error(span, e)
+            failure = exception_failure(e)
+            if failure.retryable:
+                continue
+            break
 
-    df_rakuten = pd.DataFrame(item_list)
-    if df_rakuten.empty:
-        df_rakuten = pd.DataFrame(columns=['itemCode', 'itemName', 'itemPrice', 'pointRate', 'postageFlag'])
+    failure.attempts = span.attempts
+    failure.history = history
+    metrics.finish(span, failure)
+    return [], 0, failure
 
-    df_sales = sale_list_mod[['商品コード', '通販単価', '送料区分名']].rename(columns={'商品コード': 'itemCode'})
-    df_merged = pd.merge(df_rakuten, df_sales, on='itemCode', how='left')
 
-    df_merged['itemPrice'] = df_merged['itemPrice'].replace(',', '', regex=True).astype(float)
-    df_merged['通販単価'] = df_merged['通販単価'].astype(float)
-    df_merged['差額'] = df_merged['itemPrice'] - df_merged['通販単価']
+def fetch_rakuten_catalog_page(session, metrics, low, high, page, interval=0, quota=None):
+    """楽天市場APIで店舗の商品を価格帯・ページ指定で取得する関数"""
+    params = {
+        "format": "json",
+        "shopCode": "tonya",
+        "applicationId": RAKUTEN_APP_ID,
+        "availability": 1,
+        "hits": 30,
+        "page": page,
+        "minPrice": low,
+        "maxPrice": high,
+        'sort': '+itemPrice',
+    }
 
-    df_merged['通販単価'] = df_merged['通販単価'].apply(lambda x: '{:,.0f}'.format(x) if not np.isnan(x) else '')
-    df_merged['itemPrice'] = df_merged['itemPrice'].apply(lambda x: '{:,.0f}'.format(x) if not np.isnan(x) else '')
-    df_merged['差額'] = df_merged['差額'].apply(lambda x: '{:,.0f}'.format(x) if not np.isnan(x) else '')
+    def parse_page(data):
+        return [_rakuten_item(item['Item']) for item in data.get('Items', [])], data.get('count', 0)
+
+    return _fetch_catalog_page(
+        session, metrics, RAKUTEN_API_URL, params, f"rakuten:{low}-{high}:{page}", parse_page, interval, quota
+    )
+
+
+def fetch_yahoo_catalog_page(session, metrics, low, high, page, interval=0, quota=None):
+    """Yahoo!ショッピングAPIで店舗の商品を価格帯・ページ指定で取得する関数"""
+    params = {
+        "appid": YAHOO_APP_ID,
+        "seller_id": "tonya",
+        "results": 50,
+        "start": (page - 1) * 50 + 1,
+        "price_from": low,
+        "price_to": high,
+        "sort": "+price",
+    }
+
+    def parse_page(data):
+        items = []
+        for hit in data.get("hits", []):
+            # 商品コードは「出店者ID_商品コード」の形式
+            item_code = str(hit.get("code", ""))
+            if item_code.startswith("tonya_"):
+                item_code = item_code[len("tonya_"):]
+            items.append({
+                "itemCode": item_code,
+                "itemName": hit.get("name", ""),
+                "itemPrice": hit.get("price", ""),
+                "pointRate": hit.get("point", {}).get("times", ""),
+                "postageFlag": hit.get("shipping", {}).get("name", ""),
+            })
+        return items, data.get("totalResultsAvailable", 0)
+
+    return _fetch_catalog_page(
+        session, metrics, YAHOO_API_URL, params, f"yahoo:{low}-{high}:{page}", parse_page, interval, quota
+    )
+
+
+# 検索APIごとのカタログ取得設定（1ページの件数, 1つの検索条件で取得できる最大件数）
+CATALOG_SOURCES = {
+    'rakuten': {'label': '楽天市場API', 'fetch_page': fetch_rakuten_catalog_page, 'page_size': 30, 'max_results': 3000},
+    'yahoo': {'label': 'Yahoo!ショッピングAPI', 'fetch_page': fetch_yahoo_catalog_page, 'page_size': 50, 'max_results': 1000},
+}
+
+
+# 店舗カタログの一括同期による取得
+def get_catalog_data(source, sale_list, metrics=None, reuse_catalog=False, spill=False):
+    """店舗の全商品（カタログ）を一括取得し、販売リストと照合する関数
+
+    商品コードごとに検索する代わりに、店舗の全商品を価格帯で分割したページ送りで列挙する。
+    リクエスト数は商品コード数ではなくカタログの件数 / 1ページの件数で決まる。
+    同期したカタログはローカルに保存し、reuse_catalog=True なら CATALOG_REUSE_HOURS 以内のものを再利用する。
+    spill=True の場合は、照合結果をファイルに書き出し、SpilledResult で返す（メモリ節約モード）。
+    """
+    config = CATALOG_SOURCES[source]
+    st.info(f"{config['label']}から店舗カタログの一括取得を開始します...")
+
+    sale_list_mod = expand_sale_list(sale_list)
+    # 取得できなかった商品とその理由（FetchFailure）を記録
+    not_found_reasons = {}
+    # リクエスト計測
+    metrics = metrics or fetch_metrics.FetchMetrics(source)
+
+    # プログレスバー
+    progress_bar, status_text = progress_elements()
+
+    catalog_info = catalog_sync.load_catalog_info(CATALOG_DB, source)
+    reusable = (
+        reuse_catalog and catalog_info is not None and catalog_info['complete']
+        and time.time() - catalog_info['synced_at'] < CATALOG_REUSE_HOURS * 3600
+    )
+    failed_bands = []
+    if reusable:
+        status_text.text("同期済みのカタログを使用します")
+        metrics.info['catalog'] = {**catalog_info, 'reused': True}
+    else:
+        session = get_http_session(source)
+        meter = api_quota.QuotaMeter(QUOTA_DB, source)
+        requested = []
+
+        def fetch_page(low, high, page):
+            # API制限を考慮して2件目以降は待機（1分30リクエスト = 2秒間隔）
+            interval = API_REQUEST_INTERVAL if requested else 0
+            requested.append(page)
+            return config['fetch_page'](session, metrics, low, high, page, interval, meter)
+
+        def on_page(low, high, page, total, collected):
+            pages = -(-min(total, config['max_results']) // config['page_size'])
+            progress_bar.progress(min(page / max(pages, 1), 1.0))
+            status_text.text(
+                f"カタログ取得中: 価格帯 {low:,}〜{high:,}円 {page}/{pages}ページ - 取得済み {collected}件"
+            )
+
+        items, failed_bands, stats = catalog_sync.enumerate_catalog(
+            fetch_page, config['page_size'], config['max_results'], on_page=on_page
+        )
+        close_quota_meter(meter, metrics)
+        # 一部の価格帯が取得できなかったカタログは再利用しない
+        catalog_sync.save_catalog(CATALOG_DB, source, items, complete=not failed_bands, requests=stats['requests'])
+        metrics.info['catalog'] = {
+            **stats, 'items': len(items), 'complete': not failed_bands, 'reused': False,
+            'failed_bands': [[low, high, failure.metric_key] for low, high, failure in failed_bands],
+        }
+
+    with metrics.run_phase('merge'):
+        df_items, missing_codes = catalog_sync.match_catalog(sale_list_mod, catalog_sync.load_catalog(CATALOG_DB, source))
+        for code in missing_codes:
+            if failed_bands:
+                # 取得できなかった価格帯に含まれている可能性があるため、未掲載とは判定しない
+                failure = failed_bands[0][2]
+                not_found_reasons[code] = FetchFailure(
+                    failure.kind, detail="カタログの一部が取得できなかったため未確認", status=failure.status
+                )
+            else:
+                not_found_reasons[code] = FetchFailure(NOT_LISTED, detail="店舗カタログに商品がありませんでした")
+        df_merged = merge_marketplace_items(df_items, sale_list_mod)
+        if spill:
+            # カタログはSQLiteに保存済みのため、照合結果だけを書き出してセッション状態には保持しない
+            df_merged = write_spilled_result(source, [df_merged], record_spool.MARKETPLACE_RESULT_SCHEMA)
 
-    cols = ['itemCode', 'itemName', 'itemPrice', 'pointRate', 'postageFlag', '通販単価', '差額', '送料区分名']
-    df_merged = df_merged[cols]
-    
-    # プログレスバーを完了
     progress_bar.progress(1.0)
-    status_text.text("楽天市場API取得完了！")
-    
-    # 取得できなかった商品の理由をセッション状態に保存
-    st.session_state.not_found_reasons_rakuten = not_found_reasons
-    
+    status_text.text(f"{config['label']}カタログ取得完了！")
+
+    # 取得できなかった商品の理由と計測結果をセッション状態に保存
+    metrics.close()
+    st.session_state[f'not_found_reasons_{source}'] = not_found_reasons
+    st.session_state[f'fetch_metrics_{source}'] = metrics
+
     return df_merged
 
-# Yahoo!ショッピングAPI取得関数
-def get_yahoo_data(sale_list):
-    """Yahoo!ショッピングAPIから商品情報を取得する関数"""
-    st.info("Yahoo!ショッピングAPIからのデータ取得を開始します...")
-    
-    # Yahoo!ショッピングAPIのエンドポイント
-    # 制限内容: 1アプリケーションIDあたり1日50,000回
-    # 商品検索(v3)APIは1分30リクエスト（2秒間隔でリクエスト）
-    YAHOO_API_URL = "https://shopping.yahooapis.jp/ShoppingWebService/V3/itemSearch"
-    YAHOO_APP_ID = "dj00aiZpPTBCMkFRMnZSNU1sSyZzPWNvbnN1bWVyc2VjcmV0Jng9ZDQ-"
-    
-    # 商品コード拡張（楽天と同じロジック）
-    cat1 = sale_list[sale_list['大分類コード'] == 1]
-    cat2 = sale_list[sale_list['大分類コード'] == 2]
-    other = sale_list[~sale_list['大分類コード'].isin([1, 2])]
 
-    rows = []
-    for _, row in cat1.iterrows():
-        code = str(row['商品コード'])
-        
-        # 販売単価1-5の値を安全に取得
-        def safe_get_price(price_value):
-            try:
-                if pd.isna(price_value) or price_value == '' or price_value is None:
-                    return 0
-                return float(str(price_value).replace(',', ''))
-            except (ValueError, TypeError):
-                return 0
-        
-        sale_price1 = safe_get_price(row.get('販売単価1', 0))
-        sale_price2 = safe_get_price(row.get('販売単価2', 0))
-        sale_price3 = safe_get_price(row.get('販売単価3', 0))
-        sale_price4 = safe_get_price(row.get('販売単価4', 0))
-        sale_price5 = safe_get_price(row.get('販売単価5', 0))
-        
-        # 販売単価1-5が0でない場合の計算
-        if sale_price1 > 0 or sale_price2 > 0 or sale_price3 > 0 or sale_price4 > 0 or sale_price5 > 0:
-            # -50と-100は販売単価1
-            for suf in ['-50', '-100']:
-                r = row.copy()
-                r['商品コード'] = code + suf
-                r['通販単価'] = float(str(sale_price1).replace(',', '')) if sale_price1 > 0 else np.nan
-                rows.append(r)
-            
-            # -200は販売単価2×2
-            r = row.copy()
-            r['商品コード'] = code + '-200'
-            r['通販単価'] = float(str(sale_price2).replace(',', '')) * 2 if sale_price2 > 0 else np.nan
-            rows.append(r)
-            
-            # -300は販売単価3×3
-            r = row.copy()
-            r['商品コード'] = code + '-300'
-            r['通販単価'] = float(str(sale_price3).replace(',', '')) * 3 if sale_price3 > 0 else np.nan
-            rows.append(r)
-            
-            # -400は販売単価4×4
-            r = row.copy()
-            r['商品コード'] = code + '-400'
-            r['通販単価'] = float(str(sale_price4).replace(',', '')) * 4 if sale_price4 > 0 else np.nan
-            rows.append(r)
-            
-            # -500は販売単価5×5
-            r = row.copy()
-            r['商品コード'] = code + '-500'
-            r['通販単価'] = float(str(sale_price5).replace(',', '')) * 5 if sale_price5 > 0 else np.nan
-            rows.append(r)
-        else:
-            # 従来の計算方法（販売単価1-5がすべて0の場合）
-            for i, suf in enumerate(['-100', '-200', '-300', '-400', '-500'], 1):
-                r = row.copy()
-                r['商品コード'] = code + suf
-                r['通販単価'] = float(str(row['通販単価']).replace(',', '')) * i if row['通販単価'] else np.nan
-                rows.append(r)
-    
-    for _, row in cat2.iterrows():
-        code = str(row['商品コード'])
-        r = row.copy()
-        r['商品コード'] = code + '-50'
-        r['通販単価'] = float(str(row['通販単価']).replace(',', '')) if row['通販単価'] else np.nan
-        rows.append(r)
-    for _, row in other.iterrows():
-        r = row.copy()
-        r['商品コード'] = str(row['商品コード'])
-        r['通販単価'] = float(str(row['通販単価']).replace(',', '')) if row['通販単価'] else np.nan
-        rows.append(r)
-    sale_list_mod = pd.DataFrame(rows)
-
-    yahoo_item_codes = sale_list_mod['商品コード'].astype(str).unique()
-    yahoo_items = []
-    # 取得できなかった商品とその理由を記録
-    not_found_reasons = {}
-    
-    # プログレスバー
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    total_codes = len(yahoo_item_codes)
-    
-    for idx, code in enumerate(yahoo_item_codes):
-        # 進捗更新
-        progress = (idx + 1) / total_codes
-        progress_bar.progress(progress)
-        status_text.text(f"処理中: {idx + 1}/{total_codes} - 商品コード: {code}")
-        
-        params = {
-            "appid": YAHOO_APP_ID,
-            "query": code,
-            "hits": 30,  # 複数ヒットに対応するため30件まで取得
-            "seller_id": "tonya",  # 出店者IDを指定
-        }
-        # リトライ処理を追加
-        max_retries = 3
-        retry_count = 0
-        success = False
-        found = False
-        
-        while retry_count < max_retries and not success:
-            try:
-                res = requests.get(YAHOO_API_URL, params=params)
-                
-                # 429エラー（Too Many Requests）の場合は待機時間を延長
-                if res.status_code == 429:
-                    wait_time = (retry_count + 1) * 5  # 5秒、10秒、15秒と段階的に延長
-                    st.warning(f"API制限に達しました。{wait_time}秒待機します...")
-                    time.sleep(wait_time)
-                    retry_count += 1
-                    continue
-                
-                if res.status_code != 200:
-                    not_found_reasons[code] = f"HTTPエラー: {res.status_code}"
-                    retry_count += 1
-                    continue
-                
-                res.raise_for_status()
-                data = res.json()
-                hits = data.get("hits", [])
-                if hits:
-                    # 通販単価を取得（sale_list_modから該当商品の通販単価を取得）
-                    target_price = None
-                    matching_row = sale_list_mod[sale_list_mod['商品コード'] == code]
-                    if not matching_row.empty:
-                        target_price = matching_row.iloc[0]['通販単価']
-                    
-                    # 通販単価と一致する商品を探す
-                    selected_item = None
-                    if target_price is not None:
-                        for item in hits:
-                            item_price = item.get("price", "")
-                            if item_price:
-                                try:
-                                    # 価格を数値に変換して比較
-                                    item_price_num = float(str(item_price).replace(',', ''))
-                                    target_price_num = float(str(target_price).replace(',', ''))
-                                    if abs(item_price_num - target_price_num) < 1:  # 1円以内の差なら一致とみなす
-                                        selected_item = item
-                                        break
-                                except (ValueError, TypeError):
-                                    continue
-                    
-                    # 通販単価と一致する商品がない場合は最初の商品を使用
-                    if selected_item is None:
-                        selected_item = hits[0]
-                        if target_price is not None:
-                            st.info(f"商品コード: {code} - 通販単価と一致する商品が見つかりません。最初の商品を選択します。")
-                    
-                    shipping_name = ""
-                    if "shipping" in selected_item and "name" in selected_item["shipping"]:
-                        shipping_name = selected_item["shipping"]["name"]
-                    
-                    yahoo_items.append({
-                        "itemCode": code,
-                        "itemName": selected_item.get("name", ""),
-                        "itemPrice": selected_item.get("price", ""),
-                        "pointRate": selected_item.get("point", {}).get("times", ""),
-                        "postageFlag": shipping_name,
-                    })
-                    found = True
-                else:
-                    not_found_reasons[code] = "APIで商品が見つかりませんでした（ヒットなし）"
-                success = True
-                
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 429:
-                    wait_time = (retry_count + 1) * 5
-                    st.warning(f"API制限に達しました。{wait_time}秒待機します...")
-                    time.sleep(wait_time)
-                    retry_count += 1
-                    continue
-                else:
-                    not_found_reasons[code] = f"HTTPエラー: {e.response.status_code}"
-                    retry_count += 1
-                    continue
-            except requests.exceptions.RequestException as e:
-                not_found_reasons[code] = f"リクエストエラー: {str(e)}"
-                retry_count += 1
-                continue
-            except Exception as e:
-                not_found_reasons[code] = f"エラー: {str(e)}"
-                retry_count += 1
-                continue
-        
-        if not success and retry_count >= max_retries:
-            if code not in not_found_reasons:
-                not_found_reasons[code] = "最大リトライ回数に達しました"
-        
-        if not found and code not in not_found_reasons:
-            not_found_reasons[code] = "商品が見つかりませんでした"
-        
-        # API制限を考慮して待機（Yahoo!ショッピングAPI: 1分30リクエスト = 2秒間隔）
-        time.sleep(2.1)
+CATALOG_FETCH_MODE = "店舗カタログを一括取得"
+SAMPLE_FETCH_MODE = "抽出して確認（サンプリング）"
+
+
+def render_fetch_mode_options(source):
+    """楽天市場・Yahoo!ショッピングの取得方式の選択を表示する関数"""
+    fetch_mode = st.sidebar.radio(
+        "取得方式：",
+        ["商品コードごとに検索", CATALOG_FETCH_MODE, SAMPLE_FETCH_MODE],
+        key=f"{source}_fetch_mode",
+        help="商品数が多い場合は、店舗の全商品をページ送りで一括取得する方がリクエスト数が少なくなります。"
+             "価格がおおむね一致しているかだけを確認する場合は、一部の商品を抽出して不一致率を推定できます。"
+    )
+    reuse_catalog = False
+    if fetch_mode == CATALOG_FETCH_MODE:
+        catalog_info = catalog_sync.load_catalog_info(CATALOG_DB, source)
+        if catalog_info is not None:
+            synced_at = dt.datetime.fromtimestamp(catalog_info['synced_at']).strftime('%Y-%m-%d %H:%M')
+            st.sidebar.caption(
+                f"前回の同期: {synced_at}（{catalog_info['items']:,}件・{catalog_info['requests']}リクエスト"
+                f"{'' if catalog_info['complete'] else '・一部取得失敗'}）"
+            )
+        reuse_catalog = st.sidebar.checkbox(
+            f"{CATALOG_REUSE_HOURS}時間以内に同期したカタログを再利用する", key=f"{source}_reuse_catalog"
+        )
+    return fetch_mode, reuse_catalog
+
+
+def format_duration(seconds):
+    """所要時間を「n時間n分」の形式で返す関数"""
+    minutes = math.ceil(seconds / 60)
+    if minutes < 60:
+        return f"{minutes}分"
+    return f"{minutes // 60}時間{minutes % 60}分"
+
+
+def expanded_code_count(sale_list):
+    """拡張後の商品コード数（商品コードごとに検索する場合のAPIの呼び出し対象の件数）を返す関数"""
+    return result_view(
+        'expanded_code_count', (sale_list,),
+        lambda: expand_sale_list(sale_list)['商品コード'].astype(str).nunique()
+    )
+
+
+def render_quota_plan(source, fetch_mode, reuse_catalog, digest):
+    """取得前にAPI呼び出し回数・所要時間・1日の上限回数の使用量の見積もりを表示する関数
+
+    1日の上限回数を超える取得は日ごとのチャンクに分割し、実行するチャンクを選択する。
+    戻り値: 選択したチャンク（{'index', 'count', 'plan_key', 'size', 'start', 'end'}）。分割しない場合はNone
+    """
+    if fetch_mode == SAMPLE_FETCH_MODE:
+        # 抽出して確認する取得は render_sample_options で見積もる
+        return None
+    if fetch_mode == CATALOG_FETCH_MODE:
+        # カタログの一括取得は前回の同期のリクエスト数で見積もる（再利用できる場合は呼び出さない）
+        catalog_info = catalog_sync.load_catalog_info(CATALOG_DB, source)
+        reusable = (
+            reuse_catalog and catalog_info is not None and catalog_info['complete']
+            and time.time() - catalog_info['synced_at'] < CATALOG_REUSE_HOURS * 3600
+        )
+        if catalog_info is None or reusable:
+            calls = 0
+        else:
+            calls = catalog_info['requests']
+        codes, per_code = calls, 1.0
+    else:
+        codes = expanded_code_count(st.session_state.sale_list)
+        per_code = api_quota.calls_per_code(QUOTA_DB, source)
+    # 途中まで実行済みの分割がある場合は同じ区切りで続きを見積もる
+    plan_key = f"{digest}:{codes}"
+    finished, chunk_size = (
+        api_quota.done_chunks(QUOTA_DB, source, plan_key) if fetch_mode != CATALOG_FETCH_MODE else ({}, None)
+    )
+    plan = api_quota.plan_job(
+        source, codes, per_code, api_quota.usage_today(QUOTA_DB, source), API_REQUEST_INTERVAL,
+        codes_per_chunk=chunk_size
+    )
+
+    with st.sidebar.expander("API呼び出し回数の見積もり", expanded=len(plan['chunks']) > 1):
+        if fetch_mode == CATALOG_FETCH_MODE and codes == 0:
+            st.caption("同期済みのカタログがないため、呼び出し回数は取得してみるまで分かりません。" if catalog_info is None
+                       else "同期済みのカタログを再利用するため、APIは呼び出しません。")
+        else:
+            st.markdown(
+                f"- 呼び出し回数: 約{plan['calls']:,}回"
+                + (f"（{plan['codes']:,}件 × {plan['per_code']:.2f}回）" if fetch_mode != CATALOG_FETCH_MODE else "")
+                + f"\n- 所要時間: 約{format_duration(plan['duration_s'])}（{plan['interval_s']:.1f}秒間隔）"
+            )
+        if plan['daily'] is not None:
+            st.markdown(
+                f"- 今日の使用量: {plan['used_today']:,} / {plan['daily']:,}回"
+                f"（残り{max(plan['remaining_today'], 0):,}回・日本時間0時にリセット）"
+            )
+        if plan['interval_too_short']:
+            st.warning(
+                f"リクエスト間隔（{API_REQUEST_INTERVAL}秒）が1分あたりの上限"
+                f"（{api_quota.API_QUOTAS[source]['per_minute']}回）より短く、制限エラーになる可能性があります。"
+            )
+        if fetch_mode == CATALOG_FETCH_MODE or len(plan['chunks']) <= 1:
+            if plan['remaining_today'] is not None and plan['calls'] > plan['remaining_today']:
+                st.warning("今日の残り回数を超えるため、上限に達した時点で残りは取得しません。")
+            return None
+
+        # 1日の上限回数を超える場合はチャンクに分割して日ごとに実行する
+        st.warning(f"1日の上限回数を超えるため、{len(plan['chunks'])}回（1日1回）に分けて取得します。")
+        st.dataframe(pd.DataFrame([
+            {
+                'チャンク': i + 1,
+                '商品コード': f"{chunk['start'] + 1:,}〜{chunk['end']:,}",
+                '呼び出し回数': chunk['calls'],
+                '実行可能': dt.datetime.fromtimestamp(chunk['not_before'], api_quota.QUOTA_TZ).strftime('%m/%d'),
+                '状態': '完了' if i in finished else '未実行',
+            }
+            for i, chunk in enumerate(plan['chunks'])
+        ]), hide_index=True, use_container_width=True)
+        pending = [i for i in range(len(plan['chunks'])) if i not in finished]
+        index = st.selectbox(
+            "実行するチャンク", range(len(plan['chunks'])), index=pending[0] if pending else 0,
+            format_func=lambda i: f"{i + 1}/{len(plan['chunks'])}{'（完了）' if i in finished else ''}",
+            # チャンクが完了したら次の未実行のチャンクを選び直す
+            key=f"{source}_quota_chunk_{plan_key}_{len(finished)}"
+        )
+    chunk = plan['chunks'][index]
+    return {'index': index, 'count': len(plan['chunks']), 'plan_key': plan_key, 'size': plan['codes_per_chunk'],
+            'start': chunk['start'], 'end': chunk['end']}
+
+
+def render_sample_options(source):
+    """抽出して確認する取得の抽出件数・抽出のシードと所要時間の見積もりを表示する関数"""
+    codes = expanded_code_count(st.session_state.sale_list)
+    sample_size = st.sidebar.number_input(
+        "抽出件数", min_value=10, max_value=max(10, codes), value=min(SAMPLE_AUDIT_SIZE, max(10, codes)), step=50,
+        key=f"{source}_sample_size",
+        help=f"大分類コード・送料区分名・価格帯の層ごとに商品数に比例して無作為抽出します"
+             f"（各層から最低{sampling_audit.MIN_PER_STRATUM}件）。"
+    )
+    seed = st.sidebar.number_input(
+        "抽出のシード", min_value=0, value=int(dt.date.today().strftime('%Y%m%d')), key=f"{source}_sample_seed",
+        help="同じ値なら同じ商品コードを抽出します（初期値は今日の日付）。"
+    )
+    per_code = api_quota.calls_per_code(QUOTA_DB, source)
+    st.sidebar.caption(
+        f"所要時間: 約{format_duration(sample_size * per_code * API_REQUEST_INTERVAL)}"
+        f"（全{codes:,}件の場合は約{format_duration(codes * per_code * API_REQUEST_INTERVAL)}）"
+    )
+    return {'size': int(sample_size), 'seed': int(seed)}
+
+
+# 同じ内容の取得処理の共有
+def run_shared_job(key, label, result_key, state_keys, fetch, refresh=False):
+    """同じ内容（key）の取得処理が実行中・実行済みなら結果を共有し、なければ fetch() を実行する関数
 
-    # データフレーム化
-    df_yahoo = pd.DataFrame(yahoo_items)
-    if df_yahoo.empty:
-        st.warning("Yahoo!ショッピングAPIから商品情報が取得できませんでした。")
-        df_yahoo = pd.DataFrame(columns=['itemCode', 'itemName', 'itemPrice', 'pointRate', 'postageFlag'])
+    key: (取得先, 販売リストのハッシュ値, 結果が変わるオプション) のタプル
+    取得結果を result_key に、fetch() が保存した state_keys のセッション状態とあわせて保存する。
+    戻り値: 取得結果を保存できたかどうか
+    """
+    registry = get_job_registry()
+    job, owner = registry.claim(key, refresh=refresh)
+    if owner:
+        def run():
+            result = fetch()
+            return {result_key: result, **{state_key: st.session_state[state_key] for state_key in state_keys}}
 
-    # 楽天と同様に在庫データとマージ
-    df_yahoo_sales = sale_list_mod[['商品コード', '通販単価', '送料区分名']].rename(columns={'商品コード': 'itemCode'})
-    df_yahoo_merged = pd.merge(df_yahoo, df_yahoo_sales, on='itemCode', how='left')
+        registry.run(job, run)
+    elif job.running:
+        # 他のセッションで実行中の取得処理に合流し、完了を待つ
+        st.info(f"同じ販売リスト・条件の{label}を別のセッションで実行中のため、完了を待って結果を共有します。")
+        progress_bar = st.progress(job.progress)
+        status_text = st.empty()
+        while not job.wait(JOB_POLL_INTERVAL):
+            progress_bar.progress(job.progress)
+            status_text.text(f"（共有）{job.status}")
+        if job.error is not None:
+            st.error(f"共有していた{label}が中断されました。もう一度実行してください。")
+            return False
+        st.session_state.shared_job_notice = f"別のセッションで実行中だった{label}の結果を共有しています。"
+    else:
+        minutes = (time.time() - job.finished_at) / 60
+        st.session_state.shared_job_notice = (
+            f"{minutes:.0f}分前に取得した{label}の結果を共有しています"
+            f"（{JOB_RESULT_TTL_MINUTES:.0f}分以内の同じ販売リスト・条件の取得は再利用します）。"
+        )
 
-    # 価格の整形・差額計算
-    df_yahoo_merged['itemPrice'] = df_yahoo_merged['itemPrice'].replace(',', '', regex=True).astype(float)
-    df_yahoo_merged['通販単価'] = df_yahoo_merged['通販単価'].astype(float)
-    df_yahoo_merged['差額'] = df_yahoo_merged['itemPrice'] - df_yahoo_merged['通販単価']
+    registry.hold(job, st.session_state.session_key)
+    for state_key in state_keys:
+        st.session_state[state_key] = job.result[state_key]
+    store_result(result_key, job.result[result_key])
+    return True
 
-    df_yahoo_merged['通販単価'] = df_yahoo_merged['通販単価'].apply(lambda x: '{:,.0f}'.format(x) if not np.isnan(x) else '')
-    df_yahoo_merged['itemPrice'] = df_yahoo_merged['itemPrice'].apply(lambda x: '{:,.0f}'.format(x) if not np.isnan(x) else '')
-    df_yahoo_merged['差額'] = df_yahoo_merged['差額'].apply(lambda x: '{:,.0f}'.format(x) if not np.isnan(x) else '')
 
-    # カラム順を楽天と揃える
-    cols = ['itemCode', 'itemName', 'itemPrice', 'pointRate', 'postageFlag', '通販単価', '差額', '送料区分名']
-    df_yahoo_merged = df_yahoo_merged[cols]
-    
-    # プログレスバーを完了
-    progress_bar.progress(1.0)
-    status_text.text("Yahoo!ショッピングAPI取得完了！")
-    
-    # 取得できなかった商品の理由をセッション状態に保存
-    st.session_state.not_found_reasons_yahoo = not_found_reasons
-    
-    return df_yahoo_merged
+# ウォッチリスト監視
+def render_watchlist_monitor(max_concurrency, streamed):
+    """キャンペーン中の重点商品を一定間隔で監視し、変化（価格・在庫・アイコン）を表示する関数"""
+    monitor = get_watch_monitor()
+    with st.sidebar.expander("👀 ウォッチリスト監視", expanded=monitor.running):
+        st.caption(
+            "選んだ商品だけを一定間隔で取得し、前回から価格・在庫・アイコンが変わった商品をイベントとして記録します。"
+            "変化のないページは受信・解析を省略します（304・内容のハッシュ値）。"
+        )
+        codes_text = st.text_area(
+            "監視する商品コード（1行に1件）", value='\n'.join(monitor.codes), key="watch_codes", height=120
+        )
+        interval_minutes = st.number_input(
+            "監視の間隔（分）", min_value=1, max_value=120, value=max(1, int(monitor.interval // 60)), key="watch_interval"
+        )
+        webhook_url = st.text_input(
+            "イベントの送信先URL（任意）", value=watchlist_monitor.WATCH_WEBHOOK_URL, key="watch_webhook",
+            help=f"指定しない場合は {watchlist_monitor.WATCH_EVENT_LOG} への記録のみ行います。"
+        )
+        codes = [line.strip() for line in codes_text.splitlines() if line.strip()]
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("監視を開始", disabled=not codes, key="watch_start", use_container_width=True):
+                monitor.start(
+                    codes, interval=interval_minutes * 60, webhook_url=webhook_url,
+                    max_concurrency=max_concurrency, streamed=streamed
+                )
+        with col2:
+            if st.button("停止", disabled=not monitor.running, key="watch_stop", use_container_width=True):
+                monitor.stop()
+
+        if monitor.running:
+            st.success(f"{len(monitor.codes)}件を{monitor.interval / 60:.0f}分間隔で監視中")
+        if monitor.error:
+            st.error(f"監視でエラーが発生しました: {monitor.error}")
+        if monitor.cycles:
+            cycle = monitor.cycles[-1]
+            checked_at = dt.datetime.fromtimestamp(cycle['started']).strftime('%H:%M:%S')
+            st.markdown(
+                f"**前回の監視** {checked_at}（{cycle['duration_s']:.1f}秒）: 変化 {cycle['events']}件\n\n"
+                f"304 {cycle['not_modified']}件・変化なし {cycle['unchanged']}件・解析 {cycle['parsed']}件・"
+                f"失敗 {cycle['failed']}件・受信 {cycle['wire_bytes'] / 1024:,.0f}KB"
+            )
+            if cycle['webhook_errors']:
+                st.warning(f"イベントを送信できなかった回数: {cycle['webhook_errors']}回（ログには記録済み）")
+        events = watchlist_monitor.recent_events(monitor.log_path, 50)
+        if events:
+            st.dataframe(pd.DataFrame([
+                {
+                    '時刻': dt.datetime.fromtimestamp(event['time']).strftime('%m/%d %H:%M'),
+                    '商品コード': event['code'],
+                    '変化': event['message'],
+                }
+                for event in events
+            ]), hide_index=True, use_container_width=True)
+        st.button("表示を更新", key="watch_refresh", use_container_width=True)
+
 
 # サイドバー
 def render_sidebar():
@@ -680,6 +1474,36 @@ def render_sidebar():
                  1 if st.session_state.selected_data_source == "楽天市場API取得" else 2,
             key="data_source_radio"
         )
+        spill = st.sidebar.checkbox(
+            "メモリ節約モード", value=False, key="spill_to_disk",
+            help="取得した商品情報を一定件数ごとにファイル（Arrow形式）へ書き出し、結合もファイルから行います。"
+                 "件数が多い場合にサーバーのメモリ使用量を抑えられます（表示は必要な行だけをファイルから読み込みます）。"
+        )
+        prioritize = st.sidebar.checkbox(
+            "重要な商品から先に取得する", value=True, key="prioritize_fetch",
+            help="前回差額があった・取得に失敗した商品、販売リストで変更された商品、自社サイトでSALE・期間限定の商品、"
+                 "通販単価の高い商品の順に取得します。途中で止まった場合も重要な商品から確認できます"
+                 "（結果の並び順は販売リストのまま。分割した取得ではチャンクの中で並べ替えます）。"
+        )
+        refresh = st.sidebar.checkbox(
+            "共有済みの結果を使わずに取得し直す", value=False, key="job_refresh",
+            help=f"同じ販売リスト・条件の取得結果は{JOB_RESULT_TTL_MINUTES:.0f}分間、他のセッションと共有します。"
+                 "実行中の同じ取得には、この設定に関わらず合流します。"
+        )
+        profile = st.sidebar.checkbox(
+            "プロファイルを取得する", value=False, key="profile_runs",
+            help="取得処理と画面表示（スクリプト再実行）の実行中に、呼び出し履歴を一定間隔で記録します（サンプリング方式）。"
+                 "結果は speedscope 形式・フレームグラフ用の folded 形式でダウンロードでき、"
+                 f"{PROFILE_DIR} にも保存します。取得処理は共有済みの結果を使わずに実行します。"
+        )
+        if profile:
+            st.sidebar.checkbox(
+                "メモリの割り当ても記録する（tracemalloc）", value=True, key="profile_memory",
+                help="開始時と終了時のスナップショットの差分から、割り当て量の多い行を記録します。処理は遅くなります。"
+            )
+        # プロファイルは実際に実行した取得処理のものを記録する
+        refresh = refresh or profile
+        digest = sale_list_digest(st.session_state.sale_list)
         
         # セッション状態に選択を保存（ボタンが押されたときのみ更新されるようにするため、ここでは更新しない）
         
@@ -690,62 +1514,787 @@ def render_sidebar():
             st.sidebar.subheader("🏪 自社サイトスクレイピング")
             st.sidebar.markdown("自社サイトから商品情報を取得します。")
             
+            # 同時接続数（レイテンシ・エラー状況に応じて範囲内で自動調整）
+            with st.sidebar.expander("同時接続数の設定"):
+                min_concurrency = st.number_input("最小同時接続数", min_value=1, max_value=32, value=1, key="own_site_min_concurrency")
+                max_concurrency = st.number_input("最大同時接続数", min_value=1, max_value=32, value=4, key="own_site_max_concurrency")
+                st.caption("応答が速くエラーがない間は同時接続数を1ずつ増やし、5xx・タイムアウト・レイテンシ上昇を検知すると半減させます。")
+            streamed = st.sidebar.checkbox(
+                "商品情報の部分だけ受信する", value=True, key="own_site_streamed",
+                help="圧縮転送で受信し、商品詳細・ポイント・在庫のブロックがそろった時点でページの残りの受信を打ち切ります。"
+            )
+            skip_unchanged = st.sidebar.checkbox(
+                "変化のないページは解析を省略する", value=True, key="own_site_skip_unchanged",
+                help="商品ページの商品詳細・ポイント・在庫の部分のハッシュ値（毎回変わるトークン等を除く）を保存し、"
+                     "前回と同じページは解析せずに前回の商品情報を使います（分散ワーカーでの取得には適用しません）。"
+            )
+            distributed = st.sidebar.checkbox(
+                "分散ワーカーで取得する", value=False, key="own_site_distributed",
+                help="商品コードを作業単位に分けてキューに登録し、own_site_worker.py で起動したワーカー"
+                     "（他のマシンを含む）で取得します。停止したワーカーの作業単位は、リースの期限切れ後に他のワーカーが取り直します。"
+            )
+            if distributed:
+                with st.sidebar.expander("分散ワーカーの設定", expanded=True):
+                    queue_path = st.text_input(
+                        "キューのファイル", value=WORK_QUEUE_DB, key="work_queue_path",
+                        help="ワーカーと同じファイルを指定します（他のマシンのワーカーを使う場合は共有ディレクトリに置きます）。"
+                    )
+                    unit_size = st.number_input(
+                        "1作業単位の商品数", min_value=10, max_value=5000, value=WORK_QUEUE_UNIT_SIZE, step=50,
+                        key="work_queue_unit_size"
+                    )
+                    local_workers = st.number_input(
+                        "このサーバーで動かすワーカー数", min_value=0, max_value=8, value=1, key="work_queue_local_workers",
+                        help="同時接続数の設定は、このサーバーのワーカーごとに適用します。"
+                    )
+                    try:
+                        workers = work_queue.active_workers(queue_path, WORKER_ACTIVE_SECONDS)
+                        st.caption(f"接続中のワーカー: {len(workers)}台" + (f"（{', '.join(workers)}）" if workers else ""))
+                    except Exception as e:
+                        st.warning(f"キューのファイルを開けません: {e}")
+                    st.caption("他のマシンでは次のコマンドでワーカーを起動します。")
+                    st.code(f"python own_site_worker.py --queue {queue_path} --max-concurrency {int(max_concurrency)}")
+            
             if st.sidebar.button("スクレイピング開始", type="primary", use_container_width=True):
-                # 他のデータソースの結果をクリア
-                st.session_state.df_rakuten = None
-                st.session_state.df_yahoo = None
-                st.session_state.not_found_reasons_rakuten = {}
-                st.session_state.not_found_reasons_yahoo = {}
+                # 他のデータソースの結果は価格比較のため保持する
                 # 選択されたデータソースを更新
                 st.session_state.selected_data_source = "自社サイトスクレイピング"
                 
-                df_result = scrape_own_site(st.session_state.sale_list)
-                st.session_state.df_onlinestore = df_result
+                if distributed:
+                    fetch = lambda: scrape_own_site_distributed(
+                        st.session_state.sale_list,
+                        queue_path,
+                        int(unit_size),
+                        local_workers=int(local_workers),
+                        max_concurrency=max(int(min_concurrency), int(max_concurrency)),
+                        streamed=streamed,
+                        spill=spill
+                    )
+                else:
+                    fetch = lambda: scrape_own_site(
+                        st.session_state.sale_list,
+                        min_concurrency=int(min_concurrency),
+                        max_concurrency=max(int(min_concurrency), int(max_concurrency)),
+                        streamed=streamed,
+                        spill=spill,
+                        skip_unchanged=skip_unchanged,
+                        prioritize=prioritize
+                    )
+                # 同時接続数・部分受信・分散ワーカー・解析の省略・取得の順番は取得結果を変えないため、共有のキーには含めない
+                shared = run_shared_job(
+                    ('own_site', digest, spill), "自社サイトのスクレイピング", 'df_onlinestore',
+                    ['not_found_reasons_onlinestore', 'fetch_metrics_onlinestore'],
+                    lambda: profiled('own_site', fetch), refresh=refresh
+                )
                 
-                # メインエリアに結果を表示するためにリダイレクト
-                st.rerun()
+                # メインエリアに結果を表示するためにリダイレクト（共有していた取得が中断された場合はエラーを表示したままにする）
+                if shared:
+                    st.rerun()
+
+            render_watchlist_monitor(max(int(min_concurrency), int(max_concurrency)), streamed)
         
         elif data_source == "楽天市場API取得":
             st.sidebar.subheader("🛒 楽天市場API取得")
             st.sidebar.markdown("楽天市場APIから商品情報を取得します。")
+            fetch_mode, reuse_catalog = render_fetch_mode_options('rakuten')
+            chunk = render_quota_plan('rakuten', fetch_mode, reuse_catalog, digest)
+            sample = render_sample_options('rakuten') if fetch_mode == SAMPLE_FETCH_MODE else None
             
             if st.sidebar.button("API取得開始", type="primary", use_container_width=True):
-                # 他のデータソースの結果をクリア
-                st.session_state.df_onlinestore = None
-                st.session_state.df_yahoo = None
-                st.session_state.not_found_reasons_onlinestore = {}
-                st.session_state.not_found_reasons_yahoo = {}
+                # 他のデータソースの結果は価格比較のため保持する
                 # 選択されたデータソースを更新
                 st.session_state.selected_data_source = "楽天市場API取得"
                 
-                df_result = get_rakuten_data(st.session_state.sale_list)
-                st.session_state.df_rakuten = df_result
+                if fetch_mode == CATALOG_FETCH_MODE:
+                    job_key = ('rakuten', 'catalog', digest, reuse_catalog, spill)
+                    fetch = lambda: get_catalog_data(
+                        'rakuten', st.session_state.sale_list, reuse_catalog=reuse_catalog, spill=spill
+                    )
+                elif fetch_mode == SAMPLE_FETCH_MODE:
+                    job_key = ('rakuten', 'sample', digest, sample['size'], sample['seed'])
+                    fetch = lambda: get_sample_audit('rakuten', st.session_state.sale_list, sample['size'], sample['seed'])
+                else:
+                    job_key = ('rakuten', 'per_code', digest, spill, chunk and (chunk['index'], chunk['size']))
+                    fetch = lambda: get_rakuten_data(
+                        st.session_state.sale_list, spill=spill, chunk=chunk, prioritize=prioritize
+                    )
+                # 抽出して確認した推定は、抽出して確認する取得の結果にだけ表示する
+                st.session_state.sample_audit_rakuten = None
+                shared = run_shared_job(
+                    job_key, "楽天市場API取得", 'df_rakuten',
+                    ['not_found_reasons_rakuten', 'fetch_metrics_rakuten', 'sample_audit_rakuten'],
+                    lambda: profiled('rakuten', fetch), refresh=refresh
+                )
                 
-                # メインエリアに結果を表示するためにリダイレクト
-                st.rerun()
+                # メインエリアに結果を表示するためにリダイレクト（共有していた取得が中断された場合はエラーを表示したままにする）
+                if shared:
+                    st.rerun()
         
         elif data_source == "Yahoo!ショッピングAPI取得":
             st.sidebar.subheader("🛍️ Yahoo!ショッピングAPI取得")
             st.sidebar.markdown("Yahoo!ショッピングAPIから商品情報を取得します。")
             st.sidebar.info("⚠️ **API制限**: 1分30リクエスト（約2秒間隔）\n\n処理に時間がかかります。")
+            fetch_mode, reuse_catalog = render_fetch_mode_options('yahoo')
+            chunk = render_quota_plan('yahoo', fetch_mode, reuse_catalog, digest)
+            sample = render_sample_options('yahoo') if fetch_mode == SAMPLE_FETCH_MODE else None
             
             if st.sidebar.button("Yahoo!API取得開始", type="primary", use_container_width=True):
-                # 他のデータソースの結果をクリア
-                st.session_state.df_onlinestore = None
-                st.session_state.df_rakuten = None
-                st.session_state.not_found_reasons_onlinestore = {}
-                st.session_state.not_found_reasons_rakuten = {}
+                # 他のデータソースの結果は価格比較のため保持する
                 # 選択されたデータソースを更新
                 st.session_state.selected_data_source = "Yahoo!ショッピングAPI取得"
                 
-                df_result = get_yahoo_data(st.session_state.sale_list)
-                st.session_state.df_yahoo = df_result
+                if fetch_mode == CATALOG_FETCH_MODE:
+                    job_key = ('yahoo', 'catalog', digest, reuse_catalog, spill)
+                    fetch = lambda: get_catalog_data(
+                        'yahoo', st.session_state.sale_list, reuse_catalog=reuse_catalog, spill=spill
+                    )
+                elif fetch_mode == SAMPLE_FETCH_MODE:
+                    job_key = ('yahoo', 'sample', digest, sample['size'], sample['seed'])
+                    fetch = lambda: get_sample_audit('yahoo', st.session_state.sale_list, sample['size'], sample['seed'])
+                else:
+                    job_key = ('yahoo', 'per_code', digest, spill, chunk and (chunk['index'], chunk['size']))
+                    fetch = lambda: get_yahoo_data(
+                        st.session_state.sale_list, spill=spill, chunk=chunk, prioritize=prioritize
+                    )
+                # 抽出して確認した推定は、抽出して確認する取得の結果にだけ表示する
+                st.session_state.sample_audit_yahoo = None
+                shared = run_shared_job(
+                    job_key, "Yahoo!ショッピングAPI取得", 'df_yahoo',
+                    ['not_found_reasons_yahoo', 'fetch_metrics_yahoo', 'sample_audit_yahoo'],
+                    lambda: profiled('yahoo', fetch), refresh=refresh
+                )
                 
-                # メインエリアに結果を表示するためにリダイレクト
-                st.rerun()
+                # メインエリアに結果を表示するためにリダイレクト（共有していた取得が中断された場合はエラーを表示したままにする）
+                if shared:
+                    st.rerun()
+
+# 抽出して確認した結果の表示
+def render_sample_audit(source):
+    """抽出して確認した価格の不一致率の推定と、選んだ層の全件取得を表示する関数"""
+    audit = st.session_state[f'sample_audit_{source}']
+    if audit is None:
+        return
+    st.markdown("#### 🎯 抽出して確認した価格の不一致率（推定）")
+    if np.isnan(audit['rate']):
+        st.warning("抽出した商品の価格を確認できませんでした（未掲載・取得失敗のみ）。")
+    else:
+        col1, col2, col3 = st.columns(3)
+        col1.metric("推定不一致率", f"{audit['rate']:.1%}")
+        col2.metric("95%信頼区間", f"{audit['low']:.1%} 〜 {audit['high']:.1%}")
+        col3.metric("価格を確認した商品", f"{audit['checked']:,}件 / 全{audit['population']:,}件")
+        st.caption(
+            f"大分類コード・送料区分名・価格帯の層ごとに{audit['sampled']:,}件を無作為抽出し（シード: {audit['seed']}）、"
+            "価格を確認できた商品の不一致率を層の商品数で重み付けして推定しています（未掲載・取得失敗の商品は含めません）。"
+            + (f"確認できた商品がない層は推定に含めていません（推定の対象: 全商品の{audit['coverage']:.0%}）。"
+               if audit['coverage'] < 1 else "")
+        )
+
+    threshold = st.number_input(
+        "許容する不一致率（%）", min_value=0.0, max_value=100.0, value=2.0, step=0.5, key=f"{source}_audit_threshold"
+    ) / 100
+    strata = audit['strata']
+    flagged = sampling_audit.flagged_strata(strata, threshold)
+
+    def percent(value):
+        return f"{value:.1%}" if not np.isnan(value) else ""
+
+    display = strata[['層', '商品数', '抽出数', '確認数', '未掲載', '不一致']].assign(
+        不一致率=strata['不一致率'].map(percent),
+        信頼区間=[
+            f"{percent(low)} 〜 {percent(high)}" if not np.isnan(low) else ""
+            for low, high in zip(strata['下限'], strata['上限'])
+        ],
+        判定=["要確認" if label in flagged else "" for label in strata['層']],
+    ).rename(columns={'信頼区間': '95%信頼区間'})
+    st.dataframe(display, use_container_width=True, hide_index=True)
+
+    # 許容値を超えた層を初期選択にして、選んだ層だけを全件取得する
+    selected = st.multiselect(
+        "全件取得する層", strata['層'].tolist(), default=flagged, key=f"{source}_audit_strata_{audit['seed']}_{threshold}"
+    )
+    if not selected:
+        if not flagged:
+            st.success("許容する不一致率を超えた層はありません。")
+        return
+    codes = int(strata.loc[strata['層'].isin(selected), '商品数'].sum())
+    per_code = api_quota.calls_per_code(QUOTA_DB, source)
+    st.caption(f"{len(selected)}層・{codes:,}件（所要時間: 約{format_duration(codes * per_code * API_REQUEST_INTERVAL)}）")
+    if st.button("選んだ層を全件取得", key=f"{source}_audit_escalate"):
+        sale_list = st.session_state.sale_list
+        spill = st.session_state.get('spill_to_disk', False)
+        shared = run_shared_job(
+            (source, 'strata', sale_list_digest(sale_list), spill, tuple(sorted(selected))),
+            f"{PROFILE_LABELS[source]}（層を選んだ全件取得）", f'df_{source}',
+            [f'not_found_reasons_{source}', f'fetch_metrics_{source}', f'sample_audit_{source}'],
+            lambda: profiled(source, lambda: get_strata_data(
+                source, sale_list, selected, spill=spill, prioritize=st.session_state.get('prioritize_fetch', True)
+            )),
+            refresh=st.session_state.get('job_refresh', False) or profile_enabled()
+        )
+        if shared:
+            st.rerun()
+
+
+# 計測結果の表示
+def render_fetch_metrics(metrics, file_label):
+    """取得処理の計測結果（サマリーとエクスポート）を表示する関数"""
+    if metrics is None:
+        return
+
+    # 計測データは取得完了後に変わらないため、集計結果を再利用する
+    summary = result_view(f'metrics_summary_{file_label}', (metrics,), metrics.summary)
+    with st.expander("⏱️ 計測データ（リクエスト単位の処理時間）"):
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("処理時間", f"{summary['wall_s']:.1f}秒")
+        col2.metric("処理件数", f"{summary['codes']}件")
+        col3.metric("リクエスト数", f"{summary['requests']}回")
+        col4.metric("失敗", f"{summary['failed']}件")
+
+        # 区間ごとの合計・パーセンタイル
+        phase_rows = [
+            {
+                '区間': phase,
+                '合計(秒)': round(stats['sum_s'], 3),
+                'p50(ms)': round(stats['p50_s'] * 1000, 1) if stats['p50_s'] is not None else None,
+                'p95(ms)': round(stats['p95_s'] * 1000, 1) if stats['p95_s'] is not None else None,
+                'p99(ms)': round(stats['p99_s'] * 1000, 1) if stats['p99_s'] is not None else None,
+            }
+            for phase, stats in summary['phases'].items()
+        ]
+        for name, seconds in summary['run_phases'].items():
+            phase_rows.append({'区間': name, '合計(秒)': round(seconds, 3)})
+        st.dataframe(pd.DataFrame(phase_rows), use_container_width=True, hide_index=True)
+        st.markdown(
+            f"**受信量**: {summary['wire_bytes'] / 1024 / 1024:,.1f}MB（展開後 {summary['bytes'] / 1024 / 1024:,.1f}MB）"
+            + (f"・途中で受信を打ち切ったページ {summary['early_stops']}件" if summary['early_stops'] else "")
+        )
+
+        # 同時接続数の自動調整結果
+        if 'concurrency' in summary['info']:
+            concurrency = summary['info']['concurrency']
+            st.markdown(
+                f"**同時接続数**: 最終 {concurrency['final_limit']} / 最大到達 {concurrency['peak_limit']}"
+                f"（範囲 {concurrency['min_limit']}〜{concurrency['max_limit']}、"
+                f"増加 {concurrency['increases']}回・減少 {concurrency['decreases']}回）"
+            )
+            history = pd.DataFrame(summary['info']['concurrency_history'], columns=['経過秒', '同時接続数', '理由'])
+            st.line_chart(history, x='経過秒', y='同時接続数', height=200)
+
+        # 分散ワーカーの処理結果
+        if 'distributed' in summary['info']:
+            distributed = summary['info']['distributed']
+            st.markdown(
+                f"**分散ワーカー**: {len(distributed['workers'])}台で作業単位 {distributed['units']}件を処理"
+                f"（1作業単位 {distributed['unit_size']}件・このサーバーのワーカー {distributed['local_workers']}台）"
+            )
+            st.dataframe(
+                pd.DataFrame(list(distributed['workers'].items()), columns=['ワーカー', '作業単位']),
+                use_container_width=True, hide_index=True
+            )
+            if distributed['failed_units']:
+                st.warning(f"ワーカーが処理を完了できなかった作業単位があります: {distributed['failed_units']}件")
+
+        # 一時的なエラーの再取得結果
+        if summary['info'].get('retry_pass', {}).get('retried'):
+            retry_pass = summary['info']['retry_pass']
+            st.markdown(
+                f"**再取得**: 一時的なエラー {retry_pass['retried']}件を再取得し、{retry_pass['recovered']}件が回復"
+            )
+
+        # 取得する順番の優先度
+        if 'priority' in summary['info']:
+            priority = summary['info']['priority']
+            st.markdown(
+                f"**優先順位**: 前回差額あり {priority['mismatch']:,}件・前回取得失敗 {priority['failed']:,}件・"
+                f"販売リストの変更/初回 {priority['edited']:,}件・SALE/期間限定 {priority['icon']:,}件を"
+                "通販単価の高い順とあわせて先に取得"
+            )
+
+        # レイアウト変更の疑いによる中断
+        if summary['info'].get('layout_drift', {}).get('tripped'):
+            drift = summary['info']['layout_drift']
+            st.error(
+                f"**レイアウト変更の疑い**: 最初の{drift['pages']}ページのうち{drift['missing']}ページで商品詳細ブロックなし"
+                f"（許容 {drift['max_missing_rate']:.0%}）のため取得を中断"
+            )
+
+        # 変化のないページの解析の省略
+        if 'page_cache' in summary['info']:
+            cache = summary['info']['page_cache']
+            st.markdown(
+                f"**解析の省略**: 前回から変化のないページ {cache['hits']:,}件は解析せずに前回の商品情報を使用"
+                f"（解析 {cache['misses']:,}件）"
+            )
+
+        # APIの呼び出し回数（1日の上限回数の使用量）
+        if 'quota' in summary['info']:
+            quota = summary['info']['quota']
+            usage = f"**API使用量**: 今回 {quota['calls']:,}回"
+            if quota['daily'] is not None:
+                usage += f"・今日の合計 {quota['used_today']:,} / {quota['daily']:,}回"
+            if quota['chunk'] is not None:
+                usage += f"（チャンク {quota['chunk']['index'] + 1}/{quota['chunk']['count']}）"
+            st.markdown(usage)
+            if quota['exhausted_codes']:
+                st.warning(f"1日の上限回数に達したため取得しなかった商品: {quota['exhausted_codes']}件")
+
+        # 店舗カタログの一括取得結果
+        if 'catalog' in summary['info']:
+            catalog = summary['info']['catalog']
+            if catalog['reused']:
+                st.markdown(f"**店舗カタログ**: 同期済みのカタログ {catalog['items']:,}件を再利用")
+            else:
+                st.markdown(
+                    f"**店舗カタログ**: {catalog['items']:,}件を{catalog['requests']}リクエストで取得"
+                    f"（価格帯 {catalog['bands']}区分・分割 {catalog['splits']}回）"
+                )
+                if not catalog['complete']:
+                    st.warning(f"取得できなかった価格帯があります: {catalog['failed_bands']}")
+                if catalog['truncated_bands']:
+                    st.warning(
+                        f"同じ価格の商品が検索の上限件数を超えたため、一部を取得できなかった価格が"
+                        f"{catalog['truncated_bands']}件あります（その価格の商品は未掲載と判定される場合があります）"
+                    )
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("**ステータスコード別**")
+            st.json(summary['status_counts'])
+        with col2:
+            st.markdown("**失敗理由別**")
+            st.json(summary['failure_counts'])
+
+        timestamp = dt.datetime.fromtimestamp(metrics.started).strftime('%Y%m%d_%H%M%S')
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                label="計測データをダウンロード（JSON Lines）",
+                data=result_view(f'metrics_jsonl_{file_label}', (metrics,), metrics.to_jsonl),
+                file_name=f"計測データ_{file_label}_{timestamp}.jsonl",
+                mime="application/x-ndjson"
+            )
+        with col2:
+            st.download_button(
+                label="計測データをダウンロード（Prometheus）",
+                data=result_view(f'metrics_prometheus_{file_label}', (metrics,), metrics.to_prometheus),
+                file_name=f"計測データ_{file_label}_{timestamp}.prom",
+                mime="text/plain"
+            )
+
+# プロファイルの表示
+def render_profiles():
+    """取得処理・画面表示のプロファイル（CPU・メモリ）の概要とダウンロードを表示する関数"""
+    if not st.session_state.profiles:
+        return
+
+    with st.expander("🔬 プロファイル（CPU・メモリ）"):
+        for name, entry in st.session_state.profiles.items():
+            profiler = entry['profiler']
+            summary = profiler.summary()
+            st.markdown(
+                f"**{PROFILE_LABELS.get(name, name)}**: {summary['duration_s']:.2f}秒・"
+                f"サンプル {summary['samples']}回（{summary['interval_s'] * 1000:.0f}ms間隔）・スレッド {summary['threads']}"
+                + (f"・メモリのピーク {summary['traced_peak_mb']:,.1f}MB" if summary['traced_peak_mb'] is not None else "")
+            )
+            st.caption(f"保存先: {', '.join(entry['paths'])}")
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown("関数別のサンプル数（自身・呼び出し先を含む合計）")
+                functions = result_view(f'profile_functions_{name}', (profiler,), lambda: pd.DataFrame(profiler.top_functions(20)))
+                st.dataframe(functions, use_container_width=True, hide_index=True)
+            with col2:
+                st.markdown("メモリ割り当ての増加が多い行")
+                allocations = result_view(f'profile_allocations_{name}', (profiler,), lambda: pd.DataFrame(profiler.top_allocations(20)))
+                st.dataframe(allocations, use_container_width=True, hide_index=True)
+
+            timestamp = dt.datetime.fromtimestamp(profiler.started).strftime('%Y%m%d_%H%M%S')
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.download_button(
+                    label="speedscope形式",
+                    data=result_view(f'profile_speedscope_{name}', (profiler,), profiler.to_speedscope),
+                    file_name=f"profile_{name}_{timestamp}.speedscope.json",
+                    mime="application/json",
+                    key=f"profile_speedscope_{name}"
+                )
+            with col2:
+                st.download_button(
+                    label="フレームグラフ用（folded）",
+                    data=result_view(f'profile_folded_{name}', (profiler,), profiler.to_folded),
+                    file_name=f"profile_{name}_{timestamp}.folded",
+                    mime="text/plain",
+                    key=f"profile_folded_{name}"
+                )
+            with col3:
+                st.download_button(
+                    label="メモリ割り当て（上位）",
+                    data=result_view(f'profile_allocations_report_{name}', (profiler,), profiler.allocation_report),
+                    file_name=f"profile_{name}_{timestamp}_allocations.txt",
+                    mime="text/plain",
+                    key=f"profile_allocations_{name}"
+                )
+
+
+# 価格比較
+# 比較に使うのは各取得結果のキー列と価格列だけなので、ファイルに書き出した結果はその2列だけを読み込む
+def make_price_comparison(sale_list, df_onlinestore, df_rakuten, df_yahoo):
+    """3ソースの取得結果と販売リストの価格比較表を作成する関数
+
+    取得結果のいずれかをファイルに書き出している場合（メモリ節約モード）は、比較表もファイルに書き出して SpilledResult で返す。
+    外れ値の列はしきい値に応じて表示時に付けるため含めない。
+    """
+    results = {'自社': df_onlinestore, '楽天': df_rakuten, 'Yahoo': df_yahoo}
+    sale_list_mod = expand_sale_list(sale_list) if '大分類コード' in sale_list.columns else None
+    df_comparison = price_comparison.build_price_comparison(sale_list, sale_list_mod, *(
+        result_frame(df, list(price_comparison.SOURCE_COLUMNS[label])) for label, df in results.items()
+    )).drop(columns='外れ値')
+    if all(df is None or isinstance(df, pd.DataFrame) for df in results.values()):
+        return df_comparison
+    return write_spilled_result('price_comparison', [df_comparison], record_spool.PRICE_COMPARISON_SCHEMA)
+
+
+def render_price_comparison():
+    """自社サイト・楽天・Yahooの価格比較結果を表示する関数"""
+    results = [st.session_state.df_onlinestore, st.session_state.df_rakuten, st.session_state.df_yahoo]
+    if st.session_state.sale_list is None or all(df is None for df in results):
+        return
+
+    st.markdown("---")
+    st.subheader("🔍 価格比較（自社サイト・楽天市場・Yahoo!ショッピング）")
+    st.caption("取得済みの結果と販売リストを（基本コード, バリエーション）単位で結合し、通販単価との差額とモール間の価格差を表示します。")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        threshold_pct = st.slider("外れ値とする乖離率（%）", min_value=1, max_value=100, value=10, key="comparison_threshold")
+    with col2:
+        outliers_only = st.checkbox("外れ値のみ表示", value=True, key="comparison_outliers_only")
+
+    # 比較表は取得結果が変わった時だけ作り直し、外れ値の判定だけをしきい値に応じて更新する
+    sources = (st.session_state.sale_list, *results)
+    previous = st.session_state.result_views.get('price_comparison')
+    if previous is not None and not isinstance(previous[1], pd.DataFrame) and not os.path.exists(previous[1].path):
+        # 古いファイルとして削除された比較表は作り直す
+        del st.session_state.result_views['price_comparison']
+        previous = None
+
+    def build_comparison():
+        # 作り直す前の比較表の書き出しファイルは削除する
+        if previous is not None and not isinstance(previous[1], pd.DataFrame):
+            previous[1].remove()
+        return make_price_comparison(*sources)
+
+    df_base = result_view('price_comparison', sources, build_comparison)
+    threshold = threshold_pct / 100
+
+    # セッション状態には外れ値の行の位置だけを保持し、外れ値の列は表示・ダウンロードする行にだけ付ける
+    def mark_outliers(df):
+        return df.assign(外れ値=df['乖離率'].fillna(0) >= threshold)
+
+    outlier_positions = result_view(
+        'price_comparison_outliers', (df_base, threshold_pct),
+        lambda: np.flatnonzero(df_base['乖離率'].fillna(0).to_numpy() >= threshold)
+    )
+    rows = outlier_positions if outliers_only else None
+
+    st.info(f"比較対象: {len(df_base)}件 / 外れ値: {len(outlier_positions)}件")
+    render_result_grid(df_base, "価格比較", height=600, rows=rows, decorate=mark_outliers)
+
+    render_csv_download(
+        df_base, "価格比較データをダウンロード", "価格比較",
+        positions=rows, decorate=mark_outliers, sources=(df_base, threshold_pct, outliers_only)
+    )
+
+
+# 取得結果から作成する表示用データの再利用
+def result_view(name, sources, build):
+    """元の取得結果が変わるまで、build() で作成した表示用データをセッション状態に保持して再利用する関数
+
+    sources: 元になる取得結果のタプル（同じオブジェクトかどうかで変更を判定する。数値・文字列は値で比較）
+    """
+    def same(a, b):
+        return a is b or (isinstance(a, (int, float, str)) and type(a) is type(b) and a == b)
+
+    cached = st.session_state.result_views.get(name)
+    if cached is not None and len(cached[0]) == len(sources) and all(same(a, b) for a, b in zip(cached[0], sources)):
+        return cached[1]
+    value = build()
+    st.session_state.result_views[name] = (sources, value)
+    return value
+
+
+# 取得できなかった商品の一覧（自社サイト）
+def build_not_found_onlinestore(sale_list, df_onlinestore, not_found_reasons):
+    """販売リストのうち自社サイトで取得できなかった商品と理由の一覧を作成する関数"""
+    # 取得できた商品コードのリスト（ファイルに書き出した結果は商品コードの列だけを読み込む）
+    found_codes = set(df_onlinestore['No'].astype(str))
+    # 元のsale_listから取得できなかった商品を抽出
+    not_found_df = sale_list[~sale_list['商品コード'].astype(str).isin(found_codes)].copy()
+
+    # 理由を追加
+    failures = not_found_df['商品コード'].astype(str).map(not_found_reasons)
+    not_found_df['取得失敗理由'] = failures.map(lambda f: f.message if pd.notnull(f) else "理由不明")
+    not_found_df['失敗分類'] = failures.map(lambda f: f.label if pd.notnull(f) else "不明")
+    return _not_found_display_columns(not_found_df)
+
+
+# 取得できなかった商品の一覧（楽天市場・Yahoo!ショッピング）
+def build_not_found_marketplace(sale_list, df_result, not_found_reasons):
+    """販売リストのうち楽天市場・Yahoo!ショッピングで取得できなかった商品と理由の一覧を作成する関数"""
+    # 取得できた商品コードのリスト（すべてのコードを含める、空白除去して正規化）
+    # ファイルに書き出した結果は商品コードの列だけを読み込む
+    found_codes = {str(code).strip() for code in df_result['itemCode'].astype(str)}
+    
+    # 大分類コード1,2の商品は拡張コードに変換されるため、元の商品コードから拡張コードを生成して比較
+    # 大分類コード1: -50, -100, -200, -300, -400, -500
+    # 大分類コード2: -50
+    cat1_codes = set()
+    cat2_codes = set()
+    # まず、各base_codeに対してどの拡張コードが存在するかを集計
+    base_code_extensions = {}
+    for code in found_codes:
+        if '-' in code:
+            base_code = code.split('-')[0].strip()
+            suffix = code.split('-', 1)[1].strip() if '-' in code else ''
+            if base_code not in base_code_extensions:
+                base_code_extensions[base_code] = set()
+            base_code_extensions[base_code].add(suffix)
+    
+    # 大分類コード1の商品は複数の拡張コード（-50, -100, -200等）が生成される
+    # 大分類コード2の商品は-50のみが生成される
+    for base_code, extensions in base_code_extensions.items():
+        if len(extensions) > 1 or (len(extensions) == 1 and '-50' not in extensions):
+            # 複数の拡張コードがある、または-50以外の拡張コードがある場合は大分類コード1
+            cat1_codes.add(base_code)
+        elif len(extensions) == 1 and '-50' in extensions:
+            # -50のみの場合は大分類コード2の可能性が高いが、大分類コード1の可能性もある
+            # より正確な判定のため、sale_listの大分類コードを確認
+            matching_rows = sale_list[sale_list['商品コード'].astype(str).str.strip() == base_code]
+            if not matching_rows.empty:
+                cat_code = matching_rows.iloc[0]['大分類コード']
+                if cat_code == 2:
+                    cat2_codes.add(base_code)
+                else:
+                    cat1_codes.add(base_code)
+            else:
+                # 見つからない場合は大分類コード2と仮定（-50のみなので）
+                cat2_codes.add(base_code)
+    
+    # 大分類コード1,2以外の商品は元の商品コードのまま（空白除去済み）
+    other_codes = {code for code in found_codes if '-' not in code}
+    
+    # 元のsale_listから取得できなかった商品を抽出
+    # 大分類コード1と2の商品は拡張コードで取得されるため、すべての拡張コードが取得できなかった場合のみリストに含める
+    not_found_list = []
+    for _, row in sale_list.iterrows():
+        code = str(row['商品コード']).strip()
+        cat_code = row['大分類コード']
+        
+        # 大分類コード1の商品は、すべての拡張コードが取得できなかった場合のみリストに含める
+        if cat_code == 1:
+            if code not in cat1_codes:
+                # 拡張コードで取得できなかった場合のみ追加
+                not_found_list.append(row)
+        # 大分類コード2の商品は、-50が取得できなかった場合のみリストに含める
+        elif cat_code == 2:
+            if code not in cat2_codes:
+                # 拡張コードで取得できなかった場合のみ追加
+                not_found_list.append(row)
+        # その他の商品は元の商品コードで比較
+        else:
+            if code not in other_codes:
+                not_found_list.append(row)
+    
+    # 空のリストの場合は元のsale_listと同じカラムを持つ空のDataFrameを作成
+    if not_found_list:
+        not_found_df = pd.DataFrame(not_found_list)
+    else:
+        not_found_df = pd.DataFrame(columns=sale_list.columns)
+    
+    # 理由を追加（拡張コードから元の商品コードにマッピング）
+    def get_failures(row):
+        code = str(row['商品コード']).strip()
+        cat_code = row['大分類コード']
+        failures = []
+        
+        # 大分類コード1の場合は複数の拡張コードをチェック
+        if cat_code == 1:
+            for suffix in ['-50', '-100', '-200', '-300', '-400', '-500']:
+                ext_code = code + suffix
+                if ext_code in not_found_reasons:
+                    failures.append((ext_code, not_found_reasons[ext_code]))
+        # 大分類コード2の場合は-50をチェック
+        elif cat_code == 2:
+            ext_code = code + '-50'
+            if ext_code in not_found_reasons:
+                failures.append((None, not_found_reasons[ext_code]))
+        # その他の場合は元の商品コードをチェック
+        else:
+            if code in not_found_reasons:
+                failures.append((None, not_found_reasons[code]))
+        return failures
+    
+    def get_reason(row):
+        reasons = [
+            f"{ext_code}: {failure.message}" if ext_code else failure.message
+            for ext_code, failure in get_failures(row)
+        ]
+        return "; ".join(reasons) if reasons else "理由不明"
+    
+    def get_label(row):
+        labels = list(dict.fromkeys(failure.label for _, failure in get_failures(row)))
+        return " / ".join(labels) if labels else "不明"
+    
+    if not not_found_df.empty and not_found_reasons:
+        not_found_df['取得失敗理由'] = not_found_df.apply(get_reason, axis=1)
+        not_found_df['失敗分類'] = not_found_df.apply(get_label, axis=1)
+    else:
+        not_found_df['取得失敗理由'] = "理由不明"
+        not_found_df['失敗分類'] = "不明"
+    return _not_found_display_columns(not_found_df)
+
+
+def _not_found_display_columns(not_found_df):
+    # 商品名の列が存在するか確認
+    if '商品名' not in not_found_df.columns:
+        # 商品名の列がない場合は空の列を追加
+        not_found_df['商品名'] = ''
+    # 商品コード、商品名、失敗分類、取得失敗理由のみを抽出
+    display_columns = ['商品コード', '商品名', '失敗分類', '取得失敗理由']
+    return not_found_df[display_columns].copy()
+
+
+def render_not_found(not_found_display_df, file_label):
+    """取得できなかった商品の一覧とダウンロードボタンを表示する関数"""
+    if not_found_display_df.empty:
+        return
+
+    st.markdown("---")
+    st.subheader("❌ 取得できなかった商品")
+    st.warning(f"{len(not_found_display_df)}件の商品が取得できませんでした")
+    
+    # 取得できなかった商品を表示
+    st.dataframe(
+        not_found_display_df,
+        use_container_width=True,
+        height=400
+    )
+    
+    # 取得できなかった商品のダウンロードボタン
+    render_csv_download(not_found_display_df, "取得できなかった商品データをダウンロード", f"取得できなかった商品_{file_label}")
+
+
+# 取得結果の表示（絞り込み・並べ替えはサーバー側で行い、1ページ分だけを表示する）
+GRID_PAGE_SIZES = [50, 100, 200, 500, 1000]
+
+
+def render_result_grid(df, name, height=600, rows=None, decorate=None):
+    """取得結果を絞り込み・並べ替えて、1ページ分だけを表示する関数
+
+    全件をブラウザに送ると件数が多い時に画面が重くなるため、表示するのは選択したページの行だけにする。
+    rows: 表示の対象にする行の位置（省略時は全件）
+    decorate: 表示・ダウンロードする行に列を追加する関数
+    """
+    # ファイルに書き出した結果（メモリ節約モード）は件数と選択肢だけを保持し、
+    # 絞り込み・並べ替えに使う列は条件が変わった時に1列ずつ読み込む
+    index = result_view(
+        f'grid_index_{name}', (df,),
+        lambda: result_grid.build_grid_index(df, keep_arrays=isinstance(df, pd.DataFrame))
+    )
+    total = len(df) if rows is None else len(rows)
+
+    with st.expander("🔎 絞り込み・並べ替え", expanded=True):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            diff = st.radio("差額", result_grid.DIFF_OPTIONS, horizontal=True, key=f"grid_{name}_diff") \
+                if '差額' in index['numeric'] else result_grid.DIFF_ALL
+            keyword = st.text_input("商品コード・商品名で検索", key=f"grid_{name}_keyword")
+        with col2:
+            categories = {
+                col: st.multiselect(col, options, key=f"grid_{name}_category_{col}")
+                for col, options in index['options'].items()
+            }
+            list_values = {
+                col: st.multiselect(f"{col}（いずれかを含む）", list(values), key=f"grid_{name}_list_{col}")
+                for col, values in index['list'].items()
+            }
+        with col3:
+            sort_column = st.selectbox("並べ替え", ["（取得順）"] + list(df.columns), key=f"grid_{name}_sort")
+            ascending = st.radio("順序", ["昇順", "降順"], horizontal=True, key=f"grid_{name}_order") == "昇順"
+            page_size = st.selectbox("1ページの件数", GRID_PAGE_SIZES, index=1, key=f"grid_{name}_page_size")
+
+    # 条件が変わったら1ページ目に戻す
+    conditions = repr((diff, keyword, categories, list_values, sort_column, ascending, page_size))
+    page_key = f"grid_{name}_page"
+    if st.session_state.get(f"grid_{name}_conditions") != conditions:
+        st.session_state[f"grid_{name}_conditions"] = conditions
+        st.session_state[page_key] = 1
+
+    def build_positions():
+        mask = result_grid.filter_rows(index, diff, categories, list_values, keyword, df=df)
+        if rows is not None:
+            in_rows = np.zeros(len(mask), dtype=bool)
+            in_rows[rows] = True
+            mask &= in_rows
+        column = sort_column if sort_column in df.columns else None
+        return result_grid.sorted_positions(df, index, mask, column, ascending)
+
+    positions = result_view(f'grid_positions_{name}', (df, rows, conditions), build_positions)
+    pages = max(1, -(-len(positions) // page_size))
+    if st.session_state[page_key] > pages:
+        st.session_state[page_key] = pages
+    page = st.number_input(f"ページ（全{pages}ページ）", min_value=1, max_value=pages, step=1, key=page_key)
+    page_positions, page, pages = result_grid.page_slice(positions, page, page_size)
+
+    if len(positions):
+        st.caption(f"全{total}件中 {len(positions)}件が該当（{(page - 1) * page_size + 1}〜"
+                   f"{(page - 1) * page_size + len(page_positions)}件目を表示）")
+    else:
+        st.caption(f"全{total}件中 該当なし")
+    # ファイルに書き出した結果（メモリ節約モード）も表示するページの行だけを読み込む
+    df_page = df.take(page_positions)
+    st.dataframe(decorate(df_page) if decorate else df_page, use_container_width=True, height=height)
+
+    # 絞り込み結果だけのダウンロード（全件のダウンロードは別のボタン）
+    if len(positions) < total:
+        render_csv_download(
+            df, f"絞り込み結果（{len(positions)}件）をダウンロード", f"{name}_絞り込み",
+            positions=positions, decorate=decorate, sources=(df, rows, conditions)
+        )
+
+
+def render_csv_download(df, label, file_label, positions=None, decorate=None, sources=None):
+    """データフレームのCSVダウンロードボタンを表示する関数（CSVは取得結果が変わるまで再利用）
+
+    positions: 出力する行の位置（省略時は全件）
+    decorate: 出力する行に列を追加する関数
+    sources: CSVを作り直す条件（省略時は取得結果が変わった時だけ作り直す）
+    """
+    def build_csv():
+        df_rows = result_frame(df) if positions is None else df.take(positions)
+        if decorate:
+            df_rows = decorate(df_rows)
+        return df_rows.to_csv(index=False, encoding='utf-8-sig')
+
+    if not isinstance(df, pd.DataFrame):
+        # ファイルに書き出した結果（メモリ節約モード）は、CSVを保持せずボタンが押された時だけ作成する
+        if not st.button(f"{label}（CSVを作成）", key=f"csv_prepare_{file_label}"):
+            return
+        csv_data = build_csv()
+    else:
+        csv_data = result_view(f'csv_{file_label}', sources or (df,), build_csv)
+    st.download_button(
+        label=label,
+        data=csv_data,
+        file_name=f"{file_label}_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+        mime="text/csv"
+    )
+
 
 # メイン処理
 def main():
+    # 共有ジョブの結果をまだ使っていることを記録（操作のないセッションの結果は一定時間後に手放す）
+    get_job_registry().touch(st.session_state.session_key)
+
     # CSVファイルアップロードセクション
     st.subheader("📁 CSVファイルアップロード")
     
@@ -756,8 +2305,12 @@ def main():
     )
     
     if uploaded_file is not None:
-        # CSVファイルを読み込み
-        sale_list = load_csv_data_from_upload(uploaded_file)
+        # CSVファイルを読み込み（同じファイルは再実行のたびに読み込み直さない）
+        if st.session_state.sale_list_file_id != uploaded_file.file_id or st.session_state.sale_list is None:
+            sale_list = load_csv_data_from_upload(uploaded_file)
+            st.session_state.sale_list_file_id = uploaded_file.file_id if sale_list is not None else None
+        else:
+            sale_list = st.session_state.sale_list
         
         if sale_list is not None:
             st.success(f"読み込み完了: {len(sale_list)}件の商品データ")
@@ -769,378 +2322,101 @@ def main():
     # サイドバーを表示（CSV読み込み後に実行）
     render_sidebar()
 
+    # 他のセッションと共有した取得結果の案内
+    shared_job_notice = st.session_state.pop('shared_job_notice', None)
+    if shared_job_notice:
+        st.info(f"🔗 {shared_job_notice}")
+
     # 結果表示（選択されたデータソースのみ表示）
     if st.session_state.selected_data_source == "自社サイトスクレイピング" and st.session_state.df_onlinestore is not None:
         st.markdown("---")
         st.subheader("📊 自社サイト取得結果")
         st.success("スクレイピングが完了しました！")
         
-        # 高さを指定してデータフレームを表示
-        st.dataframe(
-            st.session_state.df_onlinestore,
-            use_container_width=True,
-            height=600
-        )
+        # 絞り込み・並べ替えをして1ページ分を表示
+        render_result_grid(st.session_state.df_onlinestore, "自社サイトデータ", height=600)
         
         # 取得できなかった商品リストを表示
         if st.session_state.sale_list is not None:
-            # 取得できた商品コードのリスト
-            found_codes = set(st.session_state.df_onlinestore['No'].astype(str))
-            # 元のsale_listから取得できなかった商品を抽出
-            not_found_df = st.session_state.sale_list[
-                ~st.session_state.sale_list['商品コード'].astype(str).isin(found_codes)
-            ].copy()
-            
-            if not not_found_df.empty:
-                st.markdown("---")
-                st.subheader("❌ 取得できなかった商品")
-                st.warning(f"{len(not_found_df)}件の商品が取得できませんでした")
-                
-                # 理由を追加
-                if st.session_state.not_found_reasons_onlinestore:
-                    not_found_df['取得失敗理由'] = not_found_df['商品コード'].astype(str).map(
-                        lambda x: st.session_state.not_found_reasons_onlinestore.get(x, "理由不明")
-                    )
-                else:
-                    not_found_df['取得失敗理由'] = "理由不明"
-                
-                # 商品コード、商品名、取得失敗理由のみを抽出
-                display_columns = ['商品コード', '商品名', '取得失敗理由']
-                # 商品名の列が存在するか確認
-                if '商品名' not in not_found_df.columns:
-                    # 商品名の列がない場合は空の列を追加
-                    not_found_df['商品名'] = ''
-                not_found_display_df = not_found_df[display_columns].copy()
-                
-                # 取得できなかった商品を表示
-                st.dataframe(
-                    not_found_display_df,
-                    use_container_width=True,
-                    height=400
-                )
-                
-                # 取得できなかった商品のダウンロードボタン
-                csv_data_not_found = not_found_display_df.to_csv(index=False, encoding='utf-8-sig')
-                st.download_button(
-                    label="取得できなかった商品データをダウンロード",
-                    data=csv_data_not_found,
-                    file_name=f"取得できなかった商品_自社サイト_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv"
+            not_found_display_df = result_view(
+                'not_found_onlinestore',
+                (st.session_state.sale_list, st.session_state.df_onlinestore, st.session_state.not_found_reasons_onlinestore),
+                lambda: build_not_found_onlinestore(
+                    st.session_state.sale_list, st.session_state.df_onlinestore,
+                    st.session_state.not_found_reasons_onlinestore
                 )
+            )
+            render_not_found(not_found_display_df, "自社サイト")
         
         # ダウンロードボタン
-        csv_data = st.session_state.df_onlinestore.to_csv(index=False, encoding='utf-8-sig')
-        st.download_button(
-            label="自社サイトデータをダウンロード",
-            data=csv_data,
-            file_name=f"自社サイトデータ_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv"
-        )
+        render_csv_download(st.session_state.df_onlinestore, "自社サイトデータをダウンロード", "自社サイトデータ")
+        
+        # 計測データ
+        render_fetch_metrics(st.session_state.fetch_metrics_onlinestore, "自社サイト")
     
     elif st.session_state.selected_data_source == "楽天市場API取得" and st.session_state.df_rakuten is not None:
         st.markdown("---")
         st.subheader("📊 楽天市場取得結果")
         st.success("楽天市場API取得が完了しました！")
+
+        # 抽出して確認した場合は価格の不一致率の推定
+        render_sample_audit('rakuten')
         
-        # 高さを指定してデータフレームを表示
-        st.dataframe(
-            st.session_state.df_rakuten,
-            use_container_width=True,
-            height=800
-        )
+        # 絞り込み・並べ替えをして1ページ分を表示
+        render_result_grid(st.session_state.df_rakuten, "楽天市場データ", height=800)
         
         # 取得できなかった商品リストを表示
         if st.session_state.sale_list is not None:
-            # 取得できた商品コードのリスト（すべてのコードを含める、空白除去して正規化）
-            found_codes = {str(code).strip() for code in st.session_state.df_rakuten['itemCode'].astype(str)}
-            
-            # 大分類コード1,2の商品は拡張コードに変換されるため、元の商品コードから拡張コードを生成して比較
-            # 大分類コード1: -50, -100, -200, -300, -400, -500
-            # 大分類コード2: -50
-            cat1_codes = set()
-            cat2_codes = set()
-            # まず、各base_codeに対してどの拡張コードが存在するかを集計
-            base_code_extensions = {}
-            for code in found_codes:
-                if '-' in code:
-                    base_code = code.split('-')[0].strip()
-                    suffix = code.split('-', 1)[1].strip() if '-' in code else ''
-                    if base_code not in base_code_extensions:
-                        base_code_extensions[base_code] = set()
-                    base_code_extensions[base_code].add(suffix)
-            
-            # 大分類コード1の商品は複数の拡張コード（-50, -100, -200等）が生成される
-            # 大分類コード2の商品は-50のみが生成される
-            for base_code, extensions in base_code_extensions.items():
-                if len(extensions) > 1 or (len(extensions) == 1 and '-50' not in extensions):
-                    # 複数の拡張コードがある、または-50以外の拡張コードがある場合は大分類コード1
-                    cat1_codes.add(base_code)
-                elif len(extensions) == 1 and '-50' in extensions:
-                    # -50のみの場合は大分類コード2の可能性が高いが、大分類コード1の可能性もある
-                    # より正確な判定のため、sale_listの大分類コードを確認
-                    matching_rows = st.session_state.sale_list[
-                        st.session_state.sale_list['商品コード'].astype(str).str.strip() == base_code
-                    ]
-                    if not matching_rows.empty:
-                        cat_code = matching_rows.iloc[0]['大分類コード']
-                        if cat_code == 2:
-                            cat2_codes.add(base_code)
-                        else:
-                            cat1_codes.add(base_code)
-                    else:
-                        # 見つからない場合は大分類コード2と仮定（-50のみなので）
-                        cat2_codes.add(base_code)
-            
-            # 大分類コード1,2以外の商品は元の商品コードのまま（空白除去済み）
-            other_codes = {code for code in found_codes if '-' not in code}
-            
-            # 元のsale_listから取得できなかった商品を抽出
-            # 大分類コード1と2の商品は拡張コードで取得されるため、すべての拡張コードが取得できなかった場合のみリストに含める
-            not_found_list = []
-            for _, row in st.session_state.sale_list.iterrows():
-                code = str(row['商品コード']).strip()
-                cat_code = row['大分類コード']
-                
-                # 大分類コード1の商品は、すべての拡張コードが取得できなかった場合のみリストに含める
-                if cat_code == 1:
-                    if code not in cat1_codes:
-                        # 拡張コードで取得できなかった場合のみ追加
-                        not_found_list.append(row)
-                # 大分類コード2の商品は、-50が取得できなかった場合のみリストに含める
-                elif cat_code == 2:
-                    if code not in cat2_codes:
-                        # 拡張コードで取得できなかった場合のみ追加
-                        not_found_list.append(row)
-                # その他の商品は元の商品コードで比較
-                else:
-                    if code not in other_codes:
-                        not_found_list.append(row)
-            
-            # 空のリストの場合は元のsale_listと同じカラムを持つ空のDataFrameを作成
-            if not_found_list:
-                not_found_df = pd.DataFrame(not_found_list)
-            else:
-                not_found_df = pd.DataFrame(columns=st.session_state.sale_list.columns)
-            
-            if not not_found_df.empty:
-                st.markdown("---")
-                st.subheader("❌ 取得できなかった商品")
-                st.warning(f"{len(not_found_df)}件の商品が取得できませんでした")
-                
-                # 理由を追加（拡張コードから元の商品コードにマッピング）
-                if st.session_state.not_found_reasons_rakuten:
-                    def get_reason(row):
-                        code = str(row['商品コード']).strip()
-                        cat_code = row['大分類コード']
-                        reasons = []
-                        
-                        # 大分類コード1の場合は複数の拡張コードをチェック
-                        if cat_code == 1:
-                            for suffix in ['-50', '-100', '-200', '-300', '-400', '-500']:
-                                ext_code = code + suffix
-                                if ext_code in st.session_state.not_found_reasons_rakuten:
-                                    reasons.append(f"{ext_code}: {st.session_state.not_found_reasons_rakuten[ext_code]}")
-                        # 大分類コード2の場合は-50をチェック
-                        elif cat_code == 2:
-                            ext_code = code + '-50'
-                            if ext_code in st.session_state.not_found_reasons_rakuten:
-                                reasons.append(st.session_state.not_found_reasons_rakuten[ext_code])
-                        # その他の場合は元の商品コードをチェック
-                        else:
-                            if code in st.session_state.not_found_reasons_rakuten:
-                                reasons.append(st.session_state.not_found_reasons_rakuten[code])
-                        
-                        return "; ".join(reasons) if reasons else "理由不明"
-                    
-                    not_found_df['取得失敗理由'] = not_found_df.apply(get_reason, axis=1)
-                else:
-                    not_found_df['取得失敗理由'] = "理由不明"
-                
-                # 商品コード、商品名、取得失敗理由のみを抽出
-                display_columns = ['商品コード', '商品名', '取得失敗理由']
-                # 商品名の列が存在するか確認
-                if '商品名' not in not_found_df.columns:
-                    # 商品名の列がない場合は空の列を追加
-                    not_found_df['商品名'] = ''
-                not_found_display_df = not_found_df[display_columns].copy()
-                
-                # 取得できなかった商品を表示
-                st.dataframe(
-                    not_found_display_df,
-                    use_container_width=True,
-                    height=400
-                )
-                
-                # 取得できなかった商品のダウンロードボタン
-                csv_data_not_found = not_found_display_df.to_csv(index=False, encoding='utf-8-sig')
-                st.download_button(
-                    label="取得できなかった商品データをダウンロード",
-                    data=csv_data_not_found,
-                    file_name=f"取得できなかった商品_楽天市場_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv"
+            not_found_display_df = result_view(
+                'not_found_rakuten',
+                (st.session_state.sale_list, st.session_state.df_rakuten, st.session_state.not_found_reasons_rakuten),
+                lambda: build_not_found_marketplace(
+                    st.session_state.sale_list, st.session_state.df_rakuten,
+                    st.session_state.not_found_reasons_rakuten
                 )
+            )
+            render_not_found(not_found_display_df, "楽天市場")
         
         # ダウンロードボタン
-        csv_data = st.session_state.df_rakuten.to_csv(index=False, encoding='utf-8-sig')
-        st.download_button(
-            label="楽天市場データをダウンロード",
-            data=csv_data,
-            file_name=f"楽天市場データ_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv"
-        )
+        render_csv_download(st.session_state.df_rakuten, "楽天市場データをダウンロード", "楽天市場データ")
+        
+        # 計測データ
+        render_fetch_metrics(st.session_state.fetch_metrics_rakuten, "楽天市場")
     
     elif st.session_state.selected_data_source == "Yahoo!ショッピングAPI取得" and st.session_state.df_yahoo is not None:
         st.markdown("---")
         st.subheader("📊 Yahoo!ショッピング取得結果")
         st.success("Yahoo!ショッピングAPI取得が完了しました！")
+
+        # 抽出して確認した場合は価格の不一致率の推定
+        render_sample_audit('yahoo')
         
-        # 高さを指定してデータフレームを表示
-        st.dataframe(
-            st.session_state.df_yahoo,
-            use_container_width=True,
-            height=800
-        )
+        # 絞り込み・並べ替えをして1ページ分を表示
+        render_result_grid(st.session_state.df_yahoo, "Yahoo!ショッピングデータ", height=800)
         
         # 取得できなかった商品リストを表示
         if st.session_state.sale_list is not None:
-            # 取得できた商品コードのリスト（すべてのコードを含める、空白除去して正規化）
-            found_codes = {str(code).strip() for code in st.session_state.df_yahoo['itemCode'].astype(str)}
-            
-            # 大分類コード1,2の商品は拡張コードに変換されるため、元の商品コードから拡張コードを生成して比較
-            # 大分類コード1: -50, -100, -200, -300, -400, -500
-            # 大分類コード2: -50
-            cat1_codes = set()
-            cat2_codes = set()
-            # まず、各base_codeに対してどの拡張コードが存在するかを集計
-            base_code_extensions = {}
-            for code in found_codes:
-                if '-' in code:
-                    base_code = code.split('-')[0]
-                    suffix = code.split('-', 1)[1] if '-' in code else ''
-                    if base_code not in base_code_extensions:
-                        base_code_extensions[base_code] = set()
-                    base_code_extensions[base_code].add(suffix)
-            
-            # 大分類コード1の商品は複数の拡張コード（-50, -100, -200等）が生成される
-            # 大分類コード2の商品は-50のみが生成される
-            for base_code, extensions in base_code_extensions.items():
-                if len(extensions) > 1 or (len(extensions) == 1 and '-50' not in extensions):
-                    # 複数の拡張コードがある、または-50以外の拡張コードがある場合は大分類コード1
-                    cat1_codes.add(base_code)
-                elif len(extensions) == 1 and '-50' in extensions:
-                    # -50のみの場合は大分類コード2の可能性が高いが、大分類コード1の可能性もある
-                    # より正確な判定のため、sale_listの大分類コードを確認
-                    matching_rows = st.session_state.sale_list[
-                        st.session_state.sale_list['商品コード'].astype(str) == base_code
-                    ]
-                    if not matching_rows.empty:
-                        cat_code = matching_rows.iloc[0]['大分類コード']
-                        if cat_code == 2:
-                            cat2_codes.add(base_code)
-                        else:
-                            cat1_codes.add(base_code)
-                    else:
-                        # 見つからない場合は大分類コード2と仮定（-50のみなので）
-                        cat2_codes.add(base_code)
-            
-            # 大分類コード1,2以外の商品は元の商品コードのまま
-            # 空白を除去し、文字列として正規化
-            other_codes = {str(code).strip() for code in found_codes if '-' not in str(code)}
-            
-            # 元のsale_listから取得できなかった商品を抽出
-            # 大分類コード1と2の商品は拡張コードで取得されるため、すべての拡張コードが取得できなかった場合のみリストに含める
-            not_found_list = []
-            for _, row in st.session_state.sale_list.iterrows():
-                code = str(row['商品コード']).strip()
-                cat_code = row['大分類コード']
-                
-                # 大分類コード1の商品は、すべての拡張コードが取得できなかった場合のみリストに含める
-                if cat_code == 1:
-                    if code not in cat1_codes:
-                        # 拡張コードで取得できなかった場合のみ追加
-                        not_found_list.append(row)
-                # 大分類コード2の商品は、-50が取得できなかった場合のみリストに含める
-                elif cat_code == 2:
-                    if code not in cat2_codes:
-                        # 拡張コードで取得できなかった場合のみ追加
-                        not_found_list.append(row)
-                # その他の商品は元の商品コードで比較（空白除去して比較）
-                else:
-                    if code not in other_codes:
-                        not_found_list.append(row)
-            
-            # 空のリストの場合は元のsale_listと同じカラムを持つ空のDataFrameを作成
-            if not_found_list:
-                not_found_df = pd.DataFrame(not_found_list)
-            else:
-                not_found_df = pd.DataFrame(columns=st.session_state.sale_list.columns)
-            
-            if not not_found_df.empty:
-                st.markdown("---")
-                st.subheader("❌ 取得できなかった商品")
-                st.warning(f"{len(not_found_df)}件の商品が取得できませんでした")
-                
-                # 理由を追加（拡張コードから元の商品コードにマッピング）
-                if st.session_state.not_found_reasons_yahoo:
-                    def get_reason(row):
-                        code = str(row['商品コード']).strip()
-                        cat_code = row['大分類コード']
-                        reasons = []
-                        
-                        # 大分類コード1の場合は複数の拡張コードをチェック
-                        if cat_code == 1:
-                            for suffix in ['-50', '-100', '-200', '-300', '-400', '-500']:
-                                ext_code = code + suffix
-                                if ext_code in st.session_state.not_found_reasons_yahoo:
-                                    reasons.append(f"{ext_code}: {st.session_state.not_found_reasons_yahoo[ext_code]}")
-                        # 大分類コード2の場合は-50をチェック
-                        elif cat_code == 2:
-                            ext_code = code + '-50'
-                            if ext_code in st.session_state.not_found_reasons_yahoo:
-                                reasons.append(st.session_state.not_found_reasons_yahoo[ext_code])
-                        # その他の場合は元の商品コードをチェック
-                        else:
-                            if code in st.session_state.not_found_reasons_yahoo:
-                                reasons.append(st.session_state.not_found_reasons_yahoo[code])
-                        
-                        return "; ".join(reasons) if reasons else "理由不明"
-                    
-                    not_found_df['取得失敗理由'] = not_found_df.apply(get_reason, axis=1)
-                else:
-                    not_found_df['取得失敗理由'] = "理由不明"
-                
-                # 商品コード、商品名、取得失敗理由のみを抽出
-                display_columns = ['商品コード', '商品名', '取得失敗理由']
-                # 商品名の列が存在するか確認
-                if '商品名' not in not_found_df.columns:
-                    # 商品名の列がない場合は空の列を追加
-                    not_found_df['商品名'] = ''
-                not_found_display_df = not_found_df[display_columns].copy()
-                
-                # 取得できなかった商品を表示
-                st.dataframe(
-                    not_found_display_df,
-                    use_container_width=True,
-                    height=400
-                )
-                
-                # 取得できなかった商品のダウンロードボタン
-                csv_data_not_found = not_found_display_df.to_csv(index=False, encoding='utf-8-sig')
-                st.download_button(
-                    label="取得できなかった商品データをダウンロード",
-                    data=csv_data_not_found,
-                    file_name=f"取得できなかった商品_Yahoo!ショッピング_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv"
+            not_found_display_df = result_view(
+                'not_found_yahoo',
+                (st.session_state.sale_list, st.session_state.df_yahoo, st.session_state.not_found_reasons_yahoo),
+                lambda: build_not_found_marketplace(
+                    st.session_state.sale_list, st.session_state.df_yahoo,
+                    st.session_state.not_found_reasons_yahoo
                 )
+            )
+            render_not_found(not_found_display_df, "Yahoo!ショッピング")
         
         # ダウンロードボタン
-        csv_data = st.session_state.df_yahoo.to_csv(index=False, encoding='utf-8-sig')
-        st.download_button(
-            label="Yahoo!ショッピングデータをダウンロード",
-            data=csv_data,
-            file_name=f"Yahoo!ショッピングデータ_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv"
-        )
+        render_csv_download(st.session_state.df_yahoo, "Yahoo!ショッピングデータをダウンロード", "Yahoo!ショッピングデータ")
+        
+        # 計測データ
+        render_fetch_metrics(st.session_state.fetch_metrics_yahoo, "Yahoo!ショッピング")
+
+    # 価格比較
+    render_price_comparison()
+
+    # プロファイル
+    render_profiles()
 
     # サイドバーに結果表示
     st.sidebar.markdown("---")
@@ -1167,4 +2443,14 @@ def main():
     )
 
 if __name__ == "__main__":
-    main()
+    if profile_enabled():
+        # 画面表示のプロファイル（取得後の st.rerun() 等で中断した再実行は記録しない）
+        render_profiler = run_profiler.RunProfiler('render', trace_memory=st.session_state.get('profile_memory', True))
+        render_profiler.start()
+        try:
+            main()
+        finally:
+            render_profiler.stop()
+        store_profile('render', render_profiler)
+    else:
+        main()
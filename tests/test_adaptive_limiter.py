@@ -0,0 +1,175 @@
+"""adaptive_limiter.AdaptiveConcurrencyLimiter（AIMD方式の同時リクエスト数の調整）のテスト
+
+レイテンシ・エラーの結果を決まった順で与え、上限の増減・減少後の待機・範囲内への制限を確認する。
+履歴の経過秒は差し替えた時計で確認する。
+"""
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import pytest  # noqa: E402
+
+from adaptive_limiter import AdaptiveConcurrencyLimiter  # noqa: E402
+
+
+class FakeClock:
+    """呼び出すたびに step 秒ずつ進む時計"""
+
+    def __init__(self, step=0.5):
+        self.now = 100.0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+def make_limiter(**kwargs):
+    options = {'min_limit': 1, 'max_limit': 4, 'window': 4, 'clock': FakeClock()}
+    options.update(kwargs)
+    return AdaptiveConcurrencyLimiter(**options)
+
+
+def saturate(limiter, latency, requests):
+    """常に上限まで実行枠を使い切りながら requests 件を完了させる（続きのリクエストは処理中のまま残す）"""
+    for _ in range(requests):
+        while limiter.try_acquire():
+            pass
+        limiter.release(latency)
+
+
+def reasons(limiter):
+    return [(limit, reason) for _, limit, reason in limiter.history]
+
+
+@pytest.mark.parametrize('min_limit, max_limit', [(0, 4), (3, 2)])
+def test_invalid_range(min_limit, max_limit):
+    with pytest.raises(ValueError):
+        AdaptiveConcurrencyLimiter(min_limit=min_limit, max_limit=max_limit)
+
+
+@pytest.mark.parametrize('initial, expected', [(None, 2), (0, 2), (3, 3), (10, 5)])
+def test_initial_limit_is_clamped(initial, expected):
+    limiter = make_limiter(min_limit=2, max_limit=5, initial_limit=initial)
+    assert limiter.current_limit == expected
+    assert limiter.history == [(0.0, expected, 'initial')]
+
+
+def test_additive_increase_per_window():
+    limiter = make_limiter()
+    saturate(limiter, 0.1, 4)
+    assert limiter.current_limit == 2
+    assert limiter.baseline_latency == 0.1
+    saturate(limiter, 0.1, 4)
+    assert limiter.current_limit == 3
+    assert reasons(limiter) == [(1, 'initial'), (2, 'increase'), (3, 'increase')]
+
+
+def test_no_increase_when_limit_is_not_used():
+    limiter = make_limiter(initial_limit=2)
+    # 1件ずつ実行している間は上限を使い切っていないため増やさない
+    for _ in range(12):
+        assert limiter.try_acquire()
+        limiter.release(0.1)
+    assert limiter.current_limit == 2
+    assert limiter.increases == 0
+
+
+def test_increase_stops_at_max_limit():
+    limiter = make_limiter(max_limit=3)
+    for _ in range(5):
+        saturate(limiter, 0.1, 4)
+    assert limiter.current_limit == 3
+    assert limiter.increases == 2
+    assert limiter.peak_limit == 3
+
+
+def test_try_acquire_respects_limit():
+    limiter = make_limiter(initial_limit=2)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    assert not limiter.acquire(timeout=0)
+    limiter.release(0.1)
+    assert limiter.try_acquire()
+
+
+def test_multiplicative_decrease_on_error():
+    limiter = make_limiter(max_limit=8, initial_limit=8)
+    limiter.try_acquire()
+    limiter.release(5.0, error=True)
+    assert limiter.current_limit == 4
+    assert limiter.decreases == 1
+    assert reasons(limiter)[-1] == (4, 'error')
+
+
+def test_multiplicative_decrease_on_p95_latency():
+    limiter = make_limiter(max_limit=8, initial_limit=8)
+    saturate(limiter, 0.1, 8)
+    assert limiter.baseline_latency == 0.1
+    # p95 が基準値の2倍を超えたら下げる（平均ではなくp95で判定する）
+    for latency in [0.1] * 6 + [1.0] * 2:
+        limiter.release(latency)
+    assert limiter.current_limit == 4
+    assert reasons(limiter)[-1] == (4, 'latency')
+
+
+def test_latency_within_tolerance_keeps_limit():
+    limiter = make_limiter(max_limit=4, initial_limit=4)
+    saturate(limiter, 0.1, 4)
+    saturate(limiter, 0.19, 8)
+    assert limiter.decreases == 0
+    assert limiter.current_limit == 4
+
+
+def test_baseline_drifts_up_slowly():
+    limiter = make_limiter(max_limit=2, initial_limit=2, baseline_drift=1.5)
+    saturate(limiter, 0.1, 4)
+    saturate(limiter, 0.4, 4)
+    # 基準値は観測したp95の最小値だが、ウィンドウごとに baseline_drift 倍まで引き上げる
+    assert limiter.baseline_latency == pytest.approx(0.15)
+    assert limiter.current_limit == 1
+
+
+def test_cooldown_ignores_errors_from_the_same_overload():
+    limiter = make_limiter(max_limit=8, initial_limit=8)
+    for _ in range(8):
+        assert limiter.try_acquire()
+    limiter.release(5.0, error=True)
+    assert limiter.current_limit == 4
+    # 減少時に処理中だった7件が完了するまでは、エラーでも下げない
+    for _ in range(6):
+        limiter.release(5.0, error=True)
+    assert limiter.current_limit == 4
+    limiter.release(5.0, error=True)
+    assert limiter.current_limit == 2
+    assert limiter.decreases == 2
+
+
+def test_decrease_stops_at_min_limit():
+    limiter = make_limiter(min_limit=2, max_limit=8, initial_limit=3)
+    for _ in range(3):
+        limiter.try_acquire()
+        limiter.release(5.0, error=True)
+    assert limiter.current_limit == 2
+    assert limiter.decreases == 1
+    assert limiter.stats()['final_limit'] == 2
+
+
+def test_history_uses_injected_clock():
+    clock = FakeClock(step=0.25)
+    limiter = make_limiter(clock=clock)
+    saturate(limiter, 0.1, 4)
+    limiter.try_acquire()
+    limiter.release(5.0, error=True)
+    assert limiter.history == [(0.0, 1, 'initial'), (0.25, 2, 'increase'), (0.5, 1, 'error')]
+
+
+def test_stats():
+    limiter = make_limiter()
+    saturate(limiter, 0.1, 4)
+    assert limiter.stats() == {
+        'min_limit': 1, 'max_limit': 4, 'final_limit': 2, 'peak_limit': 2,
+        'increases': 1, 'decreases': 0, 'baseline_latency_s': 0.1,
+    }
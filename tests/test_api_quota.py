@@ -0,0 +1,128 @@
+"""api_quota（APIの利用制限の見積もり・使用量の記録）のテスト
+
+取得の分割（plan_job）と、1日の上限回数が日本時間0時にリセットされることを確認する。
+"""
+import os
+import sys
+from datetime import datetime
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import pytest  # noqa: E402
+
+import api_quota  # noqa: E402
+
+# 2026-10-19 00:00（日本時間）= 2026-10-18 15:00（UTC）
+JST_MIDNIGHT = datetime(2026, 10, 19, tzinfo=api_quota.QUOTA_TZ).timestamp()
+# 1チャンクの呼び出し回数の上限（Yahoo!ショッピング: 50,000回の95%）
+YAHOO_CHUNK_CALLS = 47500
+
+
+@pytest.fixture
+def quota_db(tmp_path):
+    return str(tmp_path / 'api_quota.sqlite3')
+
+
+def test_quota_day_changes_at_jst_midnight():
+    assert api_quota.quota_day(JST_MIDNIGHT - 1) == '2026-10-18'
+    assert api_quota.quota_day(JST_MIDNIGHT) == '2026-10-19'
+
+
+@pytest.mark.parametrize('now', [JST_MIDNIGHT - 1, JST_MIDNIGHT - 12 * 3600, JST_MIDNIGHT - 86400])
+def test_next_reset(now):
+    assert api_quota.next_reset(now) == JST_MIDNIGHT
+
+
+def test_usage_resets_at_jst_midnight(quota_db):
+    api_quota.record_usage(quota_db, 'yahoo', 100, codes=90, code_calls=95, now=JST_MIDNIGHT - 60)
+    api_quota.record_usage(quota_db, 'yahoo', 20, now=JST_MIDNIGHT - 1)
+    api_quota.record_usage(quota_db, 'yahoo', 7, now=JST_MIDNIGHT)
+    assert api_quota.usage_today(quota_db, 'yahoo', now=JST_MIDNIGHT - 1) == 120
+    assert api_quota.usage_today(quota_db, 'yahoo', now=JST_MIDNIGHT + 3600) == 7
+    # 他のAPIの使用量は数えない
+    assert api_quota.usage_today(quota_db, 'rakuten', now=JST_MIDNIGHT) == 0
+    # 1件あたりの呼び出し回数は日をまたいで集計する
+    assert api_quota.calls_per_code(quota_db, 'yahoo') == pytest.approx(95 / 90)
+
+
+def test_calls_per_code_without_history(quota_db):
+    assert api_quota.calls_per_code(quota_db, 'yahoo') == 1.0
+
+
+def test_plan_without_daily_limit_is_one_chunk():
+    now = JST_MIDNIGHT + 3600
+    plan = api_quota.plan_job('rakuten', 1000, 1.5, 0, 2.1, now=now)
+    assert plan['calls'] == 1500
+    assert plan['interval_s'] == 2.1
+    assert not plan['interval_too_short']
+    assert plan['remaining_today'] is None
+    assert plan['chunks'] == [{'start': 0, 'end': 1000, 'calls': 1500, 'not_before': now}]
+
+
+@pytest.mark.parametrize('source, interval, expected', [
+    pytest.param('rakuten', 1.0, 2.0, id='rakuten-30-per-minute'),
+    pytest.param('yahoo', 0.5, 2.0, id='yahoo-30-per-minute'),
+    pytest.param('yahoo', 3.0, 3.0, id='longer-interval'),
+])
+def test_plan_interval_respects_per_minute_limit(source, interval, expected):
+    plan = api_quota.plan_job(source, 10, 1.0, 0, interval, now=JST_MIDNIGHT)
+    assert plan['interval_s'] == expected
+    assert plan['interval_too_short'] == (interval < expected)
+    assert plan['duration_s'] == 10 * expected
+
+
+def test_plan_fits_in_one_chunk_today():
+    now = JST_MIDNIGHT + 3600
+    plan = api_quota.plan_job('yahoo', 1000, 1.0, 10000, 2.1, now=now)
+    assert plan['remaining_today'] == 40000
+    assert plan['codes_per_chunk'] == YAHOO_CHUNK_CALLS
+    assert plan['chunks'] == [{'start': 0, 'end': 1000, 'calls': 1000, 'not_before': now}]
+
+
+def test_plan_splits_into_daily_chunks():
+    now = JST_MIDNIGHT + 3600
+    plan = api_quota.plan_job('yahoo', 100000, 1.0, 0, 2.1, now=now)
+    reset = JST_MIDNIGHT + 86400
+    assert [(chunk['start'], chunk['end']) for chunk in plan['chunks']] == [
+        (0, 47500), (47500, 95000), (95000, 100000),
+    ]
+    # 1チャンク目は今日、以降は日本時間0時のリセットごとに1チャンクずつ
+    assert [chunk['not_before'] for chunk in plan['chunks']] == [now, reset, reset + 86400]
+    assert all(chunk['calls'] <= YAHOO_CHUNK_CALLS for chunk in plan['chunks'])
+
+
+def test_plan_chunk_size_uses_calls_per_code():
+    plan = api_quota.plan_job('yahoo', 50000, 2.5, 0, 2.1, now=JST_MIDNIGHT)
+    assert plan['codes_per_chunk'] == YAHOO_CHUNK_CALLS // 2.5
+    assert [chunk['calls'] for chunk in plan['chunks']] == [47500, 47500, 30000]
+
+
+def test_plan_defers_first_chunk_when_today_is_used_up():
+    now = JST_MIDNIGHT + 3600
+    plan = api_quota.plan_job('yahoo', 60000, 1.0, 49000, 2.1, now=now)
+    reset = JST_MIDNIGHT + 86400
+    assert plan['remaining_today'] == 1000
+    assert [chunk['not_before'] for chunk in plan['chunks']] == [reset, reset + 86400]
+
+
+def test_plan_resumes_with_recorded_chunk_size():
+    plan = api_quota.plan_job('yahoo', 100000, 3.0, 0, 2.1, now=JST_MIDNIGHT, codes_per_chunk=40000)
+    assert plan['codes_per_chunk'] == 40000
+    assert [(chunk['start'], chunk['end']) for chunk in plan['chunks']] == [(0, 40000), (40000, 80000), (80000, 100000)]
+
+
+def test_plan_without_codes():
+    plan = api_quota.plan_job('yahoo', 0, 1.0, 0, 2.1, now=JST_MIDNIGHT)
+    assert plan['calls'] == 0
+    assert plan['chunks'] == [{'start': 0, 'end': 0, 'calls': 0, 'not_before': JST_MIDNIGHT}]
+
+
+def test_chunk_runs_keep_last_chunk_size(quota_db):
+    api_quota.mark_chunk_done(quota_db, 'yahoo', 'plan', 1, 40000)
+    assert list(api_quota.done_chunks(quota_db, 'yahoo', 'plan')[0]) == [1]
+    # 区切りを変えて実行し直した場合は、前の区切りのチャンクは実行済みとしない
+    api_quota.mark_chunk_done(quota_db, 'yahoo', 'plan', 2, 30000)
+    done, chunk_size = api_quota.done_chunks(quota_db, 'yahoo', 'plan')
+    assert list(done) == [2] and chunk_size == 30000
+    assert api_quota.done_chunks(quota_db, 'yahoo', 'other') == ({}, None)
@@ -0,0 +1,158 @@
+"""catalog_sync（店舗カタログの価格帯分割による列挙・照合）のテスト
+
+価格の安い順に返す検索APIの代わり（FakeCatalogApi）で、価格帯の分割・1ページ目の再利用・
+取得できる件数の上限を超える価格の扱い・失敗した価格帯を確認する。
+"""
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+
+import catalog_sync  # noqa: E402
+from fetch_failures import FetchFailure  # noqa: E402
+
+PAGE_SIZE = 3
+MAX_RESULTS = 10
+
+
+class FakeCatalogApi:
+    """価格帯（両端を含む）で検索し、価格の安い順にページ単位で返す検索APIの代わり"""
+
+    def __init__(self, prices, fail_bands=()):
+        self.catalog = sorted((price, f"{100000 + i}") for i, price in enumerate(prices))
+        self.fail_bands = set(fail_bands)
+        self.requests = []
+
+    def fetch_page(self, low, high, page):
+        self.requests.append((low, high, page))
+        if (low, high) in self.fail_bands:
+            return [], 0, FetchFailure('server_error', '503')
+        matched = [(price, code) for price, code in self.catalog if low <= price <= high]
+        start = (page - 1) * PAGE_SIZE
+        assert start < MAX_RESULTS
+        items = [
+            {'itemCode': code, 'itemName': f"商品 {code}", 'itemPrice': price, 'pointRate': 1, 'postageFlag': '送料込'}
+            for price, code in matched[start:min(start + PAGE_SIZE, MAX_RESULTS)]
+        ]
+        return items, len(matched), None
+
+    def codes(self, low=0, high=catalog_sync.PRICE_CEILING):
+        return {code for price, code in self.catalog if low <= price <= high}
+
+
+def enumerate_all(api, **kwargs):
+    return catalog_sync.enumerate_catalog(api.fetch_page, PAGE_SIZE, MAX_RESULTS, **kwargs)
+
+
+def test_single_band():
+    api = FakeCatalogApi([100 * i for i in range(1, 9)])
+    items, failed_bands, stats = enumerate_all(api)
+    assert set(items) == api.codes()
+    assert failed_bands == []
+    assert api.requests == [(0, catalog_sync.PRICE_CEILING, page) for page in (1, 2, 3)]
+    assert stats == {'requests': 3, 'bands': 1, 'splits': 0, 'truncated_bands': 0, 'reused_pages': 0}
+
+
+def test_split_finds_every_item_without_refetching_first_pages():
+    api = FakeCatalogApi([500 + (i * 37) % 200 for i in range(120)])
+    items, failed_bands, stats = enumerate_all(api)
+    assert set(items) == api.codes()
+    assert failed_bands == []
+    assert stats['splits'] > 0 and stats['truncated_bands'] == 0
+    # 二分した下側の価格帯の1ページ目は取得せず、分割前の1ページ目を使う
+    assert stats['reused_pages'] == stats['splits']
+    assert len(api.requests) == len(set(api.requests)) == stats['requests']
+    first_pages = [(low, high) for low, high, page in api.requests if page == 1]
+    assert len(first_pages) == 1 + stats['splits']
+
+
+def test_split_bands_do_not_overlap():
+    api = FakeCatalogApi([500 + i % 40 for i in range(200)])
+    enumerate_all(api)
+    bands = sorted({(low, high) for low, high, _ in api.requests})
+    leaves = [band for band in bands if not any(o != band and band[0] <= o[0] <= o[1] <= band[1] for o in bands)]
+    assert all(a[1] < b[0] for a, b in zip(leaves, leaves[1:]))
+
+
+def test_two_price_band_is_split_into_single_prices():
+    api = FakeCatalogApi([100] * 8 + [101] * 8)
+    items, failed_bands, stats = catalog_sync.enumerate_catalog(api.fetch_page, PAGE_SIZE, MAX_RESULTS, low=100, high=101)
+    # 2つの価格だけの価格帯も1つの価格ずつに分割し、上限で切り捨てない
+    assert set(items) == api.codes()
+    assert stats['truncated_bands'] == 0
+    assert (101, 101, 1) in api.requests
+    assert (100, 100, 1) not in api.requests
+
+
+def test_single_price_over_limit_is_truncated():
+    api = FakeCatalogApi([100] * 15 + [200] * 2)
+    items, failed_bands, stats = enumerate_all(api)
+    assert stats['truncated_bands'] == 1
+    assert len(api.codes(100, 100) & set(items)) == MAX_RESULTS
+    assert api.codes(200, 200) <= set(items)
+    assert failed_bands == []
+
+
+def test_failed_upper_band_fetches_lower_first_page():
+    prices = [100 + i for i in range(30)]
+    api = FakeCatalogApi(prices, fail_bands={(65, 129)})
+    items, failed_bands, stats = catalog_sync.enumerate_catalog(api.fetch_page, PAGE_SIZE, MAX_RESULTS, low=0, high=129)
+    assert [(low, high) for low, high, _ in failed_bands] == [(65, 129)]
+    # 上側の件数がわからないため、下側の1ページ目は取得し直す
+    assert (0, 64, 1) in api.requests
+    assert set(items) == api.codes(0, 64)
+
+
+def test_unparsable_prices_fetch_lower_first_page():
+    api = FakeCatalogApi([100 + i for i in range(30)])
+    fetch_page = api.fetch_page
+
+    def without_prices(low, high, page):
+        page_items, total, failure = fetch_page(low, high, page)
+        return [{**item, 'itemPrice': ''} for item in page_items], total, failure
+
+    items, _, stats = catalog_sync.enumerate_catalog(without_prices, PAGE_SIZE, MAX_RESULTS, low=0, high=129)
+    assert set(items) == api.codes()
+    assert stats['reused_pages'] == 0
+
+
+def test_on_page_reports_reused_first_page():
+    api = FakeCatalogApi([100 + i for i in range(40)])
+    pages = []
+    _, _, stats = catalog_sync.enumerate_catalog(
+        api.fetch_page, PAGE_SIZE, MAX_RESULTS, low=0, high=127,
+        on_page=lambda low, high, page, total, collected: pages.append((low, high, page)),
+    )
+    # 1ページ目を再利用した価格帯も含め、取得した価格帯ごとに1ページ目を1回ずつ通知する
+    first_pages = [(low, high) for low, high, page in pages if page == 1]
+    assert len(first_pages) == len(set(first_pages)) == stats['bands']
+    assert stats['reused_pages'] > 0
+
+
+def test_save_load_and_match(tmp_path):
+    path = str(tmp_path / 'catalog.sqlite3')
+    api = FakeCatalogApi([100, 200, 300])
+    items, _, stats = enumerate_all(api)
+    catalog_sync.save_catalog(path, 'rakuten', items, complete=True, requests=stats['requests'])
+    info = catalog_sync.load_catalog_info(path, 'rakuten')
+    assert (info['complete'], info['items'], info['requests']) == (True, 3, 1)
+    assert catalog_sync.load_catalog_info(path, 'yahoo') is None
+    sale_list = pd.DataFrame({'商品コード': ['100000', '100002', '999999', '100000']})
+    found, missing = catalog_sync.match_catalog(sale_list, catalog_sync.load_catalog(path, 'rakuten'))
+    assert found['itemCode'].tolist() == ['100000', '100002']
+    assert found['itemPrice'].tolist() == [100.0, 300.0]
+    assert missing == ['999999']
+
+
+@pytest.mark.parametrize('item, expected', [
+    ({'itemPrice': 1580}, 1580.0),
+    ({'itemPrice': '1580'}, 1580.0),
+    ({'itemPrice': ''}, None),
+    ({}, None),
+])
+def test_item_price(item, expected):
+    assert catalog_sync._item_price(item) == expected
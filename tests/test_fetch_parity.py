@@ -0,0 +1,132 @@
+"""取得エンジン（run_source_fetch と FETCH_SOURCES の取得先ごとの処理）の結果の一致テスト
+
+ローカルのモックサーバー（benchmarks/mock_servers.py）に対して scrape_own_site / get_rakuten_data /
+get_yahoo_data を実行し、取得エンジンへ移す前の関数の結果（fixtures/fetch_parity_baseline.json）と
+結果の表・取得失敗の理由・リクエスト数が同じことを確認する。
+
+基準の結果は、取得エンジンへ移す前のコミット（c1bee5a）で次のように作成した:
+    python tests/test_fetch_parity.py --write-baseline tests/fixtures/fetch_parity_baseline.json
+"""
+import importlib
+import json
+import os
+import sys
+import tempfile
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+sys.path.insert(0, REPO_DIR)
+
+import pytest  # noqa: E402
+
+from mock_servers import MockConfig, start_in_process  # noqa: E402
+
+BASELINE_PATH = os.path.join(TESTS_DIR, 'fixtures', 'fetch_parity_baseline.json')
+# 販売リストの件数・大分類コード（1は拡張コードに展開する）
+SALE_LIST_SIZE = 60
+CATEGORIES = (1, 3)
+# モックサーバーの設定（エラーなし。未掲載は商品コードごとに決まる）
+MOCK_CONFIG = MockConfig(latency_ms=1, jitter_ms=0, not_found_rate=0.05, seed=1)
+
+
+def fetch_all(size, categories):
+    """各取得先・オプションで取得し、結果をセッション状態の 'parity' に保存するスクリプト（AppTest で実行）"""
+    import streamlit as st
+    import streamlit_scraping_app as app
+    from run_benchmarks import make_sale_list
+
+    fetchers = {
+        'own_site': (lambda sale_list, spill: app.scrape_own_site(sale_list, spill=spill), 'onlinestore'),
+        'own_site_concurrent': (
+            lambda sale_list, spill: app.scrape_own_site(sale_list, spill=spill, max_concurrency=4, skip_unchanged=True),
+            'onlinestore'
+        ),
+        'rakuten': (lambda sale_list, spill: app.get_rakuten_data(sale_list, spill=spill), 'rakuten'),
+        'yahoo': (lambda sale_list, spill: app.get_yahoo_data(sale_list, spill=spill), 'yahoo'),
+    }
+    results = {}
+    for category in categories:
+        sale_list = make_sale_list(size, category=category)
+        for spill in (False, True):
+            for name, (fetch, state_key) in fetchers.items():
+                df = app.result_frame(fetch(sale_list, spill))
+                reasons = st.session_state[f'not_found_reasons_{state_key}']
+                metrics = st.session_state[f'fetch_metrics_{state_key}']
+                results[f"{name}/category{category}/{'spill' if spill else 'memory'}"] = {
+                    'columns': [str(column) for column in df.columns],
+                    'rows': df.astype(str).values.tolist(),
+                    'not_found': {code: failure.kind for code, failure in sorted(reasons.items())},
+                    'requests': metrics.summary()['requests'],
+                }
+    st.session_state['parity'] = results
+
+
+def collect_results():
+    """モックサーバーを起動して全ケースを取得し、ケース名 → 結果の辞書を返す関数"""
+    from streamlit.testing.v1 import AppTest
+
+    process, base_url = start_in_process(MOCK_CONFIG)
+    work_dir = tempfile.mkdtemp()
+    os.environ.update({
+        'OWN_SITE_BASE_URL': base_url,
+        'RAKUTEN_API_URL': f"{base_url}/rakuten",
+        'YAHOO_API_URL': f"{base_url}/yahoo",
+        'API_REQUEST_INTERVAL': '0',
+        'API_RETRY_WAIT': '0.01',
+        'RETRY_PASS_DELAY': '0',
+        'QUOTA_DB': os.path.join(work_dir, 'api_quota.sqlite3'),
+        'PAGE_CACHE_DB': os.path.join(work_dir, 'page_cache.sqlite3'),
+        'PRIORITY_DB': os.path.join(work_dir, 'fetch_history.sqlite3'),
+        'SPILL_DIR': work_dir,
+    })
+    # 取得先は読み込み時に環境変数から決まるため、他のテストで読み込み済みのモジュールは読み込み直す
+    for name in ('own_site_fetch', 'own_site_worker'):
+        if name in sys.modules:
+            importlib.reload(sys.modules[name])
+    # Streamlitはスクリプトを __main__ として実行したまま戻さないため、後で戻す
+    # （戻さないと、以降のテストで spawn したモックサーバーのプロセスがスクリプトを実行しようとして起動しない）
+    main_module = sys.modules['__main__']
+    try:
+        at = AppTest.from_function(fetch_all, args=(SALE_LIST_SIZE, CATEGORIES), default_timeout=600)
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        return at.session_state['parity']
+    finally:
+        sys.modules['__main__'] = main_module
+        process.terminate()
+
+
+@pytest.fixture(scope='module')
+def results():
+    return collect_results()
+
+
+def load_baseline():
+    with open(BASELINE_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+# 基準の結果がない場合（基準を作成する時）はケースなし（test_covers_all_baseline_cases は失敗する）
+@pytest.mark.parametrize('case', sorted(load_baseline()) if os.path.exists(BASELINE_PATH) else [])
+def test_matches_pre_port_results(results, case):
+    expected = load_baseline()[case]
+    actual = results[case]
+    assert actual['columns'] == expected['columns']
+    assert actual['rows'] == expected['rows']
+    assert actual['not_found'] == expected['not_found']
+    assert actual['requests'] == expected['requests']
+
+
+def test_covers_all_baseline_cases(results):
+    assert sorted(results) == sorted(load_baseline())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != '--write-baseline':
+        sys.exit(f"使い方: python {sys.argv[0]} --write-baseline 出力先のパス")
+    baseline = collect_results()
+    with open(sys.argv[2], 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=1)
+    print(f"基準の結果を保存しました: {sys.argv[2]}（{len(baseline)}ケース）")
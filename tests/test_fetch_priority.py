@@ -0,0 +1,126 @@
+"""fetch_priority（商品コードを取得する順番の決定）のテスト
+
+優先度の点数による並び順（販売リストの変更・差額・失敗・アイコン・通販単価の順位）と、
+点数が同じ商品コードは販売リストの並び順になること、取得結果の保存・読み込みを確認する。
+"""
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+
+import fetch_priority  # noqa: E402
+from fetch_priority import FAILED, MISMATCH, OK  # noqa: E402
+
+
+@pytest.fixture
+def history_db(tmp_path):
+    return str(tmp_path / 'fetch_history.sqlite3')
+
+
+def sale_list(prices, codes=None):
+    codes = codes or [str(100001 + i) for i in range(len(prices))]
+    return pd.DataFrame({'商品コード': codes, '通販単価': prices, '送料区分名': ['通常'] * len(prices)})
+
+
+def order_codes(path, source, rows):
+    order, _ = fetch_priority.prioritize(path, source, rows)
+    return [rows['code'][i] for i in order]
+
+
+def test_code_rows_strips_and_deduplicates():
+    df = sale_list(['1,580', '980', '1,200'], codes=[' 100001', '100002', '100001 '])
+    rows = fetch_priority.code_rows(df)
+    assert rows['code'].tolist() == ['100001', '100002']
+    assert rows['base_code'].tolist() == ['100001', '100002']
+    assert rows['price'].tolist() == [1580.0, 980.0]
+
+
+def test_code_rows_base_column():
+    df = sale_list(['1,000', '2,000'], codes=['100001-01', '100001-02']).assign(基本コード=['100001', '100001'])
+    rows = fetch_priority.code_rows(df, base_column='基本コード')
+    assert rows['base_code'].tolist() == ['100001', '100001']
+
+
+def test_first_fetch_orders_by_price(history_db):
+    rows = fetch_priority.code_rows(sale_list(['980', '1,580', 'abc', '12,000']))
+    order, stats = fetch_priority.prioritize(history_db, 'own_site', rows)
+    # 初めて取得する商品コードはすべて「変更あり」。通販単価の高い順、価格のない行は最後
+    assert order == [3, 1, 0, 2]
+    assert stats == {'codes': 4, 'history': 0, 'edited': 4, 'mismatch': 0, 'failed': 0, 'icon': 0}
+
+
+def test_ties_keep_sale_list_order(history_db):
+    rows = fetch_priority.code_rows(sale_list(['1,000', '2,000', '1,000', '2,000', '1,000']))
+    assert fetch_priority.prioritize(history_db, 'own_site', rows)[0] == [1, 3, 0, 2, 4]
+
+
+def test_score_ordering(history_db):
+    df = sale_list(['1,000', '2,000', '3,000', '4,000', '5,000', '6,000'])
+    rows = fetch_priority.code_rows(df)
+    codes = rows['code'].tolist()
+    fetch_priority.record_outcomes(
+        history_db, 'own_site', rows,
+        {codes[0]: MISMATCH, codes[1]: OK, codes[2]: FAILED, codes[3]: OK, codes[4]: OK, codes[5]: OK},
+        icons={codes[1]: ['SALE', 'NEW']},
+    )
+    # 販売リストの行を変更した商品コード
+    df.loc[4, '送料区分名'] = '送料無料'
+    rows = fetch_priority.code_rows(df)
+    order, stats = fetch_priority.prioritize(history_db, 'own_site', rows)
+    # 差額あり(3) > 変更あり(2)・アイコンあり(2)（同点は通販単価の順位）> 失敗(1.5) > 通販単価の順位のみ
+    assert [rows['code'][i] for i in order] == [codes[0], codes[4], codes[1], codes[2], codes[5], codes[3]]
+    assert stats == {'codes': 6, 'history': 6, 'edited': 1, 'mismatch': 1, 'failed': 1, 'icon': 1}
+
+
+def test_marketplace_uses_own_site_icons_by_base_code(history_db):
+    own_rows = fetch_priority.code_rows(sale_list(['1,000', '1,000'], codes=['100001', '100002']))
+    fetch_priority.record_outcomes(
+        history_db, 'own_site', own_rows, {'100001': OK, '100002': OK}, icons={'100002': ['期間限定']}
+    )
+    df = sale_list(['1,000'] * 3, codes=['100001-01', '100002-01', '100002-02'])
+    rows = fetch_priority.code_rows(df.assign(基本コード=['100001', '100002', '100002']), base_column='基本コード')
+    order, stats = fetch_priority.prioritize(history_db, 'rakuten', rows)
+    assert order == [1, 2, 0]
+    assert stats['icon'] == 2 and stats['history'] == 0
+
+
+def test_record_outcomes_round_trip(history_db):
+    rows = fetch_priority.code_rows(sale_list(['1,000', '2,000', '3,000']))
+    codes = rows['code'].tolist()
+    fetch_priority.record_outcomes(
+        history_db, 'own_site', rows, {codes[0]: OK, codes[1]: FAILED}, icons={codes[0]: ['NEW', 'SALE', '期間限定']}
+    )
+    history = fetch_priority.load_history(history_db, 'own_site')
+    # 優先度に使わないアイコンは保存しない。取得しなかった商品コードは記録しない
+    assert history == {
+        codes[0]: (rows['row_digest'][0], OK, 'SALE,期間限定'),
+        codes[1]: (rows['row_digest'][1], FAILED, ''),
+    }
+    # 取得しなかった商品コードは前回の記録を残す
+    fetch_priority.record_outcomes(history_db, 'own_site', rows, {codes[2]: MISMATCH})
+    history = fetch_priority.load_history(history_db, 'own_site')
+    assert history[codes[1]][1] == FAILED and history[codes[2]][1] == MISMATCH
+    assert fetch_priority.load_history(history_db, 'yahoo') == {}
+
+
+def test_record_outcomes_without_outcomes(history_db):
+    rows = fetch_priority.code_rows(sale_list(['1,000']))
+    fetch_priority.record_outcomes(history_db, 'own_site', rows, {})
+    assert fetch_priority.load_history(history_db, 'own_site') == {}
+
+
+@pytest.mark.parametrize('item_price, target_price, failure, expected', [
+    pytest.param('1,580', 1580.0, None, OK, id='same'),
+    pytest.param('1,580', 1579.5, None, OK, id='within-tolerance'),
+    pytest.param('1,580', 1500.0, None, MISMATCH, id='mismatch'),
+    pytest.param(None, 1500.0, None, OK, id='no-item-price'),
+    pytest.param('1,580', np.nan, None, OK, id='no-target-price'),
+    pytest.param('1,580', 1500.0, 'not_listed', FAILED, id='failed'),
+])
+def test_outcome(item_price, target_price, failure, expected):
+    assert fetch_priority.outcome(item_price, target_price, failure) == expected
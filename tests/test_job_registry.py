@@ -0,0 +1,236 @@
+"""job_registry.JobRegistry（セッション間で共有する取得処理の一覧）のテスト
+
+合流・結果の再利用・取り直し・手放し・期限切れによる破棄と、古い書き出しファイルの削除を確認する。
+時刻は job_registry の time を差し替えて進める。
+"""
+import os
+import sys
+import threading
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import pytest  # noqa: E402
+
+import job_registry  # noqa: E402
+import record_spool  # noqa: E402
+from job_registry import JobRegistry  # noqa: E402
+
+TTL = 600
+HOLDER_TTL = 3600
+
+
+class FakeTime:
+    """job_registry から見た time モジュールの代わり（advance() で進める）"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class Result:
+    """結果の書き出しファイルの代わり（path 属性を持つ値）"""
+
+    def __init__(self, path):
+        self.path = path
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(job_registry, 'time', fake)
+    return fake
+
+
+@pytest.fixture
+def evicted():
+    return []
+
+
+@pytest.fixture
+def registry(clock, evicted):
+    return JobRegistry(TTL, HOLDER_TTL, on_evict=evicted.append)
+
+
+def finish(registry, job, path='a.arrow'):
+    value = Result(path)
+    registry.run(job, lambda: {'df': value})
+    return value
+
+
+def test_claim_runs_once_and_joins_running_job(registry):
+    job, run = registry.claim('k')
+    assert run and job.running
+    again, run_again = registry.claim('k')
+    assert again is job and not run_again
+    assert job.attached == 1
+    other, run_other = registry.claim('other')
+    assert other is not job and run_other
+
+
+def test_completed_job_is_reused_within_ttl(registry, clock, evicted):
+    job, _ = registry.claim('k')
+    finish(registry, job)
+    clock.advance(TTL)
+    assert registry.claim('k') == (job, False)
+    clock.advance(1)
+    new, run = registry.claim('k')
+    # 使っているセッションのない期限切れのジョブは破棄する
+    assert new is not job and run
+    assert evicted == [job]
+
+
+def test_refresh_retires_held_job_until_released(registry, evicted):
+    job, _ = registry.claim('k')
+    value = finish(registry, job, 'old.arrow')
+    registry.hold(job, 'session-a')
+    new, run = registry.claim('k', refresh=True)
+    assert new is not job and run
+    # 取り直しても、使っているセッションがある間は古い結果を残す
+    assert evicted == []
+    assert registry.held_paths() == {'old.arrow'}
+    assert registry.release(value, 'session-a')
+    assert registry.held_paths() == set()
+    # 手放したセッションが削除するため、on_evict は呼ばない
+    assert evicted == []
+
+
+def test_refresh_joins_running_job(registry):
+    job, _ = registry.claim('k')
+    assert registry.claim('k', refresh=True) == (job, False)
+
+
+def test_refresh_discards_unheld_job(registry, evicted):
+    job, _ = registry.claim('k')
+    finish(registry, job)
+    registry.claim('k', refresh=True)
+    assert evicted == [job]
+
+
+def test_release_with_other_holders(registry):
+    job, _ = registry.claim('k')
+    value = finish(registry, job)
+    registry.hold(job, 'session-a')
+    registry.hold(job, 'session-b')
+    assert not registry.release(value, 'session-a')
+    assert registry.claim('k') == (job, False)
+    assert registry.release(value, 'session-b')
+    # 結果のファイルは削除されるため、以降の要求には共有しない
+    new, run = registry.claim('k')
+    assert new is not job and run
+
+
+def test_release_value_of_no_job(registry):
+    assert registry.release(Result('x.arrow'), 'session-a')
+
+
+def test_failed_job_is_not_shared(registry, evicted):
+    job, _ = registry.claim('k')
+
+    def fail():
+        raise RuntimeError('接続エラー')
+
+    with pytest.raises(RuntimeError):
+        registry.run(job, fail)
+    assert not job.running and isinstance(job.error, RuntimeError)
+    new, run = registry.claim('k')
+    assert new is not job and run
+    # 結果のないジョブは on_evict を呼ばない
+    assert evicted == []
+
+
+def test_abandoned_holder_expires(registry, clock, evicted):
+    job, _ = registry.claim('k')
+    finish(registry, job)
+    registry.hold(job, 'session-a')
+    clock.advance(TTL + 1)
+    # 期限切れでも、使っているセッションがあれば結果を残す
+    new, _ = registry.claim('k')
+    assert new is not job
+    assert registry.held_paths() == {'a.arrow'}
+    clock.advance(HOLDER_TTL + 1)
+    registry.claim('other')
+    # release() を呼ばずに閉じたセッションは、touch() しなければ手放したとみなす
+    assert evicted == [job]
+    assert registry.held_paths() == set()
+
+
+def test_touch_keeps_holder(registry, clock, evicted):
+    job, _ = registry.claim('k')
+    finish(registry, job)
+    registry.hold(job, 'session-a')
+    for _ in range(3):
+        clock.advance(HOLDER_TTL - 1)
+        registry.touch('session-a')
+        registry.claim('other')
+    assert evicted == []
+    assert job.holders == {'session-a': clock.now}
+
+
+def test_current_job_inside_run(registry):
+    job, _ = registry.claim('k')
+    seen = registry.run(job, lambda: {'job': job_registry.current_job()})
+    assert seen == {'job': job}
+    assert job_registry.current_job() is None
+
+
+def test_concurrent_claims_run_once():
+    registry = JobRegistry(TTL, HOLDER_TTL)
+    barrier = threading.Barrier(16)
+    results = []
+
+    def claim():
+        barrier.wait()
+        job, run = registry.claim('k')
+        if run:
+            registry.run(job, lambda: time.sleep(0.05) or {'df': Result('a.arrow')})
+        else:
+            assert job.wait(5)
+        results.append((job, run))
+
+    threads = [threading.Thread(target=claim) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(run for _, run in results) == 1
+    assert len({id(job) for job, _ in results}) == 1
+
+
+def test_progress_mirror():
+    class Element:
+        def __init__(self):
+            self.calls = []
+
+        def progress(self, value):
+            self.calls.append(('progress', value))
+
+        def text(self, value):
+            self.calls.append(('text', value))
+
+    job = job_registry.Job('k')
+    element = Element()
+    mirror = job_registry.ProgressMirror(element, job)
+    mirror.progress(0.5)
+    mirror.text('取得中')
+    assert element.calls == [('progress', 0.5), ('text', '取得中')]
+    assert (job.progress, job.status) == (0.5, '取得中')
+
+
+def test_remove_stale_keeps_held_files(tmp_path):
+    old = time.time() - 48 * 3600
+    paths = {}
+    for name in ('held.arrow', 'stale.arrow', 'fresh.arrow', 'other.txt'):
+        path = tmp_path / name
+        path.write_bytes(b'')
+        paths[name] = str(path)
+        if name != 'fresh.arrow':
+            os.utime(path, (old, old))
+    record_spool.remove_stale(str(tmp_path), 24, keep={paths['held.arrow']})
+    assert sorted(os.listdir(tmp_path)) == ['fresh.arrow', 'held.arrow', 'other.txt']
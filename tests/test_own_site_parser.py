@@ -0,0 +1,67 @@
+"""own_site_parser.BlockScanner（受信途中で使用するブロックがそろったかの判定）のテスト
+
+受信した分ずつ渡した結果が、受信済みテキスト全体を _find_block で探した結果と同じになることを確認する。
+"""
+import os
+import random
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+sys.path.insert(0, REPO_DIR)
+
+import pytest  # noqa: E402
+
+import own_site_parser  # noqa: E402
+from mock_servers import OWN_SITE_TEMPLATE, render_own_site_page  # noqa: E402
+
+
+def blocks_complete(html):
+    """受信済みテキスト全体から、使用するブロックがすべて閉じタグまで含まれているか判定する（基準）"""
+    return all(
+        own_site_parser._find_block(html, start_pattern, tag) is not None
+        for start_pattern, tag in own_site_parser.OWN_SITE_BLOCKS
+    )
+
+
+def render(variant):
+    with open(OWN_SITE_TEMPLATE, encoding='utf-8') as f:
+        return render_own_site_page(f.read(), '100123', 'x' * 5000, variant)
+
+
+@pytest.mark.parametrize('variant', [0, 1, 2, 3])
+def test_each_character(variant):
+    # 1文字ずつ渡すと、最後の閉じタグの「>」を受信した時点でそろう
+    html = render(variant)
+    scanner = own_site_parser.BlockScanner()
+    for end in range(1, len(html) + 1):
+        if scanner.feed(html[end - 1]):
+            break
+    else:
+        pytest.fail("ブロックがそろわなかった")
+    assert blocks_complete(html[:end])
+    assert html[end - 1] == '>'
+    assert not blocks_complete(html[:end - 2])
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_chunks(seed):
+    rng = random.Random(seed)
+    html = render(seed % 4)
+    scanner = own_site_parser.BlockScanner()
+    received = ''
+    while len(received) < len(html):
+        piece = html[len(received):len(received) + rng.randint(1, 300)]
+        received += piece
+        if scanner.feed(piece):
+            break
+    assert blocks_complete(received)
+
+
+def test_missing_block():
+    html = render(0)
+    start = html.index('<div')
+    scanner = own_site_parser.BlockScanner()
+    # 商品詳細ブロックがないページは最後まで受信してもそろわない
+    assert not scanner.feed(html[:start] + html[start:].replace('goodsproductdetail_', 'other_', 1))
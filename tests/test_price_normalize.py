@@ -0,0 +1,152 @@
+"""price_normalize（取得後の価格の整形・差額計算）のテスト
+
+以前の行ごとの処理（merge_own_site_items の apply・merge_marketplace_items の .apply）と同じ結果になることを
+境界値（NaN・空・カンマ区切り・全角数字・数値でない値）で確認する。
+"""
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+
+import price_comparison  # noqa: E402
+import price_normalize  # noqa: E402
+
+
+def own_site_reference(prices, unit_prices):
+    """以前の自社サイトの通販単価の整形・差額計算（行ごと）"""
+    formatted = [
+        f"{int(str(x).replace(',', '')):,}" if pd.notnull(x) and str(x).replace(',', '').isdigit() else x
+        for x in unit_prices
+    ]
+    diffs = []
+    for price, sale in zip(prices, formatted):
+        try:
+            diffs.append(f"{int(str(price).replace(',', '')) - int(str(sale).replace(',', '')):,}")
+        except ValueError:
+            diffs.append(None)
+    return formatted, diffs
+
+
+def marketplace_reference(values):
+    """以前の楽天市場・Yahoo!ショッピングの価格の整形（行ごと）"""
+    return [('{:,.0f}'.format(x) if not np.isnan(x) else '') for x in values]
+
+
+def same_value(a, b):
+    if isinstance(a, float) and np.isnan(a):
+        return isinstance(b, float) and np.isnan(b)
+    return a == b and type(a) is type(b)
+
+
+@pytest.mark.parametrize('value, expected', [
+    pytest.param(np.nan, pd.NA, id='NaN'),
+    pytest.param(None, pd.NA, id='None'),
+    pytest.param('', pd.NA, id='empty'),
+    pytest.param('1,234', 1234, id='comma'),
+    pytest.param('1,234,567', 1234567, id='comma-millions'),
+    pytest.param(' 1580 ', 1580, id='spaces'),
+    pytest.param('-100', -100, id='negative'),
+    pytest.param('+7', 7, id='plus-sign'),
+    pytest.param('１２３', 123, id='full-width-digits'),
+    pytest.param('２，０００', pd.NA, id='full-width-comma'),
+    pytest.param('1_000', 1000, id='underscore'),
+    pytest.param('12.5', pd.NA, id='decimal'),
+    pytest.param(1200.0, pd.NA, id='float-value'),
+    pytest.param(1200, 1200, id='int-value'),
+    pytest.param('abc', pd.NA, id='non-numeric'),
+])
+def test_parse_integers(value, expected):
+    result = price_normalize.parse_integers([value])
+    assert str(result.dtype) == 'Int64'
+    if expected is pd.NA:
+        assert result.isna()[0]
+    else:
+        assert result[0] == expected
+
+
+@pytest.mark.parametrize('price, unit_price', [
+    pytest.param('1,580', '1,500', id='comma'),
+    pytest.param('1,580', np.nan, id='NaN-unit-price'),
+    pytest.param(None, '1,000', id='missing-price'),
+    pytest.param('1,580', '', id='empty-unit-price'),
+    pytest.param('1,580', None, id='None-unit-price'),
+    pytest.param('1,580', '12.5', id='decimal-unit-price'),
+    pytest.param('0', ' 1580', id='spaces-unit-price'),
+    pytest.param('1,000', '-100', id='negative-unit-price'),
+    pytest.param('100', '+7', id='plus-sign-unit-price'),
+    pytest.param('5', 1200, id='int-unit-price'),
+    pytest.param('2,000', 1200.0, id='float-unit-price'),
+    pytest.param('7', '１２３', id='full-width-digits'),
+    pytest.param('1,234', '２，０００', id='full-width-comma'),
+    pytest.param('9', '1_0', id='underscore'),
+    pytest.param('1,580', 'abc', id='non-numeric-unit-price'),
+    pytest.param('abc', '1,000', id='non-numeric-price'),
+])
+def test_own_site_prices_matches_row_wise(price, unit_price):
+    expected_units, expected_diffs = own_site_reference([price], [unit_price])
+    units, diffs = price_normalize.own_site_prices(pd.Series([price], dtype=object), pd.Series([unit_price], dtype=object))
+    assert same_value(units[0], expected_units[0])
+    assert diffs[0] == expected_diffs[0]
+
+
+def test_own_site_prices_mixed_column():
+    prices = ['1,580', None, '980', '7', 'abc', '1,000,000']
+    unit_prices = ['1,500', '1,000', np.nan, '１２３', '', None]
+    expected_units, expected_diffs = own_site_reference(prices, unit_prices)
+    units, diffs = price_normalize.own_site_prices(pd.Series(prices, dtype=object), pd.Series(unit_prices, dtype=object))
+    assert all(same_value(a, b) for a, b in zip(units, expected_units))
+    assert list(diffs) == expected_diffs
+
+
+def test_own_site_prices_empty():
+    units, diffs = price_normalize.own_site_prices(pd.Series([], dtype=object), pd.Series([], dtype=object))
+    assert len(units) == 0 and len(diffs) == 0
+
+
+@pytest.mark.parametrize('values', [
+    pytest.param([1580.0, 1234567.0], id='comma'),
+    pytest.param([np.nan], id='NaN'),
+    pytest.param([1234.5, 1235.5, 0.4], id='rounding'),
+    pytest.param([-1580.0], id='negative'),
+    pytest.param([], id='empty'),
+])
+def test_format_prices_matches_row_wise(values):
+    assert list(price_normalize.format_prices(values)) == marketplace_reference(values)
+
+
+@pytest.mark.parametrize('values, expected', [
+    pytest.param([1234, None], ['1,234', None], id='NA'),
+    pytest.param([-1000000], ['-1,000,000'], id='negative'),
+    pytest.param([], [], id='empty'),
+])
+def test_format_integers(values, expected):
+    assert list(price_normalize.format_integers(pd.array(values, dtype='Int64'))) == expected
+
+
+@pytest.mark.parametrize('values, expected', [
+    pytest.param(['1,234'], [1234.0], id='comma'),
+    pytest.param([' 1,234 '], [1234.0], id='spaces'),
+    pytest.param([np.nan], [np.nan], id='NaN'),
+    pytest.param([''], [np.nan], id='empty'),
+    pytest.param(['abc'], [np.nan], id='non-numeric'),
+    pytest.param([1580, None], [1580.0, np.nan], id='numeric-object'),
+    pytest.param(['12.5'], [12.5], id='decimal'),
+])
+def test_to_price_number(values, expected):
+    result = price_normalize.to_price_number(pd.Series(values, dtype=object)).astype(float)
+    np.testing.assert_array_equal(result.to_numpy(), np.array(expected, dtype=float))
+
+
+def test_to_price_number_keeps_numeric_column():
+    result = price_normalize.to_price_number(pd.Series([1580, 980]))
+    assert result.dtype == 'int64'
+    assert result.tolist() == [1580, 980]
+
+
+def test_price_comparison_uses_shared_parser():
+    assert price_comparison.to_price_number is price_normalize.to_price_number
@@ -0,0 +1,92 @@
+"""result_grid（取得結果の絞り込み・並べ替え）のテスト
+
+ファイルに書き出した結果（メモリ節約モード）を1列ずつ読み込んで絞り込み・並べ替えた場合と、
+データフレームから作成した索引を使った場合で、同じ行の位置になることを確認する。
+"""
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+
+import record_spool  # noqa: E402
+import result_grid  # noqa: E402
+
+
+def make_own_site_result(rows=60):
+    return pd.DataFrame({
+        'No': [f"{100000 + i}" for i in range(rows)],
+        'Name': [f"テスト商品 {'ABC'[i % 3]}{i}" for i in range(rows)],
+        'Price': [f"{(i * 37) % 2000 + 100:,}" for i in range(rows)],
+        'Point': [i % 5 for i in range(rows)],
+        'Stock': [['在庫あり', '在庫なし', None, ''][i % 4] for i in range(rows)],
+        'Icon': [[['SALE'], ['NEW', 'SALE'], [], ['NEW']][i % 4] for i in range(rows)],
+        '通販単価': [f"{(i * 37) % 2000 + 100:,}" for i in range(rows)],
+        '差額': [['0', '-100', None, '1,200'][i % 4] for i in range(rows)],
+        '送料区分名': [['送料無料', '通常', '大型'][i % 3] for i in range(rows)],
+    })
+
+
+@pytest.fixture
+def results(tmp_path):
+    df = make_own_site_result()
+    spilled = record_spool.write_result(
+        str(tmp_path / 'own_site.arrow'), [df.iloc[:25], df.iloc[25:]], record_spool.OWN_SITE_RESULT_SCHEMA
+    )
+    return df, spilled
+
+
+CONDITIONS = [
+    {},
+    {'diff': result_grid.DIFF_NONZERO},
+    {'diff': result_grid.DIFF_ZERO},
+    {'diff': result_grid.DIFF_MISSING},
+    {'categories': {'Stock': [result_grid.EMPTY_LABEL]}},
+    {'categories': {'送料区分名': ['通常', '大型'], 'Stock': []}},
+    {'list_values': {'Icon': ['NEW']}},
+    {'list_values': {'Icon': ['NEW', 'SALE']}, 'keyword': 'b'},
+    {'keyword': '10001'},
+    {'keyword': '該当なし'},
+]
+
+
+@pytest.mark.parametrize('conditions', CONDITIONS)
+@pytest.mark.parametrize('sort_column', [None, 'Price', 'Name', '差額'])
+def test_spilled_result_matches_dataframe(results, conditions, sort_column):
+    df, spilled = results
+    index = result_grid.build_grid_index(df)
+    lazy_index = result_grid.build_grid_index(spilled, keep_arrays=False)
+
+    expected = result_grid.sorted_positions(df, index, result_grid.filter_rows(index, **conditions), sort_column)
+    mask = result_grid.filter_rows(lazy_index, df=spilled, **conditions)
+    positions = result_grid.sorted_positions(spilled, lazy_index, mask, sort_column)
+    np.testing.assert_array_equal(positions, expected)
+
+
+def test_lazy_index_keeps_only_options(results):
+    df, spilled = results
+    index = result_grid.build_grid_index(spilled, keep_arrays=False)
+
+    assert index['rows'] == len(df)
+    assert set(index['numeric']) == {'Price', 'Point', '通販単価', '差額'}
+    assert all(values is None for values in index['numeric'].values())
+    assert all(values is None for values in index['category'].values())
+    assert all(values is None for values in index['list']['Icon'].values())
+    assert index['text'] is None
+    assert index['options'] == result_grid.build_grid_index(df)['options']
+    assert list(index['list']['Icon']) == ['NEW', 'SALE']
+
+
+def test_descending_sort_puts_missing_values_last(results):
+    df, spilled = results
+    index = result_grid.build_grid_index(spilled, keep_arrays=False)
+    mask = result_grid.filter_rows(index, df=spilled)
+
+    positions = result_grid.sorted_positions(spilled, index, mask, '差額', ascending=False)
+    diffs = df['差額'].iloc[positions].tolist()
+    assert diffs[0] == '1,200'
+    assert all(pd.isna(value) for value in diffs[-15:])
@@ -0,0 +1,260 @@
+"""work_queue（分散ワーカーのキュー）と own_site_worker（分散ワーカー）のテスト
+
+一時ファイルのSQLiteで、作業単位の確保・リースの延長・期限切れ後の取り直し・max_attempts 回での FAILED・
+結果の書き込みと、ジョブ全体のレイアウト変更の検出を確認する。時刻は work_queue の time を差し替えて進める。
+ワーカーの実行はローカルのモックサーバー（benchmarks/mock_servers.py）に対して行う。
+"""
+import copy
+import os
+import sys
+import threading
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+sys.path.insert(0, REPO_DIR)
+
+import pytest  # noqa: E402
+
+import fetch_metrics  # noqa: E402
+import own_site_fetch  # noqa: E402
+import own_site_parser  # noqa: E402
+import own_site_worker  # noqa: E402
+import work_queue  # noqa: E402
+from adaptive_limiter import AdaptiveConcurrencyLimiter  # noqa: E402
+from fetch_failures import LAYOUT_DRIFT  # noqa: E402
+from mock_servers import MockConfig, start_in_process  # noqa: E402
+
+LEASE = 60
+CODES = [str(100001 + i) for i in range(10)]
+
+
+class FakeTime:
+    """work_queue から見た time モジュールの代わり（advance() で進める）"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(work_queue, 'time', fake)
+    return fake
+
+
+@pytest.fixture
+def queue_db(tmp_path):
+    return str(tmp_path / 'work_queue.sqlite3')
+
+
+def unit_states(path, job_id):
+    return [(state, worker) for _, state, worker, _ in work_queue.job_results(path, job_id)]
+
+
+def test_create_job_splits_codes(queue_db, clock):
+    job_id = work_queue.create_job(queue_db, CODES, 4, options={'streamed': False})
+    progress = work_queue.job_progress(queue_db, job_id)
+    assert (progress['units'], progress['pending'], progress['codes']) == (3, 3, 10)
+    assert not progress['finished']
+    assert [codes for codes, _, _, _ in work_queue.job_results(queue_db, job_id)] == [CODES[:4], CODES[4:8], CODES[8:]]
+    unit = work_queue.claim_unit(queue_db, 'worker-a', LEASE)
+    assert unit == {'job_id': job_id, 'seq': 0, 'codes': CODES[:4], 'options': {'streamed': False}, 'attempts': 1}
+
+
+def test_claim_skips_leased_units(queue_db, clock):
+    job_id = work_queue.create_job(queue_db, CODES, 4)
+    assert work_queue.claim_unit(queue_db, 'worker-a', LEASE)['seq'] == 0
+    assert work_queue.claim_unit(queue_db, 'worker-b', LEASE)['seq'] == 1
+    assert work_queue.claim_unit(queue_db, 'worker-a', LEASE)['seq'] == 2
+    assert work_queue.claim_unit(queue_db, 'worker-c', LEASE) is None
+    progress = work_queue.job_progress(queue_db, job_id)
+    assert progress['leased'] == 3
+    assert progress['workers'] == ['worker-a', 'worker-b']
+
+
+def test_expired_lease_is_reclaimed(queue_db, clock):
+    job_id = work_queue.create_job(queue_db, CODES, 10)
+    unit = work_queue.claim_unit(queue_db, 'worker-a', LEASE)
+    clock.advance(LEASE)
+    assert work_queue.claim_unit(queue_db, 'worker-b', LEASE) is None
+    clock.advance(1)
+    # 処理中のワーカーが停止した作業単位は、リースの期限切れ後に他のワーカーが取り直す
+    reclaimed = work_queue.claim_unit(queue_db, 'worker-b', LEASE)
+    assert (reclaimed['seq'], reclaimed['attempts']) == (unit['seq'], 2)
+    assert unit_states(queue_db, job_id) == [(work_queue.LEASED, 'worker-b')]
+    # 期限切れ後は元のワーカーはリースを延長できない
+    assert not work_queue.heartbeat(queue_db, unit, 'worker-a', LEASE, 5)
+
+
+def test_heartbeat_extends_lease_and_records_progress(queue_db, clock):
+    job_id = work_queue.create_job(queue_db, CODES, 10)
+    unit = work_queue.claim_unit(queue_db, 'worker-a', LEASE)
+    for completed in (3, 6, 9):
+        clock.advance(LEASE - 1)
+        assert work_queue.heartbeat(queue_db, unit, 'worker-a', LEASE, completed)
+        assert work_queue.claim_unit(queue_db, 'worker-b', LEASE) is None
+    progress = work_queue.job_progress(queue_db, job_id)
+    assert progress['completed_codes'] == 9
+    assert progress['workers'] == ['worker-a']
+    assert work_queue.active_workers(queue_db, 10) == ['worker-a', 'worker-b']
+
+
+def test_unit_fails_after_max_attempts(queue_db, clock):
+    job_id = work_queue.create_job(queue_db, CODES, 10)
+    for attempt in range(1, 4):
+        unit = work_queue.claim_unit(queue_db, f'worker-{attempt}', LEASE, max_attempts=3)
+        assert unit['attempts'] == attempt
+        clock.advance(LEASE + 1)
+    # max_attempts 回続けて応答しなくなった作業単位は取り直さずに FAILED にする
+    assert work_queue.claim_unit(queue_db, 'worker-4', LEASE, max_attempts=3) is None
+    progress = work_queue.job_progress(queue_db, job_id)
+    assert (progress['failed'], progress['finished'], progress['completed_codes']) == (1, True, 10)
+    assert list(work_queue.job_results(queue_db, job_id)) == [(CODES, work_queue.FAILED, 'worker-3', None)]
+
+
+def test_first_completion_wins(queue_db, clock):
+    job_id = work_queue.create_job(queue_db, CODES, 10)
+    unit = work_queue.claim_unit(queue_db, 'worker-a', LEASE)
+    clock.advance(LEASE + 1)
+    reclaimed = work_queue.claim_unit(queue_db, 'worker-b', LEASE)
+    assert work_queue.complete_unit(queue_db, reclaimed, 'worker-b', {'items': 'b'})
+    assert not work_queue.complete_unit(queue_db, unit, 'worker-a', {'items': 'a'})
+    assert list(work_queue.job_results(queue_db, job_id)) == [(CODES, work_queue.DONE, 'worker-b', {'items': 'b'})]
+    progress = work_queue.job_progress(queue_db, job_id)
+    assert (progress['done'], progress['finished'], progress['completed_codes']) == (1, True, 10)
+
+
+def test_job_filter_and_cancel(queue_db, clock):
+    first = work_queue.create_job(queue_db, CODES[:2], 1)
+    clock.advance(1)
+    second = work_queue.create_job(queue_db, CODES[2:4], 1)
+    assert work_queue.claim_unit(queue_db, 'worker-a', LEASE, job_id=second)['job_id'] == second
+    work_queue.cancel_job(queue_db, first)
+    assert work_queue.claim_unit(queue_db, 'worker-a', LEASE)['job_id'] == second
+    assert work_queue.claim_unit(queue_db, 'worker-a', LEASE) is None
+
+
+def test_delete_and_remove_stale(queue_db, clock):
+    old = work_queue.create_job(queue_db, CODES, 5)
+    work_queue.claim_unit(queue_db, 'worker-a', LEASE)
+    work_queue.record_drift(queue_db, old, 5, 5, 10, 0.2)
+    clock.advance(2 * 3600)
+    new = work_queue.create_job(queue_db, CODES, 5)
+    work_queue.remove_stale(queue_db, 1)
+    assert list(work_queue.job_results(queue_db, old)) == []
+    assert work_queue.job_progress(queue_db, old)['drift'] == {'pages': 0, 'missing': 0, 'tripped': False}
+    assert work_queue.active_workers(queue_db, 10 * 3600) == []
+    work_queue.delete_job(queue_db, new)
+    assert work_queue.job_progress(queue_db, new)['units'] == 0
+
+
+def test_record_drift_aggregates_workers(queue_db, clock):
+    job_id = work_queue.create_job(queue_db, CODES, 5)
+    assert work_queue.record_drift(queue_db, job_id, 4, 1, 10, 0.2) == {'pages': 4, 'missing': 1, 'tripped': False}
+    assert work_queue.record_drift(queue_db, job_id, 4, 1, 10, 0.2) == {'pages': 8, 'missing': 2, 'tripped': False}
+    # 最初の sample_pages ページを超えた分は、商品詳細ブロックがあったページから除く
+    assert work_queue.record_drift(queue_db, job_id, 4, 2, 10, 0.2) == {'pages': 10, 'missing': 2, 'tripped': False}
+    assert work_queue.record_drift(queue_db, job_id, 4, 4, 10, 0.2)['missing'] == 2
+    assert work_queue.job_progress(queue_db, job_id)['drift'] == {'pages': 10, 'missing': 2, 'tripped': False}
+
+
+def test_record_drift_trips_job(queue_db, clock):
+    job_id = work_queue.create_job(queue_db, CODES, 5)
+    assert work_queue.record_drift(queue_db, job_id, 3, 3, 10, 0.2)['tripped']
+    # 一度中断したジョブは中断のまま
+    assert work_queue.record_drift(queue_db, job_id, 0, 0, 10, 0.2)['tripped']
+    other = work_queue.create_job(queue_db, CODES, 5)
+    # ワーカー自身の記録で検出した場合
+    assert work_queue.record_drift(queue_db, other, 0, 0, 10, 0.2, tripped=True)['tripped']
+    assert work_queue.job_progress(queue_db, other)['drift']['tripped']
+
+
+@pytest.fixture(scope='module')
+def mock_base_url():
+    process, base_url = start_in_process(MockConfig(latency_ms=20, jitter_ms=0, not_found_rate=0))
+    yield base_url
+    process.terminate()
+
+
+@pytest.fixture
+def own_site(monkeypatch, mock_base_url):
+    monkeypatch.setattr(own_site_fetch, 'OWN_SITE_BASE_URL', mock_base_url)
+    return mock_base_url
+
+
+@pytest.fixture
+def broken_layout(monkeypatch):
+    """商品詳細ブロックのCSSセレクターを変え、すべての商品ページでブロックが見つからない状態にする"""
+    spec = copy.deepcopy(own_site_parser.OWN_SITE_SPEC)
+    spec['blocks']['detail']['css'] = 'div.goodsdetail_new_'
+    monkeypatch.setattr(own_site_parser, '_COMPILED_SPEC', own_site_parser.compile_spec(spec))
+
+
+def failure_kinds(path, job_id):
+    return [
+        [failure['kind'] if failure is not None else None for _, failure in result['items']]
+        for _, _, _, result in work_queue.job_results(path, job_id)
+    ]
+
+
+def test_worker_completes_units(queue_db, own_site):
+    job_id = work_queue.create_job(queue_db, CODES, 4, options={'streamed': True})
+    written = own_site_worker.run_worker(queue_db, 'worker-a', retry_delay=0, job_id=job_id, exit_when_idle=True)
+    assert written == 3
+    progress = work_queue.job_progress(queue_db, job_id)
+    assert progress['finished'] and progress['done'] == 3
+    assert progress['drift'] == {'pages': 10, 'missing': 0, 'tripped': False}
+    items = [item for _, _, _, result in work_queue.job_results(queue_db, job_id) for item, _ in result['items']]
+    assert [str(item['No']) for item in items] == CODES
+
+
+def test_worker_heartbeat_keeps_lease(queue_db, own_site):
+    job_id = work_queue.create_job(queue_db, CODES, 10, options={'streamed': True})
+    unit = work_queue.claim_unit(queue_db, 'worker-a', 0.15)
+    written = []
+    # 10件を1件ずつ取得する間（リース期間より長い）、リースを延長し続ける
+    worker = threading.Thread(target=lambda: written.append(own_site_worker.process_unit(
+        queue_db, unit, 'worker-a', fetch_metrics.create_session(), AdaptiveConcurrencyLimiter(1, 1),
+        lease_seconds=0.15, retry_delay=0
+    )))
+    worker.start()
+    stolen = []
+    while worker.is_alive():
+        other = work_queue.claim_unit(queue_db, 'worker-b', 0.15, job_id=job_id)
+        if other is not None:
+            stolen.append(other)
+        worker.join(0.02)
+    assert stolen == []
+    assert written == [True]
+    assert unit_states(queue_db, job_id) == [(work_queue.DONE, 'worker-a')]
+
+
+def test_worker_detects_layout_drift(queue_db, own_site, broken_layout):
+    codes = [str(100001 + i) for i in range(40)]
+    options = {'streamed': True, 'drift': {'sample_pages': 10, 'max_missing_rate': 0.2}}
+    job_id = work_queue.create_job(queue_db, codes, 5, options=options)
+    own_site_worker.run_worker(queue_db, 'worker-a', max_concurrency=2, retry_delay=0, job_id=job_id,
+                               exit_when_idle=True)
+    progress = work_queue.job_progress(queue_db, job_id)
+    assert progress['finished']
+    assert progress['drift']['tripped']
+    kinds = failure_kinds(queue_db, job_id)
+    # 検出後の作業単位はリクエストせずに中断として記録する
+    assert kinds[-1] == [LAYOUT_DRIFT] * 5
+    assert sum(kind == LAYOUT_DRIFT for unit in kinds for kind in unit) >= 30
+
+
+def test_worker_stops_when_other_worker_detected_drift(queue_db, monkeypatch):
+    # 接続できない取得先（リクエストすれば通信エラーになる）
+    monkeypatch.setattr(own_site_fetch, 'OWN_SITE_BASE_URL', 'http://127.0.0.1:9')
+    job_id = work_queue.create_job(queue_db, CODES, 5, options={'streamed': True})
+    work_queue.record_drift(queue_db, job_id, 0, 0, 10, 0.2, tripped=True)
+    own_site_worker.run_worker(queue_db, 'worker-a', retry_delay=0, job_id=job_id, exit_when_idle=True)
+    assert failure_kinds(queue_db, job_id) == [[LAYOUT_DRIFT] * 5, [LAYOUT_DRIFT] * 5]
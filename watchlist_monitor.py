@@ -0,0 +1,374 @@
+"""自社サイトのウォッチリスト監視（キャンペーン中の重点商品の価格・在庫・アイコンの変化の検知）
+
+選んだ数百件程度の商品コードを数分ごとに取得し、前回から変化した商品だけをイベントとして出力する。
+1回の監視のコストを変化した商品の数に近づけるため、次の順に処理を省略する。
+- 条件付きリクエスト（If-None-Match / If-Modified-Since）で、サーバーが 304 を返した商品は本文を受信しない
+- 本文は商品詳細・ポイント・在庫のブロックがそろった時点で受信を打ち切る
+- ブロック部分のハッシュ値が前回と同じ商品は解析しない
+
+イベントはJSON Lines形式のログに追記し、webhookのURLを指定した場合はPOSTでも送信する。
+
+実行例:
+    python watchlist_monitor.py --codes watchlist.txt --interval 300 --webhook http://localhost:9000/events
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import fetch_metrics
+import own_site_fetch
+import own_site_parser
+from adaptive_limiter import AdaptiveConcurrencyLimiter
+from fetch_failures import FetchFailure, NOT_LISTED, PARSE_MISSING_BLOCK, http_failure
+
+# 監視状態（前回の取得結果）の保存先
+WATCH_DB = os.environ.get('WATCH_DB', 'watchlist.sqlite3')
+# 変化イベントのログ（JSON Lines）
+WATCH_EVENT_LOG = os.environ.get('WATCH_EVENT_LOG', 'watch_events.jsonl')
+# 変化イベントの送信先（省略時はログのみ）
+WATCH_WEBHOOK_URL = os.environ.get('WATCH_WEBHOOK_URL', '')
+# 監視の間隔（秒）
+WATCH_INTERVAL = float(os.environ.get('WATCH_INTERVAL', '300'))
+# 在庫切れとみなす在庫表示の文言
+OUT_OF_STOCK_WORDS = ('在庫切れ', '品切れ', '売り切れ', '売切れ', '完売', '在庫なし')
+
+# 1件分の監視結果
+NOT_MODIFIED = 'not_modified'  # 304（本文なし）
+UNCHANGED = 'unchanged'        # ブロックのハッシュ値が前回と同じ（解析なし）
+PARSED = 'parsed'              # 解析した（変化の有無は前回の内容と比較して判定）
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS watch_state (
+            code TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            digest TEXT,
+            -- 前回の商品情報（JSON）。掲載されていない場合はNULL
+            item TEXT,
+            checked_at REAL NOT NULL,
+            changed_at REAL
+        )
+    """)
+    return conn
+
+
+def load_states(path, codes):
+    """商品コード → 前回の監視状態の辞書を返す関数（初めて監視する商品は含まない）"""
+    conn = _connect(path)
+    try:
+        rows = conn.execute("SELECT code, etag, last_modified, digest, item, checked_at, changed_at FROM watch_state")
+        states = {}
+        wanted = set(codes)
+        for code, etag, last_modified, digest, item, checked_at, changed_at in rows:
+            if code in wanted:
+                states[code] = {
+                    'etag': etag, 'last_modified': last_modified, 'digest': digest,
+                    'item': json.loads(item) if item is not None else None,
+                    'checked_at': checked_at, 'changed_at': changed_at,
+                }
+        return states
+    finally:
+        conn.close()
+
+
+def save_states(path, states):
+    """監視状態をまとめて保存する関数"""
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO watch_state VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (code, state['etag'], state['last_modified'], state['digest'],
+                     json.dumps(state['item'], ensure_ascii=False) if state['item'] is not None else None,
+                     state['checked_at'], state['changed_at'])
+                    for code, state in states.items()
+                ]
+            )
+    finally:
+        conn.close()
+
+
+def is_out_of_stock(stock):
+    """在庫表示が在庫切れかどうかを判定する関数"""
+    return stock is not None and any(word in stock for word in OUT_OF_STOCK_WORDS)
+
+
+def diff_items(code, before, after, now=None):
+    """前回と今回の商品情報を比較し、変化イベントのリストを返す関数
+
+    before・after: 商品情報（掲載されていない場合はNone）
+    """
+    now = now if now is not None else time.time()
+    events = []
+
+    def event(kind, message, old=None, new=None):
+        events.append({'time': now, 'code': code, 'event': kind, 'before': old, 'after': new, 'message': message})
+
+    if before is None and after is None:
+        return events
+    if after is None:
+        event('not_listed', "商品ページがなくなりました")
+        return events
+    if before is None:
+        event('listed', "商品ページが掲載されました", new=after['Price'])
+        return events
+
+    if before['Price'] != after['Price']:
+        event('price_changed', f"価格: {before['Price']}円 → {after['Price']}円", before['Price'], after['Price'])
+    if before['Stock'] != after['Stock']:
+        if is_out_of_stock(after['Stock']) and not is_out_of_stock(before['Stock']):
+            kind = 'out_of_stock'
+        elif is_out_of_stock(before['Stock']) and not is_out_of_stock(after['Stock']):
+            kind = 'back_in_stock'
+        else:
+            kind = 'stock_changed'
+        event(kind, f"在庫: {before['Stock']} → {after['Stock']}", before['Stock'], after['Stock'])
+    for icon in after['Icon']:
+        if icon not in before['Icon']:
+            event('icon_added', f"アイコン追加: {icon}", new=icon)
+    for icon in before['Icon']:
+        if icon not in after['Icon']:
+            event('icon_removed', f"アイコン削除: {icon}", old=icon)
+    return events
+
+
+def check_item(session, code, metrics, span, streamed, state):
+    """商品ページを条件付きリクエストで取得し、(監視結果, FetchFailure)を返す関数
+
+    監視結果: {'result': NOT_MODIFIED/UNCHANGED/PARSED, 'etag', 'last_modified', 'digest', 'item'}
+    （商品ページがない場合は PARSED で item=None）
+    """
+    url = f'{own_site_fetch.OWN_SITE_BASE_URL}/shop/g/g{code}'
+    headers = {'Accept-Encoding': 'gzip, deflate'}
+    if state is not None and state['etag']:
+        headers['If-None-Match'] = state['etag']
+    if state is not None and state['last_modified']:
+        headers['If-Modified-Since'] = state['last_modified']
+    if streamed:
+        res, html, stopped = metrics.get_until(
+            session, span, url, own_site_parser.BlockScanner(),
+            drain_limit=own_site_fetch.OWN_SITE_DRAIN_LIMIT, headers=headers, timeout=own_site_fetch.OWN_SITE_TIMEOUT
+        )
+    else:
+        res = metrics.get(session, span, url, headers=headers, timeout=own_site_fetch.OWN_SITE_TIMEOUT)
+        html, stopped = res.text, False
+
+    if res.status_code == 304 and state is not None:
+        metrics.finish(span)
+        return {'result': NOT_MODIFIED, 'etag': state['etag'], 'last_modified': state['last_modified'],
+                'digest': state['digest'], 'item': state['item']}, None
+    if res.status_code != 200:
+        failure = http_failure(res.status_code, missing_means_not_listed=True)
+        metrics.finish(span, failure)
+        if failure.kind == NOT_LISTED:
+            # 掲載終了は変化として扱う
+            return {'result': PARSED, 'etag': None, 'last_modified': None, 'digest': None, 'item': None}, None
+        return None, failure
+
+    checked = {
+        'etag': res.headers.get('ETag'),
+        'last_modified': res.headers.get('Last-Modified'),
+        'digest': own_site_parser.own_site_blocks_digest(html),
+    }
+    if state is not None and checked['digest'] is not None and checked['digest'] == state['digest']:
+        metrics.finish(span)
+        return {'result': UNCHANGED, 'item': state['item'], **checked}, None
+
+    with metrics.parse(span):
+        item_dict = own_site_parser.parse_own_site_page(html)
+    if item_dict is None and stopped:
+        # 打ち切った本文では解析できなかった場合は本文全体で取得し直す（条件付きにはしない）
+        return check_item(session, code, metrics, span, False, None)
+    if item_dict is None:
+        failure = FetchFailure(PARSE_MISSING_BLOCK)
+        metrics.finish(span, failure)
+        return None, failure
+    metrics.finish(span)
+    return {'result': PARSED, 'item': item_dict, **checked}, None
+
+
+class EventSink:
+    """変化イベントをログ（JSON Lines）に追記し、webhookのURLがあればPOSTで送信するクラス"""
+
+    def __init__(self, log_path=WATCH_EVENT_LOG, webhook_url=WATCH_WEBHOOK_URL, session=None, timeout=10):
+        self.log_path = log_path
+        self.webhook_url = webhook_url
+        self.session = session
+        self.timeout = timeout
+        self.webhook_errors = 0
+
+    def emit(self, events):
+        if not events:
+            return
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+        if self.webhook_url:
+            try:
+                (self.session or fetch_metrics.create_session()).post(
+                    self.webhook_url, json={'events': events}, timeout=self.timeout
+                ).raise_for_status()
+            except Exception:
+                # 送信できなくてもログには残っているため監視は続ける
+                self.webhook_errors += 1
+
+
+def recent_events(log_path=WATCH_EVENT_LOG, limit=100):
+    """ログから新しい順に変化イベントを返す関数"""
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path, encoding='utf-8') as f:
+        lines = f.readlines()[-limit:]
+    return [json.loads(line) for line in reversed(lines) if line.strip()]
+
+
+def run_cycle(path, codes, sink, session=None, limiter=None, streamed=True, metrics=None):
+    """ウォッチリストを1回取得し、変化イベントを出力して、1回分の集計を返す関数
+
+    取得に失敗した商品は前回の状態のまま残し、イベントは出力しない（次の監視で取り直す）。
+    """
+    started = time.time()
+    metrics = metrics or fetch_metrics.FetchMetrics('watchlist')
+    session = session or fetch_metrics.create_session()
+    limiter = limiter or AdaptiveConcurrencyLimiter(min_limit=1, max_limit=4)
+    states = load_states(path, codes)
+
+    def fetch_item(session, code, metrics, span, streamed):
+        return check_item(session, code, metrics, span, streamed, states.get(code))
+
+    results = own_site_fetch.scrape_pass(
+        session, codes, metrics, limiter, lambda completed, total: None, streamed, fetch_item=fetch_item
+    )
+    counts = {NOT_MODIFIED: 0, UNCHANGED: 0, PARSED: 0, 'failed': 0}
+    events = []
+    updated = {}
+    for code, (checked, failure) in zip(codes, results):
+        if failure is not None:
+            counts['failed'] += 1
+            continue
+        counts[checked['result']] += 1
+        previous = states.get(code)
+        changes = diff_items(code, previous['item'], checked['item'], started) if previous is not None else []
+        events.extend(changes)
+        updated[code] = {
+            'etag': checked['etag'], 'last_modified': checked['last_modified'], 'digest': checked['digest'],
+            'item': checked['item'], 'checked_at': started,
+            'changed_at': started if changes else (previous['changed_at'] if previous is not None else None),
+        }
+    save_states(path, updated)
+    sink.emit(events)
+    metrics.close()
+    summary = metrics.summary()
+    return {
+        'started': started,
+        'duration_s': time.time() - started,
+        'codes': len(codes),
+        # 初めて監視した商品（比較する前回の内容がないためイベントは出力しない）
+        'new': sum(1 for code in updated if code not in states),
+        'not_modified': counts[NOT_MODIFIED],
+        'unchanged': counts[UNCHANGED],
+        'parsed': counts[PARSED],
+        'failed': counts['failed'],
+        'events': len(events),
+        'wire_bytes': summary['wire_bytes'],
+        'parse_cpu_s': summary['parse_cpu_s'],
+    }
+
+
+class WatchMonitor:
+    """ウォッチリストを一定間隔で監視するスレッドを管理するクラス
+
+    Streamlitアプリではサーバー全体で1つ（st.cache_resource）を使い、画面を閉じても監視を続ける。
+    """
+
+    def __init__(self, path=WATCH_DB, log_path=WATCH_EVENT_LOG):
+        self.path = path
+        self.log_path = log_path
+        self.codes = []
+        self.interval = WATCH_INTERVAL
+        self.cycles = []
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, codes, interval=WATCH_INTERVAL, webhook_url=WATCH_WEBHOOK_URL, max_concurrency=4, streamed=True):
+        """監視を開始する（実行中の場合は止めてから新しい条件で開始する）"""
+        self.stop()
+        self.codes = list(dict.fromkeys(codes))
+        self.interval = interval
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(webhook_url, max_concurrency, streamed), name='watch-monitor', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, webhook_url, max_concurrency, streamed):
+        session = fetch_metrics.create_session(pool_maxsize=max_concurrency)
+        limiter = AdaptiveConcurrencyLimiter(min_limit=1, max_limit=max_concurrency)
+        sink = EventSink(self.log_path, webhook_url, session)
+        while not self._stop.is_set():
+            try:
+                cycle = run_cycle(self.path, self.codes, sink, session, limiter, streamed)
+                cycle['webhook_errors'] = sink.webhook_errors
+                # 直近の集計だけを残す
+                self.cycles = (self.cycles + [cycle])[-50:]
+                wait = self.interval - cycle['duration_s']
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                wait = self.interval
+            self._stop.wait(max(0.0, wait))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="自社サイトのウォッチリスト監視")
+    parser.add_argument('--codes', required=True, help="監視する商品コードのファイル（1行に1件）")
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, help="監視の間隔（秒）")
+    parser.add_argument('--db', default=WATCH_DB, help="監視状態のSQLiteファイル")
+    parser.add_argument('--log', default=WATCH_EVENT_LOG, help="変化イベントのログ（JSON Lines）")
+    parser.add_argument('--webhook', default=WATCH_WEBHOOK_URL, help="変化イベントの送信先URL")
+    parser.add_argument('--max-concurrency', type=int, default=4, help="最大同時接続数")
+    parser.add_argument('--once', action='store_true', help="1回だけ監視して終了する")
+    args = parser.parse_args()
+
+    with open(args.codes, encoding='utf-8') as f:
+        codes = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+    session = fetch_metrics.create_session(pool_maxsize=args.max_concurrency)
+    limiter = AdaptiveConcurrencyLimiter(min_limit=1, max_limit=args.max_concurrency)
+    sink = EventSink(args.log, args.webhook, session)
+    print(f"{len(codes)}件の監視を開始します（{args.interval:.0f}秒間隔）")
+    try:
+        while True:
+            cycle = run_cycle(args.db, codes, sink, session, limiter)
+            print(
+                f"{time.strftime('%H:%M:%S')} 変化 {cycle['events']}件"
+                f"（304: {cycle['not_modified']}件・変化なし: {cycle['unchanged']}件・解析: {cycle['parsed']}件・"
+                f"失敗: {cycle['failed']}件・{cycle['duration_s']:.1f}秒）"
+            )
+            if args.once:
+                break
+            time.sleep(max(0.0, args.interval - cycle['duration_s']))
+    except KeyboardInterrupt:
+        print("中断しました")
+
+
+if __name__ == "__main__":
+    main()
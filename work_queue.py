@@ -0,0 +1,329 @@
+import json
+import socket
+import sqlite3
+import time
+import uuid
+
+# 作業単位の状態
+PENDING = 'pending'   # 未処理
+LEASED = 'leased'     # ワーカーが処理中（lease_expires までに完了・延長がなければ他のワーカーが取り直す）
+DONE = 'done'         # 完了（結果あり）
+FAILED = 'failed'     # 処理中のワーカーが max_attempts 回続けて応答しなくなった
+
+
+def _connect(path):
+    """キューのSQLiteに接続する関数
+
+    複数のノードから使う場合は、全ノードから読み書きできる場所に置く。
+    ネットワークファイルシステムでも使えるよう、WALではなく通常のジャーナルで排他制御する。
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS queue_jobs (
+            job_id TEXT PRIMARY KEY,
+            created_at REAL NOT NULL,
+            options TEXT NOT NULL,
+            units INTEGER NOT NULL,
+            codes INTEGER NOT NULL,
+            cancelled INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS queue_units (
+            job_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            codes TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            finished_at REAL,
+            PRIMARY KEY (job_id, seq)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS queue_drift (
+            job_id TEXT PRIMARY KEY,
+            -- レイアウト変更の検出: ジョブ全体で最初に受信した商品ページ数と、そのうち商品詳細ブロックのなかったページ数
+            pages INTEGER NOT NULL,
+            missing INTEGER NOT NULL,
+            tripped INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS queue_workers (
+            worker TEXT PRIMARY KEY,
+            host TEXT NOT NULL,
+            last_seen REAL NOT NULL,
+            units_done INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    return conn
+
+
+def default_worker_id():
+    """ワーカーの識別子（ホスト名とランダムな文字列）を作成する関数"""
+    return f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+
+
+def create_job(path, codes, unit_size, options=None):
+    """商品コードのリストを unit_size 件ずつの作業単位に分けてキューに登録し、ジョブIDを返す関数
+
+    options: ワーカーに渡す取得条件（部分受信するかどうか等）
+    """
+    job_id = uuid.uuid4().hex
+    units = [codes[start:start + unit_size] for start in range(0, len(codes), unit_size)]
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO queue_jobs (job_id, created_at, options, units, codes) VALUES (?, ?, ?, ?, ?)",
+                (job_id, time.time(), json.dumps(options or {}), len(units), len(codes))
+            )
+            conn.executemany(
+                "INSERT INTO queue_units (job_id, seq, codes, size, state) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, seq, json.dumps(unit), len(unit), PENDING) for seq, unit in enumerate(units)]
+            )
+    finally:
+        conn.close()
+    return job_id
+
+
+def _touch_worker(conn, worker, units_done=0):
+    conn.execute(
+        "INSERT INTO queue_workers (worker, host, last_seen, units_done) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(worker) DO UPDATE SET last_seen = excluded.last_seen, "
+        "units_done = units_done + excluded.units_done",
+        (worker, socket.gethostname(), time.time(), units_done)
+    )
+
+
+def claim_unit(path, worker, lease_seconds, job_id=None, max_attempts=3):
+    """未処理の作業単位（またはリース期限切れの作業単位）を1件確保して返す関数
+
+    作業単位がなければNoneを返す。job_id を指定した場合は、そのジョブの作業単位だけを確保する。
+    リース期限切れのまま max_attempts 回確保された作業単位は、取り直さずに FAILED にする
+    （ワーカーを毎回停止させる商品コードで全ワーカーが止まらないようにするため）。
+    戻り値: {'job_id', 'seq', 'codes', 'options', 'attempts'} の辞書
+    """
+    now = time.time()
+    conn = _connect(path)
+    try:
+        # 同じ作業単位を複数のワーカーが確保しないよう、確保の間はデータベースを書き込みロックする
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _touch_worker(conn, worker)
+            conn.execute(
+                "UPDATE queue_units SET state = ?, finished_at = ? "
+                "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, now, LEASED, now, max_attempts)
+            )
+            query = (
+                "SELECT u.job_id, u.seq, u.codes, j.options, u.attempts FROM queue_units u "
+                "JOIN queue_jobs j ON j.job_id = u.job_id "
+                "WHERE j.cancelled = 0 AND (u.state = ? OR (u.state = ? AND u.lease_expires < ?))"
+            )
+            params = [PENDING, LEASED, now]
+            if job_id is not None:
+                query += " AND u.job_id = ?"
+                params.append(job_id)
+            row = conn.execute(query + " ORDER BY j.created_at, u.seq LIMIT 1", params).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE queue_units SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                    "completed = 0 WHERE job_id = ? AND seq = ?",
+                    (LEASED, worker, now + lease_seconds, row[0], row[1])
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {
+        'job_id': row[0], 'seq': row[1], 'codes': json.loads(row[2]),
+        'options': json.loads(row[3]), 'attempts': row[4] + 1,
+    }
+
+
+def heartbeat(path, unit, worker, lease_seconds, completed):
+    """処理中の作業単位のリースを延長し、進捗（完了件数）を記録する関数
+
+    リースを他のワーカーに取られていた場合（期限切れ後に取り直された場合）は False を返す。
+    """
+    conn = _connect(path)
+    try:
+        with conn:
+            _touch_worker(conn, worker)
+            cursor = conn.execute(
+                "UPDATE queue_units SET lease_expires = ?, completed = ? "
+                "WHERE job_id = ? AND seq = ? AND worker = ? AND state = ?",
+                (time.time() + lease_seconds, completed, unit['job_id'], unit['seq'], worker, LEASED)
+            )
+            return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+
+def complete_unit(path, unit, worker, result):
+    """作業単位の結果を書き込む関数
+
+    同じ作業単位を複数のワーカーが処理した場合（リース期限切れで取り直された場合）は、先に完了した結果を使う。
+    戻り値: 結果を書き込んだかどうか
+    """
+    conn = _connect(path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                "UPDATE queue_units SET state = ?, worker = ?, completed = size, result = ?, finished_at = ? "
+                "WHERE job_id = ? AND seq = ? AND state IN (?, ?)",
+                (DONE, worker, json.dumps(result, ensure_ascii=False), time.time(),
+                 unit['job_id'], unit['seq'], PENDING, LEASED)
+            )
+            written = cursor.rowcount > 0
+            _touch_worker(conn, worker, units_done=int(written))
+            return written
+    finally:
+        conn.close()
+
+
+def record_drift(path, job_id, pages, missing, sample_pages, max_missing_rate, tripped=False):
+    """ワーカーが前回の報告以降に記録した商品ページの抽出結果をジョブ全体の集計に加え、ジョブ全体の状態を返す関数
+
+    ジョブ全体で最初の sample_pages ページまでを集計し（超えた分は商品詳細ブロックがあったページから除く）、
+    商品詳細ブロックのないページの割合が max_missing_rate を超えたら、全ワーカーに残りの取得を中断させる。
+    tripped=True はワーカー自身の記録でレイアウト変更の疑いを検出した場合。
+    戻り値: {'pages', 'missing', 'tripped'}
+    """
+    conn = _connect(path)
+    try:
+        # 複数のワーカーの報告を取りこぼさないよう、集計の間はデータベースを書き込みロックする
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT pages, missing, tripped FROM queue_drift WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            total_pages, total_missing, was_tripped = row if row is not None else (0, 0, 0)
+            counted = max(0, min(pages, sample_pages - total_pages))
+            total_pages += counted
+            total_missing += max(0, missing - (pages - counted))
+            tripped = bool(was_tripped or tripped or total_missing > sample_pages * max_missing_rate)
+            conn.execute(
+                "INSERT OR REPLACE INTO queue_drift VALUES (?, ?, ?, ?)",
+                (job_id, total_pages, total_missing, int(tripped))
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return {'pages': total_pages, 'missing': total_missing, 'tripped': tripped}
+
+
+def job_progress(path, job_id):
+    """ジョブの進捗（作業単位の状態別の件数、完了した商品コード数、処理中のワーカー、レイアウト変更の検出）を返す関数"""
+    now = time.time()
+    conn = _connect(path)
+    try:
+        counts = dict(conn.execute(
+            "SELECT state, COUNT(*) FROM queue_units WHERE job_id = ? GROUP BY state", (job_id,)
+        ).fetchall())
+        completed, total = conn.execute(
+            "SELECT COALESCE(SUM(CASE WHEN state IN (?, ?) THEN size ELSE completed END), 0), "
+            "COALESCE(SUM(size), 0) FROM queue_units WHERE job_id = ?", (DONE, FAILED, job_id)
+        ).fetchone()
+        workers = [row[0] for row in conn.execute(
+            "SELECT DISTINCT worker FROM queue_units WHERE job_id = ? AND state = ? AND lease_expires >= ?",
+            (job_id, LEASED, now)
+        )]
+        drift = conn.execute(
+            "SELECT pages, missing, tripped FROM queue_drift WHERE job_id = ?", (job_id,)
+        ).fetchone() or (0, 0, 0)
+    finally:
+        conn.close()
+    units = sum(counts.values())
+    return {
+        'units': units,
+        'pending': counts.get(PENDING, 0),
+        'leased': counts.get(LEASED, 0),
+        'done': counts.get(DONE, 0),
+        'failed': counts.get(FAILED, 0),
+        'finished': units == counts.get(DONE, 0) + counts.get(FAILED, 0),
+        'codes': total,
+        'completed_codes': completed,
+        'workers': sorted(workers),
+        'drift': {'pages': drift[0], 'missing': drift[1], 'tripped': bool(drift[2])},
+    }
+
+
+def job_results(path, job_id):
+    """ジョブの作業単位を並び順に (商品コードのリスト, 状態, ワーカー, 結果) で返すジェネレーター（未完了の結果はNone）"""
+    conn = _connect(path)
+    try:
+        for codes, state, worker, result in conn.execute(
+            "SELECT codes, state, worker, result FROM queue_units WHERE job_id = ? ORDER BY seq", (job_id,)
+        ):
+            yield json.loads(codes), state, worker, json.loads(result) if result is not None else None
+    finally:
+        conn.close()
+
+
+def active_workers(path, within_seconds):
+    """within_seconds 秒以内にキューへアクセスしたワーカーの識別子を返す関数"""
+    conn = _connect(path)
+    try:
+        return [row[0] for row in conn.execute(
+            "SELECT worker FROM queue_workers WHERE last_seen >= ? ORDER BY worker", (time.time() - within_seconds,)
+        )]
+    finally:
+        conn.close()
+
+
+def cancel_job(path, job_id):
+    """ジョブを取り消す関数（ワーカーは未処理の作業単位を確保しなくなる）"""
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute("UPDATE queue_jobs SET cancelled = 1 WHERE job_id = ?", (job_id,))
+    finally:
+        conn.close()
+
+
+def delete_job(path, job_id):
+    """結果を集計し終えたジョブをキューから削除する関数"""
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM queue_units WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM queue_drift WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM queue_jobs WHERE job_id = ?", (job_id,))
+    finally:
+        conn.close()
+
+
+def remove_stale(path, max_age_hours):
+    """古いジョブ（結果を集計する前に画面を閉じたジョブ等）と、しばらくアクセスのないワーカーを削除する関数"""
+    limit = time.time() - max_age_hours * 3600
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute(
+                "DELETE FROM queue_units WHERE job_id IN (SELECT job_id FROM queue_jobs WHERE created_at < ?)",
+                (limit,)
+            )
+            conn.execute(
+                "DELETE FROM queue_drift WHERE job_id IN (SELECT job_id FROM queue_jobs WHERE created_at < ?)",
+                (limit,)
+            )
+            conn.execute("DELETE FROM queue_jobs WHERE created_at < ?", (limit,))
+            conn.execute("DELETE FROM queue_workers WHERE last_seen < ?", (limit,))
+    finally:
+        conn.close()